@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Measures the creation and the serialization of Herald message beans, and
+the memory they use.
+
+Usage: ``python -m benchmarks.bench_beans -c 100000``
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+import herald
+import herald.beans as beans
+import herald.utils as utils
+
+# Benchmark utilities
+from benchmarks.harness import summarize, print_summaries
+
+# Standard library
+import argparse
+import time
+
+try:
+    # Python 3.4+
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# ------------------------------------------------------------------------------
+
+SUBJECT = "bench/beans"
+CONTENT = {"key": "value", "items": [1, 2, 3]}
+
+# ------------------------------------------------------------------------------
+
+
+def make_message():
+    """
+    Creates a message, as a transport prepares it before sending it
+    """
+    message = beans.Message(SUBJECT, CONTENT)
+    message.add_header(herald.MESSAGE_HEADER_SENDER_UID, "sender")
+    message.add_header(herald.MESSAGE_HEADER_TARGET_PEER, "target")
+    return message
+
+
+def make_received():
+    """
+    Creates a received message
+    """
+    return beans.MessageReceived("uid", SUBJECT, CONTENT, "sender", None,
+                                 "bench", 0)
+
+
+def run(name, count, method, *args):
+    """
+    Calls a method many times
+
+    :param name: Name of the benchmark
+    :param count: Number of calls
+    :param method: Method to call
+    :param args: Arguments of the method
+    :return: The summary of the run
+    """
+    start = time.time()
+    for _ in range(count):
+        method(*args)
+    return summarize(name, count, time.time() - start)
+
+
+def measure_size(count, method):
+    """
+    Computes the memory used by the objects created by a method
+
+    :param count: Number of objects to create
+    :param method: Method creating an object
+    :return: The average size of an object, in bytes (None if unavailable)
+    """
+    if tracemalloc is None:
+        return None
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [method() for _ in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    # Don't count the list itself
+    del objects
+    return float(after - before) / count
+
+
+def main(count):
+    """
+    Runs the benchmarks
+
+    :param count: Number of operations per benchmark
+    :return: A tuple: the list of benchmark summaries, the sizes of the beans
+    """
+    data = utils.to_json(make_message())
+    summaries = [run("uid", count, beans.new_uid),
+                 run("Message()", count, make_message),
+                 run("MessageReceived()", count, make_received),
+                 run("to_json()", count, utils.to_json, make_message()),
+                 run("from_json()", count, utils.from_json, data)]
+
+    sizes = {"Message": measure_size(min(count, 10000), make_message),
+             "MessageReceived": measure_size(min(count, 10000),
+                                             make_received)}
+    return summaries, sizes
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herald beans benchmark")
+    parser.add_argument("-c", "--count", type=int, default=100000,
+                        dest="count", help="Number of operations")
+    args = parser.parse_args()
+
+    results, bean_sizes = main(args.count)
+    print_summaries(results)
+    for bean, size in sorted(bean_sizes.items()):
+        if size is not None:
+            print("{0:<24} {1:>8.1f} bytes".format(bean, size))
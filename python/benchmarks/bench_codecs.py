@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Reproducible benchmarks of the Herald codecs: message beans, JSON and
+Jabsorb conversions, directory dumps and multicast discovery packets.
+
+Results can be written to a JSON file and compared to a previous run:
+
+    python -m benchmarks.bench_codecs -o before.json
+    python -m benchmarks.bench_codecs -o after.json --compare before.json
+
+The same cases are run by ``benchmarks/test_codecs.py`` with pytest (and the
+pytest-benchmark plugin, if installed).
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+import herald
+import herald.beans as beans
+import herald.directory
+import herald.utils as utils
+
+# Benchmark utilities
+from benchmarks.harness import VirtualPeer
+
+# Pelix
+import pelix.misc.jabsorb as jabsorb
+
+# Standard library
+import argparse
+import collections
+import fnmatch
+import gc
+import json
+import math
+import platform
+import random
+import sys
+import time
+import timeit
+
+# ------------------------------------------------------------------------------
+
+SEED = 42
+""" Seed of the random generator used to prepare data """
+
+SHAPES = ("string", "nested", "list", "set")
+""" Kinds of message contents """
+
+PEER_COUNTS = (10, 100, 1000, 10000)
+""" Sizes of the benchmarked directories """
+
+RESULTS_VERSION = 1
+""" Version of the results file format """
+
+SUBJECT = "bench/codecs"
+
+# ------------------------------------------------------------------------------
+
+
+def make_content(shape):
+    """
+    Prepares a message content of the given shape, always the same for a
+    given shape
+
+    :param shape: One of SHAPES
+    :return: The message content
+    """
+    rand = random.Random(SEED)
+    if shape == "string":
+        return "".join(rand.choice("abcdefghijklmnopqrstuvwxyz ")
+                       for _ in range(1024))
+
+    elif shape == "nested":
+        def make_level(depth):
+            if not depth:
+                return {"int": rand.randint(0, 1000), "float": rand.random(),
+                        "str": "value", "bool": True, "none": None}
+            return dict(("key{0}".format(idx), make_level(depth - 1))
+                        for idx in range(4))
+        return make_level(4)
+
+    elif shape == "list":
+        return [rand.randint(0, 1 << 30) for _ in range(10000)]
+
+    elif shape == "set":
+        return {"uids": set("uid-{0}".format(rand.randint(0, 1 << 30))
+                            for _ in range(1000))}
+
+    raise ValueError("Unknown content shape: {0}".format(shape))
+
+
+def make_message(shape, content=None):
+    """
+    Prepares a message, as a transport does before sending it.
+
+    Messages with a set content also have a set in their metadata, which
+    needs ``utils.json_converter`` to be converted to JSON.
+
+    :param shape: One of SHAPES
+    :param content: The content to use (computed if None)
+    :return: A Message bean
+    """
+    if content is None:
+        content = make_content(shape)
+
+    message = beans.Message(SUBJECT, content)
+    message.add_header(herald.MESSAGE_HEADER_SENDER_UID, "sender")
+    message.add_header(herald.MESSAGE_HEADER_TARGET_PEER, "target")
+    if shape == "set":
+        message.add_metadata("uids", content["uids"])
+    return message
+
+
+def make_directory(nb_peers):
+    """
+    Prepares a directory knowing the given number of peers
+
+    :param nb_peers: Number of remote peers
+    :return: A HeraldDirectory
+    """
+    directory = make_empty_directory()
+    for idx in range(nb_peers):
+        directory.register(
+            {"uid": "peer-{0:05d}".format(idx),
+             "name": "peer-{0}".format(idx),
+             "node_uid": "node-{0}".format(idx % 10),
+             "node_name": "node-{0}".format(idx % 10),
+             "app_id": herald.DEFAULT_APPLICATION_ID,
+             "groups": ["all", "group-{0}".format(idx % 10)],
+             "accesses": {"http": ["10.0.{0}.{1}".format(idx // 250,
+                                                         idx % 250),
+                                   8080, "/herald"]}})
+    return directory
+
+
+def make_empty_directory():
+    """
+    Prepares a validated directory, knowing no peer
+
+    :return: A HeraldDirectory
+    """
+    peer = VirtualPeer("local")
+    peer.directory._validate(peer.context)
+    return peer.directory
+
+# ------------------------------------------------------------------------------
+
+
+def _case_message(shape):
+    content = make_content(shape)
+    return lambda: make_message(shape, content)
+
+
+def _case_to_json(shape):
+    message = make_message(shape)
+    return lambda: utils.to_json(message)
+
+
+def _case_from_json(shape):
+    data = utils.to_json(make_message(shape))
+    return lambda: utils.from_json(data)
+
+
+def _case_to_jabsorb(shape):
+    content = make_content(shape)
+    return lambda: jabsorb.to_jabsorb(content)
+
+
+def _case_from_jabsorb(shape):
+    data = jabsorb.to_jabsorb(make_content(shape))
+    return lambda: jabsorb.from_jabsorb(data)
+
+
+def _case_peer_dump():
+    peer = make_directory(1).get_peer("peer-00000")
+    return lambda: json.dumps(peer.dump(), default=utils.json_converter)
+
+
+def _case_directory_dump(nb_peers):
+    directory = make_directory(nb_peers)
+    return lambda: json.dumps(directory.dump(), default=utils.json_converter)
+
+
+def _case_directory_load(nb_peers):
+    data = json.dumps(make_directory(nb_peers).dump(),
+                      default=utils.json_converter)
+    return lambda: make_empty_directory().load(json.loads(data))
+
+
+def _case_make_heartbeat():
+    from herald.transports.http.discovery_multicast import make_heartbeat
+    return lambda: make_heartbeat(8080, "/herald", "peer-00000",
+                                  herald.DEFAULT_APPLICATION_ID)
+
+
+def _case_parse_heartbeat():
+    from herald.transports.http.discovery_multicast import \
+        MulticastReceiver, make_heartbeat
+    receiver = MulticastReceiver("239.0.0.1", 42000, lambda *args: None)
+    packet = make_heartbeat(8080, "/herald", "peer-00000",
+                            herald.DEFAULT_APPLICATION_ID)
+    return lambda: receiver._handle_heartbeat(("10.0.0.1", 42000), packet)
+
+
+def make_cases():
+    """
+    Lists the benchmark cases.
+
+    Cases are prepared lazily: the preparation of large directories takes
+    time, and the preparation raises an ImportError if the benchmarked
+    module can't be loaded.
+
+    :return: A list of (name, preparation method) tuples, the preparation
+             method returns the method to benchmark
+    """
+    cases = []
+    for shape in SHAPES:
+        for name, factory in (("Message", _case_message),
+                              ("to_json", _case_to_json),
+                              ("from_json", _case_from_json),
+                              ("to_jabsorb", _case_to_jabsorb),
+                              ("from_jabsorb", _case_from_jabsorb)):
+            cases.append(("{0}[{1}]".format(name, shape),
+                          lambda factory=factory, shape=shape:
+                          factory(shape)))
+
+    cases.append(("Peer.dump", _case_peer_dump))
+    for nb_peers in PEER_COUNTS:
+        cases.append(("directory.dump[{0}]".format(nb_peers),
+                      lambda nb_peers=nb_peers:
+                      _case_directory_dump(nb_peers)))
+        cases.append(("directory.load[{0}]".format(nb_peers),
+                      lambda nb_peers=nb_peers:
+                      _case_directory_load(nb_peers)))
+
+    cases.append(("make_heartbeat", _case_make_heartbeat))
+    cases.append(("parse_heartbeat", _case_parse_heartbeat))
+    return cases
+
+# ------------------------------------------------------------------------------
+
+
+def measure(method, rounds=5, round_time=.05):
+    """
+    Times a method.
+
+    The number of calls per round is calibrated for a round to last at least
+    the given time. The garbage collector is disabled during the rounds,
+    as in the timeit module.
+
+    :param method: Method to call, without argument
+    :param rounds: Number of timed rounds
+    :param round_time: Minimal duration of a round, in seconds
+    :return: A dictionary of statistics, times in seconds per call
+    """
+    timer = timeit.default_timer
+
+    def run_round(number):
+        start = timer()
+        for _ in range(number):
+            method()
+        return timer() - start
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # Calibrate
+        number = 1
+        while True:
+            duration = run_round(number)
+            if duration >= round_time:
+                break
+            number *= 2 if duration < round_time / 10 \
+                else int(math.ceil(round_time / duration))
+
+        times = sorted(run_round(number) / number for _ in range(rounds))
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    mean = sum(times) / len(times)
+    return {"rounds": rounds,
+            "iterations": number,
+            "min": times[0],
+            "max": times[-1],
+            "median": times[len(times) // 2],
+            "mean": mean,
+            "stddev": math.sqrt(sum((value - mean) ** 2 for value in times)
+                                / len(times)),
+            "ops": 1. / mean if mean else None}
+
+
+def run(pattern=None, rounds=5, round_time=.05):
+    """
+    Runs the benchmarks
+
+    :param pattern: Glob-like pattern the names of the cases must match
+    :param rounds: Number of timed rounds per case
+    :param round_time: Minimal duration of a round, in seconds
+    :return: The results, as stored in the JSON file
+    """
+    results = collections.OrderedDict()
+    for name, prepare in make_cases():
+        if pattern and not fnmatch.fnmatchcase(name, pattern):
+            continue
+
+        try:
+            method = prepare()
+        except ImportError as ex:
+            sys.stderr.write("Skipping {0}: {1}\n".format(name, ex))
+            continue
+        results[name] = measure(method, rounds, round_time)
+
+    return {"version": RESULTS_VERSION,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "benchmarks": results}
+
+
+def compare(previous, current, threshold=.1):
+    """
+    Compares two runs, using the best time of each benchmark
+
+    :param previous: Results of the reference run
+    :param current: Results of the new run
+    :param threshold: Relative difference considered as significant
+    :return: A list of (name, previous time, current time, ratio, status)
+             tuples, status being "slower", "faster" or ""
+    """
+    rows = []
+    previous = previous["benchmarks"]
+    for name, stats in current["benchmarks"].items():
+        try:
+            before = previous[name]["min"]
+        except KeyError:
+            # New benchmark
+            continue
+
+        ratio = stats["min"] / before if before else None
+        if ratio is None:
+            status = ""
+        elif ratio > 1 + threshold:
+            status = "slower"
+        elif ratio < 1 - threshold:
+            status = "faster"
+        else:
+            status = ""
+        rows.append((name, before, stats["min"], ratio, status))
+    return rows
+
+
+def print_results(results):
+    """
+    Prints the results of a run as a table
+
+    :param results: Result of run()
+    """
+    print("{0:<28} {1:>12} {2:>12} {3:>12}"
+          .format("Benchmark", "Min (us)", "Median (us)", "Rate (op/s)"))
+    for name, stats in results["benchmarks"].items():
+        print("{0:<28} {1:>12.2f} {2:>12.2f} {3:>12.1f}"
+              .format(name, stats["min"] * 1e6, stats["median"] * 1e6,
+                      stats["ops"] or 0))
+
+
+def print_comparison(rows):
+    """
+    Prints the result of compare() as a table
+
+    :param rows: Result of compare()
+    """
+    print("{0:<28} {1:>12} {2:>12} {3:>8}"
+          .format("Benchmark", "Before (us)", "After (us)", "Ratio"))
+    for name, before, after, ratio, status in rows:
+        print("{0:<28} {1:>12.2f} {2:>12.2f} {3:>8.2f} {4}"
+              .format(name, before * 1e6, after * 1e6, ratio or 0, status))
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herald codecs benchmark")
+    parser.add_argument("-k", "--filter", default=None, dest="pattern",
+                        help="Run the benchmarks matching this pattern")
+    parser.add_argument("-r", "--rounds", type=int, default=5,
+                        dest="rounds", help="Number of rounds per benchmark")
+    parser.add_argument("-t", "--time", type=float, default=.05,
+                        dest="round_time",
+                        help="Minimal duration of a round, in seconds")
+    parser.add_argument("-o", "--output", default=None, dest="output",
+                        help="Write the results to this JSON file")
+    parser.add_argument("--compare", default=None, dest="compare",
+                        help="Compare the results to those of this file")
+    parser.add_argument("--threshold", type=float, default=.1,
+                        dest="threshold",
+                        help="Relative difference considered as a "
+                             "regression")
+    args = parser.parse_args()
+
+    run_results = run(args.pattern, args.rounds, args.round_time)
+    print_results(run_results)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(run_results, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as reference:
+            comparison = compare(json.load(reference), run_results,
+                                 args.threshold)
+        print("")
+        print_comparison(comparison)
+        if any(row[4] == "slower" for row in comparison):
+            sys.exit(1)
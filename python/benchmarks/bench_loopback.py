@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Measures the throughput and latency of the Herald core with the loopback
+transport: no network is involved, only the simulated conditions given on
+the command line.
+
+Usage: ``python -m benchmarks.bench_loopback -n 1 10 100 1000 -c 1000``
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+from herald.transports.loopback import ACCESS_ID
+import herald.transports.loopback.directory as loopback_directory
+import herald.transports.loopback.transport as loopback_transport
+
+# Benchmark utilities
+from benchmarks.harness import VirtualPeer, BenchListener, Counter, \
+    BENCH_GROUP, bench_fire, bench_send, bench_post, bench_fire_group, \
+    print_summaries
+
+# Standard library
+import argparse
+import logging
+import threading
+
+# ------------------------------------------------------------------------------
+
+THREAD_STACK_SIZE = 256 * 1024
+"""
+Stack size of the threads: each peer has its own thread pool, which must
+fit in memory with 1,000 peers
+"""
+
+# ------------------------------------------------------------------------------
+
+
+def start_peers(count, hub, conditions):
+    """
+    Starts the given number of peers connected to the given hub
+
+    :param count: Number of peers
+    :param hub: Name of the loopback hub
+    :param conditions: Dictionary of simulated network conditions
+    :return: A list of (VirtualPeer, BenchListener) tuples
+    """
+    peers = []
+    for idx in range(count):
+        peer = VirtualPeer("peer-{0:04d}".format(idx), "herald-bench",
+                           [BENCH_GROUP])
+        peer.start()
+
+        transport = loopback_transport.LoopbackTransport()
+        transport._hub_name = hub
+        for name, value in conditions.items():
+            setattr(transport, "_" + name, value)
+        peer.add_transport(ACCESS_ID, transport,
+                           loopback_directory.LoopbackDirectory())
+
+        listener = BenchListener()
+        peer.add_listener(listener, ["bench/*"])
+        peers.append((peer, listener))
+    return peers
+
+
+def run(nb_targets, count, payload, conditions, timeout):
+    """
+    Runs the benchmarks with the given number of target peers
+
+    :param nb_targets: Number of peers receiving messages
+    :param count: Number of messages per benchmark
+    :param payload: Size of the message payload, in characters
+    :param conditions: Dictionary of simulated network conditions
+    :param timeout: Maximum time to wait for messages, in seconds
+    :return: The list of benchmark summaries
+    """
+    hub = "bench-{0}".format(nb_targets)
+    peers = []
+    try:
+        peers = start_peers(nb_targets + 1, hub, conditions)
+        sender = peers[0][0]
+        targets = [peer for peer, _ in peers[1:]]
+        counter = Counter([listener for _, listener in peers[1:]])
+
+        summaries = [
+            bench_fire(sender, counter, targets, count, payload, timeout),
+            bench_send(sender, targets, count, payload, timeout),
+            bench_post(sender, targets, count, payload, timeout),
+            bench_fire_group(sender, counter, targets,
+                             max(1, count // nb_targets), payload, timeout)]
+        for summary in summaries[:-1]:
+            summary["name"] = "{0} ({1} peers)".format(summary["name"],
+                                                       nb_targets)
+        return summaries
+    finally:
+        for peer, _ in reversed(peers):
+            peer.stop()
+
+
+def main(all_targets, count, payload, conditions, timeout=60):
+    """
+    Runs the benchmarks
+
+    :param all_targets: List of numbers of target peers
+    :param count: Number of messages per benchmark
+    :param payload: Size of the message payload, in characters
+    :param conditions: Dictionary of simulated network conditions
+    :param timeout: Maximum time to wait for messages, in seconds
+    :return: The list of benchmark summaries
+    """
+    threading.stack_size(THREAD_STACK_SIZE)
+    summaries = []
+    for nb_targets in all_targets:
+        summaries.extend(run(max(1, nb_targets), count, payload, conditions,
+                             timeout))
+    return summaries
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herald loopback benchmark")
+    parser.add_argument("-n", "--peers", type=int, nargs="+",
+                        default=[1, 10, 100], dest="peers",
+                        help="Numbers of target peers")
+    parser.add_argument("-c", "--count", type=int, default=1000, dest="count",
+                        help="Number of messages per benchmark")
+    parser.add_argument("-s", "--size", type=int, default=64, dest="size",
+                        help="Size of the message payload")
+    parser.add_argument("-t", "--timeout", type=float, default=60,
+                        dest="timeout", help="Time to wait for messages")
+
+    group = parser.add_argument_group("Network conditions")
+    group.add_argument("--latency", type=float, default=0, dest="latency",
+                       help="Latency, in seconds")
+    group.add_argument("--jitter", type=float, default=0, dest="jitter",
+                       help="Maximal random delay added to the latency")
+    group.add_argument("--loss", type=float, default=0, dest="loss",
+                       help="Probability of a message to be lost")
+    group.add_argument("--reorder", type=float, default=0, dest="reorder",
+                       help="Probability of a message to be reordered")
+    group.add_argument("--seed", type=int, default=None, dest="seed",
+                       help="Seed of the random generator")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print_summaries(main(args.peers, args.count, args.size,
+                         {"latency": args.latency, "jitter": args.jitter,
+                          "loss": args.loss, "reorder": args.reorder,
+                          "seed": args.seed},
+                         args.timeout))
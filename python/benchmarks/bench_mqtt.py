@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Measures the throughput and latency of the Herald MQTT transport, with N
+peers running in this process against the in-process MQTT broker.
+
+Usage: ``python -m benchmarks.bench_mqtt -n 5 -c 1000``
+
+:author: Ahmad Shahwan
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+from herald.transports.mqtt import ACCESS_ID
+from herald.transports.mqtt.broker import MqttBroker
+import herald.transports.mqtt.directory as mqtt_directory
+import herald.transports.mqtt.transport as mqtt_transport
+
+# Benchmark utilities
+from benchmarks.harness import VirtualPeer, BenchListener, Counter, \
+    BENCH_GROUP, bench_fire, bench_send, bench_fire_group, print_summaries
+
+# Standard library
+import argparse
+import logging
+
+# ------------------------------------------------------------------------------
+
+
+def start_peers(count, host, port):
+    """
+    Starts the given number of peers connected to the broker
+
+    :return: A list of (VirtualPeer, BenchListener) tuples
+    """
+    peers = []
+    for idx in range(count):
+        peer = VirtualPeer("peer-{0:04d}".format(idx), "herald-bench",
+                           [BENCH_GROUP])
+        peer.start()
+
+        transport = mqtt_transport.MqttTransport()
+        transport._host = host
+        transport._port = port
+        peer.add_transport(ACCESS_ID, transport, mqtt_directory.Directory())
+
+        listener = BenchListener()
+        peer.add_listener(listener, ["bench/*"])
+        peers.append((peer, listener))
+
+    for peer, _ in peers:
+        if not peer.wait_peers(count - 1):
+            raise RuntimeError("Discovery not complete for {0}".format(peer))
+    return peers
+
+
+def main(nb_peers, count, payload):
+    """
+    Runs the benchmarks
+
+    :param nb_peers: Number of peers (at least 2)
+    :param count: Number of messages per benchmark
+    :param payload: Size of the message payload, in characters
+    :return: The list of benchmark summaries
+    """
+    broker = MqttBroker()
+    host, port = broker.start()
+    peers = []
+    try:
+        peers = start_peers(max(2, nb_peers), host, port)
+        sender = peers[0][0]
+        targets = [peer for peer, _ in peers[1:]]
+        counter = Counter([listener for _, listener in peers[1:]])
+
+        return [bench_fire(sender, counter, targets, count, payload),
+                bench_send(sender, targets, count, payload),
+                bench_fire_group(sender, counter, targets, count, payload)]
+    finally:
+        for peer, _ in peers:
+            peer.stop()
+        broker.stop()
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herald MQTT benchmark")
+    parser.add_argument("-n", "--peers", type=int, default=5, dest="peers",
+                        help="Number of peers")
+    parser.add_argument("-c", "--count", type=int, default=1000, dest="count",
+                        help="Number of messages per benchmark")
+    parser.add_argument("-s", "--size", type=int, default=64, dest="size",
+                        help="Size of the message payload")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print_summaries(main(args.peers, args.count, args.size))
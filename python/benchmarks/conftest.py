@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Pytest configuration of the benchmarks: provides a ``benchmark`` fixture
+calling the benchmarked method once when the pytest-benchmark plugin is not
+installed, so that the benchmark cases are at least checked
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Pytest
+import pytest
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+# ------------------------------------------------------------------------------
+
+if pytest_benchmark is None:
+    @pytest.fixture
+    def benchmark():
+        """
+        Stand-in of the pytest-benchmark fixture
+        """
+        def run(method, *args, **kwargs):
+            return method(*args, **kwargs)
+        return run
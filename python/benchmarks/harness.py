@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Utilities to run many Herald peers in a single process.
+
+A Pelix framework is a singleton, so each virtual peer assembles the Herald
+core components by hand, the way iPOPO would inject and validate them.
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+from herald.exceptions import HeraldTimeout
+import herald
+import herald.beans as beans
+import herald.core
+import herald.directory
+import herald.probe
+
+# Pelix
+import pelix.constants
+
+# Standard library
+import logging
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+
+class PeerContext(object):
+    """
+    Minimal bundle context: gives access to the framework properties of a
+    virtual peer
+    """
+    def __init__(self, properties):
+        """
+        :param properties: Framework properties
+        """
+        self.__properties = properties
+
+    def get_property(self, name):
+        """
+        Returns the value of a framework property, or None
+        """
+        return self.__properties.get(name)
+
+
+class ServiceReference(object):
+    """
+    Minimal service reference, giving access to service properties
+    """
+    def __init__(self, properties=None):
+        """
+        :param properties: Service properties
+        """
+        self.__properties = properties or {}
+
+    def get_property(self, name):
+        """
+        Returns the value of a service property, or None
+        """
+        return self.__properties.get(name)
+
+
+class VirtualPeer(object):
+    """
+    A Herald peer (directory and core service) running without a framework
+    """
+    def __init__(self, uid, app_id=herald.DEFAULT_APPLICATION_ID,
+                 groups=None, name=None):
+        """
+        Sets up the peer components
+
+        :param uid: Peer UID
+        :param app_id: Application ID
+        :param groups: Groups of the peer
+        :param name: Peer name (defaults to the UID)
+        """
+        self.uid = uid
+        self.context = PeerContext({
+            pelix.constants.FRAMEWORK_UID: uid,
+            herald.FWPROP_PEER_UID: uid,
+            herald.FWPROP_PEER_NAME: name or uid,
+            herald.FWPROP_APPLICATION_ID: app_id,
+            herald.FWPROP_PEER_GROUPS: list(groups or [])})
+        self.probe = herald.probe.DummyProbe()
+
+        # Core directory
+        self.directory = herald.directory.HeraldDirectory()
+        self.directory._directories = {}
+        self.directory._listeners = []
+        self.directory._group_listeners = []
+
+        # Core service
+        self.herald = herald.core.Herald()
+        self.herald._directory = self.directory
+        self.herald._probe = self.probe
+        self.herald._listeners = []
+        self.herald._transports = {}
+
+        # Access ID -> (transport, transport directory)
+        self.__transports = {}
+
+    def __str__(self):
+        return "VirtualPeer({0})".format(self.uid)
+
+    def inject(self, component):
+        """
+        Injects the peer core services in the usual fields of a component
+
+        :param component: A Herald component instance
+        :return: The given component
+        """
+        for field, value in (('_directory', self.directory),
+                             ('_herald', self.herald),
+                             ('_core', self.herald),
+                             ('_probe', self.probe)):
+            if hasattr(component, field) and getattr(component, field) is None:
+                setattr(component, field, value)
+        return component
+
+    def start(self):
+        """
+        Validates the core components
+        """
+        self.directory._validate(self.context)
+        self.herald._validate(self.context)
+        self.directory._listeners.append(self.herald)
+
+    def stop(self):
+        """
+        Invalidates all components
+        """
+        for access_id in list(self.__transports):
+            self.remove_transport(access_id)
+
+        self.directory._listeners.remove(self.herald)
+        self.herald._invalidate(self.context)
+        self.directory._invalidate(self.context)
+
+    def add_transport(self, access_id, transport, transport_directory):
+        """
+        Injects, validates and binds a transport and its directory
+
+        :param access_id: Access ID of the transport
+        :param transport: Transport component (not yet validated)
+        :param transport_directory: Transport directory component
+        """
+        self.inject(transport_directory)
+        self.inject(transport)
+        self.directory._directories[access_id] = transport_directory
+        transport_directory._validate(self.context)
+        transport._validate(self.context)
+        self.herald._transports[access_id] = transport
+        self.__transports[access_id] = (transport, transport_directory)
+
+    def remove_transport(self, access_id):
+        """
+        Unbinds and invalidates a transport and its directory
+
+        :param access_id: Access ID of the transport
+        """
+        transport, transport_directory = self.__transports.pop(access_id)
+        del self.herald._transports[access_id]
+        transport._invalidate(self.context)
+        del self.directory._directories[access_id]
+        transport_directory._invalidate(self.context)
+
+    def add_listener(self, listener, filters):
+        """
+        Registers a message listener
+
+        :param listener: An object with a herald_message() method
+        :param filters: List of subject filters
+        """
+        self.herald._listeners.append(listener)
+        self.herald._bind_listener(
+            None, listener, ServiceReference({herald.PROP_FILTERS: filters}))
+
+    def wait_peers(self, count, timeout=30):
+        """
+        Waits for the directory to know the given number of peers
+
+        :param count: Number of remote peers to wait for
+        :param timeout: Maximum time to wait, in seconds
+        :return: True if the peers have been registered in time
+        """
+        deadline = time.time() + timeout
+        while len(self.directory.get_peers()) < count:
+            if time.time() > deadline:
+                return False
+            time.sleep(.05)
+        return True
+
+# ------------------------------------------------------------------------------
+
+SUBJECT_FIRE = "bench/fire"
+SUBJECT_ECHO = "bench/echo"
+BENCH_GROUP = "bench"
+
+# ------------------------------------------------------------------------------
+
+
+class BenchListener(object):
+    """
+    Records the reception time of benchmark messages and answers echoes
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__expected = 0
+        self.__event = threading.Event()
+        self.latencies = []
+
+    def expect(self, count):
+        """
+        Resets the listener to wait for the given number of messages
+        """
+        with self.__lock:
+            self.__expected = count
+            self.latencies = []
+            self.__event.clear()
+            if count <= 0:
+                self.__event.set()
+
+    def wait(self, timeout):
+        """
+        Waits for the expected messages to be received
+        """
+        return self.__event.wait(timeout)
+
+    def herald_message(self, herald_svc, message):
+        """
+        A benchmark message has been received
+        """
+        if message.subject == SUBJECT_ECHO:
+            herald_svc.reply(message, message.content)
+            return
+
+        latency = time.time() - message.content['sent']
+        with self.__lock:
+            self.latencies.append(latency)
+            if len(self.latencies) >= self.__expected:
+                self.__event.set()
+
+
+class Counter(object):
+    """
+    Aggregates the listeners of all receiving peers
+    """
+    def __init__(self, listeners):
+        self.listeners = listeners
+
+    def expect(self, counts):
+        for listener, count in zip(self.listeners, counts):
+            listener.expect(count)
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        for listener in self.listeners:
+            if not listener.wait(max(0, deadline - time.time())):
+                return False
+        return True
+
+    def latencies(self):
+        return [latency for listener in self.listeners
+                for latency in listener.latencies]
+
+
+def make_content(payload_size):
+    """
+    Prepares a benchmark message content
+    """
+    return {"sent": time.time(), "data": "x" * payload_size}
+
+# ------------------------------------------------------------------------------
+
+
+def percentile(values, pct):
+    """
+    Computes a percentile using the nearest-rank method
+
+    :param values: A list of numbers
+    :param pct: Percentile to compute (0 to 100)
+    :return: The percentile value, or None for an empty list
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = int(round(pct / 100. * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def summarize(name, count, duration, latencies=None):
+    """
+    Prepares the summary of a benchmark run
+
+    :param name: Name of the benchmark
+    :param count: Number of operations done
+    :param duration: Duration of the run, in seconds
+    :param latencies: List of latencies, in seconds
+    :return: A dictionary
+    """
+    latencies = latencies or []
+    return {"name": name,
+            "count": count,
+            "duration": duration,
+            "rate": count / duration if duration else None,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99)}
+
+
+def print_summaries(summaries):
+    """
+    Prints a list of benchmark summaries as a table
+
+    :param summaries: Results of summarize()
+    """
+    def fmt_ms(value):
+        return "{0:9.3f}".format(value * 1000) if value is not None \
+            else "      n/a"
+
+    print("{0:<32} {1:>8} {2:>12} {3:>9} {4:>9}"
+          .format("Benchmark", "Count", "Rate (op/s)", "p50 (ms)",
+                  "p99 (ms)"))
+    for summary in summaries:
+        print("{0:<32} {1:>8} {2:>12.1f} {3} {4}"
+              .format(summary["name"], summary["count"],
+                      summary["rate"] or 0, fmt_ms(summary["p50"]),
+                      fmt_ms(summary["p99"])))
+
+# ------------------------------------------------------------------------------
+
+
+def bench_fire(sender, counter, targets, count, payload, timeout=60):
+    """
+    Fires messages to all targets, round-robin
+    """
+    counter.expect([count // len(targets) + (1 if idx < count % len(targets)
+                                             else 0)
+                    for idx in range(len(targets))])
+    start = time.time()
+    for idx in range(count):
+        sender.herald.fire(targets[idx % len(targets)].uid,
+                           beans.Message(SUBJECT_FIRE, make_content(payload)))
+
+    if not counter.wait(timeout):
+        logging.warning("fire: not all messages have been received")
+    return summarize("fire", count, time.time() - start, counter.latencies())
+
+
+def bench_send(sender, targets, count, payload, timeout=30):
+    """
+    Sends messages to all targets, round-robin, waiting for each reply
+    """
+    latencies = []
+    start = time.time()
+    for idx in range(count):
+        call_start = time.time()
+        try:
+            sender.herald.send(
+                targets[idx % len(targets)].uid,
+                beans.Message(SUBJECT_ECHO, make_content(payload)), timeout)
+        except HeraldTimeout:
+            # Lost request or reply
+            continue
+        latencies.append(time.time() - call_start)
+
+    if len(latencies) < count:
+        logging.warning("send: %d replies missing", count - len(latencies))
+    return summarize("send", count, time.time() - start, latencies)
+
+
+def bench_post(sender, targets, count, payload, timeout=60):
+    """
+    Posts messages to all targets, round-robin, without waiting for the
+    replies before posting the next message
+    """
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+    if not count:
+        done.set()
+
+    def callback(_, reply):
+        """
+        Reply received
+        """
+        with lock:
+            latencies.append(time.time() - reply.content['sent'])
+            if len(latencies) >= count:
+                done.set()
+
+    start = time.time()
+    for idx in range(count):
+        sender.herald.post(targets[idx % len(targets)].uid,
+                           beans.Message(SUBJECT_ECHO, make_content(payload)),
+                           callback, None, timeout)
+
+    if not done.wait(timeout):
+        logging.warning("post: %d replies missing", count - len(latencies))
+    return summarize("post", count, time.time() - start, latencies)
+
+
+def bench_fire_group(sender, counter, targets, count, payload, timeout=60):
+    """
+    Fires messages to the benchmark group
+    """
+    counter.expect([count] * len(targets))
+    start = time.time()
+    for _ in range(count):
+        sender.herald.fire_group(
+            BENCH_GROUP, beans.Message(SUBJECT_FIRE, make_content(payload)))
+
+    if not counter.wait(timeout):
+        logging.warning("fire_group: not all messages have been received")
+    return summarize("fire_group ({0} peers)".format(len(targets)),
+                     count * len(targets), time.time() - start,
+                     counter.latencies())
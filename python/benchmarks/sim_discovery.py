@@ -0,0 +1,564 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Discrete-event simulation of the discovery of a large cluster of HTTP
+peers, all running in this process.
+
+Each virtual peer runs the real multicast heart beat handler, peer contact
+and directories; only the network, the HTTP transport and the clock are
+simulated. Heart beats use the real packet formats.
+
+Usage: ``python -m benchmarks.sim_discovery -n 500 --leave 10 --crash 10``
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+from herald.transports.http import ACCESS_ID, MESSAGE_HEADER_PORT, \
+    MESSAGE_HEADER_PATH
+from herald.transports.http.beans import HTTPAccess
+from herald.transports.http.directory import HTTPDirectory
+from herald.transports.http.discovery_multicast import MulticastHeartbeat, \
+    MulticastReceiver, make_heartbeat, make_lastbeat
+from herald.transports.peer_contact import PeerContact
+import herald
+import herald.beans as beans
+import herald.directory
+import herald.probe
+import herald.utils as utils
+
+# Benchmark utilities
+from benchmarks.harness import PeerContext
+
+# Pelix
+import pelix.constants
+
+# Standard library
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import random
+import time
+
+try:
+    # Python 3.3+
+    cpu_time = time.process_time
+except AttributeError:
+    cpu_time = time.clock
+
+# ------------------------------------------------------------------------------
+
+HEART_PERIOD = 20
+""" Time between two heart beats of a peer, as in MulticastHeartbeat """
+
+TTL_PERIOD = 1
+""" Time between two checks of the peers TTL, as in MulticastHeartbeat """
+
+MULTICAST_PORT = 42000
+HTTP_PORT = 8080
+HTTP_PATH = "herald"
+
+# ------------------------------------------------------------------------------
+
+
+class Network(object):
+    """
+    Simulated network and clock: events are executed in the order of their
+    simulated time
+    """
+    def __init__(self, latency=.001, jitter=.004, loss=0, seed=None):
+        """
+        :param latency: Minimal time to transmit a packet, in seconds
+        :param jitter: Maximal random time added to the latency
+        :param loss: Probability of a multicast packet to be lost
+        :param seed: Seed of the random generator
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+
+        # Simulated time
+        self.now = 0.
+
+        # Events: (time, order, peer, method, arguments)
+        self.__events = []
+        self.__order = itertools.count()
+
+        # Peers: (host, HTTP port) -> SimPeer
+        self.peers = {}
+
+        # Number of peers knowing all others, expected number of known peers
+        self.complete = 0
+        self.expected = 0
+
+        # Statistics
+        self.stats = {"events": 0, "multicast_sent": 0,
+                      "multicast_received": 0, "multicast_lost": 0,
+                      "messages": {}, "bytes": 0}
+
+    def clock(self):
+        """
+        Returns the simulated time
+        """
+        return self.now
+
+    def delay(self):
+        """
+        Computes the transmission time of a packet
+        """
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def schedule(self, delay, peer, method, *args):
+        """
+        Schedules an event
+
+        :param delay: Time before the event, in seconds
+        :param peer: Peer handling the event (its CPU time is accounted)
+        :param method: Method to call
+        :param args: Method arguments
+        """
+        heapq.heappush(self.__events, (self.now + delay, next(self.__order),
+                                       peer, method, args))
+
+    def run(self, until, stop=None):
+        """
+        Executes events
+
+        :param until: Simulated time to stop at
+        :param stop: Method returning True when the simulation must stop
+        :return: True if the stop condition has been reached
+        """
+        events = self.__events
+        while events and events[0][0] <= until:
+            self.now, _, peer, method, args = heapq.heappop(events)
+            if peer is not None and not peer.active:
+                # Peer stopped
+                continue
+
+            start = cpu_time()
+            method(*args)
+            if peer is not None:
+                peer.cpu += cpu_time() - start
+            self.stats["events"] += 1
+
+            if stop is not None and stop():
+                return True
+
+        self.now = max(self.now, until)
+        return False
+
+    def multicast(self, sender, packet):
+        """
+        Sends a multicast packet to all other active peers
+
+        :param sender: Sending SimPeer
+        :param packet: Packet content
+        """
+        self.stats["multicast_sent"] += 1
+        source = (sender.host, MULTICAST_PORT)
+        for peer in self.peers.values():
+            if peer is sender or not peer.active:
+                continue
+
+            if self.loss and self.random.random() < self.loss:
+                self.stats["multicast_lost"] += 1
+                continue
+
+            self.stats["multicast_received"] += 1
+            self.schedule(self.delay(), peer, peer.receive_packet, source,
+                          packet)
+
+    def post(self, sender, host, port, subject, payload):
+        """
+        Sends an HTTP request
+
+        :param sender: Sending SimPeer
+        :param host: Target host
+        :param port: Target HTTP port
+        :param subject: Message subject, for statistics
+        :param payload: Request body
+        :return: False if no peer listens at this address
+        """
+        try:
+            peer = self.peers[(host, port)]
+        except KeyError:
+            return False
+
+        if not peer.active:
+            return False
+
+        messages = self.stats["messages"]
+        messages[subject] = messages.get(subject, 0) + 1
+        self.stats["bytes"] += len(payload)
+        self.schedule(self.delay(), peer, peer.receive_message, sender.host,
+                      payload)
+        return True
+
+    def reset_complete(self):
+        """
+        Computes the number of active peers knowing all other active peers
+        """
+        active = [peer for peer in self.peers.values() if peer.active]
+        self.expected = len(active) - 1
+        self.complete = len([peer for peer in active
+                             if peer.known == self.expected])
+
+    def is_complete(self):
+        """
+        Checks if all active peers know each other
+        """
+        return self.complete == self.expected + 1
+
+
+class SimPeer(object):
+    """
+    A virtual peer: real directories, peer contact and heart beat handler,
+    simulated HTTP transport and Herald core
+    """
+    def __init__(self, network, index, app_id, ttl):
+        """
+        :param network: The simulated Network
+        :param index: Index of the peer
+        :param app_id: Application ID
+        :param ttl: Time to live of the peers, in seconds
+        """
+        self.network = network
+        self.uid = "peer-{0:05d}".format(index)
+        self.host = "10.{0}.{1}.{2}".format(index // 65536,
+                                             (index // 256) % 256,
+                                             index % 256)
+        self.active = False
+        self.cpu = 0.
+        self.known = 0
+        self.context = PeerContext({
+            pelix.constants.FRAMEWORK_UID: self.uid,
+            herald.FWPROP_PEER_UID: self.uid,
+            herald.FWPROP_PEER_NAME: self.uid,
+            herald.FWPROP_NODE_UID: self.uid,
+            herald.FWPROP_NODE_NAME: self.uid,
+            herald.FWPROP_APPLICATION_ID: app_id,
+            herald.FWPROP_PEER_GROUPS: ["all"]})
+
+        # Directories
+        self.directory = herald.directory.HeraldDirectory()
+        self.directory._listeners = [self]
+        self.directory._group_listeners = []
+        self.http_directory = HTTPDirectory()
+        self.http_directory._directory = self.directory
+        self.directory._directories = {ACCESS_ID: self.http_directory}
+
+        # Discovery
+        self.contact = PeerContact(self.directory, self.__load_dump,
+                                   "sim.contact")
+        self.heart = MulticastHeartbeat()
+        self.heart._directory = self.directory
+        self.heart._probe = herald.probe.DummyProbe()
+        self.heart._transport = self
+        self.heart._peer_ttl = ttl
+        self.heart._clock = network.clock
+        self.receiver = MulticastReceiver(None, MULTICAST_PORT,
+                                          self.heart.handle_heartbeat)
+        network.peers[(self.host, HTTP_PORT)] = self
+
+    def __str__(self):
+        return self.uid
+
+    def start(self):
+        """
+        Starts the peer: sends heart beats and checks the peers TTL
+        """
+        self.directory._validate(self.context)
+        self.http_directory._validate(self.context)
+        local_peer = self.directory.get_local_peer()
+        local_peer.set_access(ACCESS_ID,
+                              HTTPAccess(self.host, HTTP_PORT, HTTP_PATH))
+        self.heart._local_peer = local_peer
+
+        self.active = True
+        self.network.reset_complete()
+        self.__heart_beat()
+        self.network.schedule(TTL_PERIOD, self, self.__check_ttl)
+
+    def stop(self, graceful=True):
+        """
+        Stops the peer
+
+        :param graceful: If True, sends a last beat
+        """
+        if graceful:
+            local_peer = self.directory.get_local_peer()
+            self.network.multicast(
+                self, make_lastbeat(local_peer.uid, local_peer.app_id))
+
+        self.active = False
+        self.network.reset_complete()
+
+    def __heart_beat(self):
+        """
+        Sends a heart beat and schedules the next one
+        """
+        local_peer = self.directory.get_local_peer()
+        self.network.multicast(self, make_heartbeat(
+            HTTP_PORT, HTTP_PATH, local_peer.uid, local_peer.app_id))
+        self.network.schedule(HEART_PERIOD, self, self.__heart_beat)
+
+    def __check_ttl(self):
+        """
+        Checks the peers TTL and schedules the next check
+        """
+        self.heart._check_ttl()
+        self.network.schedule(TTL_PERIOD, self, self.__check_ttl)
+
+    def __set_known(self, known):
+        """
+        Updates the number of known peers
+        """
+        network = self.network
+        if self.known == network.expected:
+            network.complete -= 1
+        self.known = known
+        if known == network.expected:
+            network.complete += 1
+
+    # Directory listener
+
+    def peer_registered(self, _):
+        self.__set_known(self.known + 1)
+
+    def peer_unregistered(self, _):
+        self.__set_known(self.known - 1)
+
+    def peer_updated(self, *_):
+        pass
+
+    # Multicast and HTTP reception
+
+    def receive_packet(self, sender, packet):
+        """
+        Handles a multicast packet, with the real packet parser
+        """
+        self.receiver._handle_heartbeat(sender, packet)
+
+    @staticmethod
+    def __load_dump(message, description):
+        """
+        Sets the HTTP access of a peer description, as the HTTP servlet does
+        """
+        extra = message.extra
+        description['accesses'][ACCESS_ID] = \
+            HTTPAccess(extra['host'], extra['port'], extra['path']).dump()
+        return description
+
+    def receive_message(self, host, payload):
+        """
+        Handles a discovery message received by the HTTP servlet
+        """
+        message = utils.from_json(payload)
+        try:
+            port = int(message.get_header(MESSAGE_HEADER_PORT))
+        except (KeyError, ValueError, TypeError):
+            port = 80
+        message.set_access(ACCESS_ID)
+        message.set_extra({'host': host, 'port': port,
+                           'path': message.get_header(MESSAGE_HEADER_PATH),
+                           'parent_uid': message.uid})
+        self.contact.herald_message(self, message)
+
+    # HTTP transport and Herald core, used by the discovery
+
+    def fire(self, peer, message, extra=None):
+        """
+        Posts a message, as the HTTP transport does
+        """
+        if extra is not None and extra.get('host'):
+            host, port, path = extra['host'], extra['port'], extra['path']
+            parent_uid = extra.get('parent_uid')
+        else:
+            host, port, path = peer.get_access(ACCESS_ID).access
+            parent_uid = None
+
+        message.add_header(herald.MESSAGE_HEADER_SENDER_UID, self.uid)
+        message.add_header(MESSAGE_HEADER_PORT, HTTP_PORT)
+        message.add_header(MESSAGE_HEADER_PATH, HTTP_PATH)
+        if parent_uid:
+            message.add_header(herald.MESSAGE_HEADER_REPLIES_TO, parent_uid)
+
+        if not self.network.post(self, host, port, message.subject,
+                                 utils.to_json(message)):
+            raise IOError("No peer at {0}:{1}/{2}".format(host, port, path))
+
+    def reply(self, message, content, subject=None):
+        """
+        Replies to a message, as the Herald core does
+        """
+        if subject is None:
+            subject = '/'.join(('reply', message.subject))
+        self.fire(None, beans.Message(subject, content), message.extra)
+
+# ------------------------------------------------------------------------------
+
+
+def simulate(nb_peers, ramp=10, leave=0, crash=0, settle=HEART_PERIOD + 1,
+             ttl=30, max_time=600, latency=.001, jitter=.004, loss=0,
+             seed=None):
+    """
+    Runs a simulation
+
+    Peers only get a TTL from the heart beats they receive: a peer learned
+    through the contact of another one, which crashes before sending a new
+    heart beat, is never forgotten. Departures therefore happen after a
+    settle period, by default a heart beat period.
+
+    :param nb_peers: Number of peers
+    :param ramp: Peers start at a random time during this period, in seconds
+    :param leave: Number of peers leaving after the full mesh is reached
+    :param crash: Number of peers crashing after the full mesh is reached
+    :param settle: Time between the full mesh and the departures, in seconds
+    :param ttl: Time to live of the peers, in seconds
+    :param max_time: Maximum simulated time of each phase, in seconds
+    :param latency: Minimal time to transmit a packet, in seconds
+    :param jitter: Maximal random time added to the latency
+    :param loss: Probability of a multicast packet to be lost
+    :param seed: Seed of the random generator
+    :return: A dictionary of results
+    """
+    network = Network(latency, jitter, loss, seed)
+    peers = [SimPeer(network, idx, "sim", ttl) for idx in range(nb_peers)]
+    for peer in peers:
+        network.schedule(network.random.uniform(0, ramp), None, peer.start)
+
+    # Discovery phase
+    wall_start = time.time()
+    cpu_start = cpu_time()
+    last_start = ramp
+    mesh = network.run(max_time,
+                       lambda: network.now >= last_start and
+                       network.is_complete() and
+                       all(peer.active for peer in peers))
+    results = {"peers": nb_peers,
+               "mesh_time": network.now if mesh else None}
+
+    # Departure phase
+    leaving = network.random.sample(peers, min(nb_peers, leave + crash))
+    if leaving:
+        network.run(network.now + settle)
+        departure = network.now
+        for idx, peer in enumerate(leaving):
+            peer.stop(idx < leave)
+        converged = network.run(departure + max_time, network.is_complete)
+        results["departure_time"] = network.now - departure \
+            if converged else None
+
+    stats = network.stats
+    cpu = sorted(peer.cpu for peer in peers)
+    results.update({
+        "events": stats["events"],
+        "multicast_sent": stats["multicast_sent"],
+        "multicast_received": stats["multicast_received"],
+        "multicast_lost": stats["multicast_lost"],
+        "messages": stats["messages"],
+        "http_messages": sum(stats["messages"].values()),
+        "http_bytes": stats["bytes"],
+        "cpu_mean": sum(cpu) / len(cpu),
+        "cpu_max": cpu[-1],
+        "cpu_total": cpu_time() - cpu_start,
+        "wall_time": time.time() - wall_start})
+    return results
+
+
+def print_results(results):
+    """
+    Prints the results of a simulation
+    """
+    def fmt_time(value):
+        return "{0:.3f} s".format(value) if value is not None \
+            else "not reached"
+
+    print("Peers ............................ {0}".format(results["peers"]))
+    print("Time to full mesh ................ {0}"
+          .format(fmt_time(results["mesh_time"])))
+    if "departure_time" in results:
+        print("Time to forget departed peers .... {0}"
+              .format(fmt_time(results["departure_time"])))
+    print("Multicast packets sent ........... {0}"
+          .format(results["multicast_sent"]))
+    print("Multicast packets received ....... {0} ({1} lost)"
+          .format(results["multicast_received"],
+                  results["multicast_lost"]))
+    print("HTTP messages .................... {0} ({1} bytes)"
+          .format(results["http_messages"], results["http_bytes"]))
+    for subject, count in sorted(results["messages"].items()):
+        print("    {0:<40} {1}".format(subject, count))
+    print("CPU time per peer (mean / max) ... {0:.2f} ms / {1:.2f} ms"
+          .format(results["cpu_mean"] * 1000, results["cpu_max"] * 1000))
+    print("Simulation ....................... {0} events, {1:.1f} s"
+          .format(results["events"], results["wall_time"]))
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Herald discovery simulator")
+    parser.add_argument("-n", "--peers", type=int, default=100, dest="peers",
+                        help="Number of peers")
+    parser.add_argument("--ramp", type=float, default=10, dest="ramp",
+                        help="Start-up period of the peers, in seconds")
+    parser.add_argument("--leave", type=int, default=0, dest="leave",
+                        help="Number of peers leaving after the full mesh")
+    parser.add_argument("--crash", type=int, default=0, dest="crash",
+                        help="Number of peers crashing after the full mesh")
+    parser.add_argument("--settle", type=float, default=HEART_PERIOD + 1,
+                        dest="settle",
+                        help="Time between the full mesh and the departures")
+    parser.add_argument("--ttl", type=int, default=30, dest="ttl",
+                        help="Time to live of the peers, in seconds")
+    parser.add_argument("--max-time", type=float, default=600,
+                        dest="max_time",
+                        help="Maximum simulated time of a phase, in seconds")
+    parser.add_argument("--latency", type=float, default=.001,
+                        dest="latency", help="Network latency, in seconds")
+    parser.add_argument("--jitter", type=float, default=.004,
+                        dest="jitter", help="Network jitter, in seconds")
+    parser.add_argument("--loss", type=float, default=0, dest="loss",
+                        help="Probability of a multicast packet to be lost")
+    parser.add_argument("--seed", type=int, default=None, dest="seed",
+                        help="Seed of the random generator")
+    parser.add_argument("-o", "--output", default=None, dest="output",
+                        help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sim_results = simulate(args.peers, args.ramp, args.leave, args.crash,
+                           args.settle, args.ttl, args.max_time,
+                           args.latency, args.jitter, args.loss, args.seed)
+    print_results(sim_results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(sim_results, output, indent=2, sort_keys=True)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Runs the codecs benchmark cases with pytest-benchmark:
+
+    python -m pytest benchmarks/test_codecs.py --benchmark-json=results.json
+
+Without the plugin, each case is run once.
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Benchmark cases
+from benchmarks.bench_codecs import make_cases
+
+# Pytest
+import pytest
+
+# ------------------------------------------------------------------------------
+
+CASES = make_cases()
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("prepare", [prepare for _, prepare in CASES],
+                         ids=[name for name, _ in CASES])
+def test_codecs(benchmark, prepare):
+    """
+    Benchmarks a codec case
+    """
+    try:
+        method = prepare()
+    except ImportError as ex:
+        pytest.skip(str(ex))
+    benchmark(method)
@@ -163,6 +163,12 @@ PROBE_CHANNEL_MSG_SEND = "msg_sent"
 PROBE_CHANNEL_MSG_CONTENT = "msg_content"
 """ Message content channel """
 
+PROBE_CHANNEL_ROUTE = "route"
+""" Changes of the state of the routes to peers """
+
+PROBE_CHANNEL_GROUP = "group_plan"
+""" Outcome of the delivery plans of group messages """
+
 # ------------------------------------------------------------------------------
 # Service properties
 
@@ -176,6 +182,12 @@ PROP_FILTERS = "herald.filters"
 A set of filename patterns to filter messages
 """
 
+PROP_BROADCAST = "herald.transport.broadcast"
+"""
+If True, the transport reaches a whole group of peers with a single call
+(e.g. a publication on a topic), instead of one call per peer
+"""
+
 # ------------------------------------------------------------------------------
 # Framework properties
 
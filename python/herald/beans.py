@@ -36,10 +36,11 @@ __docformat__ = "restructuredtext en"
 # ------------------------------------------------------------------------------
 
 # Standard library
+import binascii
 import functools
+import os
 import threading
 import time
-import uuid
 import json
 
 # import herald module to use constantes
@@ -48,6 +49,31 @@ import herald.utils as utils
 
 # ------------------------------------------------------------------------------
 
+_UNSET = object()
+""" Value of the Herald headers which haven't been set """
+
+_HEADER_SLOTS = ((herald.MESSAGE_HERALD_VERSION, '_version'),
+                 (herald.MESSAGE_HEADER_TIMESTAMP, '_timestamp'),
+                 (herald.MESSAGE_HEADER_UID, '_uid'),
+                 (herald.MESSAGE_HEADER_SENDER_UID, '_sender'),
+                 (herald.MESSAGE_HEADER_REPLIES_TO, '_replies_to'))
+""" Herald headers stored in the slots of messages: (header, slot) """
+
+_HEADER_SLOTS_MAP = dict(_HEADER_SLOTS)
+""" Herald header -> slot """
+
+
+def new_uid():
+    """
+    Generates a message UID: 32 upper-case hexadecimal characters, like the
+    UUID-based ones
+
+    :return: A random UID string
+    """
+    return binascii.hexlify(os.urandom(16)).decode('ascii').upper()
+
+# ------------------------------------------------------------------------------
+
 
 @functools.total_ordering
 class Peer(object):
@@ -403,8 +429,14 @@ class DelayedNotification(object):
 
 class Message(object):
     """
-    Represents a message to be sent
+    Represents a message to be sent.
+
+    The headers set by Herald are stored in slots, other headers and the
+    metadata are stored in dictionaries created on demand.
     """
+    __slots__ = ('_subject', '_content', '_version', '_timestamp', '_uid',
+                 '_sender', '_replies_to', '_headers', '_metadata')
+
     def __init__(self, subject, content=None):
         """
         Sets up members
@@ -414,13 +446,17 @@ class Message(object):
         """
         self._subject = subject
         self._content = content
-        
-        self._headers = {}
-        self._headers[herald.MESSAGE_HERALD_VERSION] = herald.HERALD_SPECIFICATION_VERSION
-        self._headers[herald.MESSAGE_HEADER_TIMESTAMP] = int(time.time() * 1000) 
-        self._headers[herald.MESSAGE_HEADER_UID] = str(uuid.uuid4()).replace('-', '').upper()
-        
-        self._metadata = {}  
+
+        # Herald headers
+        self._version = herald.HERALD_SPECIFICATION_VERSION
+        self._timestamp = int(time.time() * 1000)
+        self._uid = new_uid()
+        self._sender = _UNSET
+        self._replies_to = _UNSET
+
+        # Other headers and metadata
+        self._headers = None
+        self._metadata = None
 
     def __str__(self):
         """
@@ -447,82 +483,109 @@ class Message(object):
         """
         Time stamp of the message
         """
-        return self._headers[herald.MESSAGE_HEADER_TIMESTAMP]
+        return self.get_header(herald.MESSAGE_HEADER_TIMESTAMP)
 
     @property
     def uid(self):
         """
         Message UID
         """
-        return self._headers[herald.MESSAGE_HEADER_UID]
+        return self.get_header(herald.MESSAGE_HEADER_UID)
 
     @property
     def headers(self):
         """
-        Message headers
+        Message headers (a new dictionary: use add_header() to modify them)
         """
-        return self._headers
-    
-    @property    
+        headers = {}
+        for key, slot in _HEADER_SLOTS:
+            value = getattr(self, slot)
+            if value is not _UNSET:
+                headers[key] = value
+
+        if self._headers:
+            headers.update(self._headers)
+        return headers
+
+    @property
     def metadata(self):
         """
         Message metadata
         """
+        if self._metadata is None:
+            self._metadata = {}
         return self._metadata
 
     def add_header(self, key, value):
         """
         Adds a header
         """
-        self._headers[key] = value
-        
+        try:
+            setattr(self, _HEADER_SLOTS_MAP[key], value)
+        except KeyError:
+            if self._headers is None:
+                self._headers = {}
+            self._headers[key] = value
+
     def get_header(self, key):
         """
-        Gets a header value 
+        Gets a header value
         """
-        if key in self._headers:
-            return self._headers[key]       
-        return None
+        try:
+            value = getattr(self, _HEADER_SLOTS_MAP[key])
+        except KeyError:
+            if self._headers:
+                return self._headers.get(key)
+            return None
+
+        if value is _UNSET:
+            return None
+        return value
 
     def remove_header(self, key):
         """
         Removes a header from the headers list
         """
-        if key in self._headers:
-            del self._headers[key]
+        try:
+            setattr(self, _HEADER_SLOTS_MAP[key], _UNSET)
+        except KeyError:
+            if self._headers:
+                self._headers.pop(key, None)
 
     def set_content(self, content):
         """
         Set content
         """
         self._content = content
-        
+
     def add_metadata(self, key, value):
         """
         Adds a metadata
         """
-        self._metadata[key] = value
-        
+        self.metadata[key] = value
+
     def get_metadata(self, key):
         """
         Gets a metadata
         """
-        if key in self._metadata:
-            return self._metadata[key]
+        if self._metadata:
+            return self._metadata.get(key)
         return None
-        
+
     def remove_metadata(self, key):
         """
-        Removes a metadata 
+        Removes a metadata
         """
-        if key in self._metadata:
-            del self._metadata[key]
-            
-            
+        if self._metadata:
+            self._metadata.pop(key, None)
+
+
 class MessageReceived(Message):
     """
     Represents a message received by a transport
     """
+    __slots__ = ('_access', '_extra')
+
     def __init__(self, uid, subject, content, sender_uid, reply_to, access,
                  timestamp=None, extra=None):
         """
@@ -537,13 +600,18 @@ class MessageReceived(Message):
         :param timestamp: Message sending time stamp
         :param extra: Extra configuration for the transport in case of reply
         """
-        Message.__init__(self, subject, content)
-        self._headers[herald.MESSAGE_HEADER_UID] = uid
-        self._headers[herald.MESSAGE_HEADER_SENDER_UID] = sender_uid
-        self._headers[herald.MESSAGE_HEADER_REPLIES_TO] = reply_to
+        # Don't call the parent constructor: it would generate a UID
+        self._subject = subject
+        self._content = content
+        self._version = herald.HERALD_SPECIFICATION_VERSION
+        self._timestamp = timestamp
+        self._uid = uid
+        self._sender = sender_uid
+        self._replies_to = reply_to
+        self._headers = None
+        self._metadata = None
         self._access = access
         self._extra = extra
-        self._headers[herald.MESSAGE_HEADER_TIMESTAMP] = timestamp
 
     def __str__(self):
         """
@@ -564,14 +632,14 @@ class MessageReceived(Message):
         """
         UID of the message this one replies to
         """
-        return self._headers[herald.MESSAGE_HEADER_REPLIES_TO]
+        return self.get_header(herald.MESSAGE_HEADER_REPLIES_TO)
 
     @property
     def sender(self):
         """
         UID of the peer that sent this message
         """
-        return self._headers[herald.MESSAGE_HEADER_SENDER_UID]
+        return self.get_header(herald.MESSAGE_HEADER_SENDER_UID)
 
     @property
     def extra(self):
@@ -585,9 +653,9 @@ class MessageReceived(Message):
         Sets the access
         """
         self._access = access
-        
+
     def set_extra(self, extra):
         """
         Sets the extra
         """
-        self._extra = extra
\ No newline at end of file
+        self._extra = extra
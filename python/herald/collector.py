@@ -0,0 +1,316 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Herald reply collector: gathers the replies to a message sent to a group of
+peers (scatter-gather)
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Standard library
+import logging
+import math
+import numbers
+import threading
+
+# ------------------------------------------------------------------------------
+
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+
+
+class ReplyCollector(object):
+    """
+    Collects the replies of the peers targeted by a message.
+
+    The collector is done when all the targeted peers replied (or failed),
+    when the deadline has been reached or, if a number of replies is given,
+    when it has been received or can't be reached anymore.
+    """
+    def __init__(self, uid, targets, count=None, quorum=None):
+        """
+        Sets up members. Without count nor quorum, the collector waits for
+        all the targeted peers.
+
+        :param uid: UID of the sent message
+        :param targets: UIDs of the targeted peers
+        :param count: Number of first replies to wait for (positive integer)
+        :param quorum: Fraction of the targeted peers to wait for (number
+                       greater than 0, up to 1)
+        :raise ValueError: Invalid count or quorum, or both given
+        """
+        self.__uid = uid
+        self.__targets = frozenset(targets)
+
+        # Without count, wait for all peers, even if some failed
+        self.__wait_all = count is None and quorum is None
+        if count is not None and quorum is not None:
+            raise ValueError("A count and a quorum can't be used together")
+        elif count is not None:
+            if isinstance(count, bool) \
+                    or not isinstance(count, numbers.Integral) or count <= 0:
+                raise ValueError("Invalid count of replies: {0}"
+                                 .format(count))
+            self.__expected = min(count, len(self.__targets))
+        elif quorum is not None:
+            if isinstance(quorum, bool) \
+                    or not isinstance(quorum, numbers.Real) \
+                    or not 0 < quorum <= 1:
+                raise ValueError("Invalid quorum: {0}".format(quorum))
+            self.__expected = int(math.ceil(quorum * len(self.__targets)))
+        else:
+            self.__expected = len(self.__targets)
+
+        # Peer UID -> reply message / exception
+        self.__replies = {}
+        self.__errors = {}
+
+        # Peers which haven't replied yet
+        self.__pending = set(self.__targets)
+
+        # Methods to call back once done
+        self.__callbacks = []
+
+        # Deadline timer
+        self.__timer = None
+
+        self.__event = threading.Event()
+        self.__lock = threading.Lock()
+
+        # Nothing to wait for
+        self.__check()
+
+    def __str__(self):
+        return "ReplyCollector({0}: {1}/{2} replies, {3} errors)".format(
+            self.__uid, len(self.__replies), self.__expected,
+            len(self.__errors))
+
+    @property
+    def uid(self):
+        """
+        UID of the sent message
+        """
+        return self.__uid
+
+    @property
+    def targets(self):
+        """
+        UIDs of the targeted peers
+        """
+        return self.__targets
+
+    @property
+    def expected(self):
+        """
+        Number of replies waited for
+        """
+        return self.__expected
+
+    @property
+    def replies(self):
+        """
+        Peer UID -> reply message (MessageReceived bean)
+        """
+        with self.__lock:
+            return self.__replies.copy()
+
+    @property
+    def errors(self):
+        """
+        Peer UID -> exception describing the error
+        """
+        with self.__lock:
+            return self.__errors.copy()
+
+    @property
+    def missing(self):
+        """
+        UIDs of the targeted peers which didn't reply yet
+        """
+        with self.__lock:
+            return set(self.__pending)
+
+    @property
+    def done(self):
+        """
+        True if the collector doesn't wait for replies anymore
+        """
+        return self.__event.is_set()
+
+    @property
+    def success(self):
+        """
+        True if the expected number of replies has been received
+        """
+        with self.__lock:
+            return len(self.__replies) >= self.__expected
+
+    def wait(self, timeout=None):
+        """
+        Waits for the collector to be done
+
+        :param timeout: Maximum time to wait (in seconds)
+        :return: True if the collector is done
+        """
+        return self.__event.wait(timeout) or self.__event.is_set()
+
+    def add_callback(self, callback):
+        """
+        Adds a method to call back once the collector is done. It is called
+        immediately if the collector is already done.
+
+        :param callback: A method accepting the collector as argument
+        """
+        with self.__lock:
+            if not self.__event.is_set():
+                self.__callbacks.append(callback)
+                return
+
+        self.__call(callback)
+
+    def start(self, timeout):
+        """
+        Starts the deadline timer
+
+        :param timeout: Time to wait for replies, in seconds (None or <= 0
+                        to wait forever)
+        """
+        if timeout is not None and timeout > 0 and not self.__event.is_set():
+            self.__timer = threading.Timer(timeout, self.close)
+            self.__timer.name = "Herald-Gather-{0}".format(self.__uid)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def add_reply(self, message):
+        """
+        Stores the reply of a peer. Only the first reply of a targeted peer
+        is kept.
+
+        :param message: A MessageReceived bean
+        """
+        with self.__lock:
+            if self.__event.is_set() or message.sender not in self.__pending:
+                _logger.debug("Ignored reply from %s to %s", message.sender,
+                              self.__uid)
+                return
+
+            self.__pending.remove(message.sender)
+            self.__replies[message.sender] = message
+            callbacks = self.__check()
+
+        self.__call_all(callbacks)
+
+    def add_error(self, peer_uid, exception):
+        """
+        Stores the error which prevents a peer from replying
+
+        :param peer_uid: UID of a targeted peer
+        :param exception: An exception describing the error
+        """
+        with self.__lock:
+            if self.__event.is_set() or peer_uid not in self.__pending:
+                return
+
+            self.__pending.remove(peer_uid)
+            self.__errors[peer_uid] = exception
+            callbacks = self.__check()
+
+        self.__call_all(callbacks)
+
+    def close(self, exception=None):
+        """
+        Stops waiting for replies. Peers which didn't reply are kept as
+        missing, unless an exception is given.
+
+        :param exception: Error to associate to the peers which didn't reply
+        """
+        with self.__lock:
+            if exception is not None:
+                for peer_uid in self.__pending:
+                    self.__errors[peer_uid] = exception
+                self.__pending.clear()
+            callbacks = self.__set_done()
+
+        self.__call_all(callbacks)
+
+    def __check(self):
+        """
+        Checks if the collector is done. Must be called while holding the lock.
+
+        :return: The methods to call back, if the collector is now done
+        """
+        nb_replies = len(self.__replies)
+        if not self.__pending:
+            return self.__set_done()
+        elif not self.__wait_all and \
+                (nb_replies >= self.__expected
+                 or nb_replies + len(self.__pending) < self.__expected):
+            return self.__set_done()
+        return []
+
+    def __set_done(self):
+        """
+        Marks the collector as done. Must be called while holding the lock.
+
+        :return: The methods to call back
+        """
+        if self.__event.is_set():
+            return []
+
+        self.__event.set()
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+        callbacks, self.__callbacks = self.__callbacks, []
+        return callbacks
+
+    def __call_all(self, callbacks):
+        """
+        Calls the given methods, outside the lock
+
+        :param callbacks: Methods accepting the collector as argument
+        """
+        for callback in callbacks:
+            self.__call(callback)
+
+    def __call(self, callback):
+        """
+        Calls a method with the collector as argument, logging its errors
+
+        :param callback: A method accepting the collector as argument
+        """
+        try:
+            callback(self)
+        except Exception as ex:
+            _logger.exception("Error calling back a reply collector: %s", ex)
@@ -36,8 +36,10 @@ __docformat__ = "restructuredtext en"
 # ------------------------------------------------------------------------------
 
 # Herald
+from herald.collector import ReplyCollector
 from herald.exceptions import InvalidPeerAccess, NoTransport, HeraldTimeout, \
     NoListener, ForgotMessage, PeerLost
+from herald.routing import RoutingTable, plan_group_delivery
 from herald.utils import LoopTimer
 import herald
 import herald.beans as beans
@@ -46,14 +48,14 @@ import herald.probe
 # Pelix
 from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
     Validate, Invalidate, Instantiate, RequiresMap, BindField, UpdateField, \
-    UnbindField
+    UnbindField, RequiresBest
 import pelix.constants
 import pelix.threadpool
 import pelix.utilities
 
 # Standard library
+import collections
 import fnmatch
-import itertools
 import logging
 import re
 import threading
@@ -149,7 +151,7 @@ class _WaitingPost(object):
         :return: True if this message can be forgotten
         """
         if self.__deadline is not None:
-            return self.__deadline > time.time()
+            return time.time() > self.__deadline
         else:
             return False
 
@@ -183,10 +185,72 @@ class _WaitingPost(object):
             except Exception as ex:
                 _logger.exception("Error calling errback: %s", ex)
 
+    def peer_lost(self, herald_svc, peer, exception):
+        """
+        A peer has been unregistered
+
+        :param herald_svc: Herald service instance
+        :param peer: The lost Peer bean
+        :param exception: A PeerLost exception
+        """
+        if peer == self.peer:
+            self.errback(herald_svc, exception)
+
+
+class _WaitingGather(_WaitingPost):
+    """
+    A bean that describes a gather() call: forwards replies and errors to a
+    reply collector
+    """
+    def __init__(self, collector, timeout):
+        """
+        Sets up members
+
+        :param collector: The ReplyCollector of the gather() call
+        :param timeout: Time to wait before forgetting this post, in seconds
+                        (<= 0 or None for never)
+        """
+        super(_WaitingGather, self).__init__(None, None, timeout, False)
+        self.collector = collector
+
+    def callback(self, herald_svc, message):
+        """
+        A reply has been received
+
+        :param herald_svc: Herald service instance
+        :param message: Received answer message
+        """
+        self.collector.add_reply(message)
+
+    def errback(self, herald_svc, exception):
+        """
+        An error occurred: associates it to a peer, or to all the peers which
+        didn't reply yet
+
+        :param herald_svc: Herald service instance
+        :param exception: An exception describing/caused by the error
+        """
+        target = exception.target
+        if target is not None and target.uid is not None:
+            self.collector.add_error(target.uid, exception)
+        else:
+            self.collector.close(exception)
+
+    def peer_lost(self, herald_svc, peer, exception):
+        """
+        A peer has been unregistered: it won't reply
+
+        :param herald_svc: Herald service instance
+        :param peer: The lost Peer bean
+        :param exception: A PeerLost exception
+        """
+        self.collector.add_error(peer.uid, exception)
+
 
 @ComponentFactory("herald-core-factory")
 @Provides((herald.SERVICE_HERALD_INTERNAL, herald.SERVICE_DIRECTORY_LISTENER))
 @Provides(herald.SERVICE_HERALD, '_controller')
+@RequiresBest('_probe', herald.SERVICE_PROBE)
 @Requires('_directory', herald.SERVICE_DIRECTORY)
 @Requires('_listeners', herald.SERVICE_LISTENER, True, True)
 @RequiresMap('_transports', herald.SERVICE_TRANSPORT, herald.PROP_ACCESS_ID,
@@ -203,6 +267,9 @@ class Herald(object):
         # Herald core directory
         self._directory = None
 
+        # Debug probe
+        self._probe = None
+
         # Service controller
         self._controller = False
 
@@ -215,6 +282,12 @@ class Herald(object):
         # Herald transports: access ID -> implementation
         self._transports = {}
 
+        # Access IDs of the transports reaching a group in a single call
+        self.__broadcast = set()
+
+        # Health of the routes to the peers
+        self.__routing = RoutingTable(self.__route_changed)
+
         # Notification threads
         self.__pool = pelix.threadpool.ThreadPool(5, logname="HeraldNotify")
 
@@ -236,7 +309,9 @@ class Herald(object):
 
         # Thread safety
         self.__listeners_lock = threading.Lock()
-        self.__gc_lock = threading.Lock()
+        # (reentrant, as reply collectors forget their post when they're done,
+        # maybe from an errback called while the lock is held)
+        self.__gc_lock = threading.RLock()
 
     @Validate
     def _validate(self, context):
@@ -272,7 +347,7 @@ class Herald(object):
         exception = HeraldTimeout(None, "Herald stops to listen to messages",
                                   None)
         with self.__gc_lock:
-            for waiting_post in self.__waiting_posts.values():
+            for waiting_post in tuple(self.__waiting_posts.values()):
                 waiting_post.errback(self, exception)
 
         # Clear storage
@@ -296,6 +371,9 @@ class Herald(object):
         """
         A transport implementation has been bound
         """
+        if svc_ref.get_property(herald.PROP_BROADCAST):
+            self.__broadcast.add(svc_ref.get_property(herald.PROP_ACCESS_ID))
+
         # Activate the service
         def set_svc():
             self._controller = True
@@ -306,6 +384,8 @@ class Herald(object):
         """
         A transport implementation has gone away
         """
+        self.__broadcast.discard(svc_ref.get_property(herald.PROP_ACCESS_ID))
+
         if len(self._transports) == 1:
             # Last transport is going away
             def set_svc():
@@ -422,6 +502,9 @@ class Herald(object):
             for uid in to_delete:
                 del self.__treated[uid]
 
+            # Forget the routes unused for an hour
+            self.__routing.clean(3600)
+
             # Update the "last garbage collect time"
             self._last_gc = int(time.time())
 
@@ -520,18 +603,20 @@ class Herald(object):
             self.__waiting_events.pop(uid).raise_exception(exception)
 
         with self.__gc_lock:
-            # ... list post() callers for this peer
-            entries = {uid: waiting_post
-                       for uid, waiting_post in self.__waiting_posts.items()
-                       if peer == waiting_post.peer}
+            waiting_posts = tuple(self.__waiting_posts.items())
 
-            # Clean up callers dictionary
-            for uid in entries:
-                del self.__waiting_posts[uid]
+            # ... forget the post() calls waiting for this peer only
+            for uid, waiting_post in waiting_posts:
+                if peer == waiting_post.peer:
+                    del self.__waiting_posts[uid]
 
-        # ... notify post() callers
-        for waiting_post in entries.values():
-            waiting_post.errback(self, exception)
+        # ... notify post() and gather() callers (collectors forget their
+        # gather() call once done)
+        for _, waiting_post in waiting_posts:
+            waiting_post.peer_lost(self, peer, exception)
+
+        # ... forget the routes to the peer
+        self.__routing.remove_peer(peer.uid)
 
     @staticmethod
     def peer_registered(peer):
@@ -540,12 +625,32 @@ class Herald(object):
         """
         pass
 
-    @staticmethod
-    def peer_updated(peer, access_id, data, previous):
+    def peer_updated(self, peer, access_id, data, previous):
         """
-        Peer updated: ignore
+        Peer updated: the health of the route using the updated access is
+        reset, as the new access data might fix (or break) it
         """
-        pass
+        self.__routing.reset(peer.uid, access_id)
+
+    def __route_changed(self, description):
+        """
+        The state of a route changed: store it in the probe
+
+        :param description: Description of the route
+        """
+        if self._probe is not None:
+            self._probe.store(herald.PROBE_CHANNEL_ROUTE, description)
+
+    def get_routes(self, peer_uid=None):
+        """
+        Returns the health of the routes to peers, as computed by the
+        messages fired to them
+
+        :param peer_uid: Only returns the routes to this peer (optional)
+        :return: A list of dictionaries, with "peer", "access", "state",
+                 "latency", "errorRate" and "failures" entries
+        """
+        return self.__routing.get_routes(peer_uid)
 
     def __notify(self, message):
         """
@@ -660,15 +765,18 @@ class Herald(object):
             raise NoTransport(beans.Target(uid=peer.uid),
                               "No transport bound yet.")
 
-        # Get accesses
-        accesses = peer.get_accesses()
+        # Get the accesses with a transport, the healthiest route first
+        accesses = self.__routing.order(
+            peer.uid, [access for access in peer.get_accesses()
+                       if access in self._transports])
         for access in accesses:
             try:
                 transport = self._transports[access]
             except KeyError:
-                # No transport for this kind of access
-                pass
+                # Transport gone away: a route to probe stays due
+                self.__routing.cancel_probe(peer.uid, access)
             else:
+                start = time.time()
                 try:
                     # Call it
                     transport.fire(peer, message)
@@ -676,11 +784,15 @@ class Herald(object):
                     # Transport can't read peer access data
                     _logger.debug("Error reading access for transport %s: %s",
                                   access, ex)
+                    self.__routing.failure(peer.uid, access)
                 except Exception as ex:
                     # Exception during transport
                     _logger.info("Error using transport %s: %s", access, ex)
+                    self.__routing.failure(peer.uid, access)
                 else:
                     # Success
+                    self.__routing.success(peer.uid, access,
+                                           time.time() - start)
                     break
         else:
             # No transport for those accesses
@@ -690,6 +802,71 @@ class Herald(object):
 
         return message.uid
 
+    def __fire_group(self, group, peers, message):
+        """
+        Fires a message to the given peers of a group, following a delivery
+        plan: broadcast transports are preferred to those reaching peers one
+        by one. After each transport call, the plan is computed again for the
+        peers which haven't been reached, with the transports not used yet.
+
+        :param group: The name of a group of peers
+        :param peers: Peers of the group
+        :param message: A Message bean
+        :return: The set of peers which haven't been reached
+        """
+        # Access ID -> peers, in the order of the accesses of the peers
+        accesses = collections.OrderedDict()
+        for peer in peers:
+            for access in peer.get_accesses():
+                if access in self._transports:
+                    accesses.setdefault(access, set()).add(peer)
+
+        remaining = set(peers)
+        steps = []
+        while remaining:
+            plan = plan_group_delivery(accesses, self.__broadcast)
+            if not plan:
+                # No way to reach the remaining peers
+                break
+
+            # Use each transport once
+            access, access_peers = plan[0]
+            del accesses[access]
+
+            reached = set()
+            transport = self._transports.get(access)
+            if transport is not None:
+                try:
+                    reached = transport.fire_group(group, access_peers,
+                                                   message)
+                    if reached is None:
+                        reached = access_peers
+                except InvalidPeerAccess as ex:
+                    # Transport can't find group access data
+                    _logger.debug("Missing access info: %s", ex)
+                except Exception as ex:
+                    # Exception during transport
+                    _logger.warning("Error using transport %s: %s", access, ex)
+
+            # Fall back only for the peers which haven't been reached
+            reached = access_peers.intersection(reached)
+            remaining.difference_update(reached)
+            for access_peers_left in accesses.values():
+                access_peers_left.difference_update(reached)
+
+            steps.append("{0}:{1}:{2}".format(
+                access, len(access_peers), len(reached)))
+
+        if self._probe is not None:
+            self._probe.store(herald.PROBE_CHANNEL_GROUP,
+                              {"uid": message.uid,
+                               "timestamp": time.time(),
+                               "targetGroup": group,
+                               "steps": " ".join(steps),
+                               "reached": len(peers) - len(remaining),
+                               "missing": len(remaining)})
+        return remaining
+
     def fire_group(self, group, message):
         """
         Fires (and forget) the given message to the given group of peers
@@ -713,51 +890,10 @@ class Herald(object):
                              uids=[peer.uid for peer in all_peers]),
                 "No transport bound yet.")
 
-        # Find the common accesses
-        accesses = {}
-        for peer in all_peers:
-            for access in peer.get_accesses():
-                accesses.setdefault(access, set()).add(peer)
-
-        missing = []
-        for access, access_peers in accesses.items():
-            if not access_peers:
-                # Nothing to do
-                continue
-
-            try:
-                transport = self._transports[access]
-            except KeyError:
-                # No transport for this kind of access
-                _logger.debug("No transport for %s", access)
-            else:
-                try:
-                    # Call it
-                    reached_peers = transport.fire_group(group, access_peers,
-                                                         message)
-                    if reached_peers is None:
-                        reached_peers = access_peers
-                except InvalidPeerAccess as ex:
-                    # Transport can't find group access data
-                    _logger.debug("Missing access info: %s", ex)
-                else:
-                    # Success: clean up waiting peers
-                    all_done = True
-                    for remaining_peers in accesses.values():
-                        remaining_peers.difference_update(reached_peers)
-                        if remaining_peers:
-                            # Still some peers to notify
-                            all_done = False
-
-                    if all_done:
-                        break
-        else:
-            missing = set(itertools.chain(*accesses.values()))
-            if missing:
-                _logger.warning("Some peers haven't been notified: %s",
-                                ', '.join(str(peer) for peer in missing))
-            else:
-                _logger.debug("No peer to send the message to.")
+        missing = self.__fire_group(group, all_peers, message)
+        if missing:
+            _logger.warning("Some peers haven't been notified: %s",
+                            ', '.join(str(peer) for peer in missing))
 
         return message.uid, missing
 
@@ -888,42 +1024,81 @@ class Herald(object):
             self.__waiting_posts[message.uid] = \
                 _WaitingPost(callback, errback, timeout, False)
 
-        # Find the common accesses
-        accesses = {}
-        for peer in all_peers:
-            for access in peer.get_accesses():
-                accesses.setdefault(access, set()).add(peer)
+        # Send the message
+        missing = self.__fire_group(group, all_peers, message)
+        if missing:
+            _logger.warning("Some peers haven't been notified: %s",
+                            ', '.join(str(peer) for peer in missing))
 
-        for access, access_peers in accesses.items():
-            if not access_peers:
-                # Nothing to do
-                continue
+        return message.uid
 
-            try:
-                transport = self._transports[access]
-            except KeyError:
-                # No transport for this kind of access
-                pass
-            else:
-                try:
-                    # Call it
-                    transport.fire_group(group, access_peers, message)
-                except InvalidPeerAccess:
-                    # Transport can't find group access data
-                    pass
-                else:
-                    # Success: clean up waiting peers
-                    all_done = True
-                    for remaining_peers in accesses.values():
-                        remaining_peers.difference_update(access_peers)
-                        if remaining_peers:
-                            # Still some peers to notify
-                            all_done = False
+    def gather(self, group, message, count=None, timeout=60, callback=None,
+               quorum=None):
+        """
+        Sends a message to a group of peers and collects their replies.
 
-                    if all_done:
-                        break
+        The returned collector is done when all the peers of the group
+        replied (or failed), when the expected number of replies has been
+        received or can't be reached anymore, or when the timeout expired.
+        It gives the replies, the errors and the missing peers, by peer UID.
+        Peers unregistered while waiting are considered in error right away.
 
-        return message.uid
+        :param group: The name of a group of peers
+        :param message: A Message bean
+        :param count: Number of first replies to wait for (positive integer),
+                      None for all the peers of the group
+        :param timeout: Time to wait for replies, in seconds (None or <= 0
+                        to wait until forget() is called)
+        :param callback: Method to call back with the collector once done
+        :param quorum: Fraction of the peers of the group to wait for
+                       (number greater than 0, up to 1), instead of a count
+        :return: A ReplyCollector
+        :raise KeyError: Unknown group
+        :raise ValueError: Invalid count or quorum
+        :raise NoTransport: No transport bound yet
+        """
+        # Get all peers known in the group
+        all_peers = self._directory.get_peers_for_group(group)
+
+        # Check if some transports are bound
+        if not self._transports:
+            raise NoTransport(
+                beans.Target(group=group,
+                             uids=[peer.uid for peer in all_peers]),
+                "No transport bound yet.")
+
+        collector = ReplyCollector(message.uid,
+                                   [peer.uid for peer in all_peers], count,
+                                   quorum)
+        if callback is not None:
+            collector.add_callback(callback)
+
+        if collector.done:
+            # Nobody to wait for
+            return collector
+
+        def forget_gather(_):
+            """
+            Forgets the message once done
+            """
+            with self.__gc_lock:
+                self.__waiting_posts.pop(message.uid, None)
+
+        collector.add_callback(forget_gather)
+
+        with self.__gc_lock:
+            # Prepare an entry in the waiting posts
+            self.__waiting_posts[message.uid] = \
+                _WaitingGather(collector, timeout)
+        collector.start(timeout)
+
+        # Send the message
+        for peer in self.__fire_group(group, all_peers, message):
+            collector.add_error(peer.uid, NoTransport(
+                beans.Target(peer=peer),
+                "No working transport found for peer {0}".format(peer)))
+
+        return collector
 
     def forget(self, uid):
         """
@@ -35,9 +35,40 @@ __docformat__ = "restructuredtext en"
 
 # ------------------------------------------------------------------------------
 
+# Probe channels
+from herald import PROBE_CHANNEL_MSG_SEND, PROBE_CHANNEL_MSG_CONTENT, \
+    PROBE_CHANNEL_MSG_RECV, PROBE_CHANNEL_ROUTE, PROBE_CHANNEL_GROUP
+
+# ------------------------------------------------------------------------------
+
 SERVICE_STORE = 'herald.probe.store'
 """ Service to store data from probes """
 
+SERVICE_STORE_QUERY = 'herald.probe.store.query'
+""" Service to look for the data kept by a probe store """
+
+SERVICE_METRICS = 'herald.probe.metrics'
+""" Service giving the performance metrics computed from probe records """
+
+# ------------------------------------------------------------------------------
+
+CHANNEL_FIELDS = {
+    PROBE_CHANNEL_MSG_SEND: ("uid", "timestamp", "transport", "subject",
+                             "target", "transportTarget", "repliesTo"),
+    PROBE_CHANNEL_MSG_RECV: ("uid", "timestamp", "transport", "subject",
+                             "source", "transportSource", "repliesTo"),
+    PROBE_CHANNEL_MSG_CONTENT: ("uid", "content"),
+    PROBE_CHANNEL_ROUTE: ("timestamp", "peer", "access", "state", "latency",
+                          "errorRate", "failures"),
+    PROBE_CHANNEL_GROUP: ("uid", "timestamp", "targetGroup", "steps",
+                          "reached", "missing"),
+    'http_multicast': ("timestamp", "uid", "event"),
+    'xmpp_room_join': ("timestamp", "room", "latency", "status"),
+}
+"""
+For each known channel, the list of fields for which a value is given
+"""
+
 # ------------------------------------------------------------------------------
 
 
@@ -74,6 +105,14 @@ class DummyProbe(object):
         """
         return False
 
+    def get_stats(self):
+        """
+        Returns statistics about the probe buffer
+
+        :return: A dictionary
+        """
+        return {}
+
     def set_channel_filter(self, channel, ldap_filter):
         """
         Sets the LDAP filter for a channel
@@ -84,6 +123,38 @@ class DummyProbe(object):
         """
         pass
 
+    def set_channel_sampling(self, channel, rate):
+        """
+        Keeps the records of a channel about 1 message out of "rate",
+        according to their UID
+
+        :param channel: Channel to sample
+        :param rate: Sampling rate (1 or lower to keep all records)
+        :raise ValueError: Invalid rate
+        """
+        pass
+
+    def set_channel_rate_limit(self, channel, rate, burst=None):
+        """
+        Limits the number of records of a channel per second
+
+        :param channel: Channel to limit
+        :param rate: Maximum number of records per second (0 for no limit)
+        :param burst: Maximum number of records accepted at once
+        :raise ValueError: Invalid rate or burst
+        """
+        pass
+
+    def set_content_max_size(self, size):
+        """
+        Sets the maximum size of the content of messages stored in the
+        "msg_content" channel
+
+        :param size: Maximum content size (0 for no limit)
+        :raise ValueError: Invalid size
+        """
+        pass
+
     def store(self, channel, data):
         """
         Stores data in the given channel of the probe. The given dictionary
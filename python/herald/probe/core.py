@@ -36,29 +36,107 @@ __docformat__ = "restructuredtext en"
 # ------------------------------------------------------------------------------
 
 # Probe constants
-from herald import SERVICE_PROBE
+from herald import SERVICE_PROBE, PROBE_CHANNEL_MSG_CONTENT
 from herald.probe import SERVICE_STORE
 
 # Pelix
 from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
-    Property, Instantiate
+    Property, Instantiate, Validate, Invalidate
 import pelix.ldapfilter as ldapfilter
 
 # Standard library
+import collections
 import logging
+import threading
+import time
+import zlib
 _logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------------------
 
+POLICY_DROP_NEWEST = "drop-newest"
+""" Buffer full: the record being stored is dropped """
+
+POLICY_DROP_OLDEST = "drop-oldest"
+""" Buffer full: the oldest record in the buffer is dropped """
+
+DRAIN_INTERVAL = .1
+""" Maximum time between two drains of the buffer, in seconds """
+
+# ------------------------------------------------------------------------------
+
+
+def sample_uid(uid, rate):
+    """
+    Tells if the records about the message with the given UID must be kept,
+    keeping 1 message out of "rate".
+
+    The decision only depends on the message UID, so that all peers keep the
+    records of the same messages.
+
+    :param uid: A message UID
+    :param rate: Sampling rate (1 to keep all messages)
+    :return: True if the records must be kept
+    """
+    if not isinstance(uid, bytes):
+        uid = str(uid).encode("utf-8")
+    return (zlib.crc32(uid) & 0xffffffff) % rate == 0
+
+
+class TokenBucket(object):
+    """
+    A token bucket rate limiter
+    """
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Number of tokens added per second
+        :param burst: Maximum number of tokens (defaults to the rate)
+        """
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(1., self.rate)
+        self.__tokens = self.burst
+        self.__last = time.time()
+        self.__lock = threading.Lock()
+
+    def consume(self):
+        """
+        Takes a token from the bucket
+
+        :return: True if a token was available
+        """
+        with self.__lock:
+            now = time.time()
+            self.__tokens = min(self.burst, self.__tokens +
+                                (now - self.__last) * self.rate)
+            self.__last = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return True
+            return False
+
+# ------------------------------------------------------------------------------
+
 
 @ComponentFactory()
 @Requires('_stores', SERVICE_STORE, aggregate=True, optional=True)
 @Provides(SERVICE_PROBE)
 @Property('_activated', 'enabled', False)
+@Property('_buffer_size', 'buffer.size', 65536)
+@Property('_buffer_policy', 'buffer.policy', POLICY_DROP_NEWEST)
+@Property('_sampling', 'channels.sampling', None)
+@Property('_rate_limits', 'channels.rate_limit', None)
+@Property('_content_max_size', 'content.max_size', 0)
 @Instantiate('herald-probe-dispatcher')
 class ProbeCore(object):
     """
-    Debug probe for Herald
+    Debug probe for Herald.
+
+    Records are stored in a buffer, read by a background thread which gives
+    them to the stores: storing a record doesn't wait for the stores.
+
+    The records of a channel can be sampled, keeping those of 1 message out
+    of N according to their UID, and rate-limited, with a token bucket.
+    The content of messages can be truncated to a maximum size.
     """
     def __init__(self):
         """
@@ -76,6 +154,135 @@ class ProbeCore(object):
         # LDAP filter of each channel
         self._channels_filters = {}
 
+        # Configuration properties: channel -> 1-in-N sampling rate,
+        # channel -> records per second, and maximum size of the content
+        self._sampling = None
+        self._rate_limits = None
+        self._content_max_size = 0
+
+        # Sampling rate and token bucket of each channel
+        self.__sampling = {}
+        self.__buckets = {}
+
+        # Buffer of (channel, data) tuples and its configuration
+        self._buffer_size = 65536
+        self._buffer_policy = POLICY_DROP_NEWEST
+        self.__buffer = collections.deque()
+        self.__high_watermark = 0
+
+        # Number of records given to stores, dropped records and records
+        # over the rate limit per channel
+        self.__stored = 0
+        self.__dropped = {}
+        self.__limited = {}
+        self.__stats_lock = threading.Lock()
+
+        # Drain thread
+        self.__thread = None
+        self.__wake_up = threading.Event()
+        self.__stop = threading.Event()
+
+    @Validate
+    def _validate(self, _):
+        """
+        Component validated
+        """
+        self._buffer_size = max(1, int(self._buffer_size))
+        if self._buffer_policy not in (POLICY_DROP_NEWEST,
+                                       POLICY_DROP_OLDEST):
+            _logger.warning("Unknown probe buffer policy: %s",
+                            self._buffer_policy)
+            self._buffer_policy = POLICY_DROP_NEWEST
+
+        # Wake up the drain thread when the buffer is half-full
+        self.__high_watermark = self._buffer_size // 2
+        self.__stored = 0
+        with self.__stats_lock:
+            self.__dropped.clear()
+            self.__limited.clear()
+
+        # Sampling and rate limits configuration
+        self._content_max_size = max(0, int(self._content_max_size or 0))
+        self.__sampling.clear()
+        for channel, rate in (self._sampling or {}).items():
+            self.set_channel_sampling(channel, rate)
+
+        self.__buckets.clear()
+        for channel, rate in (self._rate_limits or {}).items():
+            self.set_channel_rate_limit(channel, rate)
+
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__drain_loop,
+                                         name="Herald-Probe-Drain")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    @Invalidate
+    def _invalidate(self, _):
+        """
+        Component invalidated
+        """
+        # Stop the drain thread, once it has stored the remaining records
+        self.__stop.set()
+        self.__wake_up.set()
+        self.__thread.join()
+        self.__thread = None
+        self.__buffer.clear()
+
+    def __drain_loop(self):
+        """
+        Gives buffered records to the stores, until the component is
+        invalidated
+        """
+        while not self.__stop.is_set():
+            self.__wake_up.wait(DRAIN_INTERVAL)
+            self.__wake_up.clear()
+            self.__drain()
+
+        # Last drain
+        self.__drain()
+
+    def __drain(self):
+        """
+        Gives the buffered records to the stores
+        """
+        buffer = self.__buffer
+        while True:
+            try:
+                channel, data = buffer.popleft()
+            except IndexError:
+                # Empty buffer
+                return
+
+            try:
+                # Check filter
+                authorized = self._channels_filters[channel].matches(data)
+            except KeyError:
+                # No filter
+                authorized = True
+
+            if authorized:
+                self.__call_stores("store", channel, data)
+                self.__stored += 1
+
+    def __count_drop(self, channel):
+        """
+        Counts a dropped record
+
+        :param channel: Channel of the dropped record
+        """
+        with self.__stats_lock:
+            self.__dropped[channel] = self.__dropped.get(channel, 0) + 1
+
+    def __count_limited(self, channel):
+        """
+        Counts a record over the rate limit of its channel
+
+        :param channel: Channel of the record
+        """
+        with self.__stats_lock:
+            self.__limited[channel] = self.__limited.get(channel, 0) + 1
+
     def __call_stores(self, method, *args, **kwargs):
         """
         Calls the registered stores, if any
@@ -141,6 +348,27 @@ class ProbeCore(object):
         """
         return self._activated
 
+    def get_stats(self):
+        """
+        Returns statistics about the probe buffer
+
+        :return: A dictionary
+        """
+        with self.__stats_lock:
+            dropped = self.__dropped.copy()
+            limited = self.__limited.copy()
+
+        return {"buffer.size": self._buffer_size,
+                "buffer.policy": self._buffer_policy,
+                "buffered": len(self.__buffer),
+                "stored": self.__stored,
+                "dropped": dropped,
+                "limited": limited,
+                "sampling": self.__sampling.copy(),
+                "rate_limit": dict((channel, bucket.rate) for channel, bucket
+                                   in self.__buckets.items()),
+                "content.max_size": self._content_max_size}
+
     def set_channel_filter(self, channel, ldap_filter):
         """
         Sets the LDAP filter for a channel
@@ -163,6 +391,48 @@ class ProbeCore(object):
             # Store the filter
             self._channels_filters[channel] = parsed_filter
 
+    def set_channel_sampling(self, channel, rate):
+        """
+        Keeps the records of a channel about 1 message out of "rate",
+        according to their UID: all peers keep the records of the same
+        messages. Records without UID are always kept.
+
+        :param channel: Channel to sample
+        :param rate: Sampling rate (1 or lower to keep all records)
+        :raise ValueError: Invalid rate
+        """
+        rate = int(rate)
+        if rate > 1:
+            self.__sampling[channel] = rate
+        else:
+            self.__sampling.pop(channel, None)
+
+    def set_channel_rate_limit(self, channel, rate, burst=None):
+        """
+        Limits the number of records of a channel per second
+
+        :param channel: Channel to limit
+        :param rate: Maximum number of records per second (0 for no limit)
+        :param burst: Maximum number of records accepted at once (defaults
+                      to the rate)
+        :raise ValueError: Invalid rate or burst
+        """
+        rate = float(rate)
+        if rate > 0:
+            self.__buckets[channel] = TokenBucket(rate, burst)
+        else:
+            self.__buckets.pop(channel, None)
+
+    def set_content_max_size(self, size):
+        """
+        Sets the maximum size of the content of messages stored in the
+        "msg_content" channel: longer contents are truncated
+
+        :param size: Maximum content size (0 for no limit)
+        :raise ValueError: Invalid size
+        """
+        self._content_max_size = max(0, int(size))
+
     def store(self, channel, data):
         """
         Stores data in the given channel of the probe. The given dictionary
@@ -174,12 +444,39 @@ class ProbeCore(object):
         :param data: A dictionary of data to be stored
         """
         if self._activated and channel in self._channels_enabled:
-            try:
-                # Check filter
-                authorized = self._channels_filters[channel].matches(data)
-            except KeyError:
-                # No filter
-                authorized = True
-
-            if authorized:
-                self.__call_stores("store", channel, data)
+            rate = self.__sampling.get(channel)
+            if rate is not None:
+                uid = data.get("uid")
+                if uid is not None and not sample_uid(uid, rate):
+                    return
+
+            bucket = self.__buckets.get(channel)
+            if bucket is not None and not bucket.consume():
+                self.__count_limited(channel)
+                return
+
+            max_size = self._content_max_size
+            if max_size and channel == PROBE_CHANNEL_MSG_CONTENT:
+                content = data.get("content")
+                if content is not None and len(content) > max_size:
+                    data = data.copy()
+                    data["content"] = content[:max_size]
+
+            buffer = self.__buffer
+            size = len(buffer)
+            if size >= self._buffer_size:
+                if self._buffer_policy == POLICY_DROP_NEWEST:
+                    self.__count_drop(channel)
+                    return
+
+                try:
+                    self.__count_drop(buffer.popleft()[0])
+                except IndexError:
+                    # Drained in the meantime
+                    pass
+
+            elif size == self.__high_watermark:
+                # Drain before the buffer is full
+                self.__wake_up.set()
+
+            buffer.append((channel, data))
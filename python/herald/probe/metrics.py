@@ -0,0 +1,530 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Computes performance metrics from the probe records
+
+Sent messages are kept until a reply to them (a received message with the
+same "repliesTo" value) is recorded: the difference between both time stamps
+is the round-trip time of the message, which is stored in fixed-size
+histograms, per peer, per subject and per transport.
+The number of records of each channel gives the message rates.
+
+The probe must be enabled, with the "msg_sent" and "msg_recv" channels
+activated.
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Probe constants
+from herald.probe import SERVICE_STORE, SERVICE_METRICS, \
+    PROBE_CHANNEL_MSG_SEND, PROBE_CHANNEL_MSG_RECV
+
+# Pelix
+from pelix.ipopo.decorators import ComponentFactory, Provides, Property, \
+    Validate, Invalidate
+
+# Standard library
+import array
+import collections
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+DIMENSIONS = ("peer", "subject", "transport")
+""" Dimensions of the round-trip histograms """
+
+OTHER_KEY = "<other>"
+""" Key of the histogram gathering the keys over the limit of a dimension """
+
+QUANTILES = (.5, .9, .99, .999)
+""" Quantiles given in summaries """
+
+DEFAULT_PRECISION = 5
+""" Default number of significant bits kept by histograms (~3% error) """
+
+DEFAULT_MAX_VALUE = 3600 * 1000 * 1000
+""" Default highest value of histograms: one hour, in microseconds """
+
+# ------------------------------------------------------------------------------
+
+
+class Histogram(object):
+    """
+    A log-linear histogram of positive integers, with a fixed memory size.
+
+    Values lower than 2^precision have their own bucket, others are stored
+    with "precision" significant bits: the relative error of a value is
+    lower than 2^(1-precision), like in HDR histograms.
+    """
+    __slots__ = ("__precision", "__half", "__max_value", "__counts",
+                 "count", "total", "min", "max")
+
+    def __init__(self, precision=DEFAULT_PRECISION,
+                 max_value=DEFAULT_MAX_VALUE):
+        """
+        Sets up the histogram
+
+        :param precision: Number of significant bits kept (at least 1)
+        :param max_value: Highest value stored, higher ones are clamped
+        """
+        self.__precision = max(1, int(precision))
+        self.__half = 1 << (self.__precision - 1)
+        self.__max_value = int(max_value)
+        self.__counts = array.array(
+            'L', [0]) * (self.__index(self.__max_value) + 1)
+
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __index(self, value):
+        """
+        Computes the index of the bucket of a value
+
+        :param value: A positive integer
+        :return: The bucket index
+        """
+        shift = value.bit_length() - self.__precision
+        if shift <= 0:
+            return value
+        return shift * self.__half + (value >> shift)
+
+    def __bounds(self, index):
+        """
+        Computes the bounds of a bucket
+
+        :param index: A bucket index
+        :return: A (lowest, highest) tuple of the values of the bucket
+        """
+        if index < 2 * self.__half:
+            return index, index
+
+        shift = index // self.__half - 1
+        low = (index - shift * self.__half) << shift
+        return low, low + (1 << shift) - 1
+
+    def clear(self):
+        """
+        Forgets all values
+        """
+        for idx in range(len(self.__counts)):
+            self.__counts[idx] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        """
+        Stores a value
+
+        :param value: A positive integer (negative ones are stored as 0)
+        """
+        value = min(max(0, int(value)), self.__max_value)
+        self.__counts[self.__index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        """
+        Returns the mean of the stored values (0 if empty)
+        """
+        if not self.count:
+            return 0
+        return float(self.total) / self.count
+
+    def percentile(self, quantile):
+        """
+        Returns the highest value of the bucket containing the given quantile
+
+        :param quantile: A quantile, between 0 and 1
+        :return: The value of the quantile (0 if empty)
+        """
+        if not self.count:
+            return 0
+
+        rank = max(1, int(round(quantile * self.count)))
+        seen = 0
+        for idx, count in enumerate(self.__counts):
+            seen += count
+            if seen >= rank:
+                return min(self.__bounds(idx)[1], self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Returns the main statistics of the histogram
+
+        :return: A dictionary: count, sum, min, max, mean and the quantiles
+        """
+        result = {"count": self.count, "sum": self.total,
+                  "min": self.min or 0, "max": self.max or 0,
+                  "mean": self.mean()}
+        for quantile in QUANTILES:
+            result[quantile] = self.percentile(quantile)
+        return result
+
+# ------------------------------------------------------------------------------
+
+
+class RateCounter(object):
+    """
+    Counts events in one-second slots over a sliding window
+    """
+    __slots__ = ("__window", "__slots", "__seconds")
+
+    def __init__(self, window=60):
+        """
+        :param window: Size of the window, in seconds
+        """
+        self.__window = max(1, int(window))
+        self.__slots = [0] * self.__window
+        self.__seconds = [0] * self.__window
+
+    def add(self, timestamp):
+        """
+        Counts an event
+
+        :param timestamp: Time of the event, in seconds
+        """
+        second = int(timestamp)
+        idx = second % self.__window
+        if self.__seconds[idx] != second:
+            # Slot reused for a new second
+            self.__seconds[idx] = second
+            self.__slots[idx] = 0
+        self.__slots[idx] += 1
+
+    def rate(self, now=None):
+        """
+        Returns the number of events per second over the window
+
+        :param now: Current time, in seconds
+        :return: A number of events per second
+        """
+        if now is None:
+            now = time.time()
+        oldest = int(now) - self.__window
+        return float(sum(count for count, second
+                         in zip(self.__slots, self.__seconds)
+                         if second > oldest)) / self.__window
+
+# ------------------------------------------------------------------------------
+
+
+def _format_labels(labels):
+    """
+    Formats the labels of a metric in the Prometheus text format
+
+    :param labels: A list of (name, value) tuples
+    :return: The labels string, including braces, or an empty string
+    """
+    if not labels:
+        return ""
+
+    return "{{{0}}}".format(",".join(
+        '{0}="{1}"'.format(name, str(value).replace('\\', '\\\\')
+                           .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels))
+
+
+class _PendingMessage(object):
+    """
+    A sent message waiting for replies
+    """
+    __slots__ = ("timestamp", "peer", "subject", "transport", "targets",
+                 "replied")
+
+    def __init__(self, timestamp, peer, subject, transport):
+        """
+        :param timestamp: Time stamp of the emission
+        :param peer: Target of the first emission (peer UID or group name)
+        :param subject: Message subject
+        :param transport: Transport used to send the message
+        """
+        self.timestamp = timestamp
+        self.peer = peer
+        self.subject = subject
+        self.transport = transport
+
+        # Targets of the message and peers which replied
+        self.targets = set((peer,))
+        self.replied = set()
+
+
+@ComponentFactory('herald-probe-metrics-factory')
+@Provides((SERVICE_STORE, SERVICE_METRICS))
+@Property("_pending_size", "pending.size", 10000)
+@Property("_max_keys", "keys.max", 100)
+@Property("_window", "rate.window", 60)
+class MetricsStore(object):
+    """
+    Computes round-trip histograms and message rates from probe records
+    """
+    def __init__(self):
+        """
+        Sets up members
+        """
+        # Maximum number of sent messages waiting for a reply
+        self._pending_size = 10000
+
+        # Maximum number of histograms per dimension
+        self._max_keys = 100
+
+        # Size of the rate window, in seconds
+        self._window = 60
+
+        # Message UID -> _PendingMessage, oldest first
+        self._pending = collections.OrderedDict()
+
+        # Round-trip histograms (microseconds)
+        self._rtt = Histogram()
+        self._dimensions = dict((dimension, {}) for dimension in DIMENSIONS)
+
+        # Channel -> RateCounter
+        self._rates = {}
+
+        # Number of sent messages forgotten before their reply
+        self._expired = 0
+        self.__lock = threading.Lock()
+
+    @Validate
+    def validate(self, _):
+        """
+        Component validated
+        """
+        self._pending_size = max(1, int(self._pending_size))
+        self._max_keys = max(1, int(self._max_keys))
+        self._window = max(1, int(self._window))
+
+    @Invalidate
+    def invalidate(self, _):
+        """
+        Component invalidated
+        """
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets all metrics
+        """
+        with self.__lock:
+            self._pending.clear()
+            self._rtt.clear()
+            for histograms in self._dimensions.values():
+                histograms.clear()
+            self._rates.clear()
+            self._expired = 0
+
+    def __get_histogram(self, dimension, key):
+        """
+        Returns the histogram associated to a key of a dimension, creating it
+        if necessary. Must be called while holding the lock.
+
+        :param dimension: A dimension name
+        :param key: A key in this dimension
+        :return: A Histogram
+        """
+        histograms = self._dimensions[dimension]
+        try:
+            return histograms[key]
+        except KeyError:
+            if len(histograms) >= self._max_keys:
+                # Too many keys: gather the new ones
+                key = OTHER_KEY
+                if key in histograms:
+                    return histograms[key]
+
+            histogram = histograms[key] = Histogram()
+            return histogram
+
+    def store(self, channel, data):
+        """
+        Handles a probe record
+
+        :param channel: Channel of the record
+        :param data: A dictionary of data
+        """
+        timestamp = data.get("timestamp") or time.time()
+        with self.__lock:
+            try:
+                rate = self._rates[channel]
+            except KeyError:
+                rate = self._rates[channel] = RateCounter(self._window)
+            rate.add(timestamp)
+
+            if channel == PROBE_CHANNEL_MSG_SEND:
+                self.__store_send(data, timestamp)
+            elif channel == PROBE_CHANNEL_MSG_RECV:
+                self.__store_recv(data, timestamp)
+
+    def __store_send(self, data, timestamp):
+        """
+        Keeps track of a sent message. Must be called while holding the lock.
+
+        :param data: A msg_sent record
+        :param timestamp: Time stamp of the record
+        """
+        uid = data.get("uid")
+        if not uid:
+            return
+
+        target = data.get("target")
+        try:
+            # Message sent to another peer of a group
+            self._pending[uid].targets.add(target)
+            return
+        except KeyError:
+            self._pending[uid] = _PendingMessage(
+                timestamp, target, data.get("subject"), data.get("transport"))
+
+        while len(self._pending) > self._pending_size:
+            # Forget the oldest message
+            _, pending = self._pending.popitem(last=False)
+            if not pending.replied:
+                self._expired += 1
+
+    def __store_recv(self, data, timestamp):
+        """
+        Computes the round-trip time of the message a received one replies
+        to. Must be called while holding the lock.
+
+        A message sent to a group is kept until all its targets replied (or
+        until it is forgotten), to measure the reply of each peer.
+
+        :param data: A msg_recv record
+        :param timestamp: Time stamp of the record
+        """
+        replies_to = data.get("repliesTo")
+        try:
+            pending = self._pending[replies_to]
+        except KeyError:
+            # Not a reply, or reply to an unknown message
+            return
+
+        # Messages sent to a group are identified by the replying peer
+        peer = data.get("source") or pending.peer
+        if peer in pending.replied:
+            # Only the first reply of a peer is measured
+            return
+
+        pending.replied.add(peer)
+        if pending.targets.issubset(pending.replied):
+            del self._pending[replies_to]
+
+        keys = {"peer": peer, "subject": pending.subject,
+                "transport": pending.transport}
+
+        rtt = int((timestamp - pending.timestamp) * 1000000)
+        self._rtt.record(rtt)
+        for dimension, key in keys.items():
+            self.__get_histogram(dimension, key).record(rtt)
+
+    def get_metrics(self):
+        """
+        Returns the current metrics. Durations are given in microseconds.
+
+        :return: A dictionary with the summary of all round-trip times
+                 ("rtt"), of each key of each dimension (dimension -> key ->
+                 summary), the rate of each channel ("rates") and the numbers
+                 of pending and expired sent messages.
+        """
+        now = time.time()
+        with self.__lock:
+            result = dict((dimension, dict(
+                (key, histogram.summary())
+                for key, histogram in histograms.items()))
+                for dimension, histograms in self._dimensions.items())
+            result["rtt"] = self._rtt.summary()
+            result["rates"] = dict((channel, rate.rate(now))
+                                   for channel, rate in self._rates.items())
+            result["pending"] = len(self._pending)
+            result["expired"] = self._expired
+        return result
+
+    def export_text(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        Durations are given in seconds.
+
+        :return: A string
+        """
+        metrics = self.get_metrics()
+        lines = []
+
+        def add_summary(name, labels, summary):
+            """
+            Adds the lines describing a round-trip summary
+            """
+            for quantile in QUANTILES:
+                lines.append("{0}{1} {2:.6f}".format(
+                    name, _format_labels(labels + [("quantile", quantile)]),
+                    summary[quantile] / 1000000.))
+            lines.append("{0}_sum{1} {2:.6f}".format(
+                name, _format_labels(labels), summary["sum"] / 1000000.))
+            lines.append("{0}_count{1} {2}".format(
+                name, _format_labels(labels), summary["count"]))
+
+        lines.append("# HELP herald_rtt_seconds Round-trip time of messages")
+        lines.append("# TYPE herald_rtt_seconds summary")
+        add_summary("herald_rtt_seconds", [], metrics["rtt"])
+
+        # Each dimension has its own metric, as each one covers all samples
+        for dimension in DIMENSIONS:
+            name = "herald_rtt_by_{0}_seconds".format(dimension)
+            lines.append("# HELP {0} Round-trip time of messages per {1}"
+                         .format(name, dimension))
+            lines.append("# TYPE {0} summary".format(name))
+            for key, summary in sorted(metrics[dimension].items()):
+                add_summary(name, [(dimension, key)], summary)
+
+        lines.append("# HELP herald_probe_rate Records per second")
+        lines.append("# TYPE herald_probe_rate gauge")
+        lines.extend("herald_probe_rate{0} {1:.3f}".format(
+            _format_labels([("channel", channel)]), rate)
+            for channel, rate in sorted(metrics["rates"].items()))
+
+        lines.append("# HELP herald_rtt_pending Messages waiting for a reply")
+        lines.append("# TYPE herald_rtt_pending gauge")
+        lines.append("herald_rtt_pending {0}".format(metrics["pending"]))
+        lines.append("# HELP herald_rtt_expired Messages forgotten before "
+                     "their reply")
+        lines.append("# TYPE herald_rtt_expired counter")
+        lines.append("herald_rtt_expired {0}".format(metrics["expired"]))
+        lines.append("")
+        return "\n".join(lines)
@@ -36,6 +36,7 @@ __docformat__ = "restructuredtext en"
 # ------------------------------------------------------------------------------
 
 # Herald
+from herald.probe import SERVICE_STORE_QUERY, SERVICE_METRICS
 import herald
 
 # Pelix
@@ -45,11 +46,16 @@ from pelix.ipopo.constants import use_ipopo
 import pelix.constants
 import pelix.shell
 
+# Standard library
+import time
+
 # ------------------------------------------------------------------------------
 
 
 @ComponentFactory("herald-probe-factory")
 @RequiresBest("_probe", herald.SERVICE_PROBE)
+@RequiresBest("_query", SERVICE_STORE_QUERY, optional=True)
+@RequiresBest("_metrics", SERVICE_METRICS, optional=True)
 @Requires("_utils", pelix.shell.SERVICE_SHELL_UTILS)
 @Provides(pelix.shell.SERVICE_SHELL_COMMAND)
 @Instantiate("herald-probe-shell")
@@ -63,6 +69,8 @@ class ProbeCommands(object):
         """
         self._context = None
         self._probe = None
+        self._metrics = None
+        self._query = None
         self._utils = None
 
     @Validate
@@ -94,7 +102,13 @@ class ProbeCommands(object):
                 ("disable_probe", self.disable_probe),
                 ("disable_channel", self.disable_channel),
                 ("set_channel_filter", self.set_channel_filter),
+                ("set_channel_sampling", self.set_channel_sampling),
+                ("set_channel_rate_limit", self.set_channel_rate_limit),
+                ("set_content_max_size", self.set_content_max_size),
                 ("probe_state", self.probe_state),
+                ("probe_channels", self.probe_channels),
+                ("probe_query", self.probe_query),
+                ("probe_metrics", self.probe_metrics),
                 ("install_default", self.install_default_probe)]
 
     def enable_probe(self, _):
@@ -133,6 +147,34 @@ class ProbeCommands(object):
             session.write_line("Invalid LDAP filter: {0} -- {1}",
                                ex, ldap_filter)
 
+    def set_channel_sampling(self, session, channel, rate=1):
+        """
+        Keeps the records of a channel about 1 message out of N (1 to keep
+        all of them)
+        """
+        try:
+            self._probe.set_channel_sampling(channel, rate)
+        except ValueError as ex:
+            session.write_line("Invalid sampling rate: {0}", ex)
+
+    def set_channel_rate_limit(self, session, channel, rate=0, burst=None):
+        """
+        Limits the number of records of a channel per second (0 for no limit)
+        """
+        try:
+            self._probe.set_channel_rate_limit(channel, rate, burst)
+        except ValueError as ex:
+            session.write_line("Invalid rate limit: {0}", ex)
+
+    def set_content_max_size(self, session, size=0):
+        """
+        Sets the maximum size of the stored message contents (0 for no limit)
+        """
+        try:
+            self._probe.set_content_max_size(size)
+        except ValueError as ex:
+            session.write_line("Invalid size: {0}", ex)
+
     def probe_state(self, session):
         """
         Prints the current probe configuration
@@ -143,16 +185,140 @@ class ProbeCommands(object):
             lines.append("Active channels:")
             lines.extend("\t* {0}".format(channel)
                          for channel in self._probe.get_active_channels())
+
+        stats = self._probe.get_stats()
+        if stats:
+            lines.append("Buffer.........: {0} / {1} ({2})".format(
+                stats["buffered"], stats["buffer.size"],
+                stats["buffer.policy"]))
+            lines.append("Stored records.: {0}".format(stats["stored"]))
+            dropped = stats["dropped"]
+            lines.append("Dropped records: {0}".format(
+                sum(dropped.values())))
+            lines.extend("\t* {0}: {1}".format(channel, count)
+                         for channel, count in sorted(dropped.items()))
+
+            limited = stats["limited"]
+            lines.append("Rate-limited...: {0}".format(
+                sum(limited.values())))
+            lines.extend("\t* {0}: {1}".format(channel, count)
+                         for channel, count in sorted(limited.items()))
+
+            lines.append("Sampling.......:")
+            lines.extend("\t* {0}: 1/{1}".format(channel, rate)
+                         for channel, rate
+                         in sorted(stats["sampling"].items()))
+            lines.append("Rate limits....:")
+            lines.extend("\t* {0}: {1}/s".format(channel, rate)
+                         for channel, rate
+                         in sorted(stats["rate_limit"].items()))
+            lines.append("Content size...: {0}".format(
+                stats["content.max_size"] or "unlimited"))
         lines.append("")
 
         session.write_line("\n".join(lines))
 
+    def probe_channels(self, session):
+        """
+        Lists the channels kept in memory and their number of records
+        """
+        if self._query is None:
+            session.write_line("No probe query service available")
+            return
+
+        lines = sorted(self._query.get_channels().items())
+        session.write(self._utils.make_table(("Channel", "Records"), lines))
+
+    def probe_query(self, session, channel, uid=None, subject=None,
+                    peer=None, since=None, until=None, limit=20):
+        """
+        Prints the latest records of a channel kept in memory. Subject can be
+        a glob-like pattern; since and until are given in seconds before now.
+        """
+        if self._query is None:
+            session.write_line("No probe query service available")
+            return
+
+        now = time.time()
+        try:
+            start = now - float(since) if since is not None else None
+            end = now - float(until) if until is not None else None
+            limit = int(limit)
+        except ValueError as ex:
+            session.write_line("Invalid argument: {0}", ex)
+            return
+
+        records = self._query.query(channel, uid, subject, peer, start, end,
+                                    limit)
+        if not records:
+            session.write_line("No record found")
+            return
+
+        headers = sorted(records[0])
+        if "timestamp" in headers:
+            # Show the time stamp first, in a readable format
+            headers.remove("timestamp")
+            headers.insert(0, "timestamp")
+            for record in records:
+                timestamp = record["timestamp"]
+                record["timestamp"] = "{0}.{1:03d}".format(
+                    time.strftime("%H:%M:%S", time.localtime(timestamp)),
+                    int(timestamp * 1000) % 1000)
+
+        lines = [[record[header] for header in headers] for record in records]
+        session.write(self._utils.make_table(headers, lines))
+        session.write_line("{0} record(s)", len(records))
+
+    def probe_metrics(self, session, dimension=None):
+        """
+        Prints the round-trip times (in milliseconds) and the message rates
+        computed from the probe records. Dimension can be peer, subject or
+        transport.
+        """
+        if self._metrics is None:
+            session.write_line("No probe metrics service available")
+            return
+
+        metrics = self._metrics.get_metrics()
+        dimensions = [dimension] if dimension else ["peer", "subject",
+                                                    "transport"]
+
+        def make_line(dimension, key, summary):
+            """
+            Prepares a line of the round-trip table
+            """
+            return [dimension, key, summary["count"]] + \
+                ["{0:.3f}".format(summary[name] / 1000.)
+                 for name in ("min", "mean", .5, .9, .99, "max")]
+
+        lines = [make_line("all", "", metrics["rtt"])]
+        for name in dimensions:
+            try:
+                summaries = metrics[name]
+            except KeyError:
+                session.write_line("Unknown dimension: {0}", name)
+                return
+
+            lines.extend(make_line(name, key, summary)
+                         for key, summary in sorted(summaries.items()))
+
+        session.write(self._utils.make_table(
+            ("Dimension", "Key", "Count", "Min", "Mean", "P50", "P90", "P99",
+             "Max"), lines))
+        session.write_line("{0} message(s) waiting for a reply, {1} expired",
+                           metrics["pending"], metrics["expired"])
+
+        lines = [(channel, "{0:.3f}".format(rate))
+                 for channel, rate in sorted(metrics["rates"].items())]
+        session.write(self._utils.make_table(("Channel", "Records/s"), lines))
+
     def install_default_probe(self, session):
         """
         Installs the default probe bundles (doesn't enable it)
         """
         for bundle in ("herald.probe.core", "herald.probe.store_log",
-                       "herald.probe.store_sqlite"):
+                       "herald.probe.store_sqlite",
+                       "herald.probe.store_memory", "herald.probe.metrics"):
             try:
                 self._context.install_bundle(bundle).start()
             except pelix.constants.BundleException as ex:
@@ -169,3 +335,12 @@ class ProbeCommands(object):
             ipopo.instantiate(
                 'herald-probe-sqlite-factory', 'herald-probe-sqlite',
                 {'db.file': 'herald_probe.db'})
+
+            # ... Memory store
+            ipopo.instantiate(
+                'herald-probe-memory-factory', 'herald-probe-memory',
+                {'buffer.size': 10000})
+
+            # ... Metrics
+            ipopo.instantiate(
+                'herald-probe-metrics-factory', 'herald-probe-metrics', {})
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Keeps the latest probe data in memory, in fixed-size ring buffers
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+from herald import PROBE_CHANNEL_MSG_CONTENT
+
+# Probe constants
+from herald.probe import SERVICE_STORE, SERVICE_STORE_QUERY, CHANNEL_FIELDS
+
+# Pelix
+from pelix.ipopo.decorators import ComponentFactory, Provides, Property, \
+    Validate, Invalidate
+
+# Standard library
+import array
+import fnmatch
+import threading
+
+# ------------------------------------------------------------------------------
+
+PEER_FIELDS = ("target", "source")
+""" Fields containing the UID of the remote peer """
+
+# ------------------------------------------------------------------------------
+
+
+class RingBuffer(object):
+    """
+    Keeps the latest records of a channel, one column per field.
+
+    Time stamps are kept in an array of doubles, other fields in lists.
+    """
+    def __init__(self, fields, size):
+        """
+        Sets up the buffer
+
+        :param fields: Names of the fields of the records
+        :param size: Maximum number of records
+        """
+        self.fields = tuple(fields)
+        self.size = size
+
+        # Index of the next record to write and number of records
+        self.__next = 0
+        self.__count = 0
+
+        # Columns
+        self.__timestamps = array.array('d', [0.]) * size
+        self.__columns = dict((field, [None] * size) for field in self.fields
+                              if field != "timestamp")
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return self.__count
+
+    def clear(self):
+        """
+        Forgets all records
+        """
+        with self.__lock:
+            self.__next = 0
+            self.__count = 0
+            for column in self.__columns.values():
+                column[:] = [None] * self.size
+
+    def append(self, data):
+        """
+        Stores a record, replacing the oldest one if the buffer is full
+
+        :param data: A dictionary
+        """
+        with self.__lock:
+            idx = self.__next
+            self.__timestamps[idx] = data.get("timestamp") or 0.
+            for field, column in self.__columns.items():
+                column[idx] = data.get(field)
+
+            self.__next = (idx + 1) % self.size
+            if self.__count < self.size:
+                self.__count += 1
+
+    def __indexes(self):
+        """
+        Returns the indexes of the records, from the oldest to the newest.
+        Must be called while holding the lock.
+        """
+        first = (self.__next - self.__count) % self.size
+        return [(first + offset) % self.size
+                for offset in range(self.__count)]
+
+    def query(self, uid=None, subject=None, peer=None, start=None, end=None,
+              limit=None):
+        """
+        Looks for records
+
+        :param uid: UID of the message
+        :param subject: Glob-like pattern the message subject must match
+        :param peer: UID of the remote peer (target or source)
+        :param start: Minimal time stamp (in seconds)
+        :param end: Maximal time stamp (in seconds)
+        :param limit: Maximum number of records to return (the latest ones)
+        :return: The list of matching records (dictionaries), from the oldest
+                 to the newest. A filter on a field the channel doesn't have
+                 matches no record.
+        """
+        timestamps = self.__timestamps
+        columns = self.__columns
+
+        # Tests on each record index
+        tests = []
+        if uid is not None:
+            if "uid" not in columns:
+                return []
+            uids = columns["uid"]
+            tests.append(lambda idx: uids[idx] == uid)
+
+        if subject is not None:
+            if "subject" not in columns:
+                return []
+            subjects = columns["subject"]
+            tests.append(lambda idx: fnmatch.fnmatchcase(
+                subjects[idx] or "", subject))
+
+        if peer is not None:
+            peer_columns = [columns[field] for field in PEER_FIELDS
+                            if field in columns]
+            if not peer_columns:
+                return []
+            tests.append(lambda idx: any(column[idx] == peer
+                                         for column in peer_columns))
+
+        if start is not None or end is not None:
+            if "timestamp" not in self.fields:
+                return []
+            if start is not None:
+                tests.append(lambda idx: timestamps[idx] >= start)
+            if end is not None:
+                tests.append(lambda idx: timestamps[idx] <= end)
+
+        with self.__lock:
+            # Look from the newest to the oldest record, to stop at the limit
+            found = []
+            for idx in reversed(self.__indexes()):
+                if all(test(idx) for test in tests):
+                    found.append(self.__record(idx))
+                    if limit is not None and len(found) >= limit:
+                        break
+
+        found.reverse()
+        return found
+
+    def __record(self, idx):
+        """
+        Returns the record at the given index, as a dictionary
+
+        :param idx: Index of the record
+        :return: A dictionary
+        """
+        record = dict((field, column[idx])
+                      for field, column in self.__columns.items())
+        if "timestamp" in self.fields:
+            record["timestamp"] = self.__timestamps[idx]
+        return record
+
+# ------------------------------------------------------------------------------
+
+
+@ComponentFactory('herald-probe-memory-factory')
+@Provides((SERVICE_STORE, SERVICE_STORE_QUERY))
+@Property("_size", "buffer.size", 10000)
+@Property("_content_max_size", "content.max_size", 4096)
+class MemoryStore(object):
+    """
+    Keeps the latest records of each channel in memory
+    """
+    def __init__(self):
+        """
+        Sets up members
+        """
+        # Number of records per channel
+        self._size = 10000
+
+        # Maximum size of a stored message content (0 for no limit)
+        self._content_max_size = 4096
+
+        # Channel -> RingBuffer
+        self._buffers = {}
+        self.__lock = threading.Lock()
+
+    @Validate
+    def validate(self, _):
+        """
+        Component validated
+        """
+        self._size = max(1, int(self._size))
+        self._content_max_size = max(0, int(self._content_max_size or 0))
+
+    @Invalidate
+    def invalidate(self, _):
+        """
+        Component invalidated
+        """
+        with self.__lock:
+            self._buffers.clear()
+
+    def __get_buffer(self, channel, data):
+        """
+        Returns the buffer of a channel, creating it if necessary
+
+        :param channel: A channel name
+        :param data: Data stored in the channel, describing its fields for
+                     unknown channels
+        :return: A RingBuffer
+        """
+        try:
+            return self._buffers[channel]
+        except KeyError:
+            with self.__lock:
+                try:
+                    return self._buffers[channel]
+                except KeyError:
+                    fields = CHANNEL_FIELDS.get(channel) or sorted(data)
+                    buffer = self._buffers[channel] = \
+                        RingBuffer(fields, self._size)
+                    return buffer
+
+    def store(self, channel, data):
+        """
+        Stores data to the given channel
+
+        :param channel: Channel where to store data
+        :param data: A dictionary of data to be stored
+        """
+        max_size = self._content_max_size
+        if max_size and channel == PROBE_CHANNEL_MSG_CONTENT:
+            # Bound the memory used by the buffer of contents
+            content = data.get("content")
+            if content is not None and len(content) > max_size:
+                data = data.copy()
+                data["content"] = content[:max_size]
+
+        self.__get_buffer(channel, data).append(data)
+
+    def get_channels(self):
+        """
+        Returns the channels with records and their number of records
+
+        :return: A dictionary: channel -> number of records
+        """
+        return dict((channel, len(buffer))
+                    for channel, buffer in self._buffers.items())
+
+    def query(self, channel, uid=None, subject=None, peer=None, start=None,
+              end=None, limit=None):
+        """
+        Looks for the records of a channel
+
+        :param channel: A channel name
+        :param uid: UID of the message
+        :param subject: Glob-like pattern the message subject must match
+        :param peer: UID of the remote peer (target or source)
+        :param start: Minimal time stamp (in seconds)
+        :param end: Maximal time stamp (in seconds)
+        :param limit: Maximum number of records to return (the latest ones)
+        :return: The list of matching records (dictionaries), from the oldest
+                 to the newest
+        """
+        try:
+            buffer = self._buffers[channel]
+        except KeyError:
+            return []
+
+        return buffer.query(uid, subject, peer, start, end, limit)
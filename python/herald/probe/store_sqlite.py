@@ -37,33 +37,32 @@ __docformat__ = "restructuredtext en"
 
 # Probe constants
 from herald import PROBE_CHANNEL_MSG_SEND, PROBE_CHANNEL_MSG_CONTENT, \
-    PROBE_CHANNEL_MSG_RECV
-from herald.probe import SERVICE_STORE
+    PROBE_CHANNEL_MSG_RECV, PROBE_CHANNEL_ROUTE, PROBE_CHANNEL_GROUP
+from herald.probe import SERVICE_STORE, CHANNEL_FIELDS
 
 # Pelix
 from pelix.ipopo.decorators import ComponentFactory, Provides, Property, \
-    Validate
+    Validate, Invalidate
 
 # Standard library
 import logging
 import sqlite3
+import threading
+import time
+
+try:
+    # Python 3
+    # pylint: disable=F0401
+    import queue
+except ImportError:
+    # Python 2
+    # pylint: disable=F0401
+    import Queue as queue
 
 # ------------------------------------------------------------------------------
 
 _logger = logging.getLogger(__name__)
 
-CHANNEL_FIELDS = {
-    PROBE_CHANNEL_MSG_SEND: ("uid", "timestamp", "transport", "subject",
-                             "target", "transportTarget", "repliesTo"),
-    PROBE_CHANNEL_MSG_RECV: ("uid", "timestamp", "transport", "subject",
-                             "source", "transportSource", "repliesTo"),
-    PROBE_CHANNEL_MSG_CONTENT: ("uid", "content"),
-    'http_multicast': ("timestamp", "uid", "event"),
-}
-"""
-For each channel, the list of fields for which a value is given
-"""
-
 CHANNEL_VALUES = dict((key, tuple(":{0}".format(field) for field in fields))
                       for key, fields in CHANNEL_FIELDS.items())
 """
@@ -74,15 +73,40 @@ values() SQL statement
 FAILSAFE_CHANNELS = (PROBE_CHANNEL_MSG_CONTENT,)
 """ List of channels which integrity error can be ignored """
 
+CHANNEL_INSERTS = dict(
+    (channel, "INSERT {0}INTO {1}({2}) values ({3})".format(
+        "OR IGNORE " if channel in FAILSAFE_CHANNELS else "", channel,
+        ",".join(CHANNEL_FIELDS[channel]), ",".join(CHANNEL_VALUES[channel])))
+    for channel in CHANNEL_FIELDS)
+"""
+For each channel, the INSERT statement (channel names are well defined: no
+need to escape them)
+"""
+
+INDEXED_FIELDS = ("uid", "timestamp", "repliesTo")
+""" Fields indexed in the channel tables, when they have them """
+
+PRUNE_INTERVAL = 60
+""" Time between two removals of old records, in seconds """
+
+_STOP = object()
+""" Marker telling the writer thread to stop """
+
 # ------------------------------------------------------------------------------
 
 
 @ComponentFactory('herald-probe-sqlite-factory')
 @Provides(SERVICE_STORE)
 @Property("_db_name", "db.file", "herald_probe.db")
+@Property("_batch_size", "batch.size", 500)
+@Property("_batch_delay", "batch.delay", .5)
+@Property("_retention", "retention", None)
 class SqliteStore(object):
     """
-    Traces data into a logger
+    Stores probe data in a SQLite database.
+
+    Records are written by a dedicated thread, with a single connection, in
+    transactions of up to batch.size records or batch.delay seconds.
     """
     def __init__(self):
         """
@@ -91,51 +115,132 @@ class SqliteStore(object):
         # DB file name
         self._db_name = ":memory:"
 
+        # Maximum number of records and time (in seconds) per transaction
+        self._batch_size = 500
+        self._batch_delay = .5
+
+        # Time to keep records, in seconds (None to keep them forever)
+        self._retention = None
+
+        # Writer thread and its queue of (channel, data) tuples
+        self.__queue = queue.Queue()
+        self.__thread = None
+        self.__ready = threading.Event()
+
     @Validate
     def validate(self, _):
         """
         Component validated
         """
-        # Open the database
+        self.__ready.clear()
+        self.__thread = threading.Thread(target=self.__writer_loop,
+                                         name="Herald-Probe-SQLite")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+        # Wait for the tables to be created
+        self.__ready.wait()
+
+    @Invalidate
+    def invalidate(self, _):
+        """
+        Component invalidated
+        """
+        # Stop the writer, once it has written the remaining records
+        self.__queue.put(_STOP)
+        self.__thread.join()
+        self.__thread = None
+
+    def __connect(self):
+        """
+        Opens the writer connection and creates the tables, if necessary
+
+        :return: A SQLite connection
+        """
         sql_con = sqlite3.connect(self._db_name)
-        try:
-            with sql_con:
-                # Create tables
-                sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
-                    (id integer PRIMARY KEY AUTOINCREMENT,
-                     uid text,
-                     timestamp integer,
-                     transport text,
-                     subject text,
-                     target text,
-                     transportTarget text,
-                     repliesTo text
-                    )'''.format(PROBE_CHANNEL_MSG_SEND))
-
-                sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
-                    (id integer PRIMARY KEY AUTOINCREMENT,
-                     uid text,
-                     timestamp integer,
-                     transport text,
-                     subject text,
-                     source text,
-                     transportSource text,
-                     repliesTo text
-                    )'''.format(PROBE_CHANNEL_MSG_RECV))
-
-                sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
-                    (uid text PRIMARY KEY,
-                     content BLOB
-                    )'''.format(PROBE_CHANNEL_MSG_CONTENT))
-
-                sql_con.execute('''CREATE TABLE IF NOT EXISTS http_multicast
-                    (id integer PRIMARY KEY AUTOINCREMENT,
-                     timestamp integer,
-                     uid text,
-                     event text
-                    )''')
-        finally:
-            sql_con.close()
+
+        # Readers don't block the writer, and commits don't wait for the
+        # data to be synchronized to the disk
+        sql_con.execute("PRAGMA journal_mode=WAL")
+        sql_con.execute("PRAGMA synchronous=NORMAL")
+
+        with sql_con:
+            # Create tables
+            sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
+                (id integer PRIMARY KEY AUTOINCREMENT,
+                 uid text,
+                 timestamp integer,
+                 transport text,
+                 subject text,
+                 target text,
+                 transportTarget text,
+                 repliesTo text
+                )'''.format(PROBE_CHANNEL_MSG_SEND))
+
+            sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
+                (id integer PRIMARY KEY AUTOINCREMENT,
+                 uid text,
+                 timestamp integer,
+                 transport text,
+                 subject text,
+                 source text,
+                 transportSource text,
+                 repliesTo text
+                )'''.format(PROBE_CHANNEL_MSG_RECV))
+
+            sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
+                (uid text PRIMARY KEY,
+                 content BLOB
+                )'''.format(PROBE_CHANNEL_MSG_CONTENT))
+
+            sql_con.execute('''CREATE TABLE IF NOT EXISTS http_multicast
+                (id integer PRIMARY KEY AUTOINCREMENT,
+                 timestamp integer,
+                 uid text,
+                 event text
+                )''')
+
+            sql_con.execute('''CREATE TABLE IF NOT EXISTS xmpp_room_join
+                (id integer PRIMARY KEY AUTOINCREMENT,
+                 timestamp integer,
+                 room text,
+                 latency real,
+                 status text
+                )''')
+
+            sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
+                (id integer PRIMARY KEY AUTOINCREMENT,
+                 timestamp integer,
+                 peer text,
+                 access text,
+                 state text,
+                 latency real,
+                 errorRate real,
+                 failures integer
+                )'''.format(PROBE_CHANNEL_ROUTE))
+
+            sql_con.execute('''CREATE TABLE IF NOT EXISTS {0}
+                (id integer PRIMARY KEY AUTOINCREMENT,
+                 uid text,
+                 timestamp integer,
+                 targetGroup text,
+                 steps text,
+                 reached integer,
+                 missing integer
+                )'''.format(PROBE_CHANNEL_GROUP))
+
+            # Create indexes (the content table uses its UID as key)
+            for channel, fields in CHANNEL_FIELDS.items():
+                if channel in FAILSAFE_CHANNELS:
+                    continue
+
+                for field in INDEXED_FIELDS:
+                    if field in fields:
+                        sql_con.execute(
+                            '''CREATE INDEX IF NOT EXISTS {0}_{1}
+                            ON {0}({1})'''.format(channel, field))
+
+        return sql_con
 
     def __convert_timestamp(self, data):
         """
@@ -162,30 +267,114 @@ class SqliteStore(object):
         :param channel: Channel where to store data
         :param data: A dictionary of data to be stored
         """
-        sql_con = sqlite3.connect(self._db_name)
-        try:
-            if channel in CHANNEL_FIELDS:
-                # Convert timestamp
-                filtered_data = self.__convert_timestamp(data)
+        if channel in CHANNEL_FIELDS:
+            self.__queue.put((channel, data))
 
-                # Prepare the request
-                # Channel names are well defined => no need to escape (for now)
-                sql = '''INSERT INTO {0}({1}) values ({2})''' \
-                    .format(channel, ",".join(CHANNEL_FIELDS[channel]),
-                            ",".join(CHANNEL_VALUES[channel]))
+    def __writer_loop(self):
+        """
+        Writes the queued records, by batches
+        """
+        try:
+            sql_con = self.__connect()
+        except sqlite3.Error as ex:
+            _logger.error("Error opening the probe database %s: %s",
+                          self._db_name, ex)
+            sql_con = None
+        finally:
+            self.__ready.set()
 
+        next_prune = time.time()
+        try:
+            while True:
+                # Wait for a first record
                 try:
-                    with sql_con:
-                        # Run it
-                        sql_con.execute(sql, filtered_data)
-                except sqlite3.IntegrityError as ex:
-                    # Error inserting data
-                    if channel == PROBE_CHANNEL_MSG_CONTENT:
-                        # Not a harmful error
-                        _logger.debug("Error inserting data in table %s: %s",
-                                      channel, ex)
-        except:
-            _logger.exception("Error inserting data in table %s", channel)
-            raise
+                    item = self.__queue.get(True, PRUNE_INTERVAL)
+                except queue.Empty:
+                    item = None
+
+                # Fill the batch until it is full or too old
+                batch = []
+                deadline = time.time() + self._batch_delay
+                while item is not None and item is not _STOP:
+                    batch.append(item)
+                    if len(batch) >= self._batch_size:
+                        break
+
+                    try:
+                        item = self.__queue.get(
+                            True, max(0, deadline - time.time()))
+                    except queue.Empty:
+                        break
+
+                if sql_con is not None:
+                    if batch:
+                        self.__write(sql_con, batch)
+
+                    if self._retention and \
+                            (item is _STOP or time.time() >= next_prune):
+                        self.__prune(sql_con)
+                        next_prune = time.time() + PRUNE_INTERVAL
+
+                if item is _STOP:
+                    return
         finally:
-            sql_con.close()
+            if sql_con is not None:
+                sql_con.close()
+
+    def __write(self, sql_con, batch):
+        """
+        Writes a batch of records in a single transaction
+
+        :param sql_con: The writer connection
+        :param batch: A list of (channel, data) tuples
+        """
+        channels = {}
+        for channel, data in batch:
+            # Missing fields are stored as NULL
+            fields = CHANNEL_FIELDS[channel]
+            record = dict((field, data.get(field)) for field in fields)
+            channels.setdefault(channel, []).append(
+                self.__convert_timestamp(record))
+
+        try:
+            with sql_con:
+                for channel, records in channels.items():
+                    sql_con.executemany(CHANNEL_INSERTS[channel], records)
+        except sqlite3.Error as ex:
+            _logger.warning("Error inserting %d records in %s: %s. "
+                            "Inserting them one by one.",
+                            len(batch), ", ".join(channels), ex)
+            # Only lose the faulty records
+            for channel, records in channels.items():
+                for record in records:
+                    try:
+                        with sql_con:
+                            sql_con.execute(CHANNEL_INSERTS[channel], record)
+                    except sqlite3.Error as ex:
+                        _logger.error("Error inserting a record in %s: %s",
+                                      channel, ex)
+
+    def __prune(self, sql_con):
+        """
+        Deletes the records older than the retention time
+
+        :param sql_con: The writer connection
+        """
+        limit = int((time.time() - float(self._retention)) * 1000)
+        try:
+            with sql_con:
+                for channel, fields in CHANNEL_FIELDS.items():
+                    if "timestamp" in fields:
+                        sql_con.execute(
+                            "DELETE FROM {0} WHERE timestamp < ?"
+                            .format(channel), (limit,))
+
+                # Contents don't have a timestamp: keep those of the
+                # remaining messages
+                sql_con.execute(
+                    "DELETE FROM {0} WHERE uid NOT IN "
+                    "(SELECT uid FROM {1} UNION SELECT uid FROM {2})"
+                    .format(PROBE_CHANNEL_MSG_CONTENT, PROBE_CHANNEL_MSG_SEND,
+                            PROBE_CHANNEL_MSG_RECV))
+        except sqlite3.Error as ex:
+            _logger.error("Error removing old records: %s", ex)
@@ -65,3 +65,92 @@ DEFAULT_TARGET_GROUP = 'all'
 """
 Default name of group to whom a discovery message is sent.
 """
+
+PROP_BATCH_THREADS = 'herald.rpc.batch.threads'
+"""
+Number of threads used by an exporter to execute the calls of a batch in
+parallel (0 to execute them sequentially)
+"""
+
+PROP_RPC_TIMEOUT = 'herald.rpc.timeout'
+"""
+Time to wait for the result of an asynchronous call, in seconds (0 to wait
+forever)
+"""
+
+DEFAULT_RPC_TIMEOUT = 60
+"""
+Default time to wait for the result of an asynchronous call, in seconds
+"""
+
+PROP_EXPORTER_THREADS = 'herald.rpc.exporter.threads'
+"""
+Maximum number of threads used by an exporter to execute requests
+"""
+
+DEFAULT_EXPORTER_THREADS = 10
+"""
+Default maximum number of threads used by an exporter to execute requests
+"""
+
+PROP_SERVICE_CONCURRENCY = 'herald.rpc.service.concurrency'
+"""
+Maximum number of requests accepted at once for each exported service, in
+execution or waiting for a thread (0 for no limit). The requests over this
+limit are refused with an error.
+"""
+
+DEFAULT_SERVICE_CONCURRENCY = 20
+"""
+Default maximum number of requests accepted at once for each exported service
+"""
+
+SERVICE_RPC_STATS = 'herald.rpc.stats'
+"""
+Specification of the service giving the execution times of the methods
+called through an exporter
+"""
+
+ERROR_SERVICE_BUSY = -32000
+"""
+Code of the error returned when a request calls a saturated service
+"""
+
+PROP_CACHEABLE_METHODS = 'herald.rpc.cacheable'
+"""
+Property of an exported service declaring the methods whose results can be
+cached by the importers: a dictionary (method name -> time to live in
+seconds), or a list of method names cached for DEFAULT_CACHE_TTL seconds
+"""
+
+PROP_CACHE_TTL = 'herald.rpc.cache.ttl'
+"""
+End point property: dictionary associating the names of cacheable methods to
+the time to live of their results, in seconds
+"""
+
+DEFAULT_CACHE_TTL = 1
+"""
+Default time to live of cached results, in seconds
+"""
+
+PROP_CACHE_SIZE = 'herald.rpc.cache.size'
+"""
+Maximum number of results cached by an importer for each end point
+"""
+
+DEFAULT_CACHE_SIZE = 256
+"""
+Default maximum number of results cached for each end point
+"""
+
+PROP_DISCOVERY_DELAY = 'herald.rpc.discovery.delay'
+"""
+Time to wait, in seconds, to coalesce the additions, updates and removals of
+end points into a single discovery message (0 to send them immediately)
+"""
+
+DEFAULT_DISCOVERY_DELAY = .1
+"""
+Default time to wait before sending a batch of end point events, in seconds
+"""
@@ -41,11 +41,14 @@ import herald.remote
 
 # Pelix
 from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
-    Property, Instantiate
+    Property, Validate, Invalidate, Instantiate
 import pelix.remote.beans
 
 # Standard library
+import hashlib
+import json
 import logging
+import threading
 
 from . import PROP_TARGET_GROUP, DEFAULT_TARGET_GROUP
 
@@ -56,6 +59,31 @@ _logger = logging.getLogger(__name__)
 # ------------------------------------------------------------------------------
 
 
+def endpoint_hash(dump):
+    """
+    Computes the hash of an end point description
+
+    :param dump: An end point description dictionary (see _dump_endpoint())
+    :return: The hexadecimal SHA-1 of the description
+    """
+    data = json.dumps(dump, sort_keys=True, default=repr)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def endpoints_digest(hashes):
+    """
+    Computes the digest of a set of end points
+
+    :param hashes: A dictionary: end point UID -> end point hash
+    :return: The hexadecimal SHA-1 of the set
+    """
+    data = ';'.join('{0}:{1}'.format(uid, hashes[uid])
+                    for uid in sorted(hashes))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+# ------------------------------------------------------------------------------
+
+
 @ComponentFactory(herald.remote.FACTORY_DISCOVERY)
 @Provides(pelix.remote.SERVICE_EXPORT_ENDPOINT_LISTENER)
 @Provides((herald.SERVICE_LISTENER, herald.SERVICE_DIRECTORY_LISTENER))
@@ -64,10 +92,18 @@ _logger = logging.getLogger(__name__)
 @Requires('_dispatcher', pelix.remote.SERVICE_DISPATCHER)
 @Requires('_registry', pelix.remote.SERVICE_REGISTRY)
 @Property('_filters', herald.PROP_FILTERS, ['herald/rpc/discovery/*'])
+@Property('_delay', herald.remote.PROP_DISCOVERY_DELAY,
+          herald.remote.DEFAULT_DISCOVERY_DELAY)
 @Instantiate('herald-remote-discovery')
 class HeraldDiscovery(object):
     """
-    Remote services discovery and notification using Herald
+    Remote services discovery and notification using Herald.
+
+    Peers exchange the digests of their sets of end points ("hello"
+    messages) and only send the end points the other peer is missing ("sync"
+    messages). Events on local end points are sent in batches.
+    Peers using the former protocol ("contact", "add", "update" and "remove"
+    messages) are still supported.
     """
     def __init__(self):
         """
@@ -84,6 +120,45 @@ class HeraldDiscovery(object):
         self._dispatcher = None
         self._registry = None
 
+        # Time to wait before sending a batch of events
+        self._delay = herald.remote.DEFAULT_DISCOVERY_DELAY
+
+        # Peer UID -> {end point UID -> end point description}
+        self._imported = {}
+
+        # UIDs of the peers supporting digests and batches
+        self._capable = set()
+
+        # UIDs of the peers we sent a "hello" message, waiting for a reply
+        self._hello_sent = set()
+
+        # Target group -> pending events
+        self._pending = {}
+        self._timer = None
+        self.__lock = threading.RLock()
+
+    @Validate
+    def validate(self, _):
+        """
+        Component validated
+        """
+        self._delay = max(0., float(self._delay or 0))
+
+    @Invalidate
+    def invalidate(self, _):
+        """
+        Component invalidated
+        """
+        with self.__lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            self._pending.clear()
+            self._imported.clear()
+            self._capable.clear()
+            self._hello_sent.clear()
+
     def _dump_endpoint(self, endpoint):
         """
         Converts an ExportEndpoint bean to a dictionary.
@@ -160,6 +235,42 @@ class HeraldDiscovery(object):
             except KeyError as ex:
                 _logger.error("Unreadable endpoint from %s: missing %s",
                               peer_uid, ex)
+            else:
+                with self.__lock:
+                    self._imported.setdefault(peer_uid, {})[endpoint.uid] = \
+                        endpoint_dict
+
+    def __update_endpoint(self, peer_uid, endpoint_uid, properties):
+        """
+        Updates the properties of an imported end point
+
+        :param peer_uid: UID of the peer providing the service
+        :param endpoint_uid: UID of the end point
+        :param properties: New import properties of the end point
+        """
+        with self.__lock:
+            try:
+                self._imported[peer_uid][endpoint_uid]['properties'] = \
+                    properties
+            except KeyError:
+                pass
+
+        self._registry.update(endpoint_uid, properties)
+
+    def __remove_endpoint(self, peer_uid, endpoint_uid):
+        """
+        Removes an imported end point
+
+        :param peer_uid: UID of the peer providing the service
+        :param endpoint_uid: UID of the end point
+        """
+        with self.__lock:
+            try:
+                del self._imported[peer_uid][endpoint_uid]
+            except KeyError:
+                pass
+
+        self._registry.remove(endpoint_uid)
 
     @staticmethod
     def __filter_endpoints(peer, endpoints):
@@ -176,12 +287,176 @@ class HeraldDiscovery(object):
                 if endpoint.get_properties().get(PROP_TARGET_GROUP)
                 in accepted_groups)
 
+    def __local_dumps(self, peer):
+        """
+        Returns the descriptions of the local end points relevant to a peer
+
+        :param peer: A Peer bean
+        :return: A dictionary: end point UID -> (description, hash)
+        """
+        dumps = self._dump_endpoints(self.__filter_endpoints(
+            peer, self._dispatcher.get_endpoints()))
+        return dict((dump['uid'], (dump, endpoint_hash(dump)))
+                    for dump in dumps)
+
+    def __imported_hashes(self, peer_uid):
+        """
+        Returns the hashes of the end points imported from a peer
+
+        :param peer_uid: UID of a peer
+        :return: A dictionary: end point UID -> end point hash
+        """
+        with self.__lock:
+            imported = self._imported.get(peer_uid, {}).copy()
+
+        return dict((uid, endpoint_hash(dump))
+                    for uid, dump in imported.items())
+
+    def __send_hello(self, peer, full=False):
+        """
+        Sends the digest of our end points, and the hashes of the end points
+        we imported from the given peer
+
+        :param peer: A Peer bean
+        :param full: If True, ask for all the end points of the peer
+        """
+        local = self.__local_dumps(peer)
+        content = {
+            "digest": endpoints_digest(
+                dict((uid, hashed) for uid, (_, hashed) in local.items())),
+            "known": {} if full else self.__imported_hashes(peer.uid)}
+
+        with self.__lock:
+            self._hello_sent.add(peer.uid)
+        self._herald.fire(peer, beans.Message(self.__subject('hello'),
+                                              content))
+
+    def __make_sync(self, peer, known, ask):
+        """
+        Prepares the content of a "sync" message
+
+        :param peer: The Peer bean of the recipient
+        :param known: Hashes of our end points known by the peer
+        :param ask: If True, ask the peer for the end points we are missing
+        :return: The content of the message
+        """
+        local = self.__local_dumps(peer)
+        content = {
+            "digest": endpoints_digest(
+                dict((uid, hashed) for uid, (_, hashed) in local.items())),
+            "endpoints": [dump for uid, (dump, hashed) in local.items()
+                          if known.get(uid) != hashed],
+            "removed": [uid for uid in known if uid not in local],
+            "full": not known}
+        if ask:
+            content["known"] = self.__imported_hashes(peer.uid)
+        return content
+
+    def __handle_hello(self, herald_svc, message):
+        """
+        A peer sent us its digest and the hashes of our end points it knows:
+        reply with the end points it is missing
+
+        :param herald_svc: The Herald service
+        :param message: The "hello" message
+        """
+        peer = self._directory.get_peer(message.sender)
+        content = message.content
+
+        # Ask for the end points we are missing, unless our own "hello"
+        # message will give them to us
+        with self.__lock:
+            waiting = peer.uid in self._hello_sent
+        ask = not waiting and content.get('digest') != \
+            endpoints_digest(self.__imported_hashes(peer.uid))
+
+        herald_svc.reply(
+            message, self.__make_sync(peer, content.get('known') or {}, ask),
+            self.__subject('sync'))
+
+    def __handle_sync(self, herald_svc, message):
+        """
+        A peer sent us the end points we were missing
+
+        :param herald_svc: The Herald service
+        :param message: The "sync" message
+        """
+        peer_uid = message.sender
+        content = message.content
+        with self.__lock:
+            self._hello_sent.discard(peer_uid)
+
+        for endpoint_uid in content.get('removed') or ():
+            self.__remove_endpoint(peer_uid, endpoint_uid)
+
+        with self.__lock:
+            imported = set(self._imported.get(peer_uid, ()))
+
+        added = []
+        for dump in content.get('endpoints') or ():
+            if dump.get('uid') in imported:
+                # Known end point which has changed
+                self.__update_endpoint(peer_uid, dump['uid'],
+                                       dump.get('properties'))
+            else:
+                added.append(dump)
+        self.__register_endpoints(peer_uid, added)
+
+        peer = self._directory.get_peer(peer_uid)
+        if content.get('digest') != \
+                endpoints_digest(self.__imported_hashes(peer_uid)):
+            if content.get('full'):
+                _logger.warning("End points of %s differ from its digest",
+                                peer_uid)
+            else:
+                # Ask for all the end points of the peer
+                self.__send_hello(peer, True)
+
+        if 'known' in content:
+            # The peer asks for the end points it is missing
+            herald_svc.reply(
+                message, self.__make_sync(peer, content['known'], False),
+                self.__subject('sync'))
+
+    def __handle_batch(self, message):
+        """
+        A peer sent a batch of end point events
+
+        :param message: The "batch" message
+        """
+        peer_uid = message.sender
+        content = message.content
+        for endpoint_uid in content.get('remove') or ():
+            self.__remove_endpoint(peer_uid, endpoint_uid)
+
+        for update in content.get('update') or ():
+            self.__update_endpoint(peer_uid, update['uid'],
+                                   update['properties'])
+
+        self.__register_endpoints(peer_uid, content.get('add') or [])
+
     def herald_message(self, herald_svc, message):
         """
         An Herald message has been received
         """
         kind = message.subject.rsplit('/', 1)[1]
-        if kind == 'contact':
+        if kind in ('hello', 'sync', 'batch'):
+            if message.sender not in self._directory:
+                # We can't use the services of unknown peers
+                _logger.warning("Sender of '%s' is unknown: %s",
+                                kind, message.sender)
+                return
+
+            with self.__lock:
+                self._capable.add(message.sender)
+
+            if kind == 'hello':
+                self.__handle_hello(herald_svc, message)
+            elif kind == 'sync':
+                self.__handle_sync(herald_svc, message)
+            else:
+                self.__handle_batch(message)
+        elif kind == 'contact':
             # First contact
             # Check if we know the sending peer
             # # (peer discovery process)
@@ -209,29 +484,22 @@ class HeraldDiscovery(object):
             self.__register_endpoints(message.sender, message.content)
         elif kind == 'remove':
             # The message only contains the UID of the endpoint
-            self._registry.remove(message.content['uid'])
+            self.__remove_endpoint(message.sender, message.content['uid'])
         elif kind == 'update':
             # Update the endpoint
-            endpoint_uid = message.content['uid']
-            new_properties = message.content['properties']
-            self._registry.update(endpoint_uid, new_properties)
+            self.__update_endpoint(message.sender, message.content['uid'],
+                                   message.content['properties'])
         else:
             _logger.debug("Unknown kind of discovery event: %s", kind)
 
     def peer_registered(self, peer):
         """
-        A new peer has been registered in Herald: send it a contact information
+        A new peer has been registered in Herald: send it the digest of our
+        end points
 
         :param peer: The new peer
         """
-        # Select relevant endpoints
-        endpoints = self.__filter_endpoints(
-            peer, self._dispatcher.get_endpoints())
-
-        # Send a contact message, with our list of endpoints
-        endpoints = self._dump_endpoints(endpoints)
-        self._herald.fire(peer,
-                          beans.Message(self.__subject('contact'), endpoints))
+        self.__send_hello(peer)
 
     def peer_updated(self, peer, access_id, data, previous):
         """
@@ -245,30 +513,93 @@ class HeraldDiscovery(object):
 
         :param peer: The lost peer
         """
+        with self.__lock:
+            self._imported.pop(peer.uid, None)
+            self._capable.discard(peer.uid)
+            self._hello_sent.discard(peer.uid)
+
         self._registry.lost_framework(peer.uid)
 
-    def endpoints_added(self, endpoints):
+    def __queue(self, kind, endpoints):
         """
-        Multiple endpoints have been created
+        Stores events on local end points, to be sent in the next batch
 
+        :param kind: Kind of event ("add", "update" or "remove")
         :param endpoints: A list of ExportEndpoint beans
         """
-        # Segregate endpoints according to their target group name.
-        bins = {}
-        for ep in endpoints:
-            target_group = ep.get_properties() \
-                .get(PROP_TARGET_GROUP, DEFAULT_TARGET_GROUP)
-            bins.setdefault(target_group, []).append(ep)
-        # Send an add message per target group
-        for target_group, eps in bins.items():
+        with self.__lock:
+            for endpoint in endpoints:
+                group = endpoint.get_properties().get(PROP_TARGET_GROUP,
+                                                      DEFAULT_TARGET_GROUP)
+                events = self._pending.setdefault(
+                    group, {"add": {}, "update": {}, "remove": set()})
+                uid = endpoint.uid
+                if kind == "add":
+                    events["add"][uid] = endpoint
+                elif kind == "update":
+                    # Added end points will be sent with their latest
+                    # properties
+                    if uid not in events["add"]:
+                        events["update"][uid] = endpoint
+                else:
+                    events["update"].pop(uid, None)
+                    if events["add"].pop(uid, None) is None:
+                        # The end point has already been announced
+                        events["remove"].add(uid)
+
+            if self._delay and self._timer is None:
+                self._timer = threading.Timer(self._delay, self.__flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if not self._delay:
+            self.__flush()
+
+    def __flush(self):
+        """
+        Sends the pending end point events, one batch per target group
+        """
+        with self.__lock:
+            pending = self._pending
+            self._pending = {}
+            self._timer = None
+            capable = self._capable.copy()
+
+        for group, events in pending.items():
+            added = self._dump_endpoints(events["add"].values())
+            updated = [{"uid": endpoint.uid,
+                        "properties": endpoint.make_import_properties()}
+                       for endpoint in events["update"].values()]
+            removed = sorted(events["remove"])
             try:
-                self.__send_message('add', self._dump_endpoints(eps),
-                                    target_group)
+                peers = self._directory.get_peers_for_group(group)
+                if all(peer.uid in capable for peer in peers):
+                    self.__send_message(
+                        'batch', {"add": added, "update": updated,
+                                  "remove": removed}, group)
+                else:
+                    # Some peers only support the former protocol
+                    if added:
+                        self.__send_message('add', added, group)
+                    for update in updated:
+                        self.__send_message('update', update, group)
+                    for uid in removed:
+                        self.__send_message('remove', {"uid": uid}, group)
             except KeyError:
                 _logger.debug(
                     "Group %s does't exist. Peers may not be registered yet.",
-                    target_group
-                )
+                    group)
+            except Exception as ex:
+                _logger.error("Error sending end point events to %s: %s",
+                              group, ex)
+
+    def endpoints_added(self, endpoints):
+        """
+        Multiple endpoints have been created
+
+        :param endpoints: A list of ExportEndpoint beans
+        """
+        self.__queue("add", endpoints)
 
     def endpoint_updated(self, endpoint, _):
         """
@@ -277,18 +608,10 @@ class HeraldDiscovery(object):
         :param endpoint: An updated ExportEndpoint bean
         :param _: Previous value of the endpoint properties
         """
-        self.__send_message(
-            'update',
-            {"uid": endpoint.uid,
-             "properties": endpoint.make_import_properties()},
-            endpoint.get_properties().get(
-                PROP_TARGET_GROUP, DEFAULT_TARGET_GROUP))
+        self.__queue("update", [endpoint])
 
     def endpoint_removed(self, endpoint):
         """
         An endpoint has been removed
         """
-        self.__send_message(
-            'remove', {"uid": endpoint.uid},
-            endpoint.get_properties().get(
-                PROP_TARGET_GROUP, DEFAULT_TARGET_GROUP))
+        self.__queue("remove", [endpoint])
@@ -40,6 +40,7 @@ __docformat__ = "restructuredtext en"
 import herald.beans as beans
 import herald.remote
 import herald.remote.herald_jsonrpc as herald_jsonrpc
+import herald.remote.proxies as proxies
 
 # iPOPO decorators
 from pelix.ipopo.decorators import ComponentFactory, Requires, Validate, \
@@ -103,10 +104,15 @@ class JabsorbRpcDispatcher(herald_jsonrpc.JsonRpcDispatcher):
 @ComponentFactory(herald.remote.FACTORY_HERALD_JSONRPC_EXPORTER)
 @Requires('_directory', herald.SERVICE_DIRECTORY)
 # SERVICE_EXPORT_PROVIDER is provided by the parent class
-@Provides(herald.SERVICE_LISTENER)
+@Provides((herald.SERVICE_LISTENER, herald.remote.SERVICE_RPC_STATS))
 @Property('_filters', herald.PROP_FILTERS, [SUBJECT_REQUEST])
 @Property('_kinds', pelix.remote.PROP_REMOTE_CONFIGS_SUPPORTED,
           (HERALDRPC_CONFIGURATION,))
+@Property('_batch_threads', herald.remote.PROP_BATCH_THREADS, 0)
+@Property('_nb_threads', herald.remote.PROP_EXPORTER_THREADS,
+          herald.remote.DEFAULT_EXPORTER_THREADS)
+@Property('_max_concurrency', herald.remote.PROP_SERVICE_CONCURRENCY,
+          herald.remote.DEFAULT_SERVICE_CONCURRENCY)
 @Instantiate('herald-rpc-exporter-jsonrpc')
 class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
     """
@@ -128,8 +134,17 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         # Handled configurations
         self._kinds = None
 
-        # Dispatcher
+        # Number of threads executing batches
+        self._batch_threads = 0
+
+        # Requests execution configuration
+        self._nb_threads = herald.remote.DEFAULT_EXPORTER_THREADS
+        self._max_concurrency = herald.remote.DEFAULT_SERVICE_CONCURRENCY
+        self._executor = None
+
+        # Dispatcher and its batch thread pool
         self._dispatcher = None
+        self._pool = None
 
     def make_endpoint_properties(self, svc_ref, name, fw_uid):
         """
@@ -140,8 +155,10 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         :param fw_uid: Framework UID
         :return: A dictionary of extra endpoint properties
         """
-        return {PROP_HERALDRPC_PEER: self._directory.local_uid,
-                PROP_HERALDRPC_SUBJECT: SUBJECT_REQUEST}
+        properties = proxies.cache_properties(svc_ref)
+        properties.update({PROP_HERALDRPC_PEER: self._directory.local_uid,
+                           PROP_HERALDRPC_SUBJECT: SUBJECT_REQUEST})
+        return properties
 
     @Validate
     def validate(self, context):
@@ -152,7 +169,13 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         super(HeraldRpcServiceExporter, self).validate(context)
 
         # Setup the dispatcher (use JSON-RPC ones)
-        self._dispatcher = JabsorbRpcDispatcher(self.dispatch)
+        self._pool = proxies.make_batch_pool(self._batch_threads,
+                                                    __name__)
+        self._executor = proxies.RequestExecutor(
+            self._nb_threads, self._max_concurrency, __name__)
+        self._dispatcher = JabsorbRpcDispatcher(
+            self._executor.timed(self.dispatch), pool=self._pool)
+        self._executor.start()
 
     @Invalidate
     def invalidate(self, context):
@@ -163,11 +186,43 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         super(HeraldRpcServiceExporter, self).invalidate(context)
 
         # Clean up
+        self._executor.stop()
+        self._executor = None
         self._dispatcher = None
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
 
     def herald_message(self, herald_svc, message):
         """
-        Received a message from Herald
+        Received a message from Herald: executes the request in the thread
+        pool, unless the services it calls are saturated
+
+        :param herald_svc: The Herald service
+        :param message: A message bean
+        """
+        endpoints = set()
+        if self._executor.limited:
+            try:
+                request = jsonrpclib.loads(message.content)
+                endpoints = herald_jsonrpc.request_endpoints(request)
+            except Exception:
+                # Let the dispatcher reply to the invalid request
+                pass
+
+            if not self._executor.acquire(endpoints):
+                _logger.warning("Request refused, saturated services: %s",
+                                ', '.join(sorted(endpoints)))
+                herald_svc.reply(
+                    message, herald_jsonrpc.busy_response(request, endpoints),
+                    SUBJECT_REPLY)
+                return
+
+        self._executor.execute(endpoints, self.__handle, herald_svc, message)
+
+    def __handle(self, herald_svc, message):
+        """
+        Executes a request and replies to it
 
         :param herald_svc: The Herald service
         :param message: A message bean
@@ -175,6 +230,17 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         result = self._dispatcher.dispatch(message.content)
         herald_svc.reply(message, jabsorb.to_jabsorb(result), SUBJECT_REPLY)
 
+    def get_stats(self):
+        """
+        Returns the execution statistics of the exported methods
+
+        :return: A dictionary (see RequestExecutor.get_stats()), with the
+                 handled configurations ("configurations")
+        """
+        stats = self._executor.get_stats()
+        stats["configurations"] = tuple(self._kinds or ())
+        return stats
+
 # ------------------------------------------------------------------------------
 
 
@@ -182,7 +248,8 @@ class _JsonRpcEndpointProxy(object):
     """
     Proxy to use JSON-RPC over Herald
     """
-    def __init__(self, name, peer, subject, send_method):
+    def __init__(self, name, peer, subject, send_method, post_method,
+                 results=None):
         """
         Sets up the endpoint proxy
 
@@ -190,11 +257,15 @@ class _JsonRpcEndpointProxy(object):
         :param peer: UID of the peer to contact
         :param subject: Subject to use for RPC
         :param send_method: Method to use to send a request
+        :param post_method: Method to use to post a request
+        :param results: The ResultCache of the end point (optional)
         """
         self.__name = name
         self.__peer = peer
         self.__subject = subject
         self.__send = send_method
+        self.__post = post_method
+        self.__results = results
         self.__cache = {}
 
     def __getattr__(self, name):
@@ -203,14 +274,46 @@ class _JsonRpcEndpointProxy(object):
         """
         return self.__cache.setdefault(
             name, _JsonRpcMethod("{0}.{1}".format(self.__name, name),
-                                 self.__peer, self.__subject, self.__send))
+                                 self.__peer, self.__subject, self.__send,
+                                 self.__post, self.__results))
+
+    def batch_(self):
+        """
+        Prepares a batch of calls, sent in a single message
+
+        :return: A batch object
+        """
+        return _JabsorbRpcBatch(self.__name, self.__peer, self.__subject,
+                                self.__send)
+
+
+class _JabsorbRpcBatch(herald_jsonrpc.JsonRpcBatch):
+    """
+    Sends calls as a JSON-RPC 2.0 batch, with Jabsorb conversions
+    """
+    def _parse(self, content):
+        """
+        Parses the content of a reply
+        """
+        return jabsorb.from_jabsorb(jsonrpclib.loads(content))
+
+    def _marshal(self, calls):
+        """
+        Prepares the content of the batch request
+        """
+        return super(_JabsorbRpcBatch, self)._marshal(
+            [(name, [jabsorb.to_jabsorb(arg) for arg in args],
+              dict((key, jabsorb.to_jabsorb(value))
+                   for key, value in kwargs.items()))
+             for name, args, kwargs in calls])
 
 
 class _JsonRpcMethod(object):
     """
     Represents a method in a call proxy
     """
-    def __init__(self, method_name, peer, subject, send_method):
+    def __init__(self, method_name, peer, subject, send_method, post_method,
+                 results=None):
         """
         Sets up the method
 
@@ -218,40 +321,78 @@ class _JsonRpcMethod(object):
         :param peer: UID of the peer to contact
         :param subject: Subject to use for RPC
         :param send_method: Method to use to send a request
+        :param post_method: Method to use to post a request
+        :param results: The ResultCache of the end point (optional)
         """
         self.__name = method_name
+        self.__method = method_name.rsplit('.', 1)[-1]
         self.__peer = peer
         self.__subject = subject
         self.__send = send_method
+        self.__post = post_method
+        self.__results = results
 
-    def __call__(self, *args, **kwargs):
+    def __make_request(self, *args, **kwargs):
         """
-        Method is being called
+        Forges the request content
         """
-        # Forge the request
         if args:
             args = [jabsorb.to_jabsorb(arg) for arg in args]
         elif kwargs:
             kwargs = {key: jabsorb.to_jabsorb(value)
                       for key, value in kwargs.items()}
 
-        request = jsonrpclib.dumps(args or kwargs,
-                                   self.__name, encoding='utf-8')
-
-        # Send it
-        reply_message = self.__send(self.__peer, self.__subject, request)
+        return jsonrpclib.dumps(args or kwargs,
+                                self.__name, encoding='utf-8')
 
-        # Parse the reply and check for errors
+    @staticmethod
+    def __parse_reply(reply_message):
+        """
+        Parses the reply message, raising the error of the call
+        """
         result = jabsorb.from_jabsorb(jsonrpclib.loads(reply_message.content))
         jsonrpclib.jsonrpc.check_for_errors(result)
         return result['result']
 
+    def __call__(self, *args, **kwargs):
+        """
+        Method is being called: the result might come from the cache of the
+        end point
+        """
+        if self.__results is None:
+            return self.__invoke(*args, **kwargs)
+
+        return self.__results.call(self.__method, self.__invoke, args, kwargs)
+
+    def __invoke(self, *args, **kwargs):
+        """
+        Calls the remote method
+        """
+        # Send the request and wait for the reply
+        reply_message = self.__send(self.__peer, self.__subject,
+                                    self.__make_request(*args, **kwargs))
+        return self.__parse_reply(reply_message)
+
+    def async_(self, *args, **kwargs):
+        """
+        Calls the method without waiting for its result
+
+        :return: A Future object, giving the result of the call
+        """
+        return self.__post(self.__peer, self.__subject,
+                           self.__make_request(*args, **kwargs),
+                           self.__parse_reply)
+
 
 @ComponentFactory(herald.remote.FACTORY_HERALD_JSONRPC_IMPORTER)
 @Requires('_herald', herald.SERVICE_HERALD)
 @Provides(pelix.remote.SERVICE_IMPORT_ENDPOINT_LISTENER)
 @Property('_kinds', pelix.remote.PROP_REMOTE_CONFIGS_SUPPORTED,
           (HERALDRPC_CONFIGURATION,))
+@Property('_timeout', herald.remote.PROP_RPC_TIMEOUT,
+          herald.remote.DEFAULT_RPC_TIMEOUT)
+@Property('_cache_size', herald.remote.PROP_CACHE_SIZE,
+          herald.remote.DEFAULT_CACHE_SIZE)
 @Instantiate('herald-rpc-importer-jsonrpc')
 class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
     """
@@ -269,6 +410,37 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
 
         # Component properties
         self._kinds = None
+        self._timeout = herald.remote.DEFAULT_RPC_TIMEOUT
+        self._cache_size = herald.remote.DEFAULT_CACHE_SIZE
+
+        # Asynchronous calls handler
+        self._poster = None
+
+        # End point UID -> ResultCache
+        self._results = {}
+
+    @Validate
+    def validate(self, context):
+        """
+        Component validated
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).validate(context)
+
+        self._poster = proxies.AsyncPoster(
+            self._herald, float(self._timeout or 0), __name__)
+        self._poster.start()
+
+    @Invalidate
+    def invalidate(self, context):
+        """
+        Component invalidated
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).invalidate(context)
+
+        self._poster.stop()
+        self._poster = None
 
     def __call(self, peer, subject, content):
         """
@@ -276,6 +448,14 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
         """
         return self._herald.send(peer, beans.Message(subject, content))
 
+    def __post(self, peer, subject, content, parse_method):
+        """
+        Method called by the proxy to post a message over Herald
+
+        :return: A Future object
+        """
+        return self._poster.post(peer, subject, content, parse_method)
+
     def make_service_proxy(self, endpoint):
         """
         Creates the proxy for the given ImportEndpoint
@@ -297,9 +477,35 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
                             endpoint)
             return
 
+        # Prepare the cache of the results of cacheable methods
+        results = self._results[endpoint.uid] = proxies.ResultCache(
+            endpoint.properties.get(herald.remote.PROP_CACHE_TTL),
+            self._cache_size)
+
         # Return the proxy
         return _JsonRpcEndpointProxy(endpoint.name, peer_uid, subject,
-                                     self.__call)
+                                     self.__call, self.__post, results)
+
+    def endpoint_updated(self, endpoint, old_properties):
+        """
+        An end point has been updated: forget the cached results of its
+        methods
+
+        :param endpoint: The updated ImportEndpoint bean
+        :param old_properties: Previous properties of the end point
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).endpoint_updated(
+            endpoint, old_properties)
+
+        try:
+            results = self._results[endpoint.uid]
+        except KeyError:
+            # Unknown end point
+            pass
+        else:
+            results.reset(
+                endpoint.properties.get(herald.remote.PROP_CACHE_TTL) or {})
 
     def clear_service_proxy(self, endpoint):
         """
@@ -307,5 +513,6 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
 
         :param endpoint: An ImportEndpoint bean
         """
-        # Nothing to do
-        return
+        results = self._results.pop(endpoint.uid, None)
+        if results is not None:
+            results.reset()
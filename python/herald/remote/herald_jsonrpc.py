@@ -39,6 +39,7 @@ __docformat__ = "restructuredtext en"
 # Herald
 import herald.beans as beans
 import herald.remote
+import herald.remote.proxies as proxies
 
 # iPOPO decorators
 from pelix.ipopo.decorators import ComponentFactory, Requires, Validate, \
@@ -77,15 +78,55 @@ _logger = logging.getLogger(__name__)
 # ------------------------------------------------------------------------------
 
 
+def request_endpoints(request):
+    """
+    Returns the names of the end points called by a JSON-RPC request
+
+    :param request: A parsed JSON-RPC request (dictionary or batch list)
+    :return: A set of end point names
+    """
+    if not isinstance(request, (list, tuple)):
+        request = [request]
+
+    return set(proxies.endpoint_of(entry['method']) for entry in request
+               if isinstance(entry, dict) and 'method' in entry)
+
+
+def busy_response(request, endpoints):
+    """
+    Prepares the response to a request refused due to saturated services
+
+    :param request: The parsed JSON-RPC request (dictionary or batch list)
+    :param endpoints: Names of the saturated end points
+    :return: The JSON-RPC response string
+    """
+    fault = jsonrpclib.jsonrpc.Fault(
+        herald.remote.ERROR_SERVICE_BUSY,
+        "Service busy: {0}".format(', '.join(sorted(endpoints))))
+    if isinstance(request, (list, tuple)):
+        return jsonrpclib.jdumps([fault.dump(rpcid=entry.get('id'))
+                                  for entry in request
+                                  if isinstance(entry, dict)])
+
+    return fault.response(rpcid=request.get('id'))
+
+# ------------------------------------------------------------------------------
+
+
 class JsonRpcDispatcher(SimpleJSONRPCDispatcher):
     """
     A JSON-RPC dispatcher with a custom dispatch method
 
     Calls the dispatch method given in the constructor
     """
-    def __init__(self, dispatch_method, encoding=None):
+    def __init__(self, dispatch_method, encoding=None, pool=None):
         """
         Sets up the servlet
+
+        :param dispatch_method: Method called to execute a request
+        :param encoding: Encoding of requests
+        :param pool: Thread pool used to execute the calls of a batch in
+                     parallel (optional)
         """
         SimpleJSONRPCDispatcher.__init__(self, encoding=encoding)
 
@@ -95,6 +136,9 @@ class JsonRpcDispatcher(SimpleJSONRPCDispatcher):
         # Make a link to the dispatch method
         self._dispatch_method = dispatch_method
 
+        # Batch thread pool
+        self._pool = pool
+
     def _simple_dispatch(self, name, params):
         """
         Dispatch method
@@ -116,6 +160,36 @@ class JsonRpcDispatcher(SimpleJSONRPCDispatcher):
         # in case of error
         return self._dispatch_method(name, params)
 
+    def _unmarshaled_dispatch(self, request, dispatch_method=None):
+        """
+        Executes the calls of a batch in parallel, if a thread pool is given
+
+        :param request: JSON-RPC request dictionary (or list of)
+        :param dispatch_method: Custom dispatch method
+        :return: A JSON-RPC dictionary (or list of) or None if the request
+                 was a notification
+        """
+        parent = super(JsonRpcDispatcher, self)._unmarshaled_dispatch
+        if self._pool is None or not isinstance(request, list) \
+                or len(request) < 2:
+            return parent(request, dispatch_method)
+
+        # Invalid entries are given as a batch, to get the error response
+        futures = [self._pool.enqueue(
+            parent, entry if isinstance(entry, dict) else [entry],
+            dispatch_method) for entry in request]
+
+        responses = []
+        for future in futures:
+            response = future.result()
+            if isinstance(response, list):
+                responses.extend(response)
+            elif response is not None:
+                responses.append(response)
+
+        # Only notifications: no response
+        return responses or None
+
     def dispatch(self, data):
         """
         Handles a HTTP POST request
@@ -130,10 +204,15 @@ class JsonRpcDispatcher(SimpleJSONRPCDispatcher):
 @ComponentFactory(herald.remote.FACTORY_HERALD_JSONRPC_EXPORTER)
 @Requires('_directory', herald.SERVICE_DIRECTORY)
 # SERVICE_EXPORT_PROVIDER is provided by the parent class
-@Provides(herald.SERVICE_LISTENER)
+@Provides((herald.SERVICE_LISTENER, herald.remote.SERVICE_RPC_STATS))
 @Property('_filters', herald.PROP_FILTERS, [SUBJECT_REQUEST])
 @Property('_kinds', pelix.remote.PROP_REMOTE_CONFIGS_SUPPORTED,
           (HERALDRPC_CONFIGURATION,))
+@Property('_batch_threads', herald.remote.PROP_BATCH_THREADS, 0)
+@Property('_nb_threads', herald.remote.PROP_EXPORTER_THREADS,
+          herald.remote.DEFAULT_EXPORTER_THREADS)
+@Property('_max_concurrency', herald.remote.PROP_SERVICE_CONCURRENCY,
+          herald.remote.DEFAULT_SERVICE_CONCURRENCY)
 @Instantiate('herald-rpc-exporter-jsonrpc')
 class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
     """
@@ -155,8 +234,17 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         # Handled configurations
         self._kinds = None
 
-        # Dispatcher
+        # Number of threads executing batches
+        self._batch_threads = 0
+
+        # Requests execution configuration
+        self._nb_threads = herald.remote.DEFAULT_EXPORTER_THREADS
+        self._max_concurrency = herald.remote.DEFAULT_SERVICE_CONCURRENCY
+        self._executor = None
+
+        # Dispatcher and its batch thread pool
         self._dispatcher = None
+        self._pool = None
 
     def make_endpoint_properties(self, svc_ref, name, fw_uid):
         """
@@ -167,8 +255,10 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         :param fw_uid: Framework UID
         :return: A dictionary of extra endpoint properties
         """
-        return {PROP_HERALDRPC_PEER: self._directory.local_uid,
-                PROP_HERALDRPC_SUBJECT: SUBJECT_REQUEST}
+        properties = proxies.cache_properties(svc_ref)
+        properties.update({PROP_HERALDRPC_PEER: self._directory.local_uid,
+                           PROP_HERALDRPC_SUBJECT: SUBJECT_REQUEST})
+        return properties
 
     @Validate
     def validate(self, context):
@@ -179,7 +269,12 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         super(HeraldRpcServiceExporter, self).validate(context)
 
         # Setup the dispatcher
-        self._dispatcher = JsonRpcDispatcher(self.dispatch)
+        self._pool = proxies.make_batch_pool(self._batch_threads, __name__)
+        self._executor = proxies.RequestExecutor(
+            self._nb_threads, self._max_concurrency, __name__)
+        self._dispatcher = JsonRpcDispatcher(
+            self._executor.timed(self.dispatch), pool=self._pool)
+        self._executor.start()
 
     @Invalidate
     def invalidate(self, context):
@@ -190,11 +285,42 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         super(HeraldRpcServiceExporter, self).invalidate(context)
 
         # Clean up
+        self._executor.stop()
+        self._executor = None
         self._dispatcher = None
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
 
     def herald_message(self, herald_svc, message):
         """
-        Received a message from Herald
+        Received a message from Herald: executes the request in the thread
+        pool, unless the services it calls are saturated
+
+        :param herald_svc: The Herald service
+        :param message: A message bean
+        """
+        endpoints = set()
+        if self._executor.limited:
+            try:
+                request = jsonrpclib.loads(message.content)
+                endpoints = request_endpoints(request)
+            except Exception:
+                # Let the dispatcher reply to the invalid request
+                pass
+
+            if not self._executor.acquire(endpoints):
+                _logger.warning("Request refused, saturated services: %s",
+                                ', '.join(sorted(endpoints)))
+                herald_svc.reply(message, busy_response(request, endpoints),
+                                 SUBJECT_REPLY)
+                return
+
+        self._executor.execute(endpoints, self.__handle, herald_svc, message)
+
+    def __handle(self, herald_svc, message):
+        """
+        Executes a request and replies to it
 
         :param herald_svc: The Herald service
         :param message: A message bean
@@ -202,6 +328,17 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         result = self._dispatcher.dispatch(message.content)
         herald_svc.reply(message, result, SUBJECT_REPLY)
 
+    def get_stats(self):
+        """
+        Returns the execution statistics of the exported methods
+
+        :return: A dictionary (see RequestExecutor.get_stats()), with the
+                 handled configurations ("configurations")
+        """
+        stats = self._executor.get_stats()
+        stats["configurations"] = tuple(self._kinds or ())
+        return stats
+
 # ------------------------------------------------------------------------------
 
 
@@ -209,7 +346,8 @@ class _JsonRpcEndpointProxy(object):
     """
     Proxy to use JSON-RPC over Herald
     """
-    def __init__(self, name, peer, subject, send_method):
+    def __init__(self, name, peer, subject, send_method, post_method,
+                 results=None):
         """
         Sets up the endpoint proxy
 
@@ -217,11 +355,15 @@ class _JsonRpcEndpointProxy(object):
         :param peer: UID of the peer to contact
         :param subject: Subject to use for RPC
         :param send_method: Method to use to send a request
+        :param post_method: Method to use to post a request
+        :param results: The ResultCache of the end point (optional)
         """
         self.__name = name
         self.__peer = peer
         self.__subject = subject
         self.__send = send_method
+        self.__post = post_method
+        self.__results = results
         self.__cache = {}
 
     def __getattr__(self, name):
@@ -230,14 +372,92 @@ class _JsonRpcEndpointProxy(object):
         """
         return self.__cache.setdefault(
             name, _JsonRpcMethod("{0}.{1}".format(self.__name, name),
-                                 self.__peer, self.__subject, self.__send))
+                                 self.__peer, self.__subject, self.__send,
+                                 self.__post, self.__results))
+
+    def batch_(self):
+        """
+        Prepares a batch of calls, sent in a single message
+
+        :return: A batch object
+        """
+        return JsonRpcBatch(self.__name, self.__peer, self.__subject,
+                            self.__send)
+
+
+class JsonRpcBatch(proxies.RpcBatch):
+    """
+    Sends calls as a JSON-RPC 2.0 batch
+    """
+    def _parse(self, content):
+        """
+        Parses the content of a reply
+
+        :param content: Reply message content
+        :return: The parsed reply
+        """
+        return jsonrpclib.loads(content)
+
+    def _check_call(self, method_name, args, kwargs):
+        """
+        JSON-RPC parameters are either positional or named
+        """
+        if args and kwargs:
+            raise TypeError("{0}: can't use both positional and keyword "
+                            "arguments in JSON-RPC".format(method_name))
+
+    def _marshal(self, calls):
+        """
+        Prepares the content of the batch request
+        """
+        return jsonrpclib.jdumps(
+            [jsonrpclib.jsonrpc.dump(args or kwargs, name, rpcid=index,
+                                     version=2.0)
+             for index, (name, args, kwargs) in enumerate(calls)])
+
+    def _unmarshal(self, content, count):
+        """
+        Parses the content of the batch reply
+        """
+        responses = self._parse(content)
+        if not isinstance(responses, (list, tuple)):
+            # Error concerning the whole batch
+            try:
+                jsonrpclib.jsonrpc.check_for_errors(responses)
+                error = ValueError("Invalid batch response")
+            except Exception as ex:
+                error = ex
+            return [(False, error)] * count
+
+        results = [(False, ValueError("No response to call"))] * count
+        for position, response in enumerate(responses):
+            try:
+                index = int(response["id"])
+                if not 0 <= index < count:
+                    raise ValueError
+            except (KeyError, TypeError, ValueError):
+                # Errors can lack the call ID: responses are sent in the
+                # order of the calls
+                index = position
+
+            if index >= count:
+                # Unknown call
+                continue
+
+            try:
+                jsonrpclib.jsonrpc.check_for_errors(response)
+                results[index] = (True, response["result"])
+            except Exception as ex:
+                results[index] = (False, ex)
+        return results
 
 
 class _JsonRpcMethod(object):
     """
     Represents a method in a call proxy
     """
-    def __init__(self, method_name, peer, subject, send_method):
+    def __init__(self, method_name, peer, subject, send_method, post_method,
+                 results=None):
         """
         Sets up the method
 
@@ -245,33 +465,70 @@ class _JsonRpcMethod(object):
         :param peer: UID of the peer to contact
         :param subject: Subject to use for RPC
         :param send_method: Method to use to send a request
+        :param post_method: Method to use to post a request
+        :param results: The ResultCache of the end point (optional)
         """
         self.__name = method_name
+        self.__method = method_name.rsplit('.', 1)[-1]
         self.__peer = peer
         self.__subject = subject
         self.__send = send_method
+        self.__post = post_method
+        self.__results = results
 
-    def __call__(self, *args):
+    def __make_request(self, *args):
         """
-        Method is being called
+        Forges the request content
         """
-        # Forge the request
-        request = jsonrpclib.dumps(args, self.__name, encoding='utf-8')
-
-        # Send it
-        reply_message = self.__send(self.__peer, self.__subject, request)
+        return jsonrpclib.dumps(args, self.__name, encoding='utf-8')
 
-        # Parse the reply and check for errors
+    @staticmethod
+    def __parse_reply(reply_message):
+        """
+        Parses the reply message, raising the error of the call
+        """
         result = jsonrpclib.loads(reply_message.content)
         jsonrpclib.jsonrpc.check_for_errors(result)
         return result['result']
 
+    def __call__(self, *args):
+        """
+        Method is being called: the result might come from the cache of the
+        end point
+        """
+        if self.__results is None:
+            return self.__invoke(*args)
+
+        return self.__results.call(self.__method, self.__invoke, args)
+
+    def __invoke(self, *args):
+        """
+        Calls the remote method
+        """
+        # Send the request and wait for the reply
+        reply_message = self.__send(self.__peer, self.__subject,
+                                    self.__make_request(*args))
+        return self.__parse_reply(reply_message)
+
+    def async_(self, *args):
+        """
+        Calls the method without waiting for its result
+
+        :return: A Future object, giving the result of the call
+        """
+        return self.__post(self.__peer, self.__subject,
+                           self.__make_request(*args), self.__parse_reply)
+
 
 @ComponentFactory(herald.remote.FACTORY_HERALD_JSONRPC_IMPORTER)
 @Requires('_herald', herald.SERVICE_HERALD)
 @Provides(pelix.remote.SERVICE_IMPORT_ENDPOINT_LISTENER)
 @Property('_kinds', pelix.remote.PROP_REMOTE_CONFIGS_SUPPORTED,
           (HERALDRPC_CONFIGURATION,))
+@Property('_timeout', herald.remote.PROP_RPC_TIMEOUT,
+          herald.remote.DEFAULT_RPC_TIMEOUT)
+@Property('_cache_size', herald.remote.PROP_CACHE_SIZE,
+          herald.remote.DEFAULT_CACHE_SIZE)
 @Instantiate('herald-rpc-importer-jsonrpc')
 class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
     """
@@ -289,6 +546,37 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
 
         # Component properties
         self._kinds = None
+        self._timeout = herald.remote.DEFAULT_RPC_TIMEOUT
+        self._cache_size = herald.remote.DEFAULT_CACHE_SIZE
+
+        # Asynchronous calls handler
+        self._poster = None
+
+        # End point UID -> ResultCache
+        self._results = {}
+
+    @Validate
+    def validate(self, context):
+        """
+        Component validated
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).validate(context)
+
+        self._poster = proxies.AsyncPoster(
+            self._herald, float(self._timeout or 0), __name__)
+        self._poster.start()
+
+    @Invalidate
+    def invalidate(self, context):
+        """
+        Component invalidated
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).invalidate(context)
+
+        self._poster.stop()
+        self._poster = None
 
     def __call(self, peer, subject, content):
         """
@@ -296,6 +584,14 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
         """
         return self._herald.send(peer, beans.Message(subject, content))
 
+    def __post(self, peer, subject, content, parse_method):
+        """
+        Method called by the proxy to post a message over Herald
+
+        :return: A Future object
+        """
+        return self._poster.post(peer, subject, content, parse_method)
+
     def make_service_proxy(self, endpoint):
         """
         Creates the proxy for the given ImportEndpoint
@@ -317,9 +613,35 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
                             endpoint)
             return
 
+        # Prepare the cache of the results of cacheable methods
+        results = self._results[endpoint.uid] = proxies.ResultCache(
+            endpoint.properties.get(herald.remote.PROP_CACHE_TTL),
+            self._cache_size)
+
         # Return the proxy
         return _JsonRpcEndpointProxy(endpoint.name, peer_uid, subject,
-                                     self.__call)
+                                     self.__call, self.__post, results)
+
+    def endpoint_updated(self, endpoint, old_properties):
+        """
+        An end point has been updated: forget the cached results of its
+        methods
+
+        :param endpoint: The updated ImportEndpoint bean
+        :param old_properties: Previous properties of the end point
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).endpoint_updated(
+            endpoint, old_properties)
+
+        try:
+            results = self._results[endpoint.uid]
+        except KeyError:
+            # Unknown end point
+            pass
+        else:
+            results.reset(
+                endpoint.properties.get(herald.remote.PROP_CACHE_TTL) or {})
 
     def clear_service_proxy(self, endpoint):
         """
@@ -327,5 +649,6 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
 
         :param endpoint: An ImportEndpoint bean
         """
-        # Nothing to do
-        return
+        results = self._results.pop(endpoint.uid, None)
+        if results is not None:
+            results.reset()
@@ -38,6 +38,7 @@ __docformat__ = "restructuredtext en"
 # Herald
 import herald.beans as beans
 import herald.remote
+import herald.remote.proxies as proxies
 
 # iPOPO decorators
 from pelix.ipopo.decorators import ComponentFactory, Requires, Validate, \
@@ -84,25 +85,89 @@ _logger = logging.getLogger(__name__)
 # ------------------------------------------------------------------------------
 
 
+def _request_endpoints(data):
+    """
+    Returns the names of the end points called by a XML-RPC request
+
+    :param data: The XML-RPC request string
+    :return: A set of end point names
+    """
+    params, method = xmlrpclib.loads(data)
+    if method == 'system.multicall':
+        return set(proxies.endpoint_of(call['methodName'])
+                   for call in params[0])
+
+    return set((proxies.endpoint_of(method),))
+
+
+def _busy_response(endpoints):
+    """
+    Prepares the response to a request refused due to saturated services
+
+    :param endpoints: Names of the saturated end points
+    :return: The XML-RPC response string
+    """
+    fault = xmlrpclib.Fault(
+        herald.remote.ERROR_SERVICE_BUSY,
+        "Service busy: {0}".format(', '.join(sorted(endpoints))))
+    return xmlrpclib.dumps(fault, methodresponse=True, encoding='utf-8',
+                           allow_none=True)
+
+# ------------------------------------------------------------------------------
+
+
 class _XmlRpcDispatcher(SimpleXMLRPCDispatcher):
     """
     A XML-RPC dispatcher with a custom dispatch method
 
     Calls the dispatch method given in the constructor
     """
-    def __init__(self, dispatch_method, encoding=None):
+    def __init__(self, dispatch_method, encoding=None, pool=None):
         """
         Sets up the servlet
+
+        :param dispatch_method: Method called to execute a request
+        :param encoding: Encoding of requests
+        :param pool: Thread pool used to execute the calls of a multicall in
+                     parallel (optional)
         """
         SimpleXMLRPCDispatcher.__init__(self, allow_none=True,
                                         encoding=encoding)
 
         # Register the system.* functions
         self.register_introspection_functions()
+        self.register_multicall_functions()
 
         # Make a link to the dispatch method
         self._dispatch_method = dispatch_method
 
+        # Multicall thread pool
+        self._pool = pool
+
+    def _dispatch(self, method, params):
+        """
+        Dispatches the calls of a multicall
+        """
+        return self._simple_dispatch(method, params)
+
+    def system_multicall(self, call_list):
+        """
+        Executes the calls of a multicall, in parallel if a thread pool is
+        given
+
+        :param call_list: A list of call dictionaries
+        :return: The list of results
+        """
+        if self._pool is None or len(call_list) < 2:
+            return SimpleXMLRPCDispatcher.system_multicall(self, call_list)
+
+        futures = [self._pool.enqueue(SimpleXMLRPCDispatcher.system_multicall,
+                                      self, [call]) for call in call_list]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
     def _simple_dispatch(self, name, params):
         """
         Dispatch method
@@ -132,10 +197,15 @@ class _XmlRpcDispatcher(SimpleXMLRPCDispatcher):
 @ComponentFactory(herald.remote.FACTORY_HERALD_XMLRPC_EXPORTER)
 @Requires('_directory', herald.SERVICE_DIRECTORY)
 # SERVICE_EXPORT_PROVIDER is provided by the parent class
-@Provides(herald.SERVICE_LISTENER)
+@Provides((herald.SERVICE_LISTENER, herald.remote.SERVICE_RPC_STATS))
 @Property('_filters', herald.PROP_FILTERS, [SUBJECT_REQUEST])
 @Property('_kinds', pelix.remote.PROP_REMOTE_CONFIGS_SUPPORTED,
           (HERALDRPC_CONFIGURATION,))
+@Property('_batch_threads', herald.remote.PROP_BATCH_THREADS, 0)
+@Property('_nb_threads', herald.remote.PROP_EXPORTER_THREADS,
+          herald.remote.DEFAULT_EXPORTER_THREADS)
+@Property('_max_concurrency', herald.remote.PROP_SERVICE_CONCURRENCY,
+          herald.remote.DEFAULT_SERVICE_CONCURRENCY)
 @Instantiate('herald-rpc-exporter-xmlrpc')
 class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
     """
@@ -157,8 +227,17 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         # Handled configurations
         self._kinds = None
 
-        # Dispatcher
+        # Number of threads executing multicalls
+        self._batch_threads = 0
+
+        # Requests execution configuration
+        self._nb_threads = herald.remote.DEFAULT_EXPORTER_THREADS
+        self._max_concurrency = herald.remote.DEFAULT_SERVICE_CONCURRENCY
+        self._executor = None
+
+        # Dispatcher and its multicall thread pool
         self._dispatcher = None
+        self._pool = None
 
     def make_endpoint_properties(self, svc_ref, name, fw_uid):
         """
@@ -169,8 +248,10 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         :param fw_uid: Framework UID
         :return: A dictionary of extra endpoint properties
         """
-        return {PROP_HERALDRPC_PEER: self._directory.local_uid,
-                PROP_HERALDRPC_SUBJECT: SUBJECT_REQUEST}
+        properties = proxies.cache_properties(svc_ref)
+        properties.update({PROP_HERALDRPC_PEER: self._directory.local_uid,
+                           PROP_HERALDRPC_SUBJECT: SUBJECT_REQUEST})
+        return properties
 
     @Validate
     def validate(self, context):
@@ -181,7 +262,13 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         super(HeraldRpcServiceExporter, self).validate(context)
 
         # Setup the dispatcher
-        self._dispatcher = _XmlRpcDispatcher(self.dispatch)
+        self._pool = proxies.make_batch_pool(self._batch_threads,
+                                             __name__)
+        self._executor = proxies.RequestExecutor(
+            self._nb_threads, self._max_concurrency, __name__)
+        self._dispatcher = _XmlRpcDispatcher(
+            self._executor.timed(self.dispatch), pool=self._pool)
+        self._executor.start()
 
     @Invalidate
     def invalidate(self, context):
@@ -192,11 +279,41 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         super(HeraldRpcServiceExporter, self).invalidate(context)
 
         # Clean up
+        self._executor.stop()
+        self._executor = None
         self._dispatcher = None
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
 
     def herald_message(self, herald_svc, message):
         """
-        Received a message from Herald
+        Received a message from Herald: executes the request in the thread
+        pool, unless the services it calls are saturated
+
+        :param herald_svc: The Herald service
+        :param message: A message bean
+        """
+        endpoints = set()
+        if self._executor.limited:
+            try:
+                endpoints = _request_endpoints(message.content)
+            except Exception:
+                # Let the dispatcher reply to the invalid request
+                pass
+
+            if not self._executor.acquire(endpoints):
+                _logger.warning("Request refused, saturated services: %s",
+                                ', '.join(sorted(endpoints)))
+                herald_svc.reply(message, _busy_response(endpoints),
+                                 SUBJECT_REPLY)
+                return
+
+        self._executor.execute(endpoints, self.__handle, herald_svc, message)
+
+    def __handle(self, herald_svc, message):
+        """
+        Executes a request and replies to it
 
         :param herald_svc: The Herald service
         :param message: A message bean
@@ -204,6 +321,17 @@ class HeraldRpcServiceExporter(commons.AbstractRpcServiceExporter):
         result = self._dispatcher.dispatch(message.content)
         herald_svc.reply(message, result, SUBJECT_REPLY)
 
+    def get_stats(self):
+        """
+        Returns the execution statistics of the exported methods
+
+        :return: A dictionary (see RequestExecutor.get_stats()), with the
+                 handled configurations ("configurations")
+        """
+        stats = self._executor.get_stats()
+        stats["configurations"] = tuple(self._kinds or ())
+        return stats
+
 # ------------------------------------------------------------------------------
 
 
@@ -211,7 +339,8 @@ class _XmlRpcEndpointProxy(object):
     """
     Proxy to use XML-RPC over Herald
     """
-    def __init__(self, name, peer, subject, send_method):
+    def __init__(self, name, peer, subject, send_method, post_method,
+                 results=None):
         """
         Sets up the endpoint proxy
 
@@ -219,11 +348,15 @@ class _XmlRpcEndpointProxy(object):
         :param peer: UID of the peer to contact
         :param subject: Subject to use for RPC
         :param send_method: Method to use to send a request
+        :param post_method: Method to use to post a request
+        :param results: The ResultCache of the end point (optional)
         """
         self.__name = name
         self.__peer = peer
         self.__subject = subject
         self.__send = send_method
+        self.__post = post_method
+        self.__results = results
         self.__cache = {}
 
     def __getattr__(self, name):
@@ -232,14 +365,73 @@ class _XmlRpcEndpointProxy(object):
         """
         return self.__cache.setdefault(
             name, _XmlRpcMethod("{0}.{1}".format(self.__name, name),
-                                self.__peer, self.__subject, self.__send))
+                                self.__peer, self.__subject, self.__send,
+                                self.__post, self.__results))
+
+    def batch_(self):
+        """
+        Prepares a batch of calls, sent in a single message
+
+        :return: A batch object
+        """
+        return _XmlRpcBatch(self.__name, self.__peer, self.__subject,
+                            self.__send)
+
+
+class _XmlRpcBatch(proxies.RpcBatch):
+    """
+    Sends calls with the system.multicall method
+    """
+    def _check_call(self, method_name, args, kwargs):
+        """
+        XML-RPC only supports positional parameters
+        """
+        if kwargs:
+            raise TypeError("{0}: keyword arguments are not supported by "
+                            "XML-RPC".format(method_name))
+
+    def _marshal(self, calls):
+        """
+        Prepares the content of the batch request
+        """
+        return xmlrpclib.dumps(
+            ([{'methodName': name, 'params': args}
+              for name, args, _ in calls],),
+            'system.multicall', encoding='utf-8', allow_none=True)
+
+    def _unmarshal(self, content, count):
+        """
+        Parses the content of the batch reply
+        """
+        parser, unmarshaller = xmlrpclib.getparser()
+        try:
+            parser.feed(content)
+            parser.close()
+            responses = unmarshaller.close()[0]
+        except Exception as ex:
+            # Error concerning the whole batch
+            return [(False, ex)] * count
+
+        results = []
+        for response in responses:
+            if isinstance(response, dict):
+                results.append((False, xmlrpclib.Fault(
+                    response.get('faultCode'),
+                    response.get('faultString'))))
+            else:
+                results.append((True, response[0]))
+
+        results.extend([(False, ValueError("No response to call"))] *
+                       (count - len(results)))
+        return results
 
 
 class _XmlRpcMethod(object):
     """
     Represents a method in a call proxy
     """
-    def __init__(self, method_name, peer, subject, send_method):
+    def __init__(self, method_name, peer, subject, send_method, post_method,
+                 results=None):
         """
         Sets up the method
 
@@ -247,35 +439,72 @@ class _XmlRpcMethod(object):
         :param peer: UID of the peer to contact
         :param subject: Subject to use for RPC
         :param send_method: Method to use to send a request
+        :param post_method: Method to use to post a request
+        :param results: The ResultCache of the end point (optional)
         """
         self.__name = method_name
+        self.__method = method_name.rsplit('.', 1)[-1]
         self.__peer = peer
         self.__subject = subject
         self.__send = send_method
+        self.__post = post_method
+        self.__results = results
 
-    def __call__(self, *args):
+    def __make_request(self, *args):
         """
-        Method is being called
+        Forges the request content
         """
-        # Forge the request
-        request = xmlrpclib.dumps(args, self.__name, encoding='utf-8',
-                                  allow_none=True)
+        return xmlrpclib.dumps(args, self.__name, encoding='utf-8',
+                               allow_none=True)
 
-        # Send it
-        reply_message = self.__send(self.__peer, self.__subject, request)
-
-        # Parse the reply
+    @staticmethod
+    def __parse_reply(reply_message):
+        """
+        Parses the reply message, raising the error of the call
+        """
         parser, unmarshaller = xmlrpclib.getparser()
         parser.feed(reply_message.content)
         parser.close()
         return unmarshaller.close()
 
+    def __call__(self, *args):
+        """
+        Method is being called: the result might come from the cache of the
+        end point
+        """
+        if self.__results is None:
+            return self.__invoke(*args)
+
+        return self.__results.call(self.__method, self.__invoke, args)
+
+    def __invoke(self, *args):
+        """
+        Calls the remote method
+        """
+        # Send the request and wait for the reply
+        reply_message = self.__send(self.__peer, self.__subject,
+                                    self.__make_request(*args))
+        return self.__parse_reply(reply_message)
+
+    def async_(self, *args):
+        """
+        Calls the method without waiting for its result
+
+        :return: A Future object, giving the result of the call
+        """
+        return self.__post(self.__peer, self.__subject,
+                           self.__make_request(*args), self.__parse_reply)
+
 
 @ComponentFactory(herald.remote.FACTORY_HERALD_XMLRPC_IMPORTER)
 @Requires('_herald', herald.SERVICE_HERALD)
 @Provides(pelix.remote.SERVICE_IMPORT_ENDPOINT_LISTENER)
 @Property('_kinds', pelix.remote.PROP_REMOTE_CONFIGS_SUPPORTED,
           (HERALDRPC_CONFIGURATION,))
+@Property('_timeout', herald.remote.PROP_RPC_TIMEOUT,
+          herald.remote.DEFAULT_RPC_TIMEOUT)
+@Property('_cache_size', herald.remote.PROP_CACHE_SIZE,
+          herald.remote.DEFAULT_CACHE_SIZE)
 @Instantiate('herald-rpc-importer-xmlrpc')
 class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
     """
@@ -293,6 +522,37 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
 
         # Component properties
         self._kinds = None
+        self._timeout = herald.remote.DEFAULT_RPC_TIMEOUT
+        self._cache_size = herald.remote.DEFAULT_CACHE_SIZE
+
+        # Asynchronous calls handler
+        self._poster = None
+
+        # End point UID -> ResultCache
+        self._results = {}
+
+    @Validate
+    def validate(self, context):
+        """
+        Component validated
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).validate(context)
+
+        self._poster = proxies.AsyncPoster(
+            self._herald, float(self._timeout or 0), __name__)
+        self._poster.start()
+
+    @Invalidate
+    def invalidate(self, context):
+        """
+        Component invalidated
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).invalidate(context)
+
+        self._poster.stop()
+        self._poster = None
 
     def __call(self, peer, subject, content):
         """
@@ -300,6 +560,14 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
         """
         return self._herald.send(peer, beans.Message(subject, content))
 
+    def __post(self, peer, subject, content, parse_method):
+        """
+        Method called by the proxy to post a message over Herald
+
+        :return: A Future object
+        """
+        return self._poster.post(peer, subject, content, parse_method)
+
     def make_service_proxy(self, endpoint):
         """
         Creates the proxy for the given ImportEndpoint
@@ -321,9 +589,35 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
                             endpoint)
             return
 
+        # Prepare the cache of the results of cacheable methods
+        results = self._results[endpoint.uid] = proxies.ResultCache(
+            endpoint.properties.get(herald.remote.PROP_CACHE_TTL),
+            self._cache_size)
+
         # Return the proxy
         return _XmlRpcEndpointProxy(endpoint.name, peer_uid, subject,
-                                    self.__call)
+                                    self.__call, self.__post, results)
+
+    def endpoint_updated(self, endpoint, old_properties):
+        """
+        An end point has been updated: forget the cached results of its
+        methods
+
+        :param endpoint: The updated ImportEndpoint bean
+        :param old_properties: Previous properties of the end point
+        """
+        # Call parent
+        super(HeraldRpcServiceImporter, self).endpoint_updated(
+            endpoint, old_properties)
+
+        try:
+            results = self._results[endpoint.uid]
+        except KeyError:
+            # Unknown end point
+            pass
+        else:
+            results.reset(
+                endpoint.properties.get(herald.remote.PROP_CACHE_TTL) or {})
 
     def clear_service_proxy(self, endpoint):
         """
@@ -331,5 +625,6 @@ class HeraldRpcServiceImporter(commons.AbstractRpcServiceImporter):
 
         :param endpoint: An ImportEndpoint bean
         """
-        # Nothing to do
-        return
+        results = self._results.pop(endpoint.uid, None)
+        if results is not None:
+            results.reset()
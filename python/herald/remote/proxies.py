@@ -0,0 +1,791 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Common classes of the Herald Remote Services exporters and proxies
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+from herald.exceptions import HeraldTimeout
+from herald.probe.metrics import Histogram, OTHER_KEY
+import herald.beans as beans
+import herald.remote
+
+# Pelix
+import pelix.threadpool
+
+# Standard library
+import collections
+import copy
+import heapq
+import json
+import logging
+import threading
+import time
+
+try:
+    # Python 3.2+, or the "futures" back port
+    from concurrent.futures import Future
+except ImportError:
+    Future = None
+
+MAX_TIMED_METHODS = 1000
+""" Maximum number of methods with execution statistics """
+
+# ------------------------------------------------------------------------------
+
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+
+
+def make_batch_pool(nb_threads, logname):
+    """
+    Prepares the thread pool executing the calls of batches in parallel
+
+    :param nb_threads: Maximum number of threads (0 for no pool)
+    :param logname: Name of the logger of the pool
+    :return: A started ThreadPool, or None
+    """
+    nb_threads = int(nb_threads or 0)
+    if nb_threads <= 0:
+        return None
+
+    pool = pelix.threadpool.ThreadPool(nb_threads, logname=logname)
+    pool.start()
+    return pool
+
+
+def endpoint_of(method_name):
+    """
+    Returns the name of the end point of a full method name
+
+    :param method_name: A full method name ("endpoint.method")
+    :return: The end point name
+    """
+    return method_name.rsplit('.', 1)[0]
+
+
+def cache_properties(svc_ref):
+    """
+    Prepares the end point property describing the cacheable methods of an
+    exported service, according to its PROP_CACHEABLE_METHODS property
+
+    :param svc_ref: Reference to the exported service
+    :return: A dictionary of end point properties (can be empty)
+    """
+    cacheable = svc_ref.get_property(herald.remote.PROP_CACHEABLE_METHODS)
+    if not cacheable:
+        return {}
+
+    if not isinstance(cacheable, dict):
+        if not isinstance(cacheable, (list, tuple, set, frozenset)):
+            cacheable = [cacheable]
+        cacheable = dict.fromkeys(cacheable, herald.remote.DEFAULT_CACHE_TTL)
+
+    ttls = {}
+    for name, ttl in cacheable.items():
+        try:
+            ttl = float(ttl)
+        except (TypeError, ValueError):
+            _logger.warning("Invalid cache TTL for method %s: %s", name, ttl)
+        else:
+            if ttl > 0:
+                ttls[str(name)] = ttl
+
+    return {herald.remote.PROP_CACHE_TTL: ttls} if ttls else {}
+
+# ------------------------------------------------------------------------------
+
+
+class RequestExecutor(object):
+    """
+    Executes the requests received by an exporter in a thread pool.
+
+    Requests are admitted only if the exported services they call have less
+    than a given number of requests in execution or waiting for a thread.
+    The execution times of the methods are kept in histograms.
+    """
+    def __init__(self, nb_threads, max_concurrency=0, logname=None):
+        """
+        Sets up the executor
+
+        :param nb_threads: Maximum number of threads
+        :param max_concurrency: Maximum number of admitted requests per end
+                                point (0 for no limit)
+        :param logname: Name of the logger
+        """
+        self._logger = logging.getLogger(logname or __name__)
+        self.__pool = pelix.threadpool.ThreadPool(max(1, int(nb_threads)),
+                                                  logname=logname)
+        self.__max_concurrency = max(0, int(max_concurrency or 0))
+
+        # End point name -> number of admitted requests
+        self.__admitted = {}
+
+        # Method name -> (Histogram of execution times in microseconds,
+        #                 number of errors)
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def limited(self):
+        """
+        True if the number of requests per end point is limited
+        """
+        return self.__max_concurrency > 0
+
+    def start(self):
+        """
+        Starts the thread pool
+        """
+        self.__pool.start()
+
+    def stop(self):
+        """
+        Stops the thread pool
+        """
+        self.__pool.stop()
+        with self.__lock:
+            self.__admitted.clear()
+
+    def acquire(self, endpoints):
+        """
+        Admits a request calling the given end points, if none of them is
+        saturated
+
+        :param endpoints: A set of end point names
+        :return: True if the request is admitted
+        """
+        if not self.__max_concurrency:
+            return True
+
+        with self.__lock:
+            admitted = self.__admitted
+            for endpoint in endpoints:
+                if admitted.get(endpoint, 0) >= self.__max_concurrency:
+                    return False
+
+            for endpoint in endpoints:
+                admitted[endpoint] = admitted.get(endpoint, 0) + 1
+        return True
+
+    def release(self, endpoints):
+        """
+        Releases the admission of a request
+
+        :param endpoints: The set of end point names given to acquire()
+        """
+        if not self.__max_concurrency:
+            return
+
+        with self.__lock:
+            for endpoint in endpoints:
+                count = self.__admitted.get(endpoint, 0) - 1
+                if count > 0:
+                    self.__admitted[endpoint] = count
+                else:
+                    self.__admitted.pop(endpoint, None)
+
+    def execute(self, endpoints, method, *args):
+        """
+        Executes an admitted request in the thread pool, and releases its
+        admission once done
+
+        :param endpoints: The set of end point names given to acquire()
+        :param method: Method handling the request
+        :param args: Arguments of the method
+        """
+        def run():
+            """
+            Handles the request
+            """
+            try:
+                method(*args)
+            except Exception as ex:
+                self._logger.exception("Error handling a request: %s", ex)
+            finally:
+                self.release(endpoints)
+
+        try:
+            self.__pool.enqueue(run)
+        except Exception:
+            self.release(endpoints)
+            raise
+
+    def timed(self, dispatch_method):
+        """
+        Wraps a dispatch method, to keep the execution times of methods
+
+        :param dispatch_method: A method(name, params)
+        :return: The wrapped method
+        """
+        def wrapped(name, params):
+            """
+            Calls the dispatch method and times it
+            """
+            start = time.time()
+            success = False
+            try:
+                result = dispatch_method(name, params)
+                success = True
+                return result
+            finally:
+                self.__record(name, time.time() - start, success)
+
+        return wrapped
+
+    def __record(self, name, duration, success):
+        """
+        Stores the execution time of a method
+
+        :param name: Full method name
+        :param duration: Execution time, in seconds
+        :param success: False if the method raised an error
+        """
+        with self.__lock:
+            try:
+                stats = self.__stats[name]
+            except KeyError:
+                if len(self.__stats) >= MAX_TIMED_METHODS:
+                    name = OTHER_KEY
+                stats = self.__stats.setdefault(name, [Histogram(), 0])
+
+            stats[0].record(duration * 1000000)
+            if not success:
+                stats[1] += 1
+
+    def get_stats(self):
+        """
+        Returns the execution statistics of the methods. Durations are given
+        in microseconds.
+
+        :return: A dictionary: method name -> summary dictionary (see
+                 Histogram.summary()), with an "errors" entry, and the
+                 number of admitted requests per end point ("admitted")
+        """
+        with self.__lock:
+            result = {}
+            for name, (histogram, errors) in self.__stats.items():
+                summary = result[name] = histogram.summary()
+                summary["errors"] = errors
+            return {"methods": result, "admitted": self.__admitted.copy()}
+
+# ------------------------------------------------------------------------------
+
+
+class ResultCache(object):
+    """
+    Keeps the results of the calls to the cacheable methods of an end point,
+    with a time to live per method and a least-recently-used eviction.
+
+    Callers get a copy of the cached results, which they can modify.
+    """
+    def __init__(self, ttls, max_size=herald.remote.DEFAULT_CACHE_SIZE):
+        """
+        Sets up the cache
+
+        :param ttls: Method name -> time to live of its results, in seconds
+        :param max_size: Maximum number of cached results
+        """
+        self.__ttls = dict(ttls or {})
+        self.__max_size = max(1, int(max_size))
+
+        # (Method name, arguments) -> (expiration time, result)
+        self.__results = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.__results)
+
+    @staticmethod
+    def __make_key(name, args, kwargs):
+        """
+        Computes the key of a call
+
+        :param name: Method name
+        :param args: Positional arguments (tuple)
+        :param kwargs: Keyword arguments (dictionary)
+        :return: A hashable key
+        """
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+            return key
+        except TypeError:
+            # Lists or dictionaries in the arguments
+            return name, json.dumps([args, kwargs], sort_keys=True,
+                                    default=repr)
+
+    def ttl(self, name):
+        """
+        Returns the time to live of the results of the given method
+
+        :param name: Method name (without the end point name)
+        :return: The time to live in seconds, or None if not cacheable
+        """
+        return self.__ttls.get(name)
+
+    def reset(self, ttls=None):
+        """
+        Forgets all results, and replaces the time to live of methods if
+        given
+
+        :param ttls: The new method name -> time to live dictionary
+        """
+        with self.__lock:
+            self.__results.clear()
+            if ttls is not None:
+                self.__ttls = dict(ttls)
+
+    def call(self, name, method, args, kwargs=None):
+        """
+        Returns the cached result of a call, or calls the method and caches
+        its result if the method is cacheable.
+        Errors are never cached.
+
+        :param name: Method name (without the end point name)
+        :param method: Method to call to compute the result
+        :param args: Positional arguments of the call (tuple)
+        :param kwargs: Keyword arguments of the call (dictionary)
+        :return: The result of the call
+        """
+        kwargs = kwargs or {}
+        ttl = self.__ttls.get(name)
+        if ttl is None:
+            return method(*args, **kwargs)
+
+        key = self.__make_key(name, args, kwargs)
+        now = time.time()
+        with self.__lock:
+            try:
+                expiration, result = self.__results[key]
+            except KeyError:
+                pass
+            else:
+                if expiration > now:
+                    # Keep it as the most recently used result
+                    del self.__results[key]
+                    self.__results[key] = expiration, result
+                    self.hits += 1
+                    return copy.deepcopy(result)
+
+                del self.__results[key]
+            self.misses += 1
+
+        result = method(*args, **kwargs)
+        cached = copy.deepcopy(result)
+        with self.__lock:
+            self.__results.pop(key, None)
+            self.__results[key] = time.time() + ttl, cached
+            while len(self.__results) > self.__max_size:
+                self.__results.popitem(last=False)
+
+        return result
+
+# ------------------------------------------------------------------------------
+
+
+class BatchResults(object):
+    """
+    Results of a batch of calls, in the order of the calls.
+
+    Accessing the result of a call which failed raises its exception.
+    """
+    def __init__(self, results):
+        """
+        :param results: A list of (success flag, result or exception) tuples
+        """
+        self.__results = results
+
+    def __len__(self):
+        return len(self.__results)
+
+    def __getitem__(self, index):
+        """
+        Returns the result of a call
+
+        :param index: Index of the call in the batch
+        :return: The result of the call
+        :raise Exception: The error raised by the call
+        """
+        success, result = self.__results[index]
+        if not success:
+            raise result
+        return result
+
+    def __iter__(self):
+        for index in range(len(self.__results)):
+            yield self[index]
+
+    def errors(self):
+        """
+        Returns the errors of the batch
+
+        :return: A list of (index, exception) tuples
+        """
+        return [(index, result)
+                for index, (success, result) in enumerate(self.__results)
+                if not success]
+
+
+class _BatchMethod(object):
+    """
+    Represents a method of a batch
+    """
+    def __init__(self, batch, method_name):
+        """
+        :param batch: The parent RpcBatch
+        :param method_name: Full method name
+        """
+        self.__batch = batch
+        self.__name = method_name
+
+    def __call__(self, *args, **kwargs):
+        """
+        Adds a call to the batch
+
+        :return: The index of the call in the batch
+        """
+        return self.__batch._add_call(self.__name, args, kwargs)
+
+
+class RpcBatch(object):
+    """
+    Collects calls to the methods of a remote service, then sends them in a
+    single Herald message when the batch is called. Subclasses implement the
+    marshalling of the calls and of the results.
+
+    Usage::
+
+        batch = proxy.batch_()
+        batch.add(1, 2)
+        batch.sub(4, 3)
+        results = batch()  # results[0] == 3, results[1] == 1
+    """
+    def __init__(self, name, peer, subject, send_method):
+        """
+        Sets up the batch
+
+        :param name: End point name
+        :param peer: UID of the peer to contact
+        :param subject: Subject to use for RPC
+        :param send_method: Method to use to send a request
+        """
+        self.__name = name
+        self.__peer = peer
+        self.__subject = subject
+        self.__send = send_method
+
+        # List of (method name, args, kwargs) tuples
+        self.__calls = []
+
+    def __len__(self):
+        return len(self.__calls)
+
+    def __getattr__(self, name):
+        """
+        Prefixes the requested attribute name by the endpoint name
+        """
+        if name.startswith('__'):
+            # Don't hide special attributes
+            raise AttributeError(name)
+
+        return _BatchMethod(self, "{0}.{1}".format(self.__name, name))
+
+    def _add_call(self, method_name, args, kwargs):
+        """
+        Adds a call to the batch
+
+        :param method_name: Full method name
+        :param args: Positional arguments
+        :param kwargs: Keyword arguments
+        :return: The index of the call in the batch
+        :raise TypeError: Arguments can't be sent by the protocol
+        """
+        self._check_call(method_name, args, kwargs)
+        self.__calls.append((method_name, args, kwargs))
+        return len(self.__calls) - 1
+
+    def __call__(self):
+        """
+        Sends the calls and waits for their results.
+        The batch is emptied and can be reused.
+
+        :return: A BatchResults object
+        """
+        calls, self.__calls = self.__calls, []
+        if not calls:
+            return BatchResults([])
+
+        reply_message = self.__send(self.__peer, self.__subject,
+                                    self._marshal(calls))
+        return BatchResults(self._unmarshal(reply_message.content,
+                                            len(calls)))
+
+    def _check_call(self, method_name, args, kwargs):
+        """
+        Checks if the arguments of a call can be sent by the protocol.
+        Accepts all arguments by default.
+
+        :param method_name: Full method name
+        :param args: Positional arguments
+        :param kwargs: Keyword arguments
+        :raise TypeError: Arguments can't be sent by the protocol
+        """
+        pass
+
+    def _marshal(self, calls):
+        """
+        Prepares the content of the batch request
+
+        :param calls: A list of (method name, args, kwargs) tuples
+        :return: The request content
+        """
+        raise NotImplementedError
+
+    def _unmarshal(self, content, count):
+        """
+        Parses the content of the batch reply
+
+        :param content: The reply content
+        :param count: Number of calls in the batch
+        :return: A list of (success flag, result or exception) tuples, in
+                 the order of the calls
+        """
+        raise NotImplementedError
+
+# ------------------------------------------------------------------------------
+
+
+class AsyncPoster(object):
+    """
+    Posts requests with Herald and gives their results as futures.
+
+    The timeouts of all requests are handled by a single thread, and the
+    replies are handled by the Herald threads: waiting for many requests
+    doesn't hold many threads.
+    """
+    def __init__(self, herald_svc, timeout=None, logname=None):
+        """
+        Sets up the poster
+
+        :param herald_svc: The Herald service
+        :param timeout: Time to wait for a reply, in seconds (None or <= 0
+                        to wait forever)
+        :param logname: Name of the logger
+        """
+        self._logger = logging.getLogger(logname or __name__)
+        self.__herald = herald_svc
+        self.__timeout = timeout if timeout and timeout > 0 else None
+
+        # Message UID -> (Future, peer, message, parse method)
+        self.__pending = {}
+
+        # Heap of (deadline, message UID)
+        self.__deadlines = []
+
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__running = False
+
+    def start(self):
+        """
+        Starts the timeout thread
+        """
+        with self.__condition:
+            if self.__running:
+                return
+            self.__running = True
+
+        self.__thread = threading.Thread(target=self.__timeout_loop,
+                                         name="Herald-RPC-Timeout")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the timeout thread and fails the pending requests
+        """
+        with self.__condition:
+            self.__running = False
+            self.__deadlines = []
+            self.__condition.notify_all()
+            pending = list(self.__pending)
+
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+        for uid in pending:
+            self.__fail(uid, "RPC importer stopped")
+
+    def post(self, peer, subject, content, parse_method):
+        """
+        Posts a request
+
+        :param peer: UID of the peer to contact
+        :param subject: Subject of the request
+        :param content: Content of the request
+        :param parse_method: Method called with the reply message bean,
+                             returning the result of the call or raising
+                             its error
+        :return: A Future object
+        :raise ImportError: The concurrent.futures module is missing
+        :raise ValueError: The poster is stopped
+        """
+        if Future is None:
+            raise ImportError("Asynchronous calls require the "
+                              "concurrent.futures module")
+
+        future = Future()
+        message = beans.Message(subject, content)
+        uid = message.uid
+        with self.__condition:
+            if not self.__running:
+                raise ValueError("RPC importer stopped")
+
+            self.__pending[uid] = (future, peer, message, parse_method)
+            if self.__timeout is not None:
+                heapq.heappush(self.__deadlines,
+                               (time.time() + self.__timeout, uid))
+                self.__condition.notify()
+
+        future.add_done_callback(
+            lambda done: done.cancelled() and self.__forget(uid))
+
+        try:
+            # Timeouts are handled by this object
+            self.__herald.post(
+                peer, message,
+                lambda _, reply: self.__settle(uid, reply),
+                lambda _, exception: self.__settle(uid, exception=exception),
+                None)
+        except Exception as ex:
+            self.__settle(uid, exception=ex)
+
+        return future
+
+    def __pop(self, uid):
+        """
+        Pops the description of a pending request
+
+        :param uid: UID of the request message
+        :return: The pending tuple, or None
+        """
+        with self.__condition:
+            return self.__pending.pop(uid, None)
+
+    def __settle(self, uid, reply=None, exception=None):
+        """
+        Sets the result of the future associated to a request, if it is
+        still pending
+
+        :param uid: UID of the request message
+        :param reply: The reply message bean
+        :param exception: The error to give to the future
+        """
+        pending = self.__pop(uid)
+        if pending is None:
+            # Already settled
+            return
+
+        future, _, _, parse_method = pending
+        if not future.set_running_or_notify_cancel():
+            # Cancelled by the caller
+            return
+
+        if exception is None:
+            try:
+                result = parse_method(reply)
+            except Exception as ex:
+                exception = ex
+
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+
+    def __fail(self, uid, text):
+        """
+        Fails a request with a timeout, and makes Herald forget it
+
+        :param uid: UID of the request message
+        :param text: Description of the error
+        """
+        with self.__condition:
+            try:
+                _, peer, message, _ = self.__pending[uid]
+            except KeyError:
+                # Already settled
+                return
+
+        self.__settle(uid, exception=HeraldTimeout(beans.Target(uid=peer),
+                                                   text, message))
+        self.__herald.forget(uid)
+
+    def __forget(self, uid):
+        """
+        Forgets a request cancelled by the caller
+
+        :param uid: UID of the request message
+        """
+        if self.__pop(uid) is not None:
+            self.__herald.forget(uid)
+
+    def __timeout_loop(self):
+        """
+        Fails the requests which didn't get a reply in time
+        """
+        while True:
+            with self.__condition:
+                while self.__running:
+                    if not self.__deadlines:
+                        self.__condition.wait()
+                        continue
+
+                    delay = self.__deadlines[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self.__condition.wait(delay)
+
+                if not self.__running:
+                    return
+
+                _, uid = heapq.heappop(self.__deadlines)
+
+            self.__fail(uid, "Timeout reached before receiving a reply")
@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Herald routing table: keeps track of the health of each (peer, access) route
+to choose the transport to use when sending a message
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Standard library
+import logging
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+_logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+""" Healthy route: messages go through it """
+
+STATE_OPEN = "open"
+""" Tripped route: only used if no other route works """
+
+STATE_HALF_OPEN = "half-open"
+""" Tripped route given a new chance: one message is sent through it """
+
+# ------------------------------------------------------------------------------
+
+
+class Route(object):
+    """
+    Health of the route to a peer through a kind of access
+    """
+    def __init__(self, peer_uid, access, created):
+        """
+        Sets up members
+
+        :param peer_uid: UID of the target peer
+        :param access: Access ID of the transport
+        :param created: Creation time of the route
+        """
+        self.peer_uid = peer_uid
+        self.access = access
+        self.state = STATE_CLOSED
+
+        # Average send time (in seconds, None before the first success)
+        self.latency = None
+
+        # Average error rate (between 0 and 1)
+        self.error_rate = 0.
+
+        # Number of consecutive failures
+        self.failures = 0
+
+        # Time when the route has been tripped and delay before the next probe
+        self.opened_at = None
+        self.retry_delay = None
+
+        # Creation time and last time the route has been used
+        self.created = created
+        self.last_use = None
+
+    def __str__(self):
+        return "Route({0}, {1}, {2})".format(
+            self.peer_uid, self.access, self.state)
+
+    def score(self):
+        """
+        Returns the score of the route: the lower, the better.
+        Routes never used have the best score, so that they are measured,
+        and routes which never worked have the worst one.
+
+        :return: The expected send time, penalized by the error rate
+        """
+        if self.latency is None:
+            return float("inf") if self.failures else 0.
+        return self.latency / max(1. - self.error_rate, .05)
+
+    def to_dict(self, timestamp):
+        """
+        Returns a dictionary describing the route, e.g. for the probe
+
+        :param timestamp: Time of the description
+        :return: A dictionary
+        """
+        return {"timestamp": timestamp,
+                "peer": self.peer_uid,
+                "access": self.access,
+                "state": self.state,
+                "latency": self.latency,
+                "errorRate": self.error_rate,
+                "failures": self.failures}
+
+
+class RoutingTable(object):
+    """
+    Per-peer, per-access routing table with a circuit breaker on each route.
+
+    After ``threshold`` consecutive failures, a route is opened (tripped): it
+    is only tried after all the other ones. Once ``retry_delay`` seconds have
+    passed, the next message goes through it first (half-open state): a
+    success closes the route, a failure opens it again and doubles the delay,
+    up to ``max_retry_delay``.
+    """
+    def __init__(self, listener=None, threshold=3, retry_delay=5.,
+                 max_retry_delay=120., alpha=.2, clock=time.time):
+        """
+        Sets up members
+
+        :param listener: Method called with the description of a route
+                         (see Route.to_dict()) each time its state changes
+        :param threshold: Number of consecutive failures opening a route
+        :param retry_delay: Time to wait before probing an opened route
+        :param max_retry_delay: Maximum time between two probes
+        :param alpha: Smoothing factor of the latency and error rate averages
+        :param clock: Method returning the current time
+        """
+        self._listener = listener
+        self._threshold = threshold
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._alpha = alpha
+        self._clock = clock
+
+        # Peer UID -> {access ID -> Route}
+        self.__routes = {}
+        self.__lock = threading.Lock()
+
+    def __get_route(self, peer_uid, access, now):
+        """
+        Returns the route to the given peer, creating it if necessary.
+        Must be called while holding the lock.
+
+        :param peer_uid: UID of a peer
+        :param access: Access ID
+        :param now: Current time
+        :return: A Route object
+        """
+        peer_routes = self.__routes.setdefault(peer_uid, {})
+        try:
+            return peer_routes[access]
+        except KeyError:
+            route = peer_routes[access] = Route(peer_uid, access, now)
+            return route
+
+    def __notify(self, route, timestamp):
+        """
+        Notifies the listener of the new state of a route
+
+        :param route: A Route object
+        :param timestamp: Time of the state change
+        :return: The description given to the listener, None if not listened
+        """
+        _logger.debug("%s: latency=%s, error rate=%.2f", route,
+                      route.latency, route.error_rate)
+        if self._listener is not None:
+            return route.to_dict(timestamp)
+
+    def __call_listener(self, description):
+        """
+        Calls the listener, outside the lock
+
+        :param description: A route description or None
+        """
+        if description is not None:
+            try:
+                self._listener(description)
+            except Exception as ex:
+                _logger.exception("Error notifying a route state: %s", ex)
+
+    def order(self, peer_uid, accesses):
+        """
+        Sorts the given accesses to a peer, the one to try first being the
+        first one: an opened route due for a probe, then the healthy routes
+        (best score first), then the other opened routes.
+
+        The order of the given accesses is kept between equivalent routes.
+
+        :param peer_uid: UID of the target peer
+        :param accesses: Access IDs with a bound transport
+        :return: The sorted list of access IDs
+        """
+        now = self._clock()
+        probe = None
+        healthy = []
+        tripped = []
+        notification = None
+        with self.__lock:
+            for access in accesses:
+                route = self.__get_route(peer_uid, access, now)
+                if route.state == STATE_CLOSED:
+                    healthy.append(route)
+                elif probe is None and route.state == STATE_OPEN \
+                        and now - route.opened_at >= route.retry_delay:
+                    # Give one message a chance to go through this route
+                    route.state = STATE_HALF_OPEN
+                    probe = route
+                    notification = self.__notify(route, now)
+                else:
+                    tripped.append(route)
+
+        self.__call_listener(notification)
+        healthy.sort(key=Route.score)
+        tripped.sort(key=lambda route: route.opened_at)
+        routes = healthy + tripped
+        if probe is not None:
+            routes.insert(0, probe)
+        return [route.access for route in routes]
+
+    def success(self, peer_uid, access, latency):
+        """
+        A message has been sent through a route
+
+        :param peer_uid: UID of the target peer
+        :param access: Access ID
+        :param latency: Time taken to send the message (in seconds)
+        """
+        now = self._clock()
+        notification = None
+        alpha = self._alpha
+        with self.__lock:
+            route = self.__get_route(peer_uid, access, now)
+            route.last_use = now
+            route.failures = 0
+            route.error_rate *= 1. - alpha
+            if route.latency is None:
+                route.latency = latency
+            else:
+                route.latency += alpha * (latency - route.latency)
+
+            if route.state != STATE_CLOSED:
+                # Route is back
+                route.state = STATE_CLOSED
+                route.opened_at = None
+                route.retry_delay = None
+                notification = self.__notify(route, now)
+
+        self.__call_listener(notification)
+
+    def failure(self, peer_uid, access):
+        """
+        A route failed to send a message
+
+        :param peer_uid: UID of the target peer
+        :param access: Access ID
+        """
+        now = self._clock()
+        notification = None
+        alpha = self._alpha
+        with self.__lock:
+            route = self.__get_route(peer_uid, access, now)
+            route.last_use = now
+            route.failures += 1
+            route.error_rate += alpha * (1. - route.error_rate)
+
+            if route.state == STATE_HALF_OPEN:
+                # Probe failed: wait longer before the next one
+                route.state = STATE_OPEN
+                route.opened_at = now
+                route.retry_delay = min(route.retry_delay * 2,
+                                        self._max_retry_delay)
+                notification = self.__notify(route, now)
+            elif route.state == STATE_CLOSED \
+                    and route.failures >= self._threshold:
+                # Trip the route
+                route.state = STATE_OPEN
+                route.opened_at = now
+                route.retry_delay = self._retry_delay
+                notification = self.__notify(route, now)
+
+        self.__call_listener(notification)
+
+    def cancel_probe(self, peer_uid, access):
+        """
+        The message given to a half-open route hasn't been sent through it,
+        e.g. because its transport has gone away: the route is opened again,
+        to be probed by the next message.
+
+        :param peer_uid: UID of the target peer
+        :param access: Access ID
+        """
+        now = self._clock()
+        notification = None
+        with self.__lock:
+            route = self.__routes.get(peer_uid, {}).get(access)
+            if route is not None and route.state == STATE_HALF_OPEN:
+                route.state = STATE_OPEN
+                notification = self.__notify(route, now)
+
+        self.__call_listener(notification)
+
+    def reset(self, peer_uid, access):
+        """
+        Forgets the health of a route, e.g. when its access has been updated
+
+        :param peer_uid: UID of a peer
+        :param access: Access ID
+        """
+        with self.__lock:
+            peer_routes = self.__routes.get(peer_uid)
+            if peer_routes:
+                peer_routes.pop(access, None)
+
+    def remove_peer(self, peer_uid):
+        """
+        Forgets the routes to a peer
+
+        :param peer_uid: UID of a peer
+        """
+        with self.__lock:
+            self.__routes.pop(peer_uid, None)
+
+    def clean(self, max_age):
+        """
+        Forgets the routes which haven't been used for a while
+
+        :param max_age: Maximum time since the last use of a route, or since
+                        its creation if it has never been used
+        """
+        limit = self._clock() - max_age
+        with self.__lock:
+            for peer_uid, peer_routes in list(self.__routes.items()):
+                for access, route in list(peer_routes.items()):
+                    if (route.last_use or route.created) < limit:
+                        del peer_routes[access]
+
+                if not peer_routes:
+                    del self.__routes[peer_uid]
+
+    def get_routes(self, peer_uid=None):
+        """
+        Returns the description of the known routes
+
+        :param peer_uid: Only returns the routes to this peer (optional)
+        :return: A list of dictionaries (see Route.to_dict())
+        """
+        now = self._clock()
+        with self.__lock:
+            if peer_uid is not None:
+                peers = [self.__routes.get(peer_uid, {})]
+            else:
+                peers = self.__routes.values()
+            return [route.to_dict(now) for peer_routes in peers
+                    for route in peer_routes.values()]
+
+# ------------------------------------------------------------------------------
+
+
+def plan_group_delivery(peers_by_access, broadcast=()):
+    """
+    Computes the transport calls to make to reach a group of peers, at the
+    lowest cost (greedy weighted set cover).
+
+    A call to a broadcast transport costs 1 whatever the number of peers it
+    reaches, a call to another transport costs 1 per peer. The call with the
+    lowest cost per newly reached peer is chosen first, a broadcast one in
+    case of a tie, then the one reaching the more peers. Remaining ties are
+    resolved according to the order of ``peers_by_access``.
+
+    :param peers_by_access: Access ID -> peers reachable through it
+    :param broadcast: Access IDs of the broadcast transports
+    :return: The list of (access ID, set of peers) calls to make
+    """
+    remaining = set()
+    for peers in peers_by_access.values():
+        remaining.update(peers)
+
+    plan = []
+    candidates = list(peers_by_access.items())
+    while remaining and candidates:
+        best = None
+        for idx, (access, peers) in enumerate(candidates):
+            covered = remaining.intersection(peers)
+            if not covered:
+                continue
+
+            is_broadcast = access in broadcast
+            cost = 1. if is_broadcast else float(len(covered))
+            key = (cost / len(covered), not is_broadcast, -len(covered), idx)
+            if best is None or key < best[0]:
+                best = (key, idx, covered)
+
+        if best is None:
+            break
+
+        _, idx, covered = best
+        plan.append((candidates.pop(idx)[0], covered))
+        remaining.difference_update(covered)
+
+    return plan
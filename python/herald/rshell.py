@@ -46,17 +46,12 @@ from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
 import pelix.shell.beans
 
 # Standard library
+import collections
 import logging
 import threading
+import time
 import uuid
 
-try:
-    # Python 2
-    from StringIO import StringIO
-except ImportError:
-    # Python 3
-    from io import StringIO
-
 # ------------------------------------------------------------------------------
 
 _logger = logging.getLogger(__name__)
@@ -66,6 +61,8 @@ _PREFIX_SERVER = "herald/shell"
 MSG_SERVER_OPEN = "{0}/open".format(_PREFIX_SERVER)
 MSG_SERVER_COMMAND = "{0}/command".format(_PREFIX_SERVER)
 MSG_SERVER_CLOSE = "{0}/close".format(_PREFIX_SERVER)
+MSG_SERVER_ACK = "{0}/ack".format(_PREFIX_SERVER)
+MSG_SERVER_SCRIPT = "{0}/script".format(_PREFIX_SERVER)
 
 # Subject of the messages for the client
 _PREFIX_CLIENT = "herald/shell-client"
@@ -80,6 +77,23 @@ SESSION_SESSION_ID = "__session_id__"
 SESSION_CLIENT_ID = "__client_uid__"
 SESSION_SERVER_ID = "__server_uid__"
 
+# Output streaming properties
+PROP_OUTPUT_WINDOW = "herald.shell.output.window"
+""" Maximum number of output messages sent and not acknowledged (client) """
+PROP_OUTPUT_CHUNK = "herald.shell.output.chunk"
+""" Size of the buffered output triggering a message (server) """
+PROP_OUTPUT_DELAY = "herald.shell.output.delay"
+""" Maximum time output stays in the buffer, in seconds (server) """
+
+DEFAULT_OUTPUT_WINDOW = 8
+DEFAULT_OUTPUT_CHUNK = 8192
+DEFAULT_OUTPUT_DELAY = .05
+
+OUTPUT_TIMEOUT = 30
+"""
+Time to wait for acknowledgements or missing output messages, in seconds
+"""
+
 # ------------------------------------------------------------------------------
 
 
@@ -88,6 +102,7 @@ SESSION_SERVER_ID = "__server_uid__"
 @Provides((pelix.shell.SERVICE_SHELL_COMMAND, herald.SERVICE_LISTENER,
            herald.SERVICE_DIRECTORY_LISTENER))
 @Property('_filters', herald.PROP_FILTERS, ['{0}/*'.format(_PREFIX_CLIENT)])
+@Property('_window', PROP_OUTPUT_WINDOW, DEFAULT_OUTPUT_WINDOW)
 @Instantiate("herald-remote-shell-client")
 class HeraldRemoteShellClient(object):
     """
@@ -99,12 +114,18 @@ class HeraldRemoteShellClient(object):
         """
         self._herald = None
 
+        # Output flow control window
+        self._window = DEFAULT_OUTPUT_WINDOW
+
         # Thread safety
         self.__lock = threading.Lock()
 
         # Active session ID -> local shell session
         self._sessions = {}
 
+        # Active session ID -> _OutputReceiver
+        self._receivers = {}
+
         # Peer UID -> session ID
         self._peers = {}
 
@@ -119,41 +140,20 @@ class HeraldRemoteShellClient(object):
         """
         Retrieves the list of tuples (command, method) for this command handler
         """
-        return [("remote", self.remote_shell)]
+        return [("remote", self.remote_shell),
+                ("remote_script", self.remote_script)]
 
     def remote_shell(self, session, peer):
         """
         Opens a remote shell to the given peer
         """
-        try:
-            # Open session
-            shell_info_msg = self._herald.send(
-                peer, beans.Message(MSG_SERVER_OPEN))
-        except HeraldException as ex:
-            session.write_line("Error opening session: {0}", ex)
-            return
-        except KeyError as ex:
-            session.write_line("Unknown peer: {0}", ex)
+        shell_info = self.__open_session(session, peer)
+        if shell_info is None:
             return
 
-        # Read session information
-        shell_info = shell_info_msg.content
         session_id = shell_info['session_id']
-        if not session_id:
-            session.write_line("Connection refused")
-            return
-
-        peer_uid = shell_info['peer_uid']
-        prompt_str = "({0}) {1}".format(peer_uid, shell_info['ps1'])
-
-        # Setup the session variables
-        session.set(SESSION_SHELL_RUNNING, True)
-        session.set(SESSION_SERVER_ID, peer_uid)
-
-        with self.__lock:
-            # Store the session
-            self._sessions[session_id] = session
-            self._peers.setdefault(peer_uid, set()).add(session_id)
+        prompt_str = "({0}) {1}".format(shell_info['peer_uid'],
+                                        shell_info['ps1'])
 
         # Print the banner
         session.write_line(shell_info['banner'])
@@ -170,12 +170,17 @@ class HeraldRemoteShellClient(object):
                     # Empty line
                     continue
 
-                # Send the command line
+                # Send the command line, with our output window
                 content = {"session_id": session_id,
-                           "line": line}
+                           "line": line,
+                           "window": self.__get_window()}
                 result_msg = self._herald.send(
                     peer, beans.Message(MSG_SERVER_COMMAND, content))
 
+                # Wait for the whole output of the command
+                self.__wait_output(session, peer, session_id,
+                                   result_msg.content)
+
                 # Print results
                 session.write_line(prompt_str, result_msg.content)
 
@@ -188,6 +193,122 @@ class HeraldRemoteShellClient(object):
             # Ctrl+C or Ctrl+D: just stop the shell
             pass
 
+        self.__close_session(peer, session_id)
+
+    def remote_script(self, session, peer, filename):
+        """
+        Runs the commands of a script file on the given peer
+        """
+        try:
+            with open(filename) as script_file:
+                lines = [line.rstrip('\r\n') for line in script_file]
+        except (IOError, OSError) as ex:
+            session.write_line("Error reading script: {0}", ex)
+            return
+
+        shell_info = self.__open_session(session, peer)
+        if shell_info is None:
+            return
+
+        session_id = shell_info['session_id']
+        try:
+            # Send the whole script at once: its lines are also given to
+            # the commands reading input
+            content = {"session_id": session_id,
+                       "lines": lines,
+                       "window": self.__get_window()}
+            result_msg = self._herald.send(
+                peer, beans.Message(MSG_SERVER_SCRIPT, content))
+
+            # Wait for the whole output of the script
+            result = result_msg.content
+            self.__wait_output(session, peer, session_id, result)
+            results = result.get('results') or []
+            session.write_line("{0} command(s) executed, {1} failed",
+                               len(results), results.count(False))
+        except (HeraldException, KeyError, AttributeError) as ex:
+            _logger.exception("Error running script on peer: %s", ex)
+            session.write_line("Error running script on peer: {0}", ex)
+
+        self.__close_session(peer, session_id)
+
+    def __get_window(self):
+        """
+        Returns the output flow control window to give to servers
+        """
+        return max(1, int(self._window))
+
+    def __open_session(self, session, peer):
+        """
+        Opens a session on the given peer and stores it
+
+        :param session: The local shell session
+        :param peer: The peer hosting the shell server
+        :return: The session information sent by the server, or None
+        """
+        try:
+            # Open session
+            shell_info_msg = self._herald.send(
+                peer, beans.Message(MSG_SERVER_OPEN))
+        except HeraldException as ex:
+            session.write_line("Error opening session: {0}", ex)
+            return
+        except KeyError as ex:
+            session.write_line("Unknown peer: {0}", ex)
+            return
+
+        # Read session information
+        shell_info = shell_info_msg.content
+        session_id = shell_info['session_id']
+        if not session_id:
+            session.write_line("Connection refused")
+            return
+
+        peer_uid = shell_info['peer_uid']
+
+        # Setup the session variables
+        session.set(SESSION_SHELL_RUNNING, True)
+        session.set(SESSION_SERVER_ID, peer_uid)
+
+        receiver = _OutputReceiver(session, self.__get_window())
+        with self.__lock:
+            # Store the session
+            self._sessions[session_id] = session
+            self._receivers[session_id] = receiver
+            self._peers.setdefault(peer_uid, set()).add(session_id)
+
+        return shell_info
+
+    def __wait_output(self, session, peer, session_id, result):
+        """
+        Waits for the output of a command, according to its result
+
+        :param session: The local shell session
+        :param peer: The peer hosting the shell server
+        :param session_id: Shell session ID
+        :param result: Content of the reply to the command
+        """
+        if not isinstance(result, dict) or not result.get('seq'):
+            # Server without output streaming
+            return
+
+        try:
+            receiver = self._receivers[session_id]
+        except KeyError:
+            # Session closed
+            return
+
+        if not receiver.wait(result['seq'], OUTPUT_TIMEOUT):
+            session.write_line("Missing output from the peer")
+        self.__acknowledge(peer, session_id, receiver.last_seq)
+
+    def __close_session(self, peer, session_id):
+        """
+        Forgets about a session and asks the server to close it
+
+        :param peer: The peer hosting the shell server
+        :param session_id: Shell session ID
+        """
         try:
             # Clear local references
             self.__clear_session(session_id)
@@ -213,6 +334,7 @@ class HeraldRemoteShellClient(object):
         with self.__lock:
             # Pop local session
             session = self._sessions.pop(session_id)
+            self._receivers.pop(session_id, None)
 
             # Clean up peer reference
             peer_uid = session.get(SESSION_SERVER_ID)
@@ -233,12 +355,14 @@ class HeraldRemoteShellClient(object):
             session_id = message.content['session_id']
             text = message.content['text']
             try:
-                # Print the given line, as is
-                session = self._sessions[session_id]
-                session.write(text)
-                session.flush()
+                receiver = self._receivers[session_id]
             except KeyError:
                 _logger.warning("No session with ID: %s", session_id)
+            else:
+                # Print the given text, in order
+                seq = receiver.receive(text, message.content.get('seq'))
+                if seq is not None:
+                    self.__acknowledge(message.sender, session_id, seq)
 
         elif kind == "prompt":
             # Request data from the client
@@ -272,6 +396,20 @@ class HeraldRemoteShellClient(object):
         elif kind == "error":
             _logger.warning("Error on shell server side: %s", message.content)
 
+    def __acknowledge(self, peer, session_id, seq):
+        """
+        Acknowledges the output messages received from a shell server
+
+        :param peer: UID of the shell server peer
+        :param session_id: Shell session ID
+        :param seq: Sequence number of the last message printed
+        """
+        try:
+            self._herald.fire(peer, beans.Message(
+                MSG_SERVER_ACK, {"session_id": session_id, "seq": seq}))
+        except Exception as ex:
+            _logger.warning("Error acknowledging shell output: %s", ex)
+
     def peer_unregistered(self, peer):
         """
         Peer unregistered: close local session
@@ -288,6 +426,7 @@ class HeraldRemoteShellClient(object):
                 try:
                     # Pop the session & stop the loop
                     session = self._sessions.pop(session_id)
+                    self._receivers.pop(session_id, None)
                     session.set(SESSION_SHELL_RUNNING, False)
 
                     # Print an exit message
@@ -314,62 +453,319 @@ class HeraldRemoteShellClient(object):
 # ------------------------------------------------------------------------------
 
 
+def _wait_for(condition, predicate, timeout):
+    """
+    Waits for a predicate to become true (Condition.wait_for() is missing in
+    Python 2). Must be called while holding the condition.
+
+    :param condition: A Condition object
+    :param predicate: A method returning a boolean
+    :param timeout: Maximum time to wait, in seconds
+    :return: The last result of the predicate
+    """
+    end = time.time() + timeout
+    result = predicate()
+    while not result:
+        remaining = end - time.time()
+        if remaining <= 0:
+            break
+        condition.wait(remaining)
+        result = predicate()
+    return result
+
+
+class _OutputReceiver(object):
+    """
+    Prints the output of a remote shell in order, and tells when to
+    acknowledge it
+    """
+    def __init__(self, session, window):
+        """
+        Sets up the receiver
+
+        :param session: The local shell session
+        :param window: Output flow control window
+        """
+        self._session = session
+
+        # Acknowledge every half window
+        self._ack_step = max(1, window // 2)
+        self._acked = 0
+
+        # Sequence number of the next message to print
+        self._next = 1
+
+        # Sequence number -> text received too early
+        self._pending = {}
+        self._condition = threading.Condition()
+
+    @property
+    def last_seq(self):
+        """
+        Sequence number of the last message printed
+        """
+        return self._next - 1
+
+    def receive(self, text, seq):
+        """
+        Prints the received text, once the previous ones have been printed
+
+        :param text: Received text
+        :param seq: Sequence number of the message (None if not numbered)
+        :return: The sequence number to acknowledge, or None
+        """
+        with self._condition:
+            if seq is None:
+                # Server without output streaming
+                self._session.write(text)
+            elif seq >= self._next:
+                self._pending[seq] = text
+                while self._next in self._pending:
+                    self._session.write(self._pending.pop(self._next))
+                    self._next += 1
+                self._condition.notify_all()
+
+            self._session.flush()
+            if seq is not None and \
+                    self._next - 1 - self._acked >= self._ack_step:
+                self._acked = self._next - 1
+                return self._acked
+
+    def wait(self, seq, timeout=OUTPUT_TIMEOUT):
+        """
+        Waits for the message with the given sequence number to be printed
+
+        :param seq: A sequence number
+        :param timeout: Maximum time to wait, in seconds
+        :return: True if the message has been printed
+        """
+        with self._condition:
+            if not _wait_for(self._condition, lambda: self._next > seq,
+                             timeout):
+                return False
+
+            self._acked = max(self._acked, seq)
+            return True
+
+
 class _HeraldOutputStream(object):
     """
-    The I/O handler for the Herald shell
+    The I/O handler for the Herald shell.
+
+    Output is buffered and sent when it reaches the chunk size or after a
+    delay, in numbered messages. When the client gives a window, the
+    number of messages not yet acknowledged is limited, blocking the
+    writers: the output of a command is sent with a bounded memory.
     """
-    def __init__(self, herald_svc, peer_uid, session_id):
+    # Text stream: lets the shell I/O handler write strings
+    encoding = "UTF-8"
+
+    def __init__(self, herald_svc, peer_uid, session_id,
+                 chunk_size=DEFAULT_OUTPUT_CHUNK,
+                 flush_delay=DEFAULT_OUTPUT_DELAY):
         """
         Sets up the I/O handler
 
         :param herald_svc: Herald service
         :param peer_uid: Shell client peer UID
         :param session_id: Shell session ID
+        :param chunk_size: Size of the buffered output triggering a message
+        :param flush_delay: Maximum time output stays in the buffer (0 to
+                            send the buffer on each flush)
         """
         self._herald = herald_svc
         self._peer = peer_uid
         self._session = session_id
-        self._buffer = StringIO()
+        self._chunk_size = max(1, int(chunk_size))
+        self._flush_delay = max(0., float(flush_delay or 0))
+
+        # Buffered output
+        self._buffer = []
+        self._size = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+        # Messages ordering
+        self._send_lock = threading.Lock()
+
+        # Flow control: last sent and last acknowledged sequence numbers
+        self._seq = 0
+        self._acked = 0
+        self._window = None
+        self._condition = threading.Condition()
+
+    @property
+    def last_seq(self):
+        """
+        Sequence number of the last message sent
+        """
+        return self._seq
+
+    def set_window(self, window):
+        """
+        Sets the flow control window given by the client
+
+        :param window: Maximum number of messages not yet acknowledged
+                       (None to disable flow control)
+        """
+        with self._condition:
+            self._window = max(1, int(window)) if window else None
+            self._condition.notify_all()
+
+    def acknowledge(self, seq):
+        """
+        The client acknowledged the messages up to the given one
+
+        :param seq: A sequence number
+        """
+        with self._condition:
+            if seq > self._acked:
+                self._acked = seq
+                self._condition.notify_all()
 
     def write(self, data):
         """
         Writes data to a buffer
         """
-        self._buffer.write(data)
+        with self._lock:
+            self._buffer.append(data)
+            self._size += len(data)
+            full = self._size >= self._chunk_size
+            if not full and self._flush_delay and self._timer is None:
+                self._timer = threading.Timer(self._flush_delay, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.sync()
 
     def flush(self):
         """
-        Sends buffered data to the target
+        Sends buffered data to the target, unless it is sent after a delay
         """
-        # Flush buffer
-        line = self._buffer.getvalue()
-        self._buffer = StringIO()
+        if not self._flush_delay:
+            self.sync()
+
+    def sync(self):
+        """
+        Sends buffered data to the target now
+        """
+        with self._send_lock:
+            with self._lock:
+                text = ''.join(self._buffer)
+                self._buffer = []
+                self._size = 0
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            for start in range(0, len(text), self._chunk_size):
+                self.__send(text[start:start + self._chunk_size])
+
+    def close(self):
+        """
+        Stops the delayed flush and releases the blocked writers
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        self.set_window(None)
+
+    def __send(self, text):
+        """
+        Sends a message, waiting for the client window if necessary
+
+        :param text: Text to send
+        """
+        with self._condition:
+            if self._window is not None and not self.__wait_window():
+                _logger.warning("Shell client %s doesn't acknowledge output: "
+                                "flow control disabled", self._peer)
+                self._window = None
+
+            self._seq += 1
+            content = {"session_id": self._session, "text": text,
+                       "seq": self._seq}
 
-        # Send the message
-        content = {"session_id": self._session, "text": line}
         self._herald.fire(self._peer, beans.Message(MSG_CLIENT_PRINT, content))
 
+    def __wait_window(self):
+        """
+        Waits for the client window to have room for a message.
+        Must be called while holding the condition.
+
+        :return: False on timeout
+        """
+        return _wait_for(
+            self._condition,
+            lambda: self._window is None or
+            self._seq - self._acked < self._window, OUTPUT_TIMEOUT)
+
 
 class _HeraldInputStream(object):
     """
     The I/O handler for the Herald shell
     """
-    def __init__(self, herald_svc, peer_uid, session_id):
+    def __init__(self, herald_svc, peer_uid, session_id, output=None):
         """
         Sets up the I/O handler
 
         :param herald_svc: Herald service
         :param peer_uid: Shell client peer UID
         :param session_id: Shell session ID
+        :param output: The _HeraldOutputStream of the session
         """
         self._herald = herald_svc
         self._peer = peer_uid
         self._session = session_id
+        self._output = output
+
+        # Lines given in advance by the client
+        self._lines = collections.deque()
+
+    def feed(self, lines):
+        """
+        Stores lines sent in advance by the client, read before prompting it
+
+        :param lines: A list of lines
+        """
+        self._lines.extend(lines)
+
+    def clear(self):
+        """
+        Forgets the lines sent in advance
+
+        :return: The number of lines forgotten
+        """
+        count = len(self._lines)
+        self._lines.clear()
+        return count
+
+    def readline_buffered(self):
+        """
+        Returns the next line sent in advance
+
+        :raise IndexError: No line sent in advance
+        """
+        return self._lines.popleft()
 
     def readline(self):
         """
-        Waits for a line from the Herald client
+        Returns the next line sent in advance, or waits for a line from the
+        Herald client
         """
+        try:
+            return self._lines.popleft()
+        except IndexError:
+            # Nothing in advance: prompt the client
+            pass
+
+        if self._output is not None:
+            # Print the prompt before asking for the line
+            self._output.sync()
+
         content = {"session_id": self._session}
         prompt_msg = self._herald.send(
             self._peer, beans.Message(MSG_CLIENT_PROMPT, content))
@@ -386,6 +782,8 @@ class _HeraldInputStream(object):
 @Requires("_shell", pelix.shell.SERVICE_SHELL)
 @Provides((herald.SERVICE_LISTENER, herald.SERVICE_DIRECTORY_LISTENER))
 @Property('_filters', herald.PROP_FILTERS, ['{0}/*'.format(_PREFIX_SERVER)])
+@Property('_chunk_size', PROP_OUTPUT_CHUNK, DEFAULT_OUTPUT_CHUNK)
+@Property('_flush_delay', PROP_OUTPUT_DELAY, DEFAULT_OUTPUT_DELAY)
 @Instantiate("herald-remote-shell-server")
 class HeraldRemoteShellServer(object):
     """
@@ -403,8 +801,18 @@ class HeraldRemoteShellServer(object):
         # Local peer UID
         self._local_uid = None
 
+        # Output streaming configuration
+        self._chunk_size = DEFAULT_OUTPUT_CHUNK
+        self._flush_delay = DEFAULT_OUTPUT_DELAY
+
         # Active session ID => local shell session
         self._sessions = {}
+
+        # Active session ID => _HeraldOutputStream
+        self._outputs = {}
+
+        # Active session ID => _HeraldInputStream
+        self._inputs = {}
         self.__lock = threading.Lock()
 
     @Validate
@@ -436,6 +844,10 @@ class HeraldRemoteShellServer(object):
 
             # Clear sessions
             self._sessions.clear()
+            for output in self._outputs.values():
+                output.close()
+            self._outputs.clear()
+            self._inputs.clear()
 
     def herald_message(self, herald_svc, message):
         """
@@ -454,6 +866,19 @@ class HeraldRemoteShellServer(object):
             elif kind == "command":
                 # Execute a command
                 self._run_command(herald_svc, message)
+
+            elif kind == "script":
+                # Execute a list of commands
+                self._run_script(herald_svc, message)
+
+            elif kind == "ack":
+                # Output acknowledged by the client
+                try:
+                    output = self._outputs[message.content['session_id']]
+                except KeyError:
+                    pass
+                else:
+                    output.acknowledge(message.content['seq'])
         except Exception as ex:
             herald_svc.reply(
                 message, "Error handling message: {0}".format(ex),
@@ -473,6 +898,10 @@ class HeraldRemoteShellServer(object):
             # Clear them
             for session_id in lost_sessions:
                 del self._sessions[session_id]
+                self._inputs.pop(session_id, None)
+                output = self._outputs.pop(session_id, None)
+                if output is not None:
+                    output.close()
 
     @staticmethod
     def peer_registered(peer):
@@ -502,9 +931,11 @@ class HeraldRemoteShellServer(object):
         session_id = str(uuid.uuid4())
 
         # Prepare a shell session
-        io_handler = pelix.shell.beans.IOHandler(
-            _HeraldInputStream(herald_svc, message.sender, session_id),
-            _HeraldOutputStream(herald_svc, message.sender, session_id))
+        output = _HeraldOutputStream(herald_svc, message.sender, session_id,
+                                     self._chunk_size, self._flush_delay)
+        input_stream = _HeraldInputStream(herald_svc, message.sender,
+                                          session_id, output)
+        io_handler = pelix.shell.beans.IOHandler(input_stream, output)
 
         session = pelix.shell.beans.ShellSession(io_handler)
         session.set(SESSION_SESSION_ID, session_id)
@@ -513,6 +944,8 @@ class HeraldRemoteShellServer(object):
         with self.__lock:
             # Store it
             self._sessions[session_id] = session
+            self._outputs[session_id] = output
+            self._inputs[session_id] = input_stream
 
         # Reply content
         content = {"session_id": session_id,
@@ -535,17 +968,65 @@ class HeraldRemoteShellServer(object):
         try:
             with self.__lock:
                 session = self._sessions[session_id]
+                output = self._outputs[session_id]
         except KeyError:
             # Unknown session
             _logger.warning("Unknown session for execution: %s", session_id)
             herald_svc.reply(message, session_id, MSG_CLIENT_CLOSE)
             return
 
-        # Execute the command
+        # Execute the command, with the flow control window of the client
+        output.set_window(message.content.get('window'))
         result = self._shell.execute(message.content['line'], session)
+        output.sync()
+
+        # Return the result and the number of the last output message
+        herald_svc.reply(message, {"result": result, "seq": output.last_seq})
+
+    def _run_script(self, herald_svc, message):
+        """
+        Runs the given lines as commands, in order, in a single request.
+        The commands reading input get the next lines, without prompting the
+        client.
+
+        :param herald_svc: Herald service
+        :param message: Received message
+        """
+        # Find the session
+        session_id = message.content['session_id']
+        try:
+            with self.__lock:
+                session = self._sessions[session_id]
+                output = self._outputs[session_id]
+                input_stream = self._inputs[session_id]
+        except KeyError:
+            # Unknown session
+            _logger.warning("Unknown session for execution: %s", session_id)
+            herald_svc.reply(message, session_id, MSG_CLIENT_CLOSE)
+            return
+
+        output.set_window(message.content.get('window'))
+        input_stream.feed(message.content['lines'])
+
+        results = []
+        while True:
+            try:
+                line = input_stream.readline_buffered()
+            except IndexError:
+                # End of script
+                break
+
+            if line.strip().lower() == "exit":
+                break
+            elif line.strip():
+                results.append(self._shell.execute(line, session))
+
+        input_stream.clear()
+        output.sync()
 
-        # Return the result
-        herald_svc.reply(message, result)
+        # Return the results and the number of the last output message
+        herald_svc.reply(message, {"results": results,
+                                   "seq": output.last_seq})
 
     def _close_session(self, herald_svc, message):
         """
@@ -558,6 +1039,10 @@ class HeraldRemoteShellServer(object):
         try:
             with self.__lock:
                 del self._sessions[session_id]
+                self._inputs.pop(session_id, None)
+                output = self._outputs.pop(session_id, None)
+                if output is not None:
+                    output.close()
         except KeyError:
             # Unknown session
             _logger.warning("Unknown session to close: %s", session_id)
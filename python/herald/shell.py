@@ -39,6 +39,7 @@ __docformat__ = "restructuredtext en"
 from herald.exceptions import NoTransport, HeraldTimeout, NoListener
 import herald
 import herald.beans as beans
+import herald.remote
 
 # Pelix
 from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
@@ -52,6 +53,8 @@ import pelix.shell
 @Requires("_herald", herald.SERVICE_HERALD)
 @Requires("_directory", herald.SERVICE_DIRECTORY)
 @Requires("_utils", pelix.shell.SERVICE_SHELL_UTILS)
+@Requires("_rpc_stats", herald.remote.SERVICE_RPC_STATS, aggregate=True,
+          optional=True)
 @Provides(pelix.shell.SERVICE_SHELL_COMMAND)
 @Instantiate("herald-shell")
 class HeraldCommands(object):
@@ -65,6 +68,7 @@ class HeraldCommands(object):
         self._herald = None
         self._directory = None
         self._utils = None
+        self._rpc_stats = []
 
     def get_namespace(self):
         """
@@ -83,7 +87,9 @@ class HeraldCommands(object):
                 ("post_group", self.post_group),
                 ("forget", self.forget),
                 ("peers", self.list_peers),
-                ("local", self.local_peer), ]
+                ("local", self.local_peer),
+                ("rpc_stats", self.rpc_stats),
+                ("routes", self.routes), ]
 
     def fire(self, io_handler, target, subject, *words):
         """
@@ -239,3 +245,55 @@ class HeraldCommands(object):
         for peer in self._directory.get_peers():
             self.__print_peer(io_handler, peer)
             io_handler.write_line("")
+
+    def routes(self, io_handler, peer=None):
+        """
+        Prints the health of the routes to peers: state, average send time
+        (in milliseconds) and error rate
+        """
+        lines = []
+        for route in sorted(self._herald.get_routes(peer),
+                            key=lambda item: (item["peer"], item["access"])):
+            latency = route["latency"]
+            lines.append((route["peer"], route["access"], route["state"],
+                          "-" if latency is None
+                          else "{0:.3f}".format(latency * 1000),
+                          "{0:.2f}".format(route["errorRate"]),
+                          route["failures"]))
+
+        if not lines:
+            io_handler.write_line("No route known yet")
+            return
+
+        io_handler.write(self._utils.make_table(
+            ("Peer", "Access", "State", "Latency", "Error rate", "Failures"),
+            lines))
+
+    def rpc_stats(self, io_handler):
+        """
+        Prints the execution times (in milliseconds) of the methods called
+        through the Herald RPC exporters
+        """
+        if not self._rpc_stats:
+            io_handler.write_line("No Herald RPC exporter available")
+            return
+
+        lines = []
+        admitted = {}
+        for exporter in self._rpc_stats:
+            stats = exporter.get_stats()
+            kind = ', '.join(stats["configurations"])
+            for endpoint, count in stats["admitted"].items():
+                admitted[endpoint] = admitted.get(endpoint, 0) + count
+            for name, summary in sorted(stats["methods"].items()):
+                lines.append(
+                    [kind, name, summary["count"], summary["errors"]] +
+                    ["{0:.3f}".format(summary[key] / 1000.)
+                     for key in ("min", "mean", .5, .9, .99, "max")])
+
+        io_handler.write(self._utils.make_table(
+            ("Exporter", "Method", "Count", "Errors", "Min", "Mean", "P50",
+             "P90", "P99", "Max"), lines))
+        for endpoint, count in sorted(admitted.items()):
+            io_handler.write_line("{0}: {1} request(s) in progress",
+                                  endpoint, count)
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Herald start-up utilities: selection of the transport bundles according to
+the framework configuration and profiling of the bundles import time
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald transports constants (no dependency)
+import herald.transports.http as http
+import herald.transports.loopback as loopback
+import herald.transports.mqtt as mqtt
+import herald.transports.xmpp as xmpp
+
+# Standard library
+import collections
+import importlib
+import sys
+import time
+
+# ------------------------------------------------------------------------------
+
+PROP_HTTP_PORT = "pelix.http.port"
+"""
+Port of the HTTP server (same as pelix.http.HTTP_SERVICE_PORT, without
+importing the Pelix HTTP package)
+"""
+
+TRANSPORTS = collections.OrderedDict((
+    (http.ACCESS_ID,
+     ((PROP_HTTP_PORT,),
+      ('pelix.http.basic',
+       'herald.transports.http.directory',
+       'herald.transports.http.discovery_multicast',
+       'herald.transports.http.servlet',
+       'herald.transports.http.transport'))),
+    (xmpp.ACCESS_ID,
+     ((xmpp.PROP_XMPP_SERVER,),
+      ('herald.transports.xmpp.directory',
+       'herald.transports.xmpp.transport'))),
+    (mqtt.ACCESS_ID,
+     ((mqtt.PROP_MQTT_HOST,),
+      ('herald.transports.mqtt.directory',
+       'herald.transports.mqtt.transport'))),
+    (loopback.ACCESS_ID,
+     ((loopback.PROP_LOOPBACK_HUB,),
+      ('herald.transports.loopback.directory',
+       'herald.transports.loopback.transport'))),
+))
+"""
+Transport access ID -> (configuration properties, bundles).
+A transport is configured if one of its properties is set.
+"""
+
+# ------------------------------------------------------------------------------
+
+
+def configured_transports(properties):
+    """
+    Lists the transports configured in the given framework properties
+
+    :param properties: Framework properties
+    :return: The list of the access IDs of the configured transports
+    """
+    return [access_id for access_id, (keys, _) in TRANSPORTS.items()
+            if any(properties.get(key) is not None for key in keys)]
+
+
+def select_bundles(bundles, properties):
+    """
+    Completes the given bundles with those of the transports configured in
+    the framework properties. Other transports bundles are not installed,
+    which avoids the import of their dependencies.
+
+    :param bundles: Bundles always installed
+    :param properties: Framework properties
+    :return: The tuple of the bundles to install
+    """
+    result = list(bundles)
+    for access_id in configured_transports(properties):
+        result.extend(name for name in TRANSPORTS[access_id][1]
+                      if name not in result)
+    return tuple(result)
+
+
+def profile_imports(bundles):
+    """
+    Imports the given modules in order, measuring the time spent to import
+    each one. A module only counts the dependencies which were not loaded by
+    the previous ones.
+
+    :param bundles: Names of the modules to import
+    :return: A list of (name, time in seconds, number of new modules) tuples
+    """
+    profile = []
+    for name in bundles:
+        nb_modules = len(sys.modules)
+        start = time.time()
+        importlib.import_module(name)
+        profile.append((name, time.time() - start,
+                        len(sys.modules) - nb_modules))
+    return profile
+
+
+def print_import_profile(profile, output=None):
+    """
+    Prints the result of profile_imports(), slowest imports first
+
+    :param profile: Result of profile_imports()
+    :param output: Output stream (standard output by default)
+    """
+    if output is None:
+        output = sys.stdout
+
+    output.write("{0:<48} {1:>10} {2:>8}\n".format(
+        "Bundle", "Time (ms)", "Modules"))
+    for name, duration, nb_modules in sorted(profile, key=lambda item: item[1],
+                                             reverse=True):
+        output.write("{0:<48} {1:>10.1f} {2:>8}\n".format(
+            name, duration * 1000, nb_modules))
+
+    output.write("{0:<48} {1:>10.1f} {2:>8}\n".format(
+        "Total", sum(item[1] for item in profile) * 1000,
+        sum(item[2] for item in profile)))
+    output.flush()
+
+
+def parse_properties(items):
+    """
+    Parses framework properties given as "name=value" strings
+
+    :param items: A list of "name=value" strings (can be None)
+    :return: A dictionary of properties
+    :raise ValueError: Invalid property definition
+    """
+    properties = {}
+    for item in items or ():
+        name, sep, value = item.partition('=')
+        name = name.strip()
+        if not sep or not name:
+            raise ValueError("Invalid property definition: {0}".format(item))
+        properties[name] = value
+    return properties
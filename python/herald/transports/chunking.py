@@ -0,0 +1,386 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Transport-independent fragmentation of large messages
+
+A serialized message larger than the chunk size of a transport is split into
+"herald/chunk" messages, each one carrying a part of the serialized message.
+The chunks of all large messages are sent by a single thread, one chunk of
+each message in turn, while small messages are sent directly: a large
+message doesn't delay the other ones.
+
+The receiving side gives the chunks to a Reassembler, which returns the
+original serialized message once all its chunks have been received.
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald
+import herald
+import herald.beans as beans
+import herald.utils as utils
+
+# Standard library
+import collections
+import json
+import logging
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+SUBJECT_CHUNK = "herald/chunk"
+""" Subject of the messages carrying a part of a large message """
+
+CHUNK_ID = "id"
+""" Chunk content entry: UID of the original message """
+
+CHUNK_INDEX = "index"
+""" Chunk content entry: index of the chunk (starting at 0) """
+
+CHUNK_COUNT = "count"
+""" Chunk content entry: number of chunks of the original message """
+
+CHUNK_DATA = "data"
+""" Chunk content entry: part of the serialized original message """
+
+DEFAULT_CHUNK_SIZE = 65536
+""" Default maximum size of a serialized message, in characters """
+
+DEFAULT_MAX_MEMORY = 64 * 1024 * 1024
+""" Default maximum size of all the partial messages kept by a Reassembler """
+
+DEFAULT_TIMEOUT = 60
+""" Default time to wait for the chunks of a message, in seconds """
+
+COPIED_HEADERS = (herald.MESSAGE_HEADER_SENDER_UID,
+                  herald.MESSAGE_HEADER_TARGET_PEER,
+                  herald.MESSAGE_HEADER_TARGET_GROUP)
+""" Headers of the original message copied in its chunks """
+
+# ------------------------------------------------------------------------------
+
+
+def make_chunks(message, content, chunk_size):
+    """
+    Splits a serialized message into serialized chunk messages
+
+    :param message: The original message bean
+    :param content: The serialized original message
+    :param chunk_size: Maximum size of a serialized chunk, in characters
+    :return: The list of serialized chunks
+    :raise ValueError: The chunk size is too small
+    """
+    def serialize(index, count, data):
+        """
+        Serializes a chunk message
+        """
+        chunk = beans.Message(SUBJECT_CHUNK, {CHUNK_ID: message.uid,
+                                              CHUNK_INDEX: index,
+                                              CHUNK_COUNT: count,
+                                              CHUNK_DATA: data})
+        for header in COPIED_HEADERS:
+            value = message.get_header(header)
+            if value is not None:
+                chunk.add_header(header, value)
+        return utils.to_json(chunk)
+
+    # Size taken by the chunk envelope (the count is the worst case)
+    budget = chunk_size - len(serialize(len(content), len(content), ""))
+    if budget < 16:
+        raise ValueError("Chunk size too small: {0}".format(chunk_size))
+
+    # Compute the slices, according to their escaped size
+    parts = []
+    pos = 0
+    while pos < len(content):
+        size = budget
+        while True:
+            part = content[pos:pos + size]
+            escaped = len(json.dumps(part)) - 2
+            if escaped <= budget:
+                break
+            size = max(1, size * budget // escaped - 1)
+        parts.append(part)
+        pos += len(part)
+
+    return [serialize(index, len(parts), part)
+            for index, part in enumerate(parts)]
+
+# ------------------------------------------------------------------------------
+
+
+class ChunkSender(object):
+    """
+    Sends serialized messages, splitting the large ones in chunks which are
+    sent in turn by a background thread
+    """
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, logname=None):
+        """
+        Sets up the sender
+
+        :param chunk_size: Maximum size of a serialized message, in characters
+        :param logname: Name of the logger
+        """
+        self._logger = logging.getLogger(logname or __name__)
+        self.__chunk_size = chunk_size
+
+        # Active streams: deque of (send method, deque of chunks)
+        self.__streams = collections.deque()
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__running = False
+
+    def start(self):
+        """
+        Starts the chunk sending thread
+        """
+        with self.__condition:
+            if self.__running:
+                return
+            self.__running = True
+
+        self.__thread = threading.Thread(target=self.__loop,
+                                         name="Herald-ChunkSender")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the chunk sending thread, dropping pending chunks
+        """
+        with self.__condition:
+            self.__running = False
+            self.__streams.clear()
+            self.__condition.notify_all()
+
+        if self.__thread is not None \
+                and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__thread = None
+
+    def send(self, message, content, send_method, chunk_method=None):
+        """
+        Sends a serialized message: small messages are sent immediately, in
+        the caller thread, large ones are sent by chunks in background.
+
+        The send methods are called with a single argument: the serialized
+        message or chunk to send. The chunk method should return once the
+        chunk has been written, in order to let other messages be sent
+        between two chunks.
+
+        :param message: The message bean
+        :param content: The serialized message
+        :param send_method: Method that sends a serialized message
+        :param chunk_method: Method that sends a chunk and waits for it to be
+                             written (defaults to send_method)
+        :return: The result of send_method() or None for a chunked message
+        :raise IOError: The chunk sender is stopped
+        """
+        if len(content) <= self.__chunk_size:
+            return send_method(content)
+
+        chunks = make_chunks(message, content, self.__chunk_size)
+        self._logger.debug("Sending message %s in %d chunks",
+                           message.uid, len(chunks))
+        with self.__condition:
+            if not self.__running:
+                raise IOError("Chunk sender is stopped")
+
+            self.__streams.append((chunk_method or send_method,
+                                   collections.deque(chunks)))
+            self.__condition.notify()
+
+    def __loop(self):
+        """
+        Sends the chunks of each active stream, in turn
+        """
+        while True:
+            with self.__condition:
+                while self.__running and not self.__streams:
+                    self.__condition.wait()
+
+                if not self.__running:
+                    return
+
+                send_method, chunks = self.__streams.popleft()
+
+            try:
+                send_method(chunks.popleft())
+            except Exception as ex:
+                # Drop the remaining chunks of this message
+                self._logger.error("Error sending a chunk: %s", ex)
+                continue
+
+            if chunks:
+                with self.__condition:
+                    if self.__running:
+                        # Come back to this stream later
+                        self.__streams.append((send_method, chunks))
+
+# ------------------------------------------------------------------------------
+
+
+class _PartialMessage(object):
+    """
+    The chunks received for a message
+    """
+    def __init__(self, count):
+        """
+        :param count: Number of chunks of the message
+        """
+        self.count = count
+        self.chunks = {}
+        self.size = 0
+        self.timestamp = time.time()
+
+
+class Reassembler(object):
+    """
+    Rebuilds serialized messages from their chunks
+    """
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, timeout=DEFAULT_TIMEOUT,
+                 logname=None):
+        """
+        Sets up the reassembler
+
+        :param max_memory: Maximum size of all partial messages, in
+                           characters. The oldest partial messages are
+                           dropped when this limit is reached.
+        :param timeout: Time to wait for a missing chunk, in seconds
+        :param logname: Name of the logger
+        """
+        self._logger = logging.getLogger(logname or __name__)
+        self.__max_memory = max_memory
+        self.__timeout = timeout
+
+        # (Sender UID, message UID) -> _PartialMessage, oldest first
+        self.__partials = collections.OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def size(self):
+        """
+        Size of the partial messages currently kept, in characters
+        """
+        return self.__size
+
+    def clear(self):
+        """
+        Drops all partial messages
+        """
+        with self.__lock:
+            self.__partials.clear()
+            self.__size = 0
+
+    def __drop(self, key, reason):
+        """
+        Drops a partial message. Must be called while holding the lock.
+
+        :param key: Key of the partial message
+        :param reason: Reason of the drop, for the logs
+        """
+        partial = self.__partials.pop(key)
+        self.__size -= partial.size
+        self._logger.warning("Dropped message %s from %s (%s): %d/%d chunks "
+                             "received", key[1], key[0], reason,
+                             len(partial.chunks), partial.count)
+
+    def purge(self):
+        """
+        Drops the partial messages which have waited too long for their chunks
+        """
+        limit = time.time() - self.__timeout
+        with self.__lock:
+            for key, partial in list(self.__partials.items()):
+                if partial.timestamp >= limit:
+                    # Next messages are younger
+                    break
+                self.__drop(key, "timeout")
+
+    def add(self, message):
+        """
+        Handles a received chunk message
+
+        :param message: A MessageReceived bean with the "herald/chunk"
+                        subject
+        :return: The complete serialized message, or None if some chunks are
+                 still missing
+        :raise ValueError: Invalid chunk
+        """
+        try:
+            content = message.content
+            msg_uid = content[CHUNK_ID]
+            index = int(content[CHUNK_INDEX])
+            count = int(content[CHUNK_COUNT])
+            data = content[CHUNK_DATA]
+        except (KeyError, TypeError) as ex:
+            raise ValueError("Invalid chunk: {0}".format(ex))
+
+        if not 0 <= index < count:
+            raise ValueError("Invalid chunk index: {0}/{1}"
+                             .format(index, count))
+        elif len(data) > self.__max_memory:
+            raise ValueError("Chunk too large: {0}".format(len(data)))
+
+        self.purge()
+
+        key = (message.sender, msg_uid)
+        with self.__lock:
+            partial = self.__partials.get(key)
+            if partial is None:
+                partial = self.__partials[key] = _PartialMessage(count)
+            elif count != partial.count or index >= partial.count:
+                raise ValueError("Inconsistent chunk: {0}/{1} instead of "
+                                 "{2} chunks".format(index, count,
+                                                     partial.count))
+            elif index in partial.chunks:
+                # Duplicated chunk
+                return None
+
+            partial.chunks[index] = data
+            partial.size += len(data)
+            self.__size += len(data)
+
+            if len(partial.chunks) == partial.count:
+                # Message complete
+                del self.__partials[key]
+                self.__size -= partial.size
+                return ''.join(partial.chunks[idx]
+                               for idx in range(partial.count))
+
+            # Stay under the memory limit, dropping the oldest messages
+            while self.__size > self.__max_memory:
+                self.__drop(next(iter(self.__partials)), "memory limit")
+
+        return None
@@ -530,6 +530,9 @@ class MulticastHeartbeat(object):
         self._peer_lst = {}
         self._lst_lock = threading.Lock()
 
+        # Clock of the Last Time Seen (replaced by simulations)
+        self._clock = time.time
+
     @Validate
     def _validate(self, _):
         """
@@ -626,7 +629,7 @@ class MulticastHeartbeat(object):
         elif kind == PACKET_TYPE_HEARTBEAT:
             with self._lst_lock:
                 # Update the peer LST
-                self._peer_lst[peer_uid] = time.time()
+                self._peer_lst[peer_uid] = self._clock()
 
             if peer_uid not in self._directory:
                 # The peer isn't known, register it
@@ -680,35 +683,46 @@ class MulticastHeartbeat(object):
             # Wait 20 seconds before next loop
             self._stop_event.wait(20)
 
+    def _check_ttl(self):
+        """
+        Validates the LST of all peers and removes those who took to long to
+        respond
+
+        :return: The UIDs of the removed peers
+        """
+        with self._lst_lock:
+            loop_start = self._clock()
+            to_delete = set()
+
+            for uid, last_seen in self._peer_lst.items():
+                if not last_seen:
+                    # No LST for this peer
+                    _logger.debug("Invalid LST for %s", uid)
+
+                elif (loop_start - last_seen) > self._peer_ttl:
+                    # TTL reached
+                    to_delete.add(uid)
+                    _logger.debug("Peer %s reached TTL.", uid)
+
+                    self._probe.store(
+                        PROBE_CHANNEL_MULTICAST,
+                        {"uid": uid, "timestamp": time.time(),
+                         "event": "timeout"})
+
+            for uid in to_delete:
+                # Unregister those peers
+                del self._peer_lst[uid]
+                self._directory.unregister(uid)
+
+        return to_delete
+
     def __lst_loop(self):
         """
         Loop that validates the LST of all peers and removes those who took
         to long to respond
         """
         while not self._stop_event.is_set():
-            with self._lst_lock:
-                loop_start = time.time()
-                to_delete = set()
-
-                for uid, last_seen in self._peer_lst.items():
-                    if not last_seen:
-                        # No LST for this peer
-                        _logger.debug("Invalid LST for %s", uid)
-
-                    elif (loop_start - last_seen) > self._peer_ttl:
-                        # TTL reached
-                        to_delete.add(uid)
-                        _logger.debug("Peer %s reached TTL.", uid)
-
-                        self._probe.store(
-                            PROBE_CHANNEL_MULTICAST,
-                            {"uid": uid, "timestamp": time.time(),
-                             "event": "timeout"})
-
-                for uid in to_delete:
-                    # Unregister those peers
-                    del self._peer_lst[uid]
-                    self._directory.unregister(uid)
+            self._check_ttl()
 
             # Wait a second or the event before next loop
             self._stop_event.wait(1)
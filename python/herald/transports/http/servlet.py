@@ -39,6 +39,7 @@ __docformat__ = "restructuredtext en"
 from . import ACCESS_ID, SERVICE_HTTP_DIRECTORY, SERVICE_HTTP_RECEIVER, \
     FACTORY_SERVLET, CONTENT_TYPE_JSON
 from . import beans
+from herald.probe import SERVICE_METRICS
 import herald.beans
 import herald.transports.peer_contact as peer_contact
 import herald.utils as utils
@@ -49,7 +50,9 @@ from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
     Property, Validate, Invalidate, RequiresBest
 from pelix.utilities import to_bytes, to_unicode
 import pelix.http
-import pelix.misc.jabsorb as jabsorb
+
+# Jabsorb conversion, loaded on first use
+jabsorb = utils.jabsorb
 
 # Standard library
 import json
@@ -62,6 +65,12 @@ import uuid
 
 _logger = logging.getLogger(__name__)
 
+METRICS_PATH = "/metrics"
+""" Sub-path of the servlet giving the probe metrics """
+
+CONTENT_TYPE_METRICS = "text/plain; version=0.0.4"
+""" Content type of the metrics (Prometheus text format) """
+
 # ------------------------------------------------------------------------------
 
 
@@ -80,6 +89,7 @@ def _make_json_result(code, message="", results=None):
 
 @ComponentFactory(FACTORY_SERVLET)
 @RequiresBest('_probe', herald.SERVICE_PROBE)
+@RequiresBest('_metrics', SERVICE_METRICS, optional=True)
 @Requires('_core', herald.SERVICE_HERALD_INTERNAL)
 @Requires('_directory', herald.SERVICE_DIRECTORY)
 @Requires('_http_directory', SERVICE_HTTP_DIRECTORY)
@@ -97,6 +107,7 @@ class HeraldServlet(object):
         # Herald services
         self._core = None
         self._directory = None
+        self._metrics = None
         self._probe = None
 
         # Peer contact handling
@@ -219,14 +230,27 @@ class HeraldServlet(object):
             self._host = None
             self._port = None
 
-    def do_GET(self, _, response):
+    def do_GET(self, request, response):
         """
-        Handles a GET request: sends the description of the local peer
+        Handles a GET request: sends the description of the local peer, or
+        the probe metrics in a text format if the "metrics" sub-path is
+        requested
 
-        :param _: The HTTP request bean
+        :param request: The HTTP request bean
         :param response: The HTTP response handler
         """
         # pylint: disable=C0103
+        path = request.get_path().split('?', 1)[0].rstrip('/')
+        if path == self._servlet_path.rstrip('/') + METRICS_PATH:
+            metrics = self._metrics
+            if metrics is None:
+                response.send_content(404, "No probe metrics service",
+                                      "text/plain")
+            else:
+                response.send_content(200, metrics.export_text(),
+                                      CONTENT_TYPE_METRICS)
+            return
+
         peer_dump = self._directory.get_local_peer().dump()
         jabsorb_content = jabsorb.to_jabsorb(peer_dump)
         content = json.dumps(jabsorb_content, default=utils.json_converter)
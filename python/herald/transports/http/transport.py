@@ -39,9 +39,6 @@ __docformat__ = "restructuredtext en"
 from . import ACCESS_ID, SERVICE_HTTP_RECEIVER, SERVICE_HTTP_TRANSPORT, \
     CONTENT_TYPE_JSON
 
-# HTTP requests
-import requests.exceptions
-
 # Herald Core
 from herald.exceptions import InvalidPeerAccess
 import herald
@@ -55,7 +52,6 @@ from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
 from pelix.utilities import to_str
 import pelix.utilities
 import pelix.threadpool
-import pelix.misc.jabsorb as jabsorb
 
 # Standard library
 import json
@@ -66,6 +62,9 @@ import time
 
 _logger = logging.getLogger(__name__)
 
+# HTTP requests, imported when the transport is validated
+requests = utils.LazyModule("requests")
+
 # ------------------------------------------------------------------------------
 
 
@@ -99,8 +98,8 @@ class HttpTransport(object):
         # Request send pool
         self.__pool = pelix.threadpool.ThreadPool(5, logname="herald-http")
 
-        # Requests session
-        self.__session = requests.Session()
+        # Requests session (created on validation)
+        self.__session = None
 
         # Local access information
         self.__access_port = None
@@ -130,9 +129,11 @@ class HttpTransport(object):
         """
         Component invalidated
         """
+        # Stop the pool first: queued requests still use the session
+        self.__pool.stop()
         self.__peer_uid = None
         self.__session.close()
-        self.__pool.stop()
+        self.__session = None
 
     def __get_access(self, peer, extra=None):
         """
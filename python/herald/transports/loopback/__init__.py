@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Herald loopback transport implementation: connects peers running in the
+same process, simulating network conditions
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+ACCESS_ID = "loopback"
+"""
+Access ID used by the loopback transport implementation
+"""
+
+DEFAULT_HUB = "default"
+"""
+Name of the hub used when none is configured
+"""
+
+# ------------------------------------------------------------------------------
+
+SERVICE_LOOPBACK_DIRECTORY = "herald.loopback.directory"
+"""
+Specification of the loopback transport directory
+"""
+
+SERVICE_LOOPBACK_TRANSPORT = "herald.loopback.transport"
+"""
+Specification of the loopback transport implementation
+"""
+
+# ------------------------------------------------------------------------------
+
+PROP_LOOPBACK_HUB = "loopback.hub"
+"""
+Name of the hub connecting the peers: only peers using the same hub can
+talk to each other
+"""
+
+PROP_LOOPBACK_LATENCY = "loopback.latency"
+"""
+Minimal time before a message is delivered, in seconds (default: 0)
+"""
+
+PROP_LOOPBACK_JITTER = "loopback.jitter"
+"""
+Maximal random delay added to the latency, in seconds (default: 0)
+"""
+
+PROP_LOOPBACK_LOSS = "loopback.loss"
+"""
+Probability for a message to be lost, between 0 and 1 (default: 0)
+"""
+
+PROP_LOOPBACK_REORDER = "loopback.reorder"
+"""
+Probability for a message to be held back, letting the following ones
+overtake it, between 0 and 1 (default: 0)
+"""
+
+PROP_LOOPBACK_SEED = "loopback.seed"
+"""
+Seed of the random generator simulating the network conditions, to replay
+a run (optional)
+"""
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Herald loopback transport beans
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald loopback
+from . import ACCESS_ID
+
+# ------------------------------------------------------------------------------
+
+
+class LoopbackAccess(object):
+    """
+    Description of a loopback access: the name of the hub the peer is
+    connected to
+    """
+    def __init__(self, hub):
+        """
+        Sets up the access
+
+        :param hub: Name of the hub
+        """
+        self.__hub = hub
+
+    def __hash__(self):
+        """
+        Hash is based on the hub name
+        """
+        return hash(self.__hub)
+
+    def __eq__(self, other):
+        """
+        Equality based on the hub name
+        """
+        if isinstance(other, LoopbackAccess):
+            return self.__hub == other.hub
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        """
+        String representation
+        """
+        return "loopback://{0}".format(self.__hub)
+
+    @property
+    def access_id(self):
+        """
+        Retrieves the access ID associated to this kind of access
+        """
+        return ACCESS_ID
+
+    @property
+    def hub(self):
+        """
+        Retrieves the name of the hub
+        """
+        return self.__hub
+
+    def dump(self):
+        """
+        Returns the content to store in a directory dump to describe this
+        access
+        """
+        return self.__hub
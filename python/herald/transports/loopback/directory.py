@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Herald loopback transport directory
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald loopback
+from . import ACCESS_ID, SERVICE_LOOPBACK_DIRECTORY
+from .beans import LoopbackAccess
+
+# Herald
+import herald
+
+# Pelix
+from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
+    Property, Validate, Invalidate, Instantiate
+
+# ------------------------------------------------------------------------------
+
+
+@ComponentFactory('herald-loopback-directory-factory')
+@Requires('_directory', herald.SERVICE_DIRECTORY)
+@Property('_access_id', herald.PROP_ACCESS_ID, ACCESS_ID)
+@Provides((herald.SERVICE_TRANSPORT_DIRECTORY, SERVICE_LOOPBACK_DIRECTORY))
+@Instantiate('herald-loopback-directory')
+class LoopbackDirectory(object):
+    """
+    Loopback directory for Herald: the hub keeps track of the peers
+    """
+    def __init__(self):
+        """
+        Sets up the transport directory
+        """
+        # Herald Core Directory
+        self._directory = None
+        self._access_id = ACCESS_ID
+
+    @Validate
+    def _validate(self, _):
+        """
+        Component validated
+        """
+        pass
+
+    @Invalidate
+    def _invalidate(self, _):
+        """
+        Component invalidated
+        """
+        pass
+
+    def load_access(self, data):
+        """
+        Loads a dumped access
+
+        :param data: Result of a call to LoopbackAccess.dump()
+        :return: A LoopbackAccess bean
+        """
+        return LoopbackAccess(data)
+
+    def peer_access_set(self, peer, data):
+        """
+        The access to the given peer matching our access ID has been set
+
+        :param peer: The Peer bean
+        :param data: The peer access data, previously loaded with load_access()
+        """
+        pass
+
+    def peer_access_unset(self, peer, data):
+        """
+        The access to the given peer matching our access ID has been removed
+
+        :param peer: The Peer bean
+        :param data: The peer access data
+        """
+        pass
@@ -0,0 +1,312 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Shared queues connecting the loopback transports of a process
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald loopback
+from . import DEFAULT_HUB
+
+# Standard library
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+_logger = logging.getLogger(__name__)
+
+REORDER_HOLD = .001
+"""
+Minimal time a reordered message is held back, in seconds
+"""
+
+# ------------------------------------------------------------------------------
+
+
+class LinkConditions(object):
+    """
+    Simulates the conditions of a network link: latency, jitter, loss and
+    reordering
+    """
+    def __init__(self, latency=0, jitter=0, loss=0, reorder=0, seed=None):
+        """
+        :param latency: Minimal delivery delay, in seconds
+        :param jitter: Maximal random delay added to the latency, in seconds
+        :param loss: Probability for a message to be lost
+        :param reorder: Probability for a message to be held back
+        :param seed: Seed of the random generator
+        """
+        self.latency = max(0., float(latency or 0))
+        self.jitter = max(0., float(jitter or 0))
+        self.loss = min(1., max(0., float(loss or 0)))
+        self.reorder = min(1., max(0., float(reorder or 0)))
+        self.__random = random.Random(seed)
+
+        # Number of messages lost and reordered
+        self.lost = 0
+        self.reordered = 0
+
+    def __str__(self):
+        return "LinkConditions(latency={0}, jitter={1}, loss={2}, " \
+            "reorder={3})".format(self.latency, self.jitter, self.loss,
+                                  self.reorder)
+
+    def delay(self):
+        """
+        Computes the delivery delay of a message
+
+        :return: The delay in seconds, or None if the message is lost
+        """
+        rand = self.__random
+        if self.loss and rand.random() < self.loss:
+            self.lost += 1
+            return None
+
+        delay = self.latency
+        if self.jitter:
+            delay += rand.uniform(0, self.jitter)
+
+        if self.reorder and rand.random() < self.reorder:
+            # Hold the message long enough for the next ones to overtake it
+            self.reordered += 1
+            delay += self.latency + self.jitter + REORDER_HOLD
+        return delay
+
+
+class Hub(object):
+    """
+    Connects the loopback transports of a process.
+
+    Each transport joins the hub with the description of its peer and
+    receives the descriptions of the others. Messages are queued by
+    delivery time and handed to their target by a single thread.
+    """
+    def __init__(self, name):
+        """
+        :param name: Name of the hub
+        """
+        self.name = name
+
+        # Peer UID -> (end point, peer description)
+        self.__peers = {}
+        self.__lock = threading.Lock()
+
+        # Messages: (delivery time, order, target UID, payload)
+        self.__queue = []
+        self.__order = itertools.count()
+        self.__condition = threading.Condition()
+
+        # Delivery thread
+        self.__thread = None
+        self.__stopped = False
+
+        # Number of delivered messages
+        self.delivered = 0
+
+    def __str__(self):
+        return "Hub({0})".format(self.name)
+
+    def __contains__(self, uid):
+        """
+        Checks if the peer with the given UID is connected to the hub
+        """
+        return uid in self.__peers
+
+    def __len__(self):
+        """
+        Returns the number of connected peers
+        """
+        return len(self.__peers)
+
+    def join(self, uid, description, endpoint):
+        """
+        Connects a peer to the hub.
+
+        The end point must have the following methods:
+          - peer_joined(description): another peer joined the hub
+          - peer_left(uid): another peer left the hub
+          - deliver(payload): a message has been received
+
+        :param uid: UID of the peer
+        :param description: Description of the peer (dump)
+        :param endpoint: The end point of the peer
+        """
+        with self.__lock:
+            others = list(self.__peers.values())
+            self.__peers[uid] = (endpoint, description)
+            if self.__thread is None:
+                self.__start()
+
+        # Exchange descriptions
+        for other, other_description in others:
+            endpoint.peer_joined(other_description)
+            other.peer_joined(description)
+
+    def leave(self, uid):
+        """
+        Disconnects a peer from the hub
+
+        :param uid: UID of the peer
+        """
+        with self.__lock:
+            try:
+                del self.__peers[uid]
+            except KeyError:
+                # Unknown peer
+                return
+
+            others = [endpoint for endpoint, _ in self.__peers.values()]
+            if not self.__peers:
+                self.__stop()
+
+        for other in others:
+            other.peer_left(uid)
+
+    def send(self, target, payload, delay=0):
+        """
+        Queues a message
+
+        :param target: UID of the target peer
+        :param payload: Message payload
+        :param delay: Time before the message is delivered, in seconds
+        :return: False if the target is not connected to the hub
+        """
+        if target not in self.__peers:
+            return False
+
+        with self.__condition:
+            heapq.heappush(self.__queue, (time.time() + delay,
+                                          next(self.__order), target,
+                                          payload))
+            self.__condition.notify()
+        return True
+
+    def pending(self):
+        """
+        Returns the number of messages waiting to be delivered
+        """
+        return len(self.__queue)
+
+    def __start(self):
+        """
+        Starts the delivery thread. Must be called while holding the lock.
+        """
+        self.__stopped = False
+        self.__thread = threading.Thread(
+            target=self.__run, name="Herald-Loopback-{0}".format(self.name))
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __stop(self):
+        """
+        Stops the delivery thread and drops pending messages. Must be called
+        while holding the lock.
+        """
+        with self.__condition:
+            self.__stopped = True
+            del self.__queue[:]
+            self.__condition.notify()
+
+        if self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__thread = None
+
+    def __next(self):
+        """
+        Waits for the next message to deliver
+
+        :return: A (target, payload) tuple, or None if the hub is stopped
+        """
+        with self.__condition:
+            while not self.__stopped:
+                if self.__queue:
+                    wait = self.__queue[0][0] - time.time()
+                    if wait <= 0:
+                        return heapq.heappop(self.__queue)[2:]
+                else:
+                    wait = None
+
+                self.__condition.wait(wait)
+
+    def __run(self):
+        """
+        Delivery loop
+        """
+        while True:
+            item = self.__next()
+            if item is None:
+                # Hub stopped
+                return
+
+            target, payload = item
+            try:
+                endpoint = self.__peers[target][0]
+            except KeyError:
+                # The target left the hub
+                continue
+
+            try:
+                endpoint.deliver(payload)
+            except Exception as ex:
+                _logger.exception("Error delivering a message to %s: %s",
+                                  target, ex)
+            else:
+                self.delivered += 1
+
+# ------------------------------------------------------------------------------
+
+_HUBS = {}
+""" Name -> Hub """
+
+_HUBS_LOCK = threading.Lock()
+
+
+def get_hub(name=None):
+    """
+    Returns the hub with the given name, creating it if necessary
+
+    :param name: Name of the hub (default hub if None)
+    :return: A Hub object
+    """
+    name = name or DEFAULT_HUB
+    with _HUBS_LOCK:
+        try:
+            return _HUBS[name]
+        except KeyError:
+            hub = _HUBS[name] = Hub(name)
+            return hub
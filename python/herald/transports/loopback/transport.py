@@ -0,0 +1,315 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Herald loopback transport implementation
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Herald loopback
+from . import ACCESS_ID, SERVICE_LOOPBACK_TRANSPORT, PROP_LOOPBACK_HUB, \
+    PROP_LOOPBACK_LATENCY, PROP_LOOPBACK_JITTER, PROP_LOOPBACK_LOSS, \
+    PROP_LOOPBACK_REORDER, PROP_LOOPBACK_SEED
+from .beans import LoopbackAccess
+from .hub import LinkConditions, get_hub
+
+# Herald Core
+from herald.exceptions import InvalidPeerAccess
+import herald
+import herald.beans as beans
+import herald.utils as utils
+
+# Pelix
+from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
+    Property, Validate, Invalidate, Instantiate, RequiresBest
+
+# Standard library
+import logging
+import time
+
+# ------------------------------------------------------------------------------
+
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+
+
+@ComponentFactory('herald-loopback-transport-factory')
+@RequiresBest('_probe', herald.SERVICE_PROBE)
+@Requires('_directory', herald.SERVICE_DIRECTORY)
+@Requires('_herald', herald.SERVICE_HERALD_INTERNAL)
+@Provides((herald.SERVICE_TRANSPORT, SERVICE_LOOPBACK_TRANSPORT))
+@Property('_access_id', herald.PROP_ACCESS_ID, ACCESS_ID)
+@Property('_hub_name', PROP_LOOPBACK_HUB, None)
+@Property('_latency', PROP_LOOPBACK_LATENCY, None)
+@Property('_jitter', PROP_LOOPBACK_JITTER, None)
+@Property('_loss', PROP_LOOPBACK_LOSS, None)
+@Property('_reorder', PROP_LOOPBACK_REORDER, None)
+@Property('_seed', PROP_LOOPBACK_SEED, None)
+@Instantiate('herald-loopback-transport')
+class LoopbackTransport(object):
+    """
+    Loopback transport for Herald: messages are exchanged with the peers of
+    the same process through a hub, with simulated network conditions.
+
+    Properties left to None are read from the framework properties.
+    """
+    def __init__(self):
+        """
+        Sets up the transport
+        """
+        # Herald Core directory
+        self._directory = None
+
+        # Herald Core service
+        self._herald = None
+
+        # Debug probe
+        self._probe = None
+
+        # Properties
+        self._access_id = ACCESS_ID
+        self._hub_name = None
+        self._latency = None
+        self._jitter = None
+        self._loss = None
+        self._reorder = None
+        self._seed = None
+
+        # Local peer
+        self.__peer = None
+
+        # Hub and conditions of the messages sent by this peer
+        self.__hub = None
+        self.__conditions = None
+
+    @Validate
+    def _validate(self, context):
+        """
+        Component validated
+        """
+        def get_property(value, name):
+            """
+            Returns the component property or the framework one
+            """
+            if value is None:
+                value = context.get_property(name)
+            return value
+
+        self.__hub = get_hub(get_property(self._hub_name, PROP_LOOPBACK_HUB))
+        self.__conditions = LinkConditions(
+            get_property(self._latency, PROP_LOOPBACK_LATENCY),
+            get_property(self._jitter, PROP_LOOPBACK_JITTER),
+            get_property(self._loss, PROP_LOOPBACK_LOSS),
+            get_property(self._reorder, PROP_LOOPBACK_REORDER),
+            get_property(self._seed, PROP_LOOPBACK_SEED))
+        _logger.debug("Loopback transport on %s: %s", self.__hub,
+                      self.__conditions)
+
+        # Set our access and join the hub
+        self.__peer = self._directory.get_local_peer()
+        self.__peer.set_access(ACCESS_ID, LoopbackAccess(self.__hub.name))
+        self.__hub.join(self.__peer.uid, self.__peer.dump(), self)
+
+    @Invalidate
+    def _invalidate(self, _):
+        """
+        Component invalidated
+        """
+        self.__hub.leave(self.__peer.uid)
+        self.__peer.unset_access(ACCESS_ID)
+        self.__peer = None
+        self.__hub = None
+        self.__conditions = None
+
+    @property
+    def conditions(self):
+        """
+        The simulated conditions of the messages sent by this peer
+        """
+        return self.__conditions
+
+    def peer_joined(self, description):
+        """
+        Another peer joined the hub: registers it
+
+        :param description: Description of the peer
+        """
+        try:
+            self._directory.register(description)
+        except ValueError as ex:
+            _logger.error("Error registering loopback peer %s: %s",
+                          description.get('uid'), ex)
+
+    def peer_left(self, uid):
+        """
+        Another peer left the hub
+
+        :param uid: UID of the peer
+        """
+        try:
+            self._directory.get_peer(uid).unset_access(ACCESS_ID)
+        except KeyError:
+            # Unknown peer
+            pass
+
+    def deliver(self, payload):
+        """
+        Handles a message received from the hub
+
+        :param payload: The message, in JSON format
+        """
+        message = utils.from_json(payload)
+        if message is None:
+            _logger.error("Invalid message received from the hub")
+            return
+
+        sender_uid = message.sender
+        message.set_access(ACCESS_ID)
+        message.set_extra({"sender_uid": sender_uid,
+                           "parent_uid": message.uid})
+
+        # Log before giving message to Herald
+        self._probe.store(
+            herald.PROBE_CHANNEL_MSG_RECV,
+            {"uid": message.uid, "timestamp": time.time(),
+             "transport": ACCESS_ID, "subject": message.subject,
+             "source": sender_uid, "repliesTo": message.reply_to or "",
+             "transportSource": self.__hub.name})
+
+        self._herald.handle_message(message)
+
+    def __prepare_message(self, message, parent_uid=None, target_peer=None,
+                          target_group=None):
+        """
+        Converts a message to JSON, with the transport headers
+
+        :param message: The Message bean to send
+        :param parent_uid: UID of the message this one replies to (optional)
+        :param target_peer: UID of the target peer (optional)
+        :param target_group: Name of the target group (optional)
+        :return: The message in JSON format
+        """
+        message.add_header(herald.MESSAGE_HEADER_SENDER_UID, self.__peer.uid)
+        if parent_uid:
+            message.add_header(herald.MESSAGE_HEADER_REPLIES_TO, parent_uid)
+        if target_peer is not None:
+            message.add_header(herald.MESSAGE_HEADER_TARGET_PEER, target_peer)
+        if target_group is not None:
+            message.add_header(herald.MESSAGE_HEADER_TARGET_GROUP,
+                               target_group)
+        return utils.to_json(message)
+
+    def __send(self, target_uid, message, content):
+        """
+        Gives a message to the hub, unless the simulated network loses it
+
+        :param target_uid: UID of the target peer
+        :param message: The Message bean
+        :param content: The message in JSON format
+        :return: False if the target is not connected to the hub
+        """
+        self._probe.store(
+            herald.PROBE_CHANNEL_MSG_SEND,
+            {"uid": message.uid, "timestamp": time.time(),
+             "transport": ACCESS_ID, "subject": message.subject,
+             "target": target_uid, "transportTarget": self.__hub.name,
+             "repliesTo": message.get_header(herald.MESSAGE_HEADER_REPLIES_TO)
+             or ""})
+
+        if target_uid not in self.__hub:
+            return False
+
+        delay = self.__conditions.delay()
+        if delay is not None:
+            return self.__hub.send(target_uid, content, delay)
+
+        # Lost message: the sender can't tell
+        return True
+
+    def fire(self, peer, message, extra=None):
+        """
+        Fires a message to a peer
+
+        :param peer: A Peer bean
+        :param message: Message bean to send
+        :param extra: Extra information used in case of a reply
+        :raise InvalidPeerAccess: No information found to access the peer
+        """
+        parent_uid = None
+        target_uid = None
+        if extra is not None:
+            parent_uid = extra.get('parent_uid')
+            target_uid = extra.get('sender_uid')
+
+        if peer is not None:
+            target_uid = peer.uid
+            try:
+                hub = peer.get_access(ACCESS_ID).hub
+            except (KeyError, AttributeError):
+                hub = None
+
+            if hub != self.__hub.name:
+                # Peer not connected to our hub
+                target_uid = None
+
+        if not target_uid:
+            raise InvalidPeerAccess(beans.Target(peer=peer),
+                                    "No '{0}' access found"
+                                    .format(self._access_id))
+
+        content = self.__prepare_message(message, parent_uid, target_uid)
+        self._probe.store(
+            herald.PROBE_CHANNEL_MSG_CONTENT,
+            {"uid": message.uid, "content": content})
+
+        if not self.__send(target_uid, message, content):
+            raise InvalidPeerAccess(beans.Target(uid=target_uid),
+                                    "Peer not connected to {0}"
+                                    .format(self.__hub))
+
+    def fire_group(self, group, peers, message):
+        """
+        Fires a message to a group of peers
+
+        :param group: Name of a group
+        :param peers: Peers to communicate with
+        :param message: Message to send
+        :return: The list of reached peers
+        """
+        content = self.__prepare_message(message, target_group=group)
+        self._probe.store(
+            herald.PROBE_CHANNEL_MSG_CONTENT,
+            {"uid": message.uid, "content": content})
+
+        return set(peer for peer in peers
+                   if self.__send(peer.uid, message, content))
@@ -55,3 +55,8 @@ PROP_MQTT_PASSWORD = 'mqtt.password'
 """
 MQTT password property
 """
+
+PROP_MQTT_CHUNK_SIZE = 'mqtt.chunk.size'
+"""
+Maximum size of an MQTT payload: larger messages are sent by chunks
+"""
@@ -0,0 +1,659 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Minimal in-process MQTT 3.1.1 broker, used as a stand-in for a real broker
+in tests and benchmarks of the Herald MQTT transport.
+
+Supported features:
+
+* CONNECT/CONNACK, PINGREQ/PINGRESP, DISCONNECT
+* PUBLISH with QoS 0 and 1 (QoS 2 publications are accepted and delivered
+  with QoS 1)
+* SUBSCRIBE/UNSUBSCRIBE, with the ``+`` and ``#`` wildcards
+* Retained messages and (retained) will messages
+
+Sessions are always considered clean: subscriptions are not kept after a
+disconnection and QoS 1 messages are not retransmitted.
+
+:author: Ahmad Shahwan
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import logging
+import select
+import socket
+import struct
+import threading
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+__author__ = 'Ahmad Shahwan'
+
+# ------------------------------------------------------------------------------
+
+# Control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+MAX_QOS = 1
+""" Maximum QoS granted to subscribers """
+
+_log = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+
+
+def topic_matches(topic_filter, topic):
+    """
+    Checks if the given topic matches a subscription filter, according to the
+    MQTT 3.1.1 wildcards rules
+
+    :param topic_filter: A topic filter, which can contain wildcards
+    :param topic: A topic name
+    :return: True if the topic matches the filter
+    """
+    if topic.startswith('$') and topic_filter[:1] in ('+', '#'):
+        # Wildcards don't match topics starting with '$' (MQTT-4.7.2-1)
+        return False
+
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for idx, level in enumerate(filter_levels):
+        if level == '#':
+            # Multi-level wildcard: matches the parent and all sub-levels
+            return True
+        elif idx >= len(topic_levels):
+            # Topic is shorter than the filter
+            return False
+        elif level != '+' and level != topic_levels[idx]:
+            return False
+
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length):
+    """
+    Encodes the "remaining length" field of a fixed header
+
+    :param length: Length of the packet after the fixed header
+    :return: The encoded length (bytes)
+    """
+    encoded = bytearray()
+    while True:
+        digit = length % 128
+        length //= 128
+        if length > 0:
+            digit |= 0x80
+        encoded.append(digit)
+        if length == 0:
+            return bytes(encoded)
+
+
+def _encode_string(string):
+    """
+    Encodes an UTF-8 string, prefixed by its length
+
+    :param string: A string or bytes
+    :return: The encoded string (bytes)
+    """
+    if not isinstance(string, bytes):
+        string = string.encode('utf-8')
+    return struct.pack("!H", len(string)) + string
+
+
+def _make_packet(packet_type, flags, body=b''):
+    """
+    Prepares a control packet
+
+    :param packet_type: Kind of control packet
+    :param flags: Flags of the fixed header
+    :param body: Variable header and payload
+    :return: The full packet (bytes)
+    """
+    return bytes(bytearray(((packet_type << 4) | flags,))) \
+        + _encode_length(len(body)) + body
+
+
+class _Reader(object):
+    """
+    Sequential reader of a packet body
+    """
+    def __init__(self, data):
+        """
+        :param data: Body of a packet (bytes)
+        """
+        self.__data = data
+        self.__offset = 0
+
+    def remaining(self):
+        """
+        Returns the number of bytes not read yet
+        """
+        return len(self.__data) - self.__offset
+
+    def read(self, size):
+        """
+        Reads the given amount of bytes
+
+        :raise ValueError: Packet too short
+        """
+        if self.remaining() < size:
+            raise ValueError("Malformed packet")
+
+        start = self.__offset
+        self.__offset += size
+        return self.__data[start:self.__offset]
+
+    def read_byte(self):
+        """
+        Reads an unsigned byte
+        """
+        return struct.unpack("!B", self.read(1))[0]
+
+    def read_short(self):
+        """
+        Reads a big-endian unsigned short
+        """
+        return struct.unpack("!H", self.read(2))[0]
+
+    def read_bytes(self):
+        """
+        Reads a length-prefixed binary string
+        """
+        return self.read(self.read_short())
+
+    def read_string(self):
+        """
+        Reads a length-prefixed UTF-8 string
+        """
+        return self.read_bytes().decode('utf-8')
+
+    def read_all(self):
+        """
+        Reads all remaining bytes
+        """
+        return self.read(self.remaining())
+
+# ------------------------------------------------------------------------------
+
+
+class _Session(object):
+    """
+    Connection of a client to the broker
+    """
+    def __init__(self, broker, sock, address):
+        """
+        :param broker: The parent MqttBroker
+        :param sock: Client socket
+        :param address: Client address
+        """
+        self.broker = broker
+        self.socket = sock
+        self.address = address
+        self.client_id = None
+        self.keepalive = 0
+
+        # Topic filter -> granted QoS
+        self.subscriptions = {}
+
+        # Will message: (topic, payload, qos, retain) or None
+        self.will = None
+
+        # Outgoing packet ID
+        self.__next_id = 0
+
+        # Socket access
+        self.__write_lock = threading.Lock()
+        self.__closed = False
+
+    def __str__(self):
+        return "MQTT session {0} ({1})".format(self.client_id, self.address)
+
+    def next_packet_id(self):
+        """
+        Returns a new outgoing packet ID (1 to 65535)
+        """
+        with self.__write_lock:
+            self.__next_id = self.__next_id % 0xFFFF + 1
+            return self.__next_id
+
+    def send(self, packet):
+        """
+        Sends a packet to the client
+
+        :param packet: A full control packet (bytes)
+        :return: True if the packet has been written
+        """
+        with self.__write_lock:
+            if self.__closed:
+                return False
+            try:
+                self.socket.sendall(packet)
+                return True
+            except (IOError, OSError) as ex:
+                _log.debug("Error writing to %s: %s", self, ex)
+                return False
+
+    def deliver(self, topic, payload, qos, retain=False):
+        """
+        Sends a PUBLISH packet to the client
+
+        :param topic: Topic of the message
+        :param payload: Message payload (bytes)
+        :param qos: Delivery QoS
+        :param retain: Retain flag (for retained messages only)
+        """
+        flags = (qos << 1) | (1 if retain else 0)
+        body = _encode_string(topic)
+        if qos > 0:
+            body += struct.pack("!H", self.next_packet_id())
+        return self.send(_make_packet(PUBLISH, flags, body + payload))
+
+    def close(self):
+        """
+        Closes the client socket
+        """
+        with self.__write_lock:
+            if self.__closed:
+                return
+            self.__closed = True
+
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except (IOError, OSError):
+            # Socket already closed by the client
+            pass
+        self.socket.close()
+
+
+class MqttBroker(object):
+    """
+    A minimal MQTT 3.1.1 broker running in the current process
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        Sets up the broker
+
+        :param host: Address to bind to
+        :param port: Port to bind to (0 for a random port)
+        """
+        self._host = host
+        self._port = port
+
+        # Server socket and its thread
+        self._socket = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        # Client ID -> _Session
+        self._sessions = {}
+
+        # Topic -> (payload, qos)
+        self._retained = {}
+
+        # Broker state lock
+        self._lock = threading.RLock()
+
+        # Number of messages received and delivered
+        self.received = 0
+        self.delivered = 0
+
+    @property
+    def address(self):
+        """
+        The (host, port) tuple the broker listens to
+        """
+        return self._host, self._port
+
+    def start(self):
+        """
+        Starts listening to clients
+
+        :return: The (host, port) tuple the broker listens to
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self._host, self._port))
+        self._socket.listen(128)
+        self._port = self._socket.getsockname()[1]
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.__accept_loop,
+                                        name="MQTT-Broker-{0}"
+                                        .format(self._port))
+        self._thread.daemon = True
+        self._thread.start()
+        _log.debug("MQTT broker listening on %s:%d", self._host, self._port)
+        return self.address
+
+    def stop(self):
+        """
+        Stops the broker and closes all client connections
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self._socket.close()
+        self._socket = None
+
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._retained.clear()
+
+        for session in sessions:
+            session.close()
+
+    def __accept_loop(self):
+        """
+        Accepts client connections
+        """
+        while not self._stop_event.is_set():
+            ready = select.select([self._socket], [], [], .5)
+            if not ready[0]:
+                continue
+
+            try:
+                sock, address = self._socket.accept()
+            except (IOError, OSError):
+                continue
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, sock, address)
+            thread = threading.Thread(target=self.__client_loop,
+                                      args=(session,),
+                                      name="MQTT-Broker-Client")
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def __read_exactly(sock, size):
+        """
+        Reads the given number of bytes from the socket
+
+        :raise EOFError: Connection closed
+        """
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError("Connection closed")
+            data += chunk
+        return data
+
+    def __read_packet(self, sock):
+        """
+        Reads a control packet
+
+        :return: A (packet type, flags, body) tuple
+        :raise EOFError: Connection closed
+        """
+        header = ord(self.__read_exactly(sock, 1))
+        length = 0
+        multiplier = 1
+        while True:
+            digit = ord(self.__read_exactly(sock, 1))
+            length += (digit & 0x7F) * multiplier
+            if not digit & 0x80:
+                break
+            multiplier *= 128
+            if multiplier > 128 ** 3:
+                raise ValueError("Malformed remaining length")
+
+        body = self.__read_exactly(sock, length) if length else b''
+        return header >> 4, header & 0x0F, body
+
+    def __client_loop(self, session):
+        """
+        Handles the packets sent by a client
+
+        :param session: The client session
+        """
+        clean_disconnect = False
+        try:
+            packet_type, _, body = self.__read_packet(session.socket)
+            if packet_type != CONNECT:
+                raise ValueError("First packet must be CONNECT")
+
+            self.__handle_connect(session, body)
+
+            while not self._stop_event.is_set():
+                packet_type, flags, body = self.__read_packet(session.socket)
+                if packet_type == DISCONNECT:
+                    clean_disconnect = True
+                    break
+                self.__handle_packet(session, packet_type, flags, body)
+        except socket.timeout:
+            _log.debug("Keep alive timeout for %s", session)
+        except (EOFError, IOError, OSError) as ex:
+            _log.debug("Connection lost with %s: %s", session, ex)
+        except ValueError as ex:
+            _log.warning("Protocol error with %s: %s", session, ex)
+        finally:
+            self.__end_session(session, clean_disconnect)
+
+    def __end_session(self, session, clean_disconnect):
+        """
+        Cleans up a session and sends its will, if necessary
+
+        :param session: The client session
+        :param clean_disconnect: If True, the will message is discarded
+        """
+        with self._lock:
+            if self._sessions.get(session.client_id) is session:
+                del self._sessions[session.client_id]
+
+        session.close()
+        if session.will is not None and not clean_disconnect:
+            topic, payload, qos, retain = session.will
+            self.publish(topic, payload, qos, retain)
+
+    def __handle_connect(self, session, body):
+        """
+        Handles a CONNECT packet
+
+        :param session: The client session
+        :param body: Packet body
+        """
+        reader = _Reader(body)
+        protocol = reader.read_string()
+        level = reader.read_byte()
+        if protocol not in ('MQTT', 'MQIsdp') or level not in (3, 4):
+            # Unacceptable protocol version
+            session.send(_make_packet(CONNACK, 0, b'\x00\x01'))
+            raise ValueError("Unsupported protocol {0} v{1}"
+                             .format(protocol, level))
+
+        flags = reader.read_byte()
+        session.keepalive = reader.read_short()
+        session.client_id = reader.read_string() \
+            or "auto-{0}:{1}".format(*session.address)
+
+        if flags & 0x04:
+            # Will flag
+            will_topic = reader.read_string()
+            will_payload = reader.read_bytes()
+            session.will = (will_topic, will_payload,
+                            min((flags >> 3) & 0x03, MAX_QOS),
+                            bool(flags & 0x20))
+        if flags & 0x80:
+            # User name (not checked)
+            reader.read_string()
+        if flags & 0x40:
+            # Password (not checked)
+            reader.read_bytes()
+
+        if session.keepalive:
+            # Consider the client lost after 1.5 keep alive period
+            session.socket.settimeout(session.keepalive * 1.5)
+
+        with self._lock:
+            previous = self._sessions.get(session.client_id)
+            self._sessions[session.client_id] = session
+
+        if previous is not None:
+            # Same client ID: the previous connection must be closed
+            previous.close()
+
+        session.send(_make_packet(CONNACK, 0, b'\x00\x00'))
+
+    def __handle_packet(self, session, packet_type, flags, body):
+        """
+        Handles a control packet sent by a connected client
+
+        :param session: The client session
+        :param packet_type: Kind of packet
+        :param flags: Fixed header flags
+        :param body: Packet body
+        """
+        reader = _Reader(body)
+        if packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            retain = bool(flags & 0x01)
+            topic = reader.read_string()
+            packet_id = reader.read_short() if qos > 0 else None
+            payload = reader.read_all()
+
+            if qos == 1:
+                session.send(_make_packet(PUBACK, 0,
+                                          struct.pack("!H", packet_id)))
+            elif qos == 2:
+                session.send(_make_packet(PUBREC, 0,
+                                          struct.pack("!H", packet_id)))
+
+            self.publish(topic, payload, min(qos, MAX_QOS), retain)
+
+        elif packet_type == PUBREL:
+            session.send(_make_packet(PUBCOMP, 0, body[:2]))
+
+        elif packet_type == SUBSCRIBE:
+            packet_id = reader.read_short()
+            granted = bytearray()
+            new_filters = []
+            while reader.remaining():
+                topic_filter = reader.read_string()
+                qos = min(reader.read_byte() & 0x03, MAX_QOS)
+                new_filters.append((topic_filter, qos))
+                granted.append(qos)
+
+            # Subscriptions are read by publish() in other client threads
+            with self._lock:
+                session.subscriptions.update(new_filters)
+
+            session.send(_make_packet(SUBACK, 0, struct.pack("!H", packet_id)
+                                      + bytes(granted)))
+            self.__send_retained(session, new_filters)
+
+        elif packet_type == UNSUBSCRIBE:
+            packet_id = reader.read_short()
+            topic_filters = []
+            while reader.remaining():
+                topic_filters.append(reader.read_string())
+
+            with self._lock:
+                for topic_filter in topic_filters:
+                    session.subscriptions.pop(topic_filter, None)
+            session.send(_make_packet(UNSUBACK, 0,
+                                      struct.pack("!H", packet_id)))
+
+        elif packet_type == PINGREQ:
+            session.send(_make_packet(PINGRESP, 0))
+
+        elif packet_type in (PUBACK, PUBREC, PUBCOMP):
+            # Acknowledgements of our deliveries: nothing to retransmit
+            pass
+
+        else:
+            raise ValueError("Unexpected packet type {0}".format(packet_type))
+
+    def __send_retained(self, session, filters):
+        """
+        Sends the retained messages matching new subscriptions
+
+        :param session: The subscribing session
+        :param filters: A list of (topic filter, granted QoS) tuples
+        """
+        with self._lock:
+            retained = list(self._retained.items())
+
+        for topic, (payload, msg_qos) in retained:
+            for topic_filter, sub_qos in filters:
+                if topic_matches(topic_filter, topic):
+                    session.deliver(topic, payload, min(msg_qos, sub_qos),
+                                    True)
+                    break
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """
+        Delivers a message to the matching subscribers
+
+        :param topic: Topic of the message
+        :param payload: Message payload (bytes or string)
+        :param qos: QoS of the publication
+        :param retain: If True, the message is retained for future
+                       subscribers (an empty payload clears it)
+        :return: The number of sessions the message was delivered to
+        """
+        if not isinstance(payload, bytes):
+            payload = payload.encode('utf-8')
+
+        with self._lock:
+            self.received += 1
+            if retain:
+                if payload:
+                    self._retained[topic] = (payload, qos)
+                else:
+                    self._retained.pop(topic, None)
+
+            # Compute the delivery QoS of each subscriber (highest match)
+            targets = []
+            for session in self._sessions.values():
+                granted = [sub_qos for topic_filter, sub_qos
+                           in session.subscriptions.items()
+                           if topic_matches(topic_filter, topic)]
+                if granted:
+                    targets.append((session, min(qos, max(granted))))
+
+        delivered = 0
+        for session, delivery_qos in targets:
+            if session.deliver(topic, payload, delivery_qos):
+                delivered += 1
+
+        with self._lock:
+            self.delivered += delivered
+        return delivered
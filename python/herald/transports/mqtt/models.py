@@ -203,9 +203,9 @@ class Messenger(object):
         Sends a message to another peer.
         :param peer_uid: Peer UID
         :param message: Message content
-        :return:
+        :return: The MQTTMessageInfo of the publication
         """
-        self.__mqtt.publish(
+        return self.__mqtt.publish(
             self.__make_uid_topic(peer_uid),
             message,
             1
@@ -216,9 +216,9 @@ class Messenger(object):
         Sends a message to a group of peers.
         :param group: Group's name
         :param message: Message content
-        :return:
+        :return: The MQTTMessageInfo of the publication
         """
-        self.__mqtt.publish(
+        return self.__mqtt.publish(
             self.__make_group_topic(group),
             message,
             1
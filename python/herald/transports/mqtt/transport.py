@@ -39,12 +39,14 @@ import pelix.utilities
 # Herald
 import herald
 import herald.utils as utils
+import herald.transports.chunking as chunking
 import herald.transports.mqtt.models as models
 from herald.beans import Message
 from herald.transports.peer_contact import PeerContact, \
     SUBJECT_DISCOVERY_PREFIX, SUBJECT_DISCOVERY_STEP_1
 from herald.transports.mqtt import ACCESS_ID, PROP_MQTT_HOST, \
-    PROP_MQTT_PASSWORD, PROP_MQTT_PORT, PROP_MQTT_USERNAME
+    PROP_MQTT_PASSWORD, PROP_MQTT_PORT, PROP_MQTT_USERNAME, \
+    PROP_MQTT_CHUNK_SIZE
 
 # Documentation strings format
 __docformat__ = "restructuredtext en"
@@ -57,6 +59,11 @@ _log = logging.getLogger(__name__)
 DEFAULT_MQTT_HOST = 'localhost'
 DEFAULT_MQTT_PORT = 1883
 
+CHUNK_PUBLISH_TIMEOUT = 30
+"""
+Time to wait for a chunk to be acknowledged by the broker, in seconds
+"""
+
 
 @ComponentFactory('herald-mqtt-transport-factory')
 @RequiresBest('_probe', herald.SERVICE_PROBE)
@@ -64,10 +71,12 @@ DEFAULT_MQTT_PORT = 1883
 @Requires('_herald', herald.SERVICE_HERALD_INTERNAL)
 @Provides(herald.SERVICE_TRANSPORT)
 @Property('_access_id', herald.PROP_ACCESS_ID, ACCESS_ID)
+@Property('_broadcast', herald.PROP_BROADCAST, True)
 @Property('_host', PROP_MQTT_HOST, DEFAULT_MQTT_HOST)
 @Property('_port', PROP_MQTT_PORT, DEFAULT_MQTT_PORT)
 @Property('_username', PROP_MQTT_USERNAME, None)
 @Property('_password', PROP_MQTT_PASSWORD, None)
+@Property('_chunk_size', PROP_MQTT_CHUNK_SIZE, chunking.DEFAULT_CHUNK_SIZE)
 @Instantiate('herald-mqtt-transport')
 class MqttTransport(object):
     """
@@ -86,6 +95,8 @@ class MqttTransport(object):
         self._probe = None
         # Access ID
         self._access_id = ACCESS_ID
+        # Groups are reached by a single publication
+        self._broadcast = True
         # Host name
         self._host = None
         # Port number
@@ -94,6 +105,8 @@ class MqttTransport(object):
         self._username = None
         # Password
         self._password = None
+        # Maximum size of a payload
+        self._chunk_size = chunking.DEFAULT_CHUNK_SIZE
 
         # Local peer
         self.__peer = None
@@ -101,6 +114,9 @@ class MqttTransport(object):
         self.__messenger = None
         # Peer contact
         self.__contact = None
+        # Large messages handling
+        self.__chunks = None
+        self.__reassembler = None
 
     def __get_content(self,
                       message,
@@ -152,6 +168,25 @@ class MqttTransport(object):
         # Ignore loop-backs
         if sender_uid == self.__peer.uid:
             return
+
+        if message.subject == chunking.SUBJECT_CHUNK:
+            # Part of a large message
+            try:
+                content = self.__reassembler.add(message)
+            except ValueError as ex:
+                _log.warning("Invalid chunk from %s: %s", sender_uid, ex)
+                return
+
+            if content is None:
+                # Wait for other chunks
+                return
+
+            message = utils.from_json(content)
+            if message is None:
+                _log.warning("Invalid reassembled message from %s",
+                             sender_uid)
+                return
+
         reply_to = message.get_header(herald.MESSAGE_HEADER_REPLIES_TO)
         subject = message.subject
 
@@ -221,6 +256,12 @@ class MqttTransport(object):
             self._directory,
             None,
             __name__ + ".contact")
+        # Prepare the large messages handlers
+        self.__chunks = chunking.ChunkSender(int(self._chunk_size),
+                                             __name__ + ".chunks")
+        self.__chunks.start()
+        self.__reassembler = chunking.Reassembler(
+            logname=__name__ + ".chunks")
         if self._username is not None:
             self.__messenger.login(self._username, self._password)
         Thread(target=self.__connect, args=[]).start()
@@ -231,6 +272,10 @@ class MqttTransport(object):
         Component invalidated
         """
         _log.debug("MQTT transport invalidated.")
+        self.__chunks.stop()
+        self.__chunks = None
+        self.__reassembler.clear()
+        self.__reassembler = None
         self.__messenger.disconnect()
         self.__peer.unset_access(ACCESS_ID)
         self.__peer = None
@@ -266,7 +311,11 @@ class MqttTransport(object):
             "content": content
         })
 
-        self.__messenger.fire(peer_uid, content)
+        self.__chunks.send(
+            message, content,
+            lambda payload: self.__messenger.fire(peer_uid, payload),
+            lambda payload: self.__messenger.fire(peer_uid, payload)
+            .wait_for_publish(CHUNK_PUBLISH_TIMEOUT))
 
     def fire_group(self, group, peers, message):
         """
@@ -282,5 +331,9 @@ class MqttTransport(object):
         # Prepare the message
         content = self.__get_content(message, target_group=group)
 
-        self.__messenger.fire_group(group, content)
+        self.__chunks.send(
+            message, content,
+            lambda payload: self.__messenger.fire_group(group, payload),
+            lambda payload: self.__messenger.fire_group(group, payload)
+            .wait_for_publish(CHUNK_PUBLISH_TIMEOUT))
         return peers
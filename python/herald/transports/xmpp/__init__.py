@@ -80,6 +80,39 @@ PROP_XMPP_KEEPALIVE_DELAY = 'xmpp.keepalive.delay'
 Time in seconds to consider when not receiving response from the target server
 """
 
+PROP_XMPP_SEND_THREADS = 'xmpp.send.threads'
+"""
+Number of threads writing messages to the XMPP stream
+"""
+
+PROP_XMPP_SEND_QUEUE_SIZE = 'xmpp.send.queue.size'
+"""
+Maximum number of messages waiting to be sent, per sending thread
+"""
+
+PROP_XMPP_ROOM_TIMEOUT = 'xmpp.room.timeout'
+"""
+Time in seconds to wait for a MUC room to be joined
+"""
+
+PROP_XMPP_ROOM_RETRY_DELAY = 'xmpp.room.retry_delay'
+"""
+Time in seconds to wait before trying again to join a MUC room
+"""
+
+PROP_XMPP_CHUNK_SIZE = 'xmpp.chunk.size'
+"""
+Maximum size of a serialized message, before XML escaping: larger messages
+are sent by chunks
+"""
+
+# ------------------------------------------------------------------------------
+
+PROBE_CHANNEL_ROOM_JOIN = "xmpp_room_join"
+"""
+Probe channel storing the time taken to join each MUC room
+"""
+
 # ------------------------------------------------------------------------------
 
 FACTORY_TRANSPORT = "herald-xmpp-transport-factory"
@@ -43,7 +43,9 @@ from .beans import XMPPAccess
 import herald
 
 # Standard library
+import collections
 import logging
+import threading
 from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
     Property, Validate, Invalidate, Instantiate
 
@@ -51,6 +53,23 @@ from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
 
 _logger = logging.getLogger(__name__)
 
+UNKNOWN_CACHE_SIZE = 1024
+""" Maximum number of unknown JIDs kept in cache """
+
+# ------------------------------------------------------------------------------
+
+
+def normalize_jid(jid):
+    """
+    Normalizes a JID string: its bare part is case insensitive, but not its
+    resource
+
+    :param jid: A JID (string or JID object)
+    :return: The normalized JID string
+    """
+    bare, sep, resource = str(jid).partition('/')
+    return bare.lower() + sep + resource
+
 # ------------------------------------------------------------------------------
 
 
@@ -71,9 +90,21 @@ class XMPPDirectory(object):
         self._directory = None
         self._access_id = ACCESS_ID
 
-        # JID -> Peer bean
+        # Normalized full JID -> Peer bean
         self._jid_peer = {}
 
+        # Normalized bare JID -> {Peer UID -> Peer bean}
+        self._bare_peers = {}
+
+        # Peer UID -> full JID
+        self._uid_jid = {}
+
+        # Unknown JIDs (normalized JID -> None), least recently used first
+        self._unknown = collections.OrderedDict()
+
+        # Index modification lock
+        self.__lock = threading.Lock()
+
         # Group name -> XMPP room JID
         self._groups = {}
 
@@ -82,7 +113,7 @@ class XMPPDirectory(object):
         """
         Component validated
         """
-        self._jid_peer.clear()
+        self.__clear()
         self._groups.clear()
 
     @Invalidate
@@ -90,9 +121,19 @@ class XMPPDirectory(object):
         """
         Component invalidated
         """
-        self._jid_peer.clear()
+        self.__clear()
         self._groups.clear()
 
+    def __clear(self):
+        """
+        Clears the JID indexes
+        """
+        with self.__lock:
+            self._jid_peer.clear()
+            self._bare_peers.clear()
+            self._uid_jid.clear()
+            self._unknown.clear()
+
     def load_access(self, data):
         """
         Loads a dumped access
@@ -109,27 +150,108 @@ class XMPPDirectory(object):
         :param peer: The Peer bean
         :param data: The peer access data, previously loaded with load_access()
         """
-        if peer.uid != self._directory.local_uid:
-            self._jid_peer[data.jid] = peer
+        if peer.uid == self._directory.local_uid:
+            return
+
+        jid = normalize_jid(data.jid)
+        bare = jid.partition('/')[0]
+        with self.__lock:
+            # Forget the previous JID of the peer
+            self.__remove(peer, self._uid_jid.get(peer.uid))
+
+            self._jid_peer[jid] = peer
+            self._bare_peers.setdefault(bare, {})[peer.uid] = peer
+            self._uid_jid[peer.uid] = data.jid
 
-    def peer_access_unset(self, _, data):
+            # All the JIDs with this bare form can now be resolved
+            for unknown in [unknown for unknown in self._unknown
+                            if unknown.partition('/')[0] == bare]:
+                del self._unknown[unknown]
+
+    def peer_access_unset(self, peer, data):
         """
         The access to the given peer matching our access ID has been removed
 
-        :param _: The Peer bean
+        :param peer: The Peer bean
         :param data: The peer access data
         """
-        try:
-            del self._jid_peer[data.jid]
-        except KeyError:
-            pass
+        with self.__lock:
+            self.__remove(peer, data.jid)
+
+    def __remove(self, peer, jid):
+        """
+        Removes the association between a peer and a JID from the indexes.
+
+        Must be called while holding the lock.
+
+        :param peer: The Peer bean
+        :param jid: The JID of the peer (can be None)
+        """
+        if not jid:
+            return
+
+        jid = normalize_jid(jid)
+        if self._jid_peer.get(jid) is peer:
+            del self._jid_peer[jid]
+
+        bare = jid.partition('/')[0]
+        bare_peers = self._bare_peers.get(bare)
+        if bare_peers is not None and bare_peers.get(peer.uid) is peer:
+            del bare_peers[peer.uid]
+            if not bare_peers:
+                del self._bare_peers[bare]
+
+        # The bare JID fallback might resolve those JIDs now
+        for unknown in [unknown for unknown in self._unknown
+                        if unknown.partition('/')[0] == bare]:
+            del self._unknown[unknown]
+
+        if self._uid_jid.get(peer.uid) and \
+                normalize_jid(self._uid_jid[peer.uid]) == jid:
+            del self._uid_jid[peer.uid]
 
     def from_jid(self, jid):
         """
-        Returns the peer associated to the given JID
+        Returns the peer associated to the given JID.
+
+        If the full JID is unknown, the peer is looked for using the bare
+        JID, if only one peer uses it.
 
-        :param jid: The (full) JID of a peer
+        :param jid: The (full or bare) JID of a peer
         :return: A peer bean
         :raise KeyError: Unknown JID
         """
-        return self._jid_peer[jid]
+        jid = normalize_jid(jid)
+        try:
+            # Fast path
+            return self._jid_peer[jid]
+        except KeyError:
+            pass
+
+        with self.__lock:
+            if jid in self._unknown:
+                # Already looked for: mark as recently used
+                self._unknown[jid] = self._unknown.pop(jid)
+                raise KeyError(jid)
+
+            # Bare JID fallback, if it is not ambiguous
+            bare_peers = self._bare_peers.get(jid.partition('/')[0])
+            if bare_peers and len(bare_peers) == 1:
+                return next(iter(bare_peers.values()))
+
+            # Remember that this JID is unknown
+            self._unknown[jid] = None
+            if len(self._unknown) > UNKNOWN_CACHE_SIZE:
+                self._unknown.popitem(last=False)
+
+        raise KeyError(jid)
+
+    def to_jid(self, uid):
+        """
+        Returns the JID of the peer with the given UID
+
+        :param uid: The UID of a peer
+        :return: The full JID of the peer
+        :raise KeyError: Unknown peer or no XMPP access
+        """
+        return self._uid_jid[uid]
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Asynchronous stanza sending pipeline
+
+Stanzas are queued in bounded queues, each one consumed by its own worker
+thread. A target JID is always handled by the same worker, which keeps the
+order of the stanzas sent to it. Each worker drains its queue by batches and
+gives all the stanzas of a batch with the same target at once to the sending
+method, which can then write them to the stream in a single operation.
+
+:author: Thomas Calmant
+:copyright: Copyright 2015, isandlaTech
+:license: Apache License 2.0
+:version: 0.0.4
+:status: Alpha
+
+..
+
+    Copyright 2015 isandlaTech
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Module version
+__version_info__ = (0, 0, 4)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Pelix
+import pelix.threadpool as threadpool
+
+# Standard library
+import collections
+import logging
+import threading
+
+try:
+    # Python 3
+    # pylint: disable=F0401
+    import queue
+except ImportError:
+    # Python 2
+    # pylint: disable=F0401
+    import Queue as queue
+
+# ------------------------------------------------------------------------------
+
+_STOP = object()
+""" Marker telling a worker to stop """
+
+# ------------------------------------------------------------------------------
+
+
+class StanzaSender(object):
+    """
+    Sends stanzas asynchronously, keeping their order per target
+    """
+    def __init__(self, send_method, nb_workers=2, queue_size=1000,
+                 batch_size=32, logname=None):
+        """
+        Sets up the sender
+
+        :param send_method: Method called to write stanzas, with a target and
+                            the list of its stanzas as parameters, in the
+                            order they were enqueued
+        :param nb_workers: Number of worker threads
+        :param queue_size: Maximum number of pending stanzas per worker
+        :param batch_size: Maximum number of stanzas handled at once by a
+                           worker
+        :param logname: Name of the logger
+        """
+        self._logger = logging.getLogger(logname or __name__)
+        self.__send_method = send_method
+        self.__nb_workers = max(1, int(nb_workers))
+        self.__queue_size = max(1, int(queue_size))
+        self.__batch_size = max(1, int(batch_size))
+
+        # Worker queues and threads
+        self.__queues = []
+        self.__threads = []
+        self.__lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker threads
+        """
+        with self.__lock:
+            if self.__threads:
+                return
+
+            self.__queues = [queue.Queue(self.__queue_size)
+                             for _ in range(self.__nb_workers)]
+            for idx, work_queue in enumerate(self.__queues):
+                thread = threading.Thread(
+                    target=self.__worker, args=(work_queue,),
+                    name="Herald-XMPP-Sender-{0}".format(idx))
+                thread.daemon = True
+                self.__threads.append(thread)
+                thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the worker threads once the stanzas queued so far have been
+        sent
+
+        :param timeout: Maximum time to wait for each worker to stop
+        """
+        with self.__lock:
+            queues, self.__queues = self.__queues, []
+            threads, self.__threads = self.__threads, []
+
+        for work_queue in queues:
+            # Don't block if the queue is full: the worker will still be
+            # stopped by clear()
+            try:
+                work_queue.put(_STOP, True, timeout)
+            except queue.Full:
+                self.__fail_pending(work_queue)
+                work_queue.put(_STOP)
+
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def clear(self):
+        """
+        Stops the worker threads, failing all pending stanzas
+        """
+        with self.__lock:
+            queues = self.__queues[:]
+
+        for work_queue in queues:
+            self.__fail_pending(work_queue)
+
+        self.stop()
+
+    @staticmethod
+    def __fail_pending(work_queue):
+        """
+        Sets an IOError as the result of all stanzas in the given queue
+        """
+        exception = IOError("XMPP sender stopped")
+        while True:
+            try:
+                item = work_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            if item is not _STOP:
+                _set_result(item[2], None, exception)
+
+    def enqueue(self, target, stanza):
+        """
+        Queues a stanza to be sent
+
+        :param target: Target of the stanza (JID or room JID)
+        :param stanza: The stanza to send
+        :return: A FutureResult, set when the stanza has been written
+        :raise IOError: The sender isn't running or its queue is full
+        """
+        queues = self.__queues
+        if not queues:
+            raise IOError("XMPP sender is not running")
+
+        key = str(target)
+        future = threadpool.FutureResult(self._logger)
+        try:
+            queues[hash(key) % len(queues)].put_nowait((key, stanza, future))
+        except queue.Full:
+            raise IOError("XMPP send queue is full")
+        return future
+
+    def __worker(self, work_queue):
+        """
+        Worker loop: sends the stanzas of its queue by batches
+
+        :param work_queue: The queue to read
+        """
+        while True:
+            # Wait for a first item, then get what's already there
+            batch = [work_queue.get()]
+            while len(batch) < self.__batch_size and batch[-1] is not _STOP:
+                try:
+                    batch.append(work_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is _STOP
+            if stop:
+                del batch[-1]
+
+            # Group stanzas by target, keeping their order
+            targets = collections.OrderedDict()
+            for key, stanza, future in batch:
+                targets.setdefault(key, []).append((stanza, future))
+
+            for key, items in targets.items():
+                self.__send(key, items)
+
+            if stop:
+                return
+
+    def __send(self, target, items):
+        """
+        Writes the stanzas of a target and notifies their futures
+
+        :param target: Target of the stanzas
+        :param items: List of (stanza, FutureResult) tuples
+        """
+        try:
+            result = self.__send_method(target, [item[0] for item in items])
+        except Exception as ex:
+            self._logger.error("Error sending %d stanza(s) to %s: %s",
+                               len(items), target, ex)
+            result, exception = None, ex
+        else:
+            exception = None
+
+        for _, future in items:
+            _set_result(future, result, exception)
+
+
+def _set_result(future, result, exception=None):
+    """
+    Stores the result of an operation in a FutureResult
+
+    :param future: A FutureResult object
+    :param result: The result to store
+    :param exception: The exception to store instead of the result
+    """
+    def forward():
+        """
+        Returns the result or raises the exception
+        """
+        if exception is not None:
+            raise exception
+        return result
+
+    try:
+        future.execute(forward, None, None)
+    except Exception:
+        # The exception is kept by the future
+        pass
@@ -36,9 +36,14 @@ __docformat__ = "restructuredtext en"
 # Herald XMPP
 from . import FACTORY_TRANSPORT, SERVICE_XMPP_DIRECTORY, ACCESS_ID, \
     PROP_XMPP_SERVER, PROP_XMPP_PORT, PROP_XMPP_JID, PROP_XMPP_PASSWORD, \
-    PROP_XMPP_KEEPALIVE_INTERVAL, PROP_XMPP_KEEPALIVE_DELAY
+    PROP_XMPP_KEEPALIVE_INTERVAL, PROP_XMPP_KEEPALIVE_DELAY, \
+    PROP_XMPP_SEND_THREADS, PROP_XMPP_SEND_QUEUE_SIZE, \
+    PROP_XMPP_ROOM_TIMEOUT, PROBE_CHANNEL_ROOM_JOIN, PROP_XMPP_CHUNK_SIZE, \
+    PROP_XMPP_ROOM_RETRY_DELAY
 from .beans import XMPPAccess
 from .bot import HeraldBot
+from .sender import StanzaSender
+import herald.transports.chunking as chunking
 import herald.transports.peer_contact as peer_contact
 
 # Room creation utility
@@ -58,7 +63,6 @@ from pelix.ipopo.decorators import ComponentFactory, Requires, Provides, \
     Property, Validate, Invalidate, RequiresBest
 from pelix.utilities import to_str, to_bytes
 import pelix.misc.jabsorb as jabsorb
-import pelix.threadpool as threadpool
 
 # Standard library
 import hashlib
@@ -74,6 +78,33 @@ _logger = logging.getLogger(__name__)
 
 FEATURE_MUC = 'http://jabber.org/protocol/muc'
 
+DEFAULT_CHUNK_SIZE = 30000
+"""
+Default maximum size of a message body, kept under the usual stanza size
+limit of XMPP servers, XML escaping included
+"""
+
+CHUNK_SEND_TIMEOUT = 30
+"""
+Time to wait for a chunk to be written, in seconds
+"""
+
+ROOMS_CONFIG = {
+    # ... no max users limit
+    'muc#roomconfig_maxusers': '0',
+    # ... open to anyone
+    'muc#roomconfig_membersonly': '0',
+    # ... every participant can send invites
+    'muc#roomconfig_allowinvites': '1',
+    # ... room can disappear
+    'muc#roomconfig_persistentroom': '0',
+    # ... OpenFire: Forbid nick changes
+    'x-muc#roomconfig_canchangenick': '0'}
+"""
+Configuration of the rooms we create (the same dictionary is used for all
+rooms)
+"""
+
 # ------------------------------------------------------------------------------
 
 
@@ -84,12 +115,18 @@ FEATURE_MUC = 'http://jabber.org/protocol/muc'
 @Requires('_xmpp_directory', SERVICE_XMPP_DIRECTORY)
 @Provides(herald.SERVICE_TRANSPORT, '_controller')
 @Property('_access_id', herald.PROP_ACCESS_ID, ACCESS_ID)
+@Property('_broadcast', herald.PROP_BROADCAST, True)
 @Property('_host', PROP_XMPP_SERVER, 'localhost')
 @Property('_port', PROP_XMPP_PORT, 5222)
 @Property('_username', PROP_XMPP_JID)
 @Property('_password', PROP_XMPP_PASSWORD)
 @Property('_xmpp_keepalive_interval', PROP_XMPP_KEEPALIVE_INTERVAL, 15)
 @Property('_xmpp_keepalive_delay', PROP_XMPP_KEEPALIVE_DELAY, 5)
+@Property('_send_threads', PROP_XMPP_SEND_THREADS, 2)
+@Property('_send_queue_size', PROP_XMPP_SEND_QUEUE_SIZE, 1000)
+@Property('_room_timeout', PROP_XMPP_ROOM_TIMEOUT, 30)
+@Property('_room_retry_delay', PROP_XMPP_ROOM_RETRY_DELAY, 10)
+@Property('_chunk_size', PROP_XMPP_CHUNK_SIZE, DEFAULT_CHUNK_SIZE)
 class XmppTransport(object):
     """
     XMPP Messenger for Herald.
@@ -119,6 +156,7 @@ class XmppTransport(object):
 
         # Properties
         self._access_id = ACCESS_ID
+        self._broadcast = True
         self._host = "localhost"
         self._port = 5222
         self._username = None
@@ -127,6 +165,14 @@ class XmppTransport(object):
         self._xmpp_keepalive_interval = 15
         # Herald XMPP Keepalive delay
         self._xmpp_keepalive_delay = 5
+        # Number of sending threads and size of their queue
+        self._send_threads = 2
+        self._send_queue_size = 1000
+        # Time to wait for a room to be joined, and before trying again
+        self._room_timeout = 30
+        self._room_retry_delay = 10
+        # Maximum size of a message body
+        self._chunk_size = DEFAULT_CHUNK_SIZE
 
         # XMPP bot
         self._authenticated = False
@@ -135,13 +181,27 @@ class XmppTransport(object):
         # MUC service name
         self.__muc_service = None
 
-        # Pending count downs and joined rooms
+        # Pending count downs and joined rooms (reentrant lock, as count
+        # downs call back while it is held)
         self.__countdowns = set()
-        self.__countdowns_lock = threading.Lock()
+        self.__countdowns_lock = threading.RLock()
+        self.__joined_rooms = set()
+
+        # Room creation utility and start time of joins (room JID -> time),
+        # protected by the count downs lock
+        self.__room_creator = None
+        self.__join_start = {}
+
+        # Timers of the next attempts to join rooms (count down callback ->
+        # Timer), protected by the count downs lock
+        self.__retry_timers = {}
 
-        # Message sending queue
-        self.__pool = threadpool.ThreadPool(max_threads=1,
-                                            logname="Herald-XMPP-SendThread")
+        # Message sending pipeline
+        self.__sender = None
+
+        # Large messages handling
+        self.__chunks = None
+        self.__reassembler = None
 
         # Bot possible states : creating, created, destroying, destroyed
         self._bot_state = "destroyed"
@@ -190,9 +250,19 @@ class XmppTransport(object):
         """
         Really (re)creates a new XMPP bot object
         """
-        # Clear & Start the thread pool
-        self.__pool.clear()
-        self.__pool.start()
+        # Start a new sending pipeline
+        self.__sender = StanzaSender(self.__write_stanzas,
+                                     self._send_threads,
+                                     self._send_queue_size,
+                                     logname="Herald-XMPP-SendThread")
+        self.__sender.start()
+
+        # Prepare the large messages handlers
+        self.__chunks = chunking.ChunkSender(int(self._chunk_size),
+                                             __name__ + ".chunks")
+        self.__chunks.start()
+        self.__reassembler = chunking.Reassembler(
+            logname=__name__ + ".chunks")
 
         # Prepare the peer contact handler
         self.__contact = peer_contact.PeerContact(self._directory, None,
@@ -274,9 +344,16 @@ class XmppTransport(object):
         """
         Destroys the current bot
         """
-        # Stop & Clear the pool
-        self.__pool.stop()
-        self.__pool.clear()
+        # Stop the sending pipeline, dropping pending messages
+        if self.__chunks is not None:
+            self.__chunks.stop()
+            self.__chunks = None
+        if self.__reassembler is not None:
+            self.__reassembler.clear()
+            self.__reassembler = None
+        if self.__sender is not None:
+            self.__sender.clear()
+            self.__sender = None
 
         # Disconnect the bot and clear callbacks
         if self._bot is not None:
@@ -330,11 +407,16 @@ class XmppTransport(object):
 
         return sleekxmpp.JID(local=room_name, domain=self.__muc_service)
 
-    def __create_rooms(self, rooms, nickname):
+    def __create_rooms(self, main_room, rooms, nickname):
         """
-        Creates or joins the given rooms
+        Creates or joins the given rooms, all at once.
+
+        The transport is activated as soon as the main room has been joined;
+        other rooms are joined in background. Rooms which can't be joined are
+        tried again later.
 
-        :param rooms: A list of rooms to join / create
+        :param main_room: The application room
+        :param rooms: A list of group rooms to join / create
         :param nickname: Nickname to use in MUC rooms
         :raise ValueError: No Multi-User Chat service available
         """
@@ -350,35 +432,94 @@ class XmppTransport(object):
                 except StopIteration:
                     raise ValueError("No Multi-User Chat service on server")
 
-        # Generate rooms JIDs
-        rooms_jids = {room: self.room_jid(room) for room in rooms}
-
-        # Prepare a callback
-        self.__countdowns.add(
-            MarksCallback((str(room_jid) for room_jid in rooms_jids.values()),
-                          self.__on_ready, __name__ + ".RoomCreator"))
-
         # Prepare the room creator
         creator = RoomCreator(self._bot, __name__ + ".RoomCreator")
+        with self.__countdowns_lock:
+            self.__room_creator = creator
+
+        # Create rooms, with our computing JID, without waiting for answers:
+        # one callback for the main room, one for groups
+        self.__join_rooms(creator, {main_room: self.room_jid(main_room)},
+                          nickname, self.__on_ready)
+        if rooms:
+            self.__join_rooms(
+                creator, {room: self.room_jid(room) for room in rooms},
+                nickname, self.__on_groups_ready)
+
+    def __join_rooms(self, creator, rooms_jids, nickname, callback):
+        """
+        Creates or joins the given rooms, without waiting for answers
+
+        :param creator: The RoomCreator of the session: nothing is done if
+                        the session has ended since
+        :param rooms_jids: Room name -> room JID
+        :param nickname: Nickname to use in MUC rooms
+        :param callback: Method called with the joined and erroneous rooms
+                         once all of them answered
+        """
+        with self.__countdowns_lock:
+            if creator is not self.__room_creator:
+                # Session ended
+                return
+
+            self.__countdowns.add(
+                MarksCallback((str(room_jid)
+                               for room_jid in rooms_jids.values()),
+                              callback, __name__ + ".RoomCreator"))
+
+            now = time.time()
+            for room_jid in rooms_jids.values():
+                self.__join_start[str(room_jid)] = now
 
-        # Prepare rooms configuration
-        rooms_config = {
-            # ... no max users limit
-            'muc#roomconfig_maxusers': '0',
-            # ... open to anyone
-            'muc#roomconfig_membersonly': '0',
-            # ... every participant can send invites
-            'muc#roomconfig_allowinvites': '1',
-            # ... room can disappear
-            'muc#roomconfig_persistentroom': '0',
-            # ... OpenFire: Forbid nick changes
-            'x-muc#roomconfig_canchangenick': '0'}
-
-        # Create rooms, with our computing JID
         for room, room_jid in rooms_jids.items():
             creator.create_room(room, self.__muc_service, nickname,
-                                rooms_config, self.__room_created,
-                                self.__room_error, room_jid)
+                                ROOMS_CONFIG, self.__room_created,
+                                self.__room_error, room_jid,
+                                self._room_timeout)
+
+    def __retry_rooms(self, rooms, callback):
+        """
+        Tries again to join rooms, after the retry delay
+
+        :param rooms: JIDs of the rooms which couldn't be joined
+        :param callback: Method called with the joined and erroneous rooms
+                         once all of them answered
+        """
+        with self.__countdowns_lock:
+            creator = self.__room_creator
+            if creator is None:
+                # Session ended
+                return
+
+            _logger.warning("Trying again to join rooms in %s seconds: %s",
+                            self._room_retry_delay, ", ".join(rooms))
+            timer = threading.Timer(
+                self._room_retry_delay, self.__join_rooms,
+                (creator, dict((room, room) for room in rooms),
+                 self._directory.local_uid, callback))
+            timer.daemon = True
+            self.__retry_timers[callback] = timer
+            timer.start()
+
+    def __store_join(self, room, status):
+        """
+        Stores the time taken to join a room in the probe
+
+        :param room: Bare JID of the room
+        :param status: Result of the join ("joined", "not-owner", ...)
+        """
+        try:
+            with self.__countdowns_lock:
+                start = self.__join_start.pop(str(room))
+        except KeyError:
+            # Unknown room
+            return
+
+        now = time.time()
+        self._probe.store(
+            PROBE_CHANNEL_ROOM_JOIN,
+            {"timestamp": now, "room": str(room),
+             "latency": (now - start) * 1000., "status": status})
 
     def __room_created(self, room, _):
         """
@@ -387,7 +528,9 @@ class XmppTransport(object):
         :param room: Bare JID of the room
         :param _: Our nick in the room
         """
+        self.__store_join(room, "joined")
         with self.__countdowns_lock:
+            self.__joined_rooms.add(str(room))
             to_remove = set()
             for countdown in self.__countdowns:
                 # Mark the room
@@ -411,8 +554,10 @@ class XmppTransport(object):
         """
         if condition == 'not-owner':
             _logger.debug("We are not the owner of %s", room)
+            self.__store_join(room, condition)
             self.__room_created(room, nick)
         else:
+            self.__store_join(room, condition)
             with self.__countdowns_lock:
                 to_remove = set()
                 for countdown in self.__countdowns:
@@ -447,29 +592,44 @@ class XmppTransport(object):
         peer = self._directory.get_local_peer()
 
         # Create/join rooms for each group
-        all_rooms = ["{0}--{1}".format(peer.app_id, group)
-                     for group in peer.groups]
-        all_rooms.append(peer.app_id)
+        group_rooms = ["{0}--{1}".format(peer.app_id, group)
+                       for group in peer.groups]
 
-        # Wait to have joined all rooms before activating the service
+        # Wait to have joined the main room before activating the service
         _logger.debug("Creating XMPP rooms...")
-        self.__create_rooms(all_rooms, peer.uid)
+        self.__create_rooms(peer.app_id, group_rooms, peer.uid)
 
         # activate keepalive (ping) plugin xep_0199
         self._bot.plugin['xep_0199'].enable_keepalive(
             self._xmpp_keepalive_interval, self._xmpp_keepalive_delay)
 
 
+    def __on_groups_ready(self, joined, erroneous):
+        """
+        Called when all group rooms have been created or joined
+
+        :param joined: List of joined rooms
+        :param erroneous: List of room that couldn't be joined
+        """
+        _logger.debug("Client joined group rooms: %s", ", ".join(joined))
+        if erroneous:
+            _logger.error("Error joining group rooms: %s",
+                          ", ".join(erroneous))
+            self.__retry_rooms(erroneous, self.__on_groups_ready)
+
     def __on_ready(self, joined, erroneous):
         """
-        Called when all MUC rooms have created or joined
+        Called when the main MUC room has been created or joined
 
         :param joined: List of joined rooms
         :param erroneous: List of room that couldn't be joined
         """
         _logger.debug("Client joined rooms: %s", ", ".join(joined))
         if erroneous:
+            # Stay inactive until the main room has been joined
             _logger.error("Error joining rooms: %s", ", ".join(erroneous))
+            self.__retry_rooms(erroneous, self.__on_ready)
+            return
 
         # Register our local access
         local_peer = self._directory.get_local_peer()
@@ -505,6 +665,19 @@ class XmppTransport(object):
         else:
             _logger.warning("End of session due to authentication error")
 
+        # Forget about the rooms
+        with self.__countdowns_lock:
+            creator, self.__room_creator = self.__room_creator, None
+            for timer in self.__retry_timers.values():
+                timer.cancel()
+            self.__retry_timers.clear()
+            self.__countdowns.clear()
+            self.__joined_rooms.clear()
+            self.__join_start.clear()
+
+        if creator is not None:
+            creator.clear()
+
         with self._bot_lock:
             if self._bot_state in ("creating", "created"):
                 # disable keepalive plugin
@@ -594,12 +767,21 @@ class XmppTransport(object):
         except KeyError:
             sender_uid = "<unknown>"
 
+        body = msg['body']
+        if subject == chunking.SUBJECT_CHUNK:
+            # Part of a large message
+            body = self.__reassemble(sender_jid, body)
+            if body is None:
+                # Wait for other chunks
+                return
+
         try:            
-            received_msg = utils.from_json(msg['body'])
+            received_msg = utils.from_json(body)
             content = received_msg.content
+            subject = received_msg.subject
         except ValueError:
             # Content can't be decoded, use its string representation as is
-            content = msg['body']
+            content = body
 
         uid = msg['thread']
         reply_to = msg['parent_thread']
@@ -633,6 +815,25 @@ class XmppTransport(object):
             # All other messages are given to Herald Core
             self._herald.handle_message(message)
 
+    def __reassemble(self, sender_jid, body):
+        """
+        Handles a message chunk
+
+        :param sender_jid: JID of the sender of the chunk
+        :param body: Body of the chunk message
+        :return: The body of the complete message, or None
+        """
+        chunk = utils.from_json(body)
+        if chunk is None:
+            _logger.warning("Invalid chunk from %s", sender_jid)
+            return None
+
+        try:
+            return self.__reassembler.add(chunk)
+        except ValueError as ex:
+            _logger.warning("Invalid chunk from %s: %s", sender_jid, ex)
+            return None
+
     def __handle_raw_message(self, msg):
         """
         Handles a message that is not from Herald
@@ -684,10 +885,14 @@ class XmppTransport(object):
         # Try to read information from the peer
         if not jid and peer is not None:
             try:
-                # Get the target JID
-                jid = peer.get_access(self._access_id).jid
-            except (KeyError, AttributeError):
-                pass
+                # Get the target JID from the directory index
+                jid = self._xmpp_directory.to_jid(peer.uid)
+            except KeyError:
+                try:
+                    # Get the target JID from the peer access
+                    jid = peer.get_access(self._access_id).jid
+                except (KeyError, AttributeError):
+                    pass
 
         return jid
 
@@ -699,6 +904,9 @@ class XmppTransport(object):
         :param target: Target JID or MUC room
         :param message: Herald message bean
         :param parent_uid: UID of the message this one replies to (optional)
+        :return: A FutureResult, set once the message has been written, or
+                 None for a message sent by chunks
+        :raise IOError: The transport is stopped or its send queue is full
         """
         # Convert content to JSON
         if message.subject in herald.SUBJECTS_RAW:
@@ -712,15 +920,6 @@ class XmppTransport(object):
             if target_group is not None:
                 message.add_header(herald.MESSAGE_HEADER_TARGET_GROUP, target_group)
             content = utils.to_json(message)
-        
-        # Prepare an XMPP message, based on the Herald message
-        xmpp_msg = self._bot.make_message(mto=target,
-                                          mbody=content,
-                                          msubject=message.subject,
-                                          mtype=msgtype)
-        xmpp_msg['thread'] = message.uid
-        if parent_uid:
-            xmpp_msg['parent_thread'] = parent_uid
 
         # Store message content
         self._probe.store(
@@ -728,9 +927,70 @@ class XmppTransport(object):
             {"uid": message.uid, "content": content}
         )
 
-        # Send it, using the 1-thread pool, and wait for its execution
-        future = self.__pool.enqueue(xmpp_msg.send)
-        return future.result()
+        def send(body, subject=message.subject):
+            """
+            Queues a stanza for the message or one of its chunks
+            """
+            return self.__send_stanza(msgtype, target, subject, body,
+                                      message.uid, parent_uid)
+
+        if message.subject in herald.SUBJECTS_RAW:
+            # Raw messages can't be split
+            return send(content)
+
+        # Large messages are split and sent by chunks
+        chunks = self.__chunks
+        if chunks is None:
+            raise IOError("XMPP transport is not running")
+        return chunks.send(
+            message, content, send,
+            lambda body: send(body, chunking.SUBJECT_CHUNK)
+            .result(CHUNK_SEND_TIMEOUT))
+
+    def __send_stanza(self, msgtype, target, subject, body, thread,
+                      parent_uid=None):
+        """
+        Prepares an XMPP message and queues it
+
+        :param msgtype: Kind of message (chat or groupchat)
+        :param target: Target JID or MUC room
+        :param subject: Subject of the XMPP message
+        :param body: Body of the XMPP message
+        :param thread: UID of the Herald message
+        :param parent_uid: UID of the message this one replies to (optional)
+        :return: A FutureResult, set once the message has been written
+        :raise IOError: The transport is stopped or its send queue is full
+        """
+        sender = self.__sender
+        if sender is None:
+            raise IOError("XMPP transport is not running")
+
+        # Prepare an XMPP message, based on the Herald message
+        xmpp_msg = self._bot.make_message(mto=target,
+                                          mbody=body,
+                                          msubject=subject,
+                                          mtype=msgtype)
+        xmpp_msg['thread'] = thread
+        if parent_uid:
+            xmpp_msg['parent_thread'] = parent_uid
+
+        # Queue it: the message will be sent asynchronously
+        return sender.enqueue(target, xmpp_msg)
+
+    def __write_stanzas(self, _, stanzas):
+        """
+        Writes stanzas to the XMPP stream (called by the sending pipeline)
+
+        :param _: Target of the stanzas
+        :param stanzas: Stanzas for the same target, in sending order
+        :raise IOError: No XMPP bot available
+        """
+        if self._bot is None:
+            raise IOError("No XMPP bot to send messages")
+
+        # Send each stanza through the bot, to apply its outgoing filters
+        for stanza in stanzas:
+            stanza.send()
 
     def fire(self, peer, message, extra=None):
         """
@@ -783,6 +1043,12 @@ class XmppTransport(object):
         else:
             # Get the group JID
             group_jid = self.room_jid("{0}--{1}".format(app_id, group))
+            if str(group_jid) not in self.__joined_rooms:
+                # Group room not joined (yet)
+                raise InvalidPeerAccess(
+                    beans.Target(group=group,
+                                 uids=[peer.uid for peer in peers]),
+                    "Room of group {0} not joined".format(group))
 
         # Log before sending
         self._probe.store(
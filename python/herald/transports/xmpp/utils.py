@@ -107,6 +107,9 @@ class RoomData(object):
         self.callback = callback
         self.errback = errback
 
+        # Join time out timer
+        self.timer = None
+
 
 class RoomCreator(object):
     """
@@ -137,7 +140,7 @@ class RoomCreator(object):
         self.__lock = threading.Lock()
 
     def create_room(self, room, service, nick, config=None,
-                    callback=None, errback=None, room_jid=None):
+                    callback=None, errback=None, room_jid=None, timeout=None):
         """
         Prepares the creation of a room.
 
@@ -158,6 +161,9 @@ class RoomCreator(object):
         :param callback: Method called back on success
         :param errback: Method called on error
         :param room_jid: Forced room JID
+        :param timeout: Time to wait for the room to be joined, in seconds,
+                        before calling the errback with a "timeout" condition
+                        (None to wait forever)
         """
         self.__logger.debug("Creating room: %s", room)
 
@@ -173,12 +179,67 @@ class RoomCreator(object):
                 self.__xmpp.add_event_handler("presence", self.__on_presence)
 
             # Store information
-            self.__rooms[room_jid] = RoomData(room_jid, nick, config,
-                                              callback, errback)
+            room_data = RoomData(room_jid, nick, config, callback, errback)
+            self.__rooms[room_jid] = room_data
+
+            if timeout is not None:
+                room_data.timer = threading.Timer(timeout, self.__on_timeout,
+                                                  (room_data,))
+                room_data.timer.daemon = True
+                room_data.timer.start()
 
         # Send the presence, i.e. request creation of the room
         self.__muc.joinMUC(room_jid, nick)
 
+    def clear(self):
+        """
+        Forgets about the rooms being created, without calling them back
+        """
+        with self.__lock:
+            rooms = list(self.__rooms.values())
+            if rooms:
+                self.__xmpp.del_event_handler("presence", self.__on_presence)
+            self.__rooms.clear()
+
+        for room_data in rooms:
+            if room_data.timer is not None:
+                room_data.timer.cancel()
+
+    def __pop_room(self, room):
+        """
+        Removes a room from the ones being created.
+
+        Must be called while holding the lock.
+
+        :param room: Bare JID of the room
+        :return: The RoomData of the room
+        :raise KeyError: Unknown room
+        """
+        room_data = self.__rooms.pop(room)
+        if room_data.timer is not None:
+            room_data.timer.cancel()
+
+        if not self.__rooms:
+            # No more rooms: no need to listen to presence anymore
+            self.__xmpp.del_event_handler("presence", self.__on_presence)
+
+        return room_data
+
+    def __on_timeout(self, room_data):
+        """
+        The room hasn't been joined in time
+
+        :param room_data: A RoomData object
+        """
+        with self.__lock:
+            if self.__rooms.get(room_data.room) is not room_data:
+                # Already handled
+                return
+            self.__pop_room(room_data.room)
+
+        self.__safe_errback(room_data, 'timeout',
+                            'No answer from the room in time')
+
     def __safe_callback(self, room_data):
         """
         Safe use of the callback method, to avoid errors propagation
@@ -230,11 +291,7 @@ class RoomCreator(object):
                 return
             else:
                 # Clean up, as we got what we wanted
-                del self.__rooms[room]
-
-            if not self.__rooms:
-                # No more rooms: no need to listen to presence anymore
-                self.__xmpp.del_event_handler("presence", self.__on_presence)
+                self.__pop_room(room)
 
         if data['type'] == 'error':
             # Got an error: update the state machine and clean up
@@ -247,35 +304,50 @@ class RoomCreator(object):
                                 'We are not the owner of the room')
 
         else:
-            # Success: we own the room
-            # Setup room configuration
-            try:
-                config = self.__muc.getRoomConfig(room_jid)
-            except ValueError:
-                # Can't differentiate IQ errors from a "no configuration"
-                # result: consider it OK
-                self.__logger.warning("Can't get the configuration form for "
-                                      "XMPP room %s", room_jid)
-                self.__safe_callback(room_data)
-            else:
-                # Prepare our configuration
-                custom_values = room_data.configuration or {}
-
-                # Filter options that are not known from the server
-                known_fields = config['fields']
-                to_remove = [key for key in custom_values
-                             if key not in known_fields]
-                for key in to_remove:
-                    del custom_values[key]
-
-                # Send configuration (use a new form to avoid OpenFire to have
-                # an internal error)
-                form = self.__xmpp['xep_0004'].make_form("submit")
-                form['values'] = custom_values
-                self.__muc.setRoomConfig(room_jid, form)
-
-                # Call back the creator
-                self.__safe_callback(room_data)
+            # Success: we own the room. Configure it in another thread, as
+            # configuration requires blocking IQ requests which would block
+            # the handling of the other rooms presences
+            threading.Thread(target=self.__configure_room,
+                             args=(room_jid, room_data),
+                             name="Herald-XMPP-RoomConfig").start()
+
+    def __configure_room(self, room_jid, room_data):
+        """
+        Sets up the configuration of a room we own, then calls back the
+        creator
+
+        :param room_jid: Bare JID of the room
+        :param room_data: A RoomData object
+        """
+        # Setup room configuration
+        try:
+            config = self.__muc.getRoomConfig(room_jid)
+        except ValueError:
+            # Can't differentiate IQ errors from a "no configuration"
+            # result: consider it OK
+            self.__logger.warning("Can't get the configuration form for "
+                                  "XMPP room %s", room_jid)
+            self.__safe_callback(room_data)
+        else:
+            # Prepare our configuration (the same dictionary can be used
+            # for many rooms, configured in parallel)
+            custom_values = dict(room_data.configuration or {})
+
+            # Filter options that are not known from the server
+            known_fields = config['fields']
+            to_remove = [key for key in custom_values
+                         if key not in known_fields]
+            for key in to_remove:
+                del custom_values[key]
+
+            # Send configuration (use a new form to avoid OpenFire to have
+            # an internal error)
+            form = self.__xmpp['xep_0004'].make_form("submit")
+            form['values'] = custom_values
+            self.__muc.setRoomConfig(room_jid, form)
+
+            # Call back the creator
+            self.__safe_callback(room_data)
 
 # ------------------------------------------------------------------------------
 
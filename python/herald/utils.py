@@ -35,20 +35,62 @@ __docformat__ = "restructuredtext en"
 
 # ------------------------------------------------------------------------------
 
+import importlib
 import threading
 import json
 import logging
 
 import herald
 
-import pelix.misc.jabsorb as jabsorb
-
 # ------------------------------------------------------------------------------
 
 _logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------------------
 
+
+class LazyModule(object):
+    """
+    Stands for a module which is only imported when one of its members is
+    accessed. This keeps heavy dependencies out of the framework start-up.
+    """
+    def __init__(self, name):
+        """
+        Sets up the lazy module
+
+        :param name: Full name of the module to import
+        """
+        self.__name = name
+        self.__module = None
+
+    def __repr__(self):
+        """
+        String representation
+        """
+        state = "loaded" if self.__module is not None else "not loaded"
+        return "<LazyModule {0} ({1})>".format(self.__name, state)
+
+    def __getattr__(self, item):
+        """
+        Imports the module on first access, then caches the requested member
+
+        :param item: Name of a module member
+        :return: The module member
+        :raise ImportError: Module not found
+        :raise AttributeError: Unknown member
+        """
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+
+        value = getattr(self.__module, item)
+        self.__dict__[item] = value
+        return value
+
+
+jabsorb = LazyModule("pelix.misc.jabsorb")
+
+# ------------------------------------------------------------------------------
+
 def json_converter(obj):
     """
     Converts sets to list during JSON serialization
@@ -68,10 +110,8 @@ def to_json(msg):
     #result[herald.MESSAGE_HERALD_VERSION] = herald.HERALD_SPECIFICATION_VERSION
     
     # headers
-    result[herald.MESSAGE_HEADERS] = {}        
-    if msg.headers is not None:
-        for key in msg.headers:
-            result[herald.MESSAGE_HEADERS][key] = msg.headers.get(key) or None        
+    result[herald.MESSAGE_HEADERS] = dict(
+        (key, value or None) for key, value in msg.headers.items())
     
     # subject
     result[herald.MESSAGE_SUBJECT] = msg.subject
@@ -136,14 +176,14 @@ def from_json(json_string):
         _logger.error("Error retrieving message content! " + str(ex)) 
     # other headers
     if herald.MESSAGE_HEADERS in parsed_msg:
-        for key in parsed_msg[herald.MESSAGE_HEADERS]:
-            if key not in msg._headers:
-                msg._headers[key] = parsed_msg[herald.MESSAGE_HEADERS][key]         
+        known_headers = msg.headers
+        for key, value in parsed_msg[herald.MESSAGE_HEADERS].items():
+            if key not in known_headers:
+                msg.add_header(key, value)
     # metadata
-    if herald.MESSAGE_METADATA in parsed_msg:
-        for key in parsed_msg[herald.MESSAGE_METADATA]:
-            if key not in msg._metadata:
-                msg._metadata[key] = parsed_msg[herald.MESSAGE_METADATA][key] 
+    if parsed_msg.get(herald.MESSAGE_METADATA):
+        for key, value in parsed_msg[herald.MESSAGE_METADATA].items():
+            msg.add_metadata(key, value)
                        
     return msg
 
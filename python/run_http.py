@@ -36,6 +36,7 @@ __docformat__ = "restructuredtext en"
 # ------------------------------------------------------------------------------
 
 # Herald constants
+import herald.startup
 import herald.transports.http
 
 # Pelix
@@ -46,11 +47,34 @@ import pelix.http
 # Standard library
 import argparse
 import logging
+import time
 
 # ------------------------------------------------------------------------------
 
+BUNDLES = (
+    'pelix.ipopo.core',
+    'pelix.ipopo.waiting',
+    'pelix.shell.core',
+    'pelix.shell.ipopo',
+    'pelix.shell.console',
+
+    # Herald core
+    'herald.core',
+    'herald.directory',
+    'herald.shell',
+
+    # RPC
+    'pelix.remote.dispatcher',
+    'pelix.remote.registry',
+    'herald.remote.discovery',
+    'herald.remote.herald_xmlrpc',)
+""" Bundles installed whatever the configuration """
 
-def main(http_port, peer_name, node_name, app_id):
+# ------------------------------------------------------------------------------
+
+
+def main(http_port, peer_name, node_name, app_id, properties=None,
+         profile=False):
     """
     Runs the framework
 
@@ -58,36 +82,26 @@ def main(http_port, peer_name, node_name, app_id):
     :param peer_name: Name of the peer
     :param node_name: Name (also, UID) of the node hosting the peer
     :param app_id: Application ID
+    :param properties: Additional framework properties, which can
+                       configure other transports
+    :param profile: If True, prints the import time of the bundles and the
+                    start-up time of the framework
     """
+    # Framework properties: the HTTP transport is always configured
+    properties = herald.startup.parse_properties(properties)
+    properties.update({herald.FWPROP_NODE_UID: node_name,
+                       herald.FWPROP_NODE_NAME: node_name,
+                       herald.FWPROP_PEER_NAME: peer_name,
+                       herald.FWPROP_APPLICATION_ID: app_id,
+                       herald.startup.PROP_HTTP_PORT: http_port})
+    bundles = herald.startup.select_bundles(BUNDLES, properties)
+    if profile:
+        herald.startup.print_import_profile(
+            herald.startup.profile_imports(bundles))
+        start = time.time()
+
     # Create the framework
-    framework = pelix.framework.create_framework(
-        ('pelix.ipopo.core',
-         'pelix.ipopo.waiting',
-         'pelix.shell.core',
-         'pelix.shell.ipopo',
-         'pelix.shell.console',
-         'pelix.http.basic',
-
-         # Herald core
-         'herald.core',
-         'herald.directory',
-         'herald.shell',
-
-         # Herald HTTP
-         'herald.transports.http.directory',
-         'herald.transports.http.discovery_multicast',
-         'herald.transports.http.servlet',
-         'herald.transports.http.transport',
-
-         # RPC
-         'pelix.remote.dispatcher',
-         'pelix.remote.registry',
-         'herald.remote.discovery',
-         'herald.remote.herald_xmlrpc',),
-        {herald.FWPROP_NODE_UID: node_name,
-         herald.FWPROP_NODE_NAME: node_name,
-         herald.FWPROP_PEER_NAME: peer_name,
-         herald.FWPROP_APPLICATION_ID: app_id})
+    framework = pelix.framework.create_framework(bundles, properties)
 
     # Start everything
     framework.start()
@@ -107,6 +121,10 @@ def main(http_port, peer_name, node_name, app_id):
         ipopo.add(herald.transports.http.FACTORY_DISCOVERY_MULTICAST,
                   "herald-http-discovery-multicast")
 
+    if profile:
+        print("Framework started in {0:.1f} ms"
+              .format((time.time() - start) * 1000))
+
     # Start the framework and wait for it to stop
     framework.wait_for_stop()
 
@@ -133,6 +151,17 @@ if __name__ == "__main__":
                        default=herald.DEFAULT_APPLICATION_ID,
                        dest="app_id", help="Application ID")
 
+    # Start-up
+    group = parser.add_argument_group("Start-up",
+                                      "Configuration of the framework")
+    group.add_argument("-D", "--property", action="append", default=[],
+                       dest="properties", metavar="NAME=VALUE",
+                       help="Framework property. Transports are installed "
+                            "only if their configuration is given")
+    group.add_argument("--profile-imports", action="store_true",
+                       default=False, dest="profile",
+                       help="Print the import time of the bundles")
+
     # Parse arguments
     args = parser.parse_args()
 
@@ -142,4 +171,5 @@ if __name__ == "__main__":
     logging.getLogger('requests').setLevel(logging.WARNING)
 
     # Run the framework
-    main(args.http_port, args.name, args.node, args.app_id)
+    main(args.http_port, args.name, args.node, args.app_id,
+         args.properties, args.profile)
@@ -36,6 +36,7 @@ __docformat__ = "restructuredtext en"
 # ------------------------------------------------------------------------------
 
 # Herald constants
+import herald.startup
 import herald.transports.xmpp
 
 # Pelix
@@ -45,12 +46,34 @@ import pelix.framework
 # Standard library
 import argparse
 import logging
+import time
+
+# ------------------------------------------------------------------------------
+
+BUNDLES = (
+    'pelix.ipopo.core',
+    'pelix.ipopo.waiting',
+    'pelix.shell.core',
+    'pelix.shell.ipopo',
+    'pelix.shell.console',
+
+    # Herald core
+    'herald.core',
+    'herald.directory',
+    'herald.shell',
+
+    # RPC
+    'pelix.remote.dispatcher',
+    'pelix.remote.registry',
+    'herald.remote.discovery',
+    'herald.remote.herald_xmlrpc',)
+""" Bundles installed whatever the configuration """
 
 # ------------------------------------------------------------------------------
 
 
 def main(xmpp_server, xmpp_port, peer_name, node_name, app_id,
-         xmpp_jid=None, xmpp_password=None):
+         xmpp_jid=None, xmpp_password=None, properties=None, profile=False):
     """
     Runs the framework
 
@@ -61,33 +84,27 @@ def main(xmpp_server, xmpp_port, peer_name, node_name, app_id,
     :param app_id: Application ID
     :param xmpp_jid: XMPP JID, None for Anonymous login
     :param xmpp_password: XMPP account password
+    :param properties: Additional framework properties, which can
+                       configure other transports
+    :param profile: If True, prints the import time of the bundles and the
+                    start-up time of the framework
     """
+    # Framework properties: the XMPP transport is always configured
+    properties = herald.startup.parse_properties(properties)
+    properties.update({herald.FWPROP_NODE_UID: node_name,
+                       herald.FWPROP_NODE_NAME: node_name,
+                       herald.FWPROP_PEER_NAME: peer_name,
+                       herald.FWPROP_APPLICATION_ID: app_id,
+                       herald.transports.xmpp.PROP_XMPP_SERVER: xmpp_server,
+                       herald.transports.xmpp.PROP_XMPP_PORT: xmpp_port})
+    bundles = herald.startup.select_bundles(BUNDLES, properties)
+    if profile:
+        herald.startup.print_import_profile(
+            herald.startup.profile_imports(bundles))
+        start = time.time()
+
     # Create the framework
-    framework = pelix.framework.create_framework(
-        ('pelix.ipopo.core',
-         'pelix.ipopo.waiting',
-         'pelix.shell.core',
-         'pelix.shell.ipopo',
-         'pelix.shell.console',
-
-         # Herald core
-         'herald.core',
-         'herald.directory',
-         'herald.shell',
-
-         # Herald XMPP
-         'herald.transports.xmpp.directory',
-         'herald.transports.xmpp.transport',
-
-         # RPC
-         'pelix.remote.dispatcher',
-         'pelix.remote.registry',
-         'herald.remote.discovery',
-         'herald.remote.herald_xmlrpc',),
-        {herald.FWPROP_NODE_UID: node_name,
-         herald.FWPROP_NODE_NAME: node_name,
-         herald.FWPROP_PEER_NAME: peer_name,
-         herald.FWPROP_APPLICATION_ID: app_id})
+    framework = pelix.framework.create_framework(bundles, properties)
     context = framework.get_bundle_context()
 
     # Start everything
@@ -103,6 +120,10 @@ def main(xmpp_server, xmpp_port, peer_name, node_name, app_id,
                    herald.transports.xmpp.PROP_XMPP_JID: xmpp_jid,
                    herald.transports.xmpp.PROP_XMPP_PASSWORD: xmpp_password})
 
+    if profile:
+        print("Framework started in {0:.1f} ms"
+              .format((time.time() - start) * 1000))
+
     # Start the framework and wait for it to stop
     framework.wait_for_stop()
 
@@ -140,6 +161,17 @@ if __name__ == "__main__":
                        default=herald.DEFAULT_APPLICATION_ID,
                        dest="app_id", help="Application ID")
 
+    # Start-up
+    group = parser.add_argument_group("Start-up",
+                                      "Configuration of the framework")
+    group.add_argument("-D", "--property", action="append", default=[],
+                       dest="properties", metavar="NAME=VALUE",
+                       help="Framework property. Transports are installed "
+                            "only if their configuration is given")
+    group.add_argument("--profile-imports", action="store_true",
+                       default=False, dest="profile",
+                       help="Print the import time of the bundles")
+
     # Parse arguments
     args = parser.parse_args()
 
@@ -155,4 +187,4 @@ if __name__ == "__main__":
 
     # Run the framework
     main(args.xmpp_server, args.xmpp_port, args.name, args.node, args.app_id,
-         args.xmpp_jid, password)
+         args.xmpp_jid, password, args.properties, args.profile)
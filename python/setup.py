@@ -70,6 +70,7 @@ setup(
         'herald.remote',
         'herald.transports',
         'herald.transports.http',
+        'herald.transports.loopback',
         'herald.transports.xmpp'],
     classifiers=[
         'Development Status :: 3 - Alpha',
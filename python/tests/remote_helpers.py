@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Fake remote service shared by the Herald Remote Services tests
+
+:author: Thomas Calmant
+"""
+
+# Standard library
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+
+class Reply(object):
+    """
+    Reply message stand-in
+    """
+    def __init__(self, content, reply_to=None):
+        self.content = content
+        self.reply_to = reply_to
+
+
+class Service(object):
+    """
+    Exported service, keeping the names of the threads calling it
+    """
+    def __init__(self, delay=0):
+        """
+        :param delay: Time taken by each addition, in seconds
+        """
+        self.delay = delay
+        self.threads = set()
+
+    def add(self, a, b):
+        self.threads.add(threading.current_thread().name)
+        if self.delay:
+            time.sleep(self.delay)
+        return a + b
+
+    def fail(self):
+        raise ValueError("Failure")
+
+
+def make_dispatch(service):
+    """
+    Prepares an exporter dispatch method, calling the given service
+
+    :param service: The exported service
+    :return: A method accepting a full method name and its parameters
+    """
+    def dispatch(name, params):
+        method = getattr(service, name.split('.', 1)[1])
+        if isinstance(params, dict):
+            return method(**params)
+        return method(*params)
+
+    return dispatch
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the Herald message beans
+
+:author: Thomas Calmant
+"""
+
+# Herald
+import herald
+import herald.beans as beans
+import herald.utils as utils
+
+# Standard library
+import re
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class MessageTests(unittest.TestCase):
+    """
+    Tests the message beans
+    """
+    def test_headers(self):
+        """
+        Checks the Herald headers and the other ones
+        """
+        message = beans.Message("subject", "content")
+        self.assertTrue(re.match("^[0-9A-F]{32}$", message.uid))
+        self.assertNotEqual(message.uid, beans.Message("subject").uid)
+        self.assertEqual(sorted(message.headers),
+                         sorted([herald.MESSAGE_HERALD_VERSION,
+                                 herald.MESSAGE_HEADER_TIMESTAMP,
+                                 herald.MESSAGE_HEADER_UID]))
+        self.assertRaises(AttributeError, setattr, message, "other", 1)
+
+        message.add_header(herald.MESSAGE_HEADER_SENDER_UID, "sender")
+        message.add_header("custom", 42)
+        self.assertEqual(message.get_header(herald.MESSAGE_HEADER_SENDER_UID),
+                         "sender")
+        self.assertEqual(message.headers["custom"], 42)
+        self.assertIsNone(message.get_header(herald.MESSAGE_HEADER_REPLIES_TO))
+
+        message.remove_header(herald.MESSAGE_HEADER_SENDER_UID)
+        message.remove_header("custom")
+        self.assertNotIn(herald.MESSAGE_HEADER_SENDER_UID, message.headers)
+        self.assertIsNone(message.get_header("custom"))
+
+    def test_json(self):
+        """
+        Checks the conversion of a message to and from JSON
+        """
+        message = beans.Message("subject", {"key": [1, 2]})
+        message.add_header(herald.MESSAGE_HEADER_SENDER_UID, "sender")
+        message.add_header("custom", "value")
+        message.add_metadata("meta", "data")
+
+        received = utils.from_json(utils.to_json(message))
+        self.assertIsInstance(received, beans.MessageReceived)
+        self.assertEqual(received.uid, message.uid)
+        self.assertEqual(received.timestamp, message.timestamp)
+        self.assertEqual(received.subject, "subject")
+        self.assertEqual(received.content, {"key": [1, 2]})
+        self.assertEqual(received.sender, "sender")
+        self.assertIsNone(received.reply_to)
+        self.assertEqual(received.get_header("custom"), "value")
+        self.assertEqual(received.get_metadata("meta"), "data")
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the fragmentation of large messages
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.transports.chunking import ChunkSender, Reassembler, make_chunks
+import herald
+import herald.beans as beans
+import herald.utils as utils
+
+# Standard library
+import random
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+def make_message(subject, content):
+    """
+    Prepares a serialized message
+    """
+    message = beans.Message(subject, content)
+    message.add_header(herald.MESSAGE_HEADER_SENDER_UID, "sender")
+    return message, utils.to_json(message)
+
+
+class ChunkingTests(unittest.TestCase):
+    """
+    Tests the fragmentation and the reassembly of messages
+    """
+    def test_round_trip(self):
+        """
+        Splits a message and reassembles its chunks, in any order
+        """
+        message, content = make_message(
+            "test/big", {"text": u'é"\\<' * 5000,
+                         "values": list(range(1000))})
+
+        chunks = make_chunks(message, content, 1024)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 1024)
+
+        random.shuffle(chunks)
+        reassembler = Reassembler()
+        results = [reassembler.add(utils.from_json(chunk))
+                   for chunk in chunks]
+        self.assertEqual(results[:-1], [None] * (len(chunks) - 1))
+        self.assertEqual(results[-1], content)
+        self.assertEqual(reassembler.size, 0)
+
+    def test_limits(self):
+        """
+        Checks the memory limit and the timeout of the reassembler
+        """
+        message, content = make_message("test/big", "x" * 10000)
+        chunks = [utils.from_json(chunk)
+                  for chunk in make_chunks(message, content, 1024)]
+
+        # Memory limit: partial messages are dropped
+        reassembler = Reassembler(max_memory=2048)
+        for chunk in chunks[:-1]:
+            self.assertIsNone(reassembler.add(chunk))
+            self.assertLessEqual(reassembler.size, 2048)
+        self.assertIsNone(reassembler.add(chunks[-1]))
+
+        # Timeout: the first chunks are forgotten
+        reassembler = Reassembler(timeout=-1)
+        for chunk in chunks:
+            self.assertIsNone(reassembler.add(chunk))
+
+        # Invalid chunk
+        self.assertRaises(ValueError, reassembler.add,
+                          beans.MessageReceived("uid", "herald/chunk",
+                                                {"id": "a"}, "sender", None,
+                                                None))
+
+    def test_inconsistent_count(self):
+        """
+        Checks that chunks of a message must share the same count
+        """
+        def make_chunk(index, count):
+            return beans.MessageReceived(
+                "uid", "herald/chunk",
+                {"id": "a", "index": index, "count": count, "data": "x"},
+                "sender", None, None)
+
+        reassembler = Reassembler()
+        self.assertIsNone(reassembler.add(make_chunk(0, 2)))
+        self.assertRaises(ValueError, reassembler.add, make_chunk(3, 5))
+        self.assertRaises(ValueError, reassembler.add, make_chunk(0, 1))
+
+        # The partial message is still complete-able
+        self.assertEqual(reassembler.add(make_chunk(1, 2)), "xx")
+        self.assertEqual(reassembler.size, 0)
+
+    def test_sender(self):
+        """
+        Checks that small messages aren't delayed by large ones
+        """
+        sent = []
+        event = threading.Event()
+        chunk_size = 512
+
+        def send(payload):
+            sent.append(payload)
+
+        def send_chunk(payload):
+            # Let small messages be sent between two chunks
+            event.wait(1)
+            sent.append(payload)
+
+        sender = ChunkSender(chunk_size)
+        sender.start()
+        try:
+            message, content = make_message("test/big", "x" * 4096)
+            self.assertIsNone(sender.send(message, content, send, send_chunk))
+
+            small, small_content = make_message("test/small", "hello")
+            sender.send(small, small_content, send, send_chunk)
+            event.set()
+
+            # Wait for all chunks to be sent
+            nb_chunks = len(make_chunks(message, content, chunk_size))
+            for _ in range(100):
+                if len(sent) > nb_chunks:
+                    break
+                time.sleep(.05)
+        finally:
+            sender.stop()
+
+        self.assertEqual(sent[0], small_content)
+
+        reassembler = Reassembler()
+        results = [reassembler.add(utils.from_json(chunk))
+                   for chunk in sent[1:]]
+        self.assertEqual(results[-1], content)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the scatter-gather API of Herald
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.collector import ReplyCollector
+from herald.exceptions import NoListener, PeerLost
+import herald.beans as beans
+import herald.core
+
+# Standard library
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _Peer(object):
+    """
+    Peer stand-in
+    """
+    def __init__(self, uid):
+        self.uid = uid
+
+    def __str__(self):
+        return self.uid
+
+    def get_accesses(self):
+        return ("test",)
+
+
+class _Directory(object):
+    """
+    Directory stand-in
+    """
+    def __init__(self, group):
+        self.group = group
+
+    def get_peer(self, uid):
+        raise KeyError(uid)
+
+    def get_peers_for_group(self, group):
+        return self.group
+
+
+class _Transport(object):
+    """
+    Transport keeping the messages sent to groups
+    """
+    def __init__(self):
+        self.messages = []
+
+    def fire(self, peer, message, extra=None):
+        self.messages.append(message)
+
+    def fire_group(self, group, peers, message):
+        self.messages.append(message)
+        return [peer for peer in peers if peer.uid != "unreachable"]
+
+
+def _reply(sender, message):
+    """
+    Forges a reply
+    """
+    return beans.MessageReceived(sender + message.uid, "reply", sender,
+                                 sender, message.uid, "test")
+
+
+class ReplyCollectorTests(unittest.TestCase):
+    """
+    Tests the reply collector
+    """
+    def test_all(self):
+        """
+        Waits for all the peers
+        """
+        message = beans.Message("test")
+        done = []
+        collector = ReplyCollector(message.uid, ("a", "b", "c"))
+        collector.add_callback(done.append)
+
+        collector.add_reply(_reply("a", message))
+        collector.add_reply(_reply("a", message))
+        collector.add_reply(_reply("unknown", message))
+        collector.add_error("b", ValueError("error"))
+        self.assertFalse(collector.done)
+        self.assertFalse(collector.wait(.01))
+
+        collector.add_reply(_reply("c", message))
+        self.assertTrue(collector.wait(0))
+        self.assertEqual(done, [collector])
+        self.assertEqual(sorted(collector.replies), ["a", "c"])
+        self.assertEqual(list(collector.errors), ["b"])
+        self.assertEqual(collector.missing, set())
+        self.assertFalse(collector.success)
+
+        # Late replies are ignored, late callbacks are called
+        collector.add_reply(_reply("b", message))
+        self.assertEqual(sorted(collector.replies), ["a", "c"])
+        collector.add_callback(done.append)
+        self.assertEqual(len(done), 2)
+
+    def test_count(self):
+        """
+        Checks the first-K and quorum modes
+        """
+        message = beans.Message("test")
+        collector = ReplyCollector(message.uid, "abcde", 2)
+        collector.add_reply(_reply("a", message))
+        self.assertFalse(collector.done)
+        collector.add_reply(_reply("b", message))
+        self.assertTrue(collector.done)
+        self.assertTrue(collector.success)
+        collector.add_reply(_reply("c", message))
+        self.assertEqual(collector.missing, set("cde"))
+
+        # Quorum can't be reached anymore
+        collector = ReplyCollector(message.uid, "abcde", quorum=.6)
+        self.assertEqual(collector.expected, 3)
+        collector.add_error("a", ValueError("error"))
+        collector.add_error("b", ValueError("error"))
+        self.assertFalse(collector.done)
+        collector.add_error("c", ValueError("error"))
+        self.assertTrue(collector.done)
+        self.assertFalse(collector.success)
+
+        self.assertTrue(ReplyCollector(message.uid, ()).done)
+        self.assertEqual(ReplyCollector(message.uid, "abc", quorum=1).expected,
+                         3)
+        self.assertEqual(ReplyCollector(message.uid, "abc", 1).expected, 1)
+
+        # Invalid or ambiguous values
+        for count in (0, 1.0, .5, True, "1"):
+            self.assertRaises(ValueError, ReplyCollector, message.uid, "a",
+                              count)
+        for quorum in (0, 1.5, True, "1"):
+            self.assertRaises(ValueError, ReplyCollector, message.uid, "a",
+                              quorum=quorum)
+        self.assertRaises(ValueError, ReplyCollector, message.uid, "a", 1,
+                          quorum=1)
+
+    def test_deadline(self):
+        """
+        Checks the collector timeout
+        """
+        message = beans.Message("test")
+        event = threading.Event()
+        collector = ReplyCollector(message.uid, "ab")
+        collector.add_callback(lambda _: event.set())
+        collector.start(.1)
+        collector.add_reply(_reply("a", message))
+
+        self.assertTrue(event.wait(5))
+        self.assertTrue(collector.done)
+        self.assertEqual(list(collector.replies), ["a"])
+        self.assertEqual(collector.missing, set("b"))
+
+
+class HeraldGatherTests(unittest.TestCase):
+    """
+    Tests Herald.gather()
+    """
+    def setUp(self):
+        self.peers = [_Peer(uid) for uid in ("a", "b", "c", "unreachable")]
+        self.transport = _Transport()
+        self.core = herald.core.Herald()
+        self.core._directory = _Directory(self.peers)
+        self.core._transports = {"test": self.transport}
+
+    def test_gather(self):
+        """
+        Collects replies, errors and lost peers
+        """
+        message = beans.Message("test")
+        done = []
+        collector = self.core.gather("all", message, timeout=10,
+                                     callback=done.append)
+        self.assertEqual(self.transport.messages, [message])
+        self.assertEqual(list(collector.errors), ["unreachable"])
+
+        self.core._Herald__notify(_reply("a", message))
+        self.core._handle_error(beans.MessageReceived(
+            "error", "herald/error/no-listener",
+            {"uid": message.uid, "subject": "test"}, "b", None, "test"),
+            "no-listener")
+        self.assertFalse(collector.done)
+
+        # Lost peers are removed right away
+        self.core.peer_unregistered(self.peers[2])
+        self.assertTrue(collector.wait(0))
+        self.assertEqual(done, [collector])
+        self.assertEqual(list(collector.replies), ["a"])
+        self.assertIsInstance(collector.errors["b"], NoListener)
+        self.assertIsInstance(collector.errors["c"], PeerLost)
+
+        # The message has been forgotten
+        self.assertFalse(self.core.forget(message.uid))
+
+    def test_quorum(self):
+        """
+        Stops at the first replies
+        """
+        message = beans.Message("test")
+        collector = self.core.gather("all", message, 2, timeout=10)
+        self.core._Herald__notify(_reply("c", message))
+        self.assertFalse(collector.done)
+        self.core._Herald__notify(_reply("a", message))
+        self.assertTrue(collector.done)
+        self.assertTrue(collector.success)
+        self.assertEqual(collector.missing, set("b"))
+
+        # Half of the peers (rounded up)
+        message = beans.Message("test")
+        collector = self.core.gather("all", message, timeout=10, quorum=.5)
+        self.core._Herald__notify(_reply("a", message))
+        self.assertFalse(collector.done)
+        self.core.peer_unregistered(self.peers[2])
+        self.assertFalse(collector.done)
+        self.core._Herald__notify(_reply("b", message))
+        self.assertTrue(collector.success)
+        self.assertFalse(self.core.forget(message.uid))
+
+    def test_forget(self):
+        """
+        Forgetting the message stops the collector
+        """
+        message = beans.Message("test")
+        collector = self.core.gather("all", message, timeout=None)
+        self.assertTrue(self.core.forget(message.uid))
+        self.assertTrue(collector.done)
+        self.assertEqual(sorted(collector.errors),
+                         ["a", "b", "c", "unreachable"])
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
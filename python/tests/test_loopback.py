@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the Herald loopback transport
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.transports.loopback import ACCESS_ID
+from herald.transports.loopback.hub import Hub, LinkConditions
+import herald.beans as beans
+import herald.transports.loopback.directory as loopback_directory
+import herald.transports.loopback.transport as loopback_transport
+
+# Benchmark utilities
+from benchmarks.harness import VirtualPeer, BenchListener, SUBJECT_ECHO
+
+# Standard library
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _EndPoint(object):
+    """
+    Hub end point stand-in
+    """
+    def __init__(self):
+        self.joined = []
+        self.left = []
+        self.payloads = []
+        self.event = threading.Event()
+
+    def peer_joined(self, description):
+        self.joined.append(description['uid'])
+
+    def peer_left(self, uid):
+        self.left.append(uid)
+
+    def deliver(self, payload):
+        self.payloads.append(payload)
+        self.event.set()
+
+
+class HubTests(unittest.TestCase):
+    """
+    Tests the hub and the simulated network conditions
+    """
+    def test_conditions(self):
+        """
+        Checks the delays computed by the link conditions
+        """
+        self.assertIsNone(LinkConditions(loss=1).delay())
+        self.assertEqual(LinkConditions().delay(), 0)
+
+        conditions = LinkConditions(latency=.1, jitter=.05, reorder=.2,
+                                    seed=42)
+        delays = [conditions.delay() for _ in range(1000)]
+        self.assertTrue(all(.1 <= delay <= .35 for delay in delays))
+        self.assertEqual(len([delay for delay in delays if delay > .15]),
+                         conditions.reordered)
+        self.assertTrue(100 < conditions.reordered < 300)
+
+        # Same seed, same run
+        replay = LinkConditions(.1, .05, 0, .2, 42)
+        self.assertEqual(delays, [replay.delay() for _ in range(1000)])
+
+    def test_delivery(self):
+        """
+        Messages are delivered by delivery time, to connected peers only
+        """
+        hub = Hub("test")
+        first = _EndPoint()
+        second = _EndPoint()
+        hub.join("first", {"uid": "first"}, first)
+        hub.join("second", {"uid": "second"}, second)
+        try:
+            self.assertEqual(first.joined, ["second"])
+            self.assertEqual(second.joined, ["first"])
+            self.assertFalse(hub.send("unknown", "lost"))
+
+            self.assertTrue(hub.send("second", "late", .1))
+            self.assertTrue(hub.send("second", "early"))
+            self.assertTrue(hub.send("second", "early too"))
+            deadline = time.time() + 5
+            while len(second.payloads) < 3 and time.time() < deadline:
+                time.sleep(.01)
+            self.assertEqual(second.payloads, ["early", "early too", "late"])
+        finally:
+            hub.leave("second")
+            hub.leave("first")
+
+        self.assertEqual(first.left, ["second"])
+        self.assertEqual(len(hub), 0)
+
+
+class LoopbackTransportTests(unittest.TestCase):
+    """
+    Tests peers connected by the loopback transport
+    """
+    def setUp(self):
+        self.peers = []
+        for idx in range(3):
+            peer = VirtualPeer("peer-{0}".format(idx), groups=["test"])
+            peer.start()
+            transport = loopback_transport.LoopbackTransport()
+            transport._hub_name = "test-transport"
+            peer.add_transport(ACCESS_ID, transport,
+                               loopback_directory.LoopbackDirectory())
+            listener = BenchListener()
+            peer.add_listener(listener, ["bench/*"])
+            self.peers.append((peer, listener))
+
+    def tearDown(self):
+        for peer, _ in self.peers:
+            peer.stop()
+
+    def test_messages(self):
+        """
+        Tests the discovery, send and fire_group
+        """
+        sender = self.peers[0][0]
+        for peer, _ in self.peers:
+            self.assertEqual(len(peer.directory.get_peers()), 2)
+
+        reply = sender.herald.send("peer-1",
+                                   beans.Message(SUBJECT_ECHO, {"a": 1}), 5)
+        self.assertEqual(reply.content, {"a": 1})
+        self.assertEqual(reply.sender, "peer-1")
+
+        for _, listener in self.peers[1:]:
+            listener.expect(1)
+        _, missing = sender.herald.fire_group(
+            "test", beans.Message("bench/fire", {"sent": time.time()}))
+        self.assertFalse(missing)
+        for _, listener in self.peers[1:]:
+            self.assertTrue(listener.wait(5))
+
+        # A stopped peer is forgotten
+        peer, _ = self.peers.pop()
+        peer.stop()
+        self.assertEqual([other.uid for other in sender.directory.get_peers()],
+                         ["peer-1"])
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the in-process MQTT broker
+
+:author: Ahmad Shahwan
+"""
+
+# Herald
+from herald.transports.mqtt.broker import MqttBroker, topic_matches
+
+# Standard library
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# MQTT client
+try:
+    import paho.mqtt.client as paho
+except ImportError:
+    paho = None
+
+# ------------------------------------------------------------------------------
+
+
+class TopicMatchTests(unittest.TestCase):
+    """
+    Tests the MQTT topic filters
+    """
+    def test_wildcards(self):
+        """
+        Tests single and multi-level wildcards
+        """
+        self.assertTrue(topic_matches("herald/a/b", "herald/a/b"))
+        self.assertTrue(topic_matches("herald/+/b", "herald/a/b"))
+        self.assertTrue(topic_matches("herald/#", "herald/a/b"))
+        self.assertTrue(topic_matches("herald/#", "herald"))
+        self.assertFalse(topic_matches("herald/+", "herald/a/b"))
+        self.assertFalse(topic_matches("herald/a/b/c", "herald/a/b"))
+        self.assertFalse(topic_matches("#", "$SYS/uptime"))
+
+
+@unittest.skipIf(paho is None, "paho-mqtt is missing")
+class BrokerTests(unittest.TestCase):
+    """
+    Tests the broker with the Paho client
+    """
+    def setUp(self):
+        self.broker = MqttBroker()
+        self.host, self.port = self.broker.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.loop_stop()
+            client.disconnect()
+        self.broker.stop()
+
+    def _connect(self, client_id, topics=None, will=None):
+        """
+        Connects a client, subscribing to the given topics
+
+        :return: A (client, received list, event) tuple
+        """
+        received = []
+        event = threading.Event()
+        subscribed = threading.Event()
+
+        def on_message(client, userdata, msg):
+            received.append((msg.topic, msg.payload, msg.retain))
+            event.set()
+
+        client = paho.Client(client_id)
+        client.on_message = on_message
+        client.on_subscribe = lambda *args: subscribed.set()
+        if will:
+            client.will_set(*will)
+        client.connect(self.host, self.port)
+        client.loop_start()
+        self.clients.append(client)
+
+        if topics:
+            client.subscribe([(topic, 1) for topic in topics])
+            self.assertTrue(subscribed.wait(5))
+        return client, received, event
+
+    def test_publish(self):
+        """
+        Tests the delivery of a message to wildcard subscribers
+        """
+        _, received, event = self._connect("sub", ["herald/+/peer/#"])
+        publisher, _, _ = self._connect("pub")
+
+        publisher.publish("herald/app/peer/abc", b"hello", 1)
+        self.assertTrue(event.wait(5))
+        self.assertEqual(received, [("herald/app/peer/abc", b"hello", False)])
+
+    def test_will(self):
+        """
+        Tests the retained will sent when a client disconnects abruptly
+        """
+        client, _, _ = self._connect("dying",
+                                     will=("herald/lastwill", b"bye", 1, True))
+        # Close the socket without sending DISCONNECT
+        client.loop_stop()
+        client.socket().close()
+        self.clients.remove(client)
+
+        _, received, event = self._connect("late", ["herald/lastwill"])
+        self.assertTrue(event.wait(5))
+        self.assertEqual(received, [("herald/lastwill", b"bye", True)])
+
+    def test_concurrent_subscribe(self):
+        """
+        Tests subscriptions changed while another client publishes
+        """
+        _, received, event = self._connect("sub", ["herald/end"])
+        churner, _, _ = self._connect("churner")
+        publisher, _, _ = self._connect("pub")
+
+        def publish_loop():
+            for idx in range(200):
+                publisher.publish("herald/churn/{0}".format(idx), b"data", 0)
+
+        thread = threading.Thread(target=publish_loop)
+        thread.start()
+        for idx in range(200):
+            churner.subscribe("herald/churn/{0}".format(idx), 0)
+            churner.unsubscribe("herald/churn/{0}".format(idx - 1))
+        thread.join()
+
+        # The sessions of both clients must still be alive
+        churner.publish("herald/end", b"churner", 1)
+        publisher.publish("herald/end", b"pub", 1)
+        for _ in range(50):
+            if len(received) == 2:
+                break
+            event.wait(.1)
+            event.clear()
+
+        self.assertEqual(sorted(payload for _, payload, _ in received),
+                         [b"churner", b"pub"])
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the Herald probe
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.probe.core import ProbeCore, POLICY_DROP_OLDEST, sample_uid
+from herald.probe.metrics import Histogram, MetricsStore
+from herald.probe.store_memory import MemoryStore
+from herald.probe.store_sqlite import SqliteStore
+import herald
+
+# Standard library
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _BlockingStore(object):
+    """
+    A store waiting for an event before storing records
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.records = []
+
+    def store(self, channel, data):
+        self.event.wait()
+        self.records.append((channel, data))
+
+
+class ProbeCoreTests(unittest.TestCase):
+    """
+    Tests the probe dispatcher
+    """
+    def setUp(self):
+        self.store = _BlockingStore()
+        self.probe = ProbeCore()
+        self.probe._stores = [self.store]
+        self.probe._activated = True
+
+    def tearDown(self):
+        self.store.event.set()
+
+    def _fill(self, policy):
+        """
+        Stores more records than the buffer can contain, with a blocked store
+        """
+        self.probe._buffer_size = 10
+        self.probe._buffer_policy = policy
+        self.probe._validate(None)
+        self.probe.activate_channel("test")
+
+        # Filtered records and inactive channels never reach the stores
+        self.probe.set_channel_filter("test", "(!(uid=filtered))")
+        self.probe.store("test", {"uid": "filtered"})
+        self.probe.store("ignored", {"uid": "ignored"})
+
+        for idx in range(100):
+            self.probe.store("test", {"uid": idx})
+
+        stats = self.probe.get_stats()
+        self.assertLessEqual(stats["buffered"], 10)
+        self.assertGreaterEqual(stats["dropped"]["test"], 80)
+
+        # Let the store work
+        self.store.event.set()
+        self.probe._invalidate(None)
+        return [data["uid"] for _, data in self.store.records]
+
+    def test_drop_newest(self):
+        """
+        Checks the drop-newest policy
+        """
+        uids = self._fill("drop-newest")
+        self.assertNotIn("filtered", uids)
+        self.assertNotIn("ignored", uids)
+        self.assertNotIn(99, uids)
+        self.assertEqual(uids, sorted(uids))
+
+    def test_drop_oldest(self):
+        """
+        Checks the drop-oldest policy
+        """
+        uids = self._fill(POLICY_DROP_OLDEST)
+        self.assertEqual(uids[-10:], list(range(90, 100)))
+
+    def test_sampling(self):
+        """
+        Checks sampling, rate limits and content truncation
+        """
+        self.store.event.set()
+        self.probe._sampling = {herald.PROBE_CHANNEL_MSG_SEND: 10}
+        self.probe._rate_limits = {"limited": 5}
+        self.probe._content_max_size = 4
+        self.probe._validate(None)
+        for channel in (herald.PROBE_CHANNEL_MSG_SEND, "limited",
+                        herald.PROBE_CHANNEL_MSG_CONTENT):
+            self.probe.activate_channel(channel)
+
+        uids = [str(idx) for idx in range(1000)]
+        for uid in uids:
+            self.probe.store(herald.PROBE_CHANNEL_MSG_SEND, {"uid": uid})
+            self.probe.store("limited", {"uid": uid})
+        self.probe.store(herald.PROBE_CHANNEL_MSG_CONTENT,
+                         {"uid": "0", "content": "truncated"})
+        self.assertEqual(self.probe.get_stats()["limited"], {"limited": 995})
+        self.probe._invalidate(None)
+
+        records = self.store.records
+        sampled = [data["uid"] for channel, data in records
+                   if channel == herald.PROBE_CHANNEL_MSG_SEND]
+        self.assertEqual(sampled, [uid for uid in uids
+                                   if sample_uid(uid, 10)])
+        self.assertTrue(50 < len(sampled) < 150)
+        self.assertEqual(len([channel for channel, _ in records
+                              if channel == "limited"]), 5)
+        self.assertEqual(records[-1][1]["content"], "trun")
+
+
+class SqliteStoreTests(unittest.TestCase):
+    """
+    Tests the SQLite probe store
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.directory, "probe.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_store(self):
+        """
+        Stores records, including old ones to be removed
+        """
+        store = SqliteStore()
+        store._db_name = self.db_file
+        store._retention = 3600
+        store.validate(None)
+
+        now = time.time()
+        for idx in range(1000):
+            store.store(herald.PROBE_CHANNEL_MSG_SEND,
+                        {"uid": str(idx), "timestamp": now - idx * 10,
+                         "transport": "test", "subject": "test",
+                         "target": "peer", "transportTarget": "peer",
+                         "repliesTo": ""})
+            store.store(herald.PROBE_CHANNEL_MSG_CONTENT,
+                        {"uid": str(idx), "content": "content"})
+
+        # Duplicated content must be ignored
+        store.store(herald.PROBE_CHANNEL_MSG_CONTENT,
+                    {"uid": "0", "content": "duplicate"})
+        store.invalidate(None)
+
+        sql_con = sqlite3.connect(self.db_file)
+        try:
+            self.assertEqual(sql_con.execute(
+                "PRAGMA journal_mode").fetchone()[0], "wal")
+
+            # Records older than an hour have been removed
+            count = sql_con.execute("SELECT COUNT(*) FROM msg_sent") \
+                .fetchone()[0]
+            self.assertEqual(count, 360)
+            self.assertEqual(sql_con.execute(
+                "SELECT content FROM msg_content WHERE uid='0'").fetchone(),
+                ("content",))
+        finally:
+            sql_con.close()
+
+    def test_partial_records(self):
+        """
+        Checks that an invalid record doesn't discard the rest of its batch
+        """
+        store = SqliteStore()
+        store._db_name = self.db_file
+        store.validate(None)
+
+        # Missing fields are stored as NULL
+        store.store(herald.PROBE_CHANNEL_MSG_SEND,
+                    {"uid": "partial", "timestamp": time.time()})
+        # Values SQLite can't store
+        store.store(herald.PROBE_CHANNEL_MSG_SEND,
+                    {"uid": "invalid", "timestamp": time.time(),
+                     "subject": ["not", "supported"]})
+        store.store(herald.PROBE_CHANNEL_MSG_CONTENT,
+                    {"uid": "partial", "content": "content"})
+        store.invalidate(None)
+
+        sql_con = sqlite3.connect(self.db_file)
+        try:
+            self.assertEqual(sql_con.execute(
+                "SELECT uid, subject FROM msg_sent").fetchall(),
+                [("partial", None)])
+            self.assertEqual(sql_con.execute(
+                "SELECT uid FROM msg_content").fetchall(), [("partial",)])
+        finally:
+            sql_con.close()
+
+
+class MemoryStoreTests(unittest.TestCase):
+    """
+    Tests the in-memory probe store
+    """
+    def test_query(self):
+        """
+        Stores more records than kept and looks for some of them
+        """
+        store = MemoryStore()
+        store._size = 100
+        store.validate(None)
+
+        for idx in range(250):
+            store.store(herald.PROBE_CHANNEL_MSG_SEND,
+                        {"uid": str(idx), "timestamp": float(idx),
+                         "transport": "test",
+                         "subject": "herald/{0}".format(idx % 2),
+                         "target": "peer{0}".format(idx % 5),
+                         "transportTarget": "", "repliesTo": ""})
+        store.store("custom", {"value": 42})
+
+        self.assertEqual(store.get_channels(),
+                         {herald.PROBE_CHANNEL_MSG_SEND: 100, "custom": 1})
+
+        query = store.query
+        channel = herald.PROBE_CHANNEL_MSG_SEND
+        self.assertEqual([record["uid"] for record in query(channel)],
+                         [str(idx) for idx in range(150, 250)])
+        self.assertEqual(query(channel, uid="10"), [])
+        self.assertEqual(query(channel, uid="200")[0]["target"], "peer0")
+        self.assertEqual(len(query(channel, subject="herald/1")), 50)
+        self.assertEqual(len(query(channel, subject="herald/*")), 100)
+        self.assertEqual(len(query(channel, peer="peer3")), 20)
+        self.assertEqual([record["timestamp"] for record in
+                          query(channel, start=200, end=210, limit=3)],
+                         [208., 209., 210.])
+        self.assertEqual(query("custom"), [{"value": 42}])
+        self.assertEqual(query("unknown"), [])
+
+        # Filters on missing fields match nothing
+        self.assertEqual(query("custom", uid="10"), [])
+        self.assertEqual(query("custom", subject="*"), [])
+        self.assertEqual(query("custom", peer="peer3"), [])
+        self.assertEqual(query("custom", start=0), [])
+
+    def test_content_size(self):
+        """
+        Checks the truncation of the stored message contents
+        """
+        store = MemoryStore()
+        store._content_max_size = 4
+        store.validate(None)
+
+        store.store(herald.PROBE_CHANNEL_MSG_CONTENT,
+                    {"uid": "a", "content": "truncated"})
+        store.store(herald.PROBE_CHANNEL_MSG_CONTENT,
+                    {"uid": "b", "content": "abc"})
+        self.assertEqual([record["content"] for record in store.query(
+            herald.PROBE_CHANNEL_MSG_CONTENT)], ["trun", "abc"])
+        self.assertEqual(store.query(herald.PROBE_CHANNEL_MSG_CONTENT,
+                                     uid="a", subject="*"), [])
+
+
+class MetricsTests(unittest.TestCase):
+    """
+    Tests the metrics computed from probe records
+    """
+    def test_histogram(self):
+        """
+        Checks the precision of the histogram
+        """
+        histogram = Histogram(precision=5, max_value=10 ** 7)
+        for value in range(1, 100001):
+            histogram.record(value)
+        histogram.record(10 ** 9)
+
+        self.assertEqual(histogram.count, 100001)
+        self.assertEqual(histogram.min, 1)
+        self.assertEqual(histogram.max, 10 ** 7)
+        for quantile in (.1, .5, .9, .99):
+            expected = quantile * 100001
+            error = abs(histogram.percentile(quantile) - expected)
+            self.assertLessEqual(error, expected * 2 ** -4)
+        self.assertEqual(histogram.percentile(1), 10 ** 7)
+
+        histogram.clear()
+        self.assertEqual(histogram.percentile(.5), 0)
+
+    def test_round_trip(self):
+        """
+        Joins sent messages with their replies
+        """
+        store = MetricsStore()
+        store._pending_size = 10
+        store._max_keys = 2
+        store.validate(None)
+
+        now = time.time()
+        for idx in range(20):
+            uid = str(idx)
+            store.store(herald.PROBE_CHANNEL_MSG_SEND,
+                        {"uid": uid, "timestamp": now, "transport": "test",
+                         "subject": "herald/{0}".format(idx % 3),
+                         "target": "peer", "repliesTo": ""})
+            store.store(herald.PROBE_CHANNEL_MSG_RECV,
+                        {"uid": "r" + uid, "timestamp": now + .01 * idx,
+                         "transport": "test", "subject": "reply",
+                         "source": "peer", "repliesTo": uid})
+
+        # Unknown replies and expired messages are ignored
+        store.store(herald.PROBE_CHANNEL_MSG_RECV,
+                    {"uid": "x", "timestamp": now, "repliesTo": "unknown"})
+        for idx in range(15):
+            store.store(herald.PROBE_CHANNEL_MSG_SEND,
+                        {"uid": "lost" + str(idx), "timestamp": now})
+
+        metrics = store.get_metrics()
+        self.assertEqual(metrics["rtt"]["count"], 20)
+        self.assertAlmostEqual(metrics["rtt"]["max"], 190000, delta=2000)
+        self.assertEqual(metrics["peer"]["peer"]["count"], 20)
+        self.assertEqual(sorted(metrics["subject"]),
+                         ["<other>", "herald/0", "herald/1"])
+        self.assertEqual(metrics["pending"], 10)
+        self.assertEqual(metrics["expired"], 5)
+        self.assertGreater(metrics["rates"][herald.PROBE_CHANNEL_MSG_SEND], 0)
+
+        text = store.export_text()
+        self.assertIn('herald_rtt_seconds_count 20\n', text)
+        self.assertIn('herald_rtt_by_subject_seconds_count{subject="<other>"}'
+                      ' 6\n', text)
+        self.assertIn('# TYPE herald_rtt_by_peer_seconds summary\n', text)
+        self.assertNotIn('herald_rtt_seconds_count{', text)
+        self.assertIn('herald_probe_rate{channel="msg_recv"}', text)
+
+    def test_group_round_trip(self):
+        """
+        Measures the reply of each peer of a group
+        """
+        store = MetricsStore()
+        store.validate(None)
+
+        now = time.time()
+        for peer in ("a", "b", "c"):
+            store.store(herald.PROBE_CHANNEL_MSG_SEND,
+                        {"uid": "group", "timestamp": now, "transport": "test",
+                         "subject": "herald/group", "target": peer})
+        for idx, peer in enumerate(("a", "b", "b", "c")):
+            store.store(herald.PROBE_CHANNEL_MSG_RECV,
+                        {"uid": "r" + str(idx), "timestamp": now + 1,
+                         "source": peer, "repliesTo": "group"})
+            self.assertEqual(store.get_metrics()["pending"],
+                             0 if peer == "c" else 1)
+
+        metrics = store.get_metrics()
+        self.assertEqual(metrics["rtt"]["count"], 3)
+        self.assertEqual(sorted(metrics["peer"]), ["a", "b", "c"])
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the asynchronous calls of Herald Remote Services
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.exceptions import HeraldTimeout
+import herald.remote.herald_jsonrpc as herald_jsonrpc
+import herald.remote.herald_xmlrpc as herald_xmlrpc
+import herald.remote.proxies as proxies
+
+# Tests
+from tests.remote_helpers import Reply, Service, make_dispatch
+
+# Standard library
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _Herald(object):
+    """
+    Herald service stand-in, replying from other threads
+    """
+    def __init__(self, dispatcher, delay=0):
+        self.dispatcher = dispatcher
+        self.delay = delay
+        self.forgotten = []
+        self.threads = set()
+
+    def post(self, peer, message, callback, errback, timeout):
+        def reply():
+            time.sleep(self.delay)
+            callback(self, Reply(self.dispatcher.dispatch(message.content),
+                                 message.uid))
+
+        thread = threading.Thread(target=reply)
+        thread.daemon = True
+        thread.start()
+        self.threads.add(thread)
+        return message.uid
+
+    def forget(self, uid):
+        self.forgotten.append(uid)
+
+
+class AsyncTests(unittest.TestCase):
+    """
+    Tests the future-returning calls
+    """
+    def setUp(self):
+        self.service = Service()
+        self.poster = None
+
+    def tearDown(self):
+        self.poster.stop()
+
+    def _make_proxy(self, dispatcher, proxy_class, delay=0, timeout=None):
+        """
+        Prepares a proxy posting requests to a dispatcher
+        """
+        herald_svc = _Herald(dispatcher(make_dispatch(self.service)), delay)
+        self.poster = proxies.AsyncPoster(herald_svc, timeout)
+        self.poster.start()
+        return herald_svc, proxy_class("service", "peer", "subject", None,
+                                       self.poster.post)
+
+    def test_jsonrpc(self):
+        """
+        Tests concurrent JSON-RPC calls
+        """
+        herald_svc, proxy = self._make_proxy(
+            herald_jsonrpc.JsonRpcDispatcher,
+            herald_jsonrpc._JsonRpcEndpointProxy, delay=.1)
+
+        start = time.time()
+        futures = [proxy.add.async_(idx, 1) for idx in range(50)]
+        self.assertEqual([future.result(5) for future in futures],
+                         list(range(1, 51)))
+        self.assertLess(time.time() - start, 2)
+
+        future = proxy.fail.async_()
+        self.assertRaises(Exception, future.result, 5)
+        self.assertEqual(herald_svc.forgotten, [])
+
+    def test_xmlrpc(self):
+        """
+        Tests an XML-RPC call
+        """
+        _, proxy = self._make_proxy(
+            herald_xmlrpc._XmlRpcDispatcher,
+            herald_xmlrpc._XmlRpcEndpointProxy)
+        self.assertEqual(proxy.add.async_(1, 2).result(5), (3,))
+
+    def test_timeout(self):
+        """
+        Tests the timeout and the cancellation of calls
+        """
+        herald_svc, proxy = self._make_proxy(
+            herald_jsonrpc.JsonRpcDispatcher,
+            herald_jsonrpc._JsonRpcEndpointProxy, delay=1, timeout=.1)
+
+        future = proxy.add.async_(1, 2)
+        self.assertRaises(HeraldTimeout, future.result, 5)
+        self.assertEqual(len(herald_svc.forgotten), 1)
+
+        # The late reply is ignored
+        for thread in herald_svc.threads:
+            thread.join()
+
+        future = proxy.add.async_(1, 2)
+        self.assertTrue(future.cancel())
+        self.assertEqual(len(herald_svc.forgotten), 2)
+
+        # Requests are forgotten on stop
+        self.poster._AsyncPoster__timeout = None
+        future = proxy.add.async_(1, 2)
+        self.poster.stop()
+        self.assertRaises(HeraldTimeout, future.result, 5)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the batches of calls of Herald Remote Services
+
+:author: Thomas Calmant
+"""
+
+# Herald
+import herald.remote.herald_jabsorbrpc as herald_jabsorbrpc
+import herald.remote.herald_jsonrpc as herald_jsonrpc
+import herald.remote.herald_xmlrpc as herald_xmlrpc
+import herald.remote.proxies as proxies
+
+# Tests
+from tests.remote_helpers import Reply, Service, make_dispatch
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class BatchTests(unittest.TestCase):
+    """
+    Tests JSON-RPC batches and XML-RPC multicalls
+    """
+    def setUp(self):
+        self.service = Service(.05)
+        self.sent = []
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.stop()
+
+    def _make_proxy(self, module, dispatcher_class, nb_threads):
+        """
+        Prepares a proxy calling a dispatcher
+        """
+        self.pool = proxies.make_batch_pool(nb_threads, "test")
+        dispatcher = dispatcher_class(make_dispatch(self.service),
+                                      pool=self.pool)
+
+        def send(peer, subject, content):
+            self.sent.append(content)
+            return Reply(dispatcher.dispatch(content))
+
+        return getattr(module, '_{0}EndpointProxy'.format(
+            "XmlRpc" if module is herald_xmlrpc else "JsonRpc"))(
+                "service", "peer", "subject", send, None)
+
+    def _check(self, proxy):
+        """
+        Calls methods in a batch
+        """
+        batch = proxy.batch_()
+        for idx in range(5):
+            self.assertEqual(batch.add(idx, 10), 2 * idx)
+            batch.fail()
+        results = batch()
+
+        # A single message has been sent
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(results), 10)
+        self.assertEqual([results[idx] for idx in range(0, 10, 2)],
+                         [10, 11, 12, 13, 14])
+        self.assertRaises(Exception, results.__getitem__, 1)
+        self.assertEqual([idx for idx, _ in results.errors()],
+                         [1, 3, 5, 7, 9])
+
+        # Empty batch
+        self.assertEqual(len(batch()), 0)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_jsonrpc(self):
+        """
+        Tests JSON-RPC batches, executed sequentially
+        """
+        self._check(self._make_proxy(herald_jsonrpc,
+                                     herald_jsonrpc.JsonRpcDispatcher, 0))
+        self.assertEqual(len(self.service.threads), 1)
+
+    def test_jsonrpc_parallel(self):
+        """
+        Tests JSON-RPC batches, executed in parallel
+        """
+        self._check(self._make_proxy(herald_jsonrpc,
+                                     herald_jsonrpc.JsonRpcDispatcher, 5))
+        self.assertGreater(len(self.service.threads), 1)
+
+    def test_jabsorbrpc(self):
+        """
+        Tests Jabsorb-RPC batches
+        """
+        self._check(self._make_proxy(
+            herald_jabsorbrpc, herald_jabsorbrpc.JabsorbRpcDispatcher, 5))
+
+    def test_xmlrpc(self):
+        """
+        Tests XML-RPC multicalls
+        """
+        self._check(self._make_proxy(herald_xmlrpc,
+                                     herald_xmlrpc._XmlRpcDispatcher, 5))
+        self.assertGreater(len(self.service.threads), 1)
+
+    def test_keyword_arguments(self):
+        """
+        Checks the keyword arguments which can't be sent
+        """
+        proxy = self._make_proxy(herald_jsonrpc,
+                                 herald_jsonrpc.JsonRpcDispatcher, 0)
+        batch = proxy.batch_()
+        self.assertRaises(TypeError, batch.add, 1, b=2)
+        self.assertEqual(batch.add(a=1, b=2), 0)
+        self.assertEqual(batch()[0], 3)
+
+        proxy = self._make_proxy(herald_xmlrpc,
+                                 herald_xmlrpc._XmlRpcDispatcher, 0)
+        batch = proxy.batch_()
+        self.assertRaises(TypeError, batch.add, a=1, b=2)
+        self.assertRaises(TypeError, batch.add, 1, b=2)
+        self.assertEqual(len(batch), 0)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
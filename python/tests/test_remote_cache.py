@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the cache of the results of Herald Remote Services calls
+
+:author: Thomas Calmant
+"""
+
+# Herald
+import herald.remote
+import herald.remote.herald_jsonrpc as herald_jsonrpc
+import herald.remote.proxies as proxies
+
+# Tests
+from tests.remote_helpers import Reply
+
+# JSON-RPC
+import jsonrpclib.jsonrpc
+
+# Standard library
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _Reference(object):
+    """
+    Service reference stand-in
+    """
+    def __init__(self, properties):
+        self.properties = properties
+
+    def get_property(self, name):
+        return self.properties.get(name)
+
+
+class ResultCacheTests(unittest.TestCase):
+    """
+    Tests the result cache
+    """
+    def setUp(self):
+        self.calls = []
+
+    def _method(self, *args, **kwargs):
+        self.calls.append(args)
+        return sum(args)
+
+    def test_properties(self):
+        """
+        Checks the end point properties declaring cacheable methods
+        """
+        make = proxies.cache_properties
+        self.assertEqual(make(_Reference({})), {})
+        self.assertEqual(
+            make(_Reference({herald.remote.PROP_CACHEABLE_METHODS: "get"})),
+            {herald.remote.PROP_CACHE_TTL:
+             {"get": herald.remote.DEFAULT_CACHE_TTL}})
+        self.assertEqual(
+            make(_Reference({herald.remote.PROP_CACHEABLE_METHODS:
+                             {"get": "2.5", "list": 0, "bad": "x"}})),
+            {herald.remote.PROP_CACHE_TTL: {"get": 2.5}})
+
+    def test_ttl(self):
+        """
+        Checks the expiration of results and the non-cacheable methods
+        """
+        cache = proxies.ResultCache({"get": .1})
+        for _ in range(3):
+            self.assertEqual(cache.call("get", self._method, (1, 2)), 3)
+            self.assertEqual(cache.call("other", self._method, (1, 2)), 3)
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        time.sleep(.15)
+        cache.call("get", self._method, (1, 2))
+        self.assertEqual(len(self.calls), 5)
+
+        # Unhashable arguments
+        cache.call("get", self._method, (1,), {"key": {}})
+        cache.call("get", self._method, (1,), {"key": {}})
+        self.assertEqual(len(self.calls), 6)
+
+        cache.reset({})
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.ttl("get"))
+
+    def test_mutable_result(self):
+        """
+        Checks that callers modifying a result don't modify the cached one
+        """
+        cache = proxies.ResultCache({"get": 60})
+
+        def method():
+            return {"items": [1, 2]}
+
+        result = cache.call("get", method, ())
+        result["items"].append(3)
+        result = cache.call("get", method, ())
+        self.assertEqual(result, {"items": [1, 2]})
+        result["items"].append(4)
+        result["other"] = True
+        self.assertEqual(cache.call("get", method, ()), {"items": [1, 2]})
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_lru(self):
+        """
+        Checks the eviction of the least recently used results
+        """
+        cache = proxies.ResultCache({"get": 60}, 3)
+        for value in (1, 2, 3, 1, 4):
+            cache.call("get", self._method, (value,))
+
+        # 2 has been evicted, 1 has been kept
+        self.assertEqual(len(cache), 3)
+        cache.call("get", self._method, (1,))
+        cache.call("get", self._method, (2,))
+        self.assertEqual(self.calls, [(1,), (2,), (3,), (4,), (2,)])
+
+    def test_proxy(self):
+        """
+        Checks the calls through a JSON-RPC proxy
+        """
+        sent = []
+
+        def send(peer, subject, content):
+            sent.append(content)
+            request = jsonrpclib.loads(content)
+            return Reply(jsonrpclib.jdumps(
+                {"jsonrpc": "2.0", "id": request["id"],
+                 "result": sum(request["params"])}))
+
+        cache = proxies.ResultCache({"get": 60})
+        proxy = herald_jsonrpc._JsonRpcEndpointProxy(
+            "service", "peer", "subject", send, None, cache)
+        for _ in range(3):
+            self.assertEqual(proxy.get(1, 2), 3)
+            self.assertEqual(proxy.add(1, 2), 3)
+        self.assertEqual(len(sent), 4)
+
+        # End point update
+        cache.reset({"get": 60})
+        self.assertEqual(proxy.get(1, 2), 3)
+        self.assertEqual(len(sent), 5)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
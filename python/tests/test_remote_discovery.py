@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the Herald Remote Services discovery protocol
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.remote.discovery import HeraldDiscovery
+
+# Standard library
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _Peer(object):
+    """
+    Peer bean stand-in
+    """
+    def __init__(self, uid, network):
+        self.uid = uid
+        self.groups = set(["all"])
+        self.endpoints = []
+        self.registry = {}
+
+        # Set up the discovery component
+        self.discovery = HeraldDiscovery()
+        self.discovery._delay = 0
+        self.discovery._directory = _Directory(self, network)
+        self.discovery._herald = _Herald(self, network)
+        self.discovery._dispatcher = self
+        self.discovery._registry = self
+        self.discovery.validate(None)
+
+    # Dispatcher
+    def get_endpoints(self):
+        return self.endpoints[:]
+
+    # Registry
+    def add(self, endpoint):
+        self.registry[endpoint.uid] = endpoint.properties
+
+    def update(self, uid, properties):
+        self.registry[uid] = properties
+
+    def remove(self, uid):
+        self.registry.pop(uid, None)
+
+    def lost_framework(self, uid):
+        self.registry.clear()
+
+
+class _Endpoint(object):
+    """
+    ExportEndpoint stand-in
+    """
+    def __init__(self, uid, **properties):
+        self.uid = uid
+        self.name = "service-" + uid
+        self.configurations = ["herald-jsonrpc"]
+        self.specifications = ["python:/test"]
+        self.properties = properties
+
+    def get_properties(self):
+        return self.properties
+
+    def make_import_properties(self):
+        return self.properties.copy()
+
+
+class _Message(object):
+    """
+    Received message stand-in
+    """
+    def __init__(self, sender, subject, content):
+        self.sender = sender
+        self.subject = subject
+        self.content = content
+
+
+class _Directory(object):
+    """
+    Herald directory stand-in
+    """
+    def __init__(self, peer, network):
+        self.local_uid = peer.uid
+        self.network = network
+
+    def __contains__(self, uid):
+        return uid in self.network
+
+    def get_peer(self, uid):
+        return self.network[uid]
+
+    def get_peers_for_group(self, group):
+        return [peer for uid, peer in self.network.items()
+                if uid != self.local_uid]
+
+
+class _Herald(object):
+    """
+    Herald service stand-in, delivering messages synchronously
+    """
+    def __init__(self, peer, network):
+        self.peer = peer
+        self.network = network
+
+    def __deliver(self, target, message):
+        self.network.messages.append((message.subject, message.content))
+        target.discovery.herald_message(
+            target.discovery._herald,
+            _Message(self.peer.uid, message.subject, message.content))
+
+    def fire(self, peer, message):
+        self.__deliver(self.network[peer.uid], message)
+
+    def fire_group(self, group, message):
+        for peer in self.peer.discovery._directory.get_peers_for_group(group):
+            self.__deliver(peer, message)
+
+    def reply(self, message, content, subject):
+        self.__deliver(self.network[message.sender],
+                       _Message(None, subject, content))
+
+
+class _Network(dict):
+    """
+    Peers, by UID, and the messages sent between them
+    """
+    def __init__(self):
+        super(_Network, self).__init__()
+        self.messages = []
+
+    def endpoints_sent(self):
+        """
+        Returns the number of end point descriptions sent
+        """
+        count = 0
+        for subject, content in self.messages:
+            kind = subject.rsplit('/', 1)[1]
+            if kind == 'sync':
+                count += len(content['endpoints'])
+            elif kind == 'batch':
+                count += len(content['add']) + len(content['update'])
+            elif kind in ('contact', 'add'):
+                count += len(content)
+        return count
+
+# ------------------------------------------------------------------------------
+
+
+class DiscoveryTests(unittest.TestCase):
+    """
+    Tests the discovery protocol
+    """
+    def setUp(self):
+        self.network = _Network()
+        self.peer_a = self.network["a"] = _Peer("a", self.network)
+        self.peer_b = self.network["b"] = _Peer("b", self.network)
+        self.peer_a.endpoints = [_Endpoint("a{0}".format(idx), value=idx)
+                                 for idx in range(10)]
+        self.peer_b.endpoints = [_Endpoint("b{0}".format(idx))
+                                 for idx in range(5)]
+
+    def test_contact(self):
+        """
+        Checks that peers only send the end points the other one misses
+        """
+        # Only one side notices the other one
+        self.peer_a.discovery.peer_registered(self.peer_b)
+        self.assertEqual(sorted(self.peer_a.registry),
+                         ["b{0}".format(idx) for idx in range(5)])
+        self.assertEqual(len(self.peer_b.registry), 10)
+        self.assertEqual(self.network.endpoints_sent(), 15)
+
+        # Both sides notice the other one: nothing new to send
+        del self.network.messages[:]
+        self.peer_b.endpoints.append(_Endpoint("b5"))
+        self.peer_a.endpoints[0].properties["value"] = 42
+        self.peer_b.discovery.peer_registered(self.peer_a)
+        self.peer_a.discovery.peer_registered(self.peer_b)
+        self.assertEqual(self.network.endpoints_sent(), 2)
+        self.assertIn("b5", self.peer_a.registry)
+        self.assertEqual(self.peer_b.registry["a0"], {"value": 42})
+
+        # Removed end point
+        removed = self.peer_a.endpoints.pop()
+        self.peer_a.discovery.peer_registered(self.peer_b)
+        self.assertNotIn(removed.uid, self.peer_b.registry)
+
+    def test_batch(self):
+        """
+        Checks that end point events are sent in batches
+        """
+        self.peer_a.discovery.peer_registered(self.peer_b)
+        self.peer_b.discovery.peer_registered(self.peer_a)
+        del self.network.messages[:]
+
+        self.peer_a.discovery._delay = .1
+        new = [_Endpoint("new{0}".format(idx)) for idx in range(20)]
+        self.peer_a.discovery.endpoints_added(new)
+        self.peer_a.discovery.endpoint_removed(new[0])
+        self.peer_a.discovery.endpoint_updated(new[1], None)
+        self.peer_a.discovery.endpoint_updated(self.peer_a.endpoints[1], None)
+        self.peer_a.discovery.endpoint_removed(self.peer_a.endpoints[2])
+        self.assertEqual(self.network.messages, [])
+
+        time.sleep(.3)
+        self.assertEqual([subject for subject, _ in self.network.messages],
+                         ["herald/rpc/discovery/batch"])
+        self.assertEqual(self.network.endpoints_sent(), 20)
+        self.assertNotIn("new0", self.peer_b.registry)
+        self.assertIn("new19", self.peer_b.registry)
+        self.assertNotIn("a2", self.peer_b.registry)
+
+    def test_legacy(self):
+        """
+        Checks the messages sent to peers using the former protocol
+        """
+        # Former "contact" message
+        self.peer_b.discovery.herald_message(
+            self.peer_b.discovery._herald,
+            _Message("a", "herald/rpc/discovery/contact", []))
+        self.assertEqual(len(self.peer_a.registry), 5)
+
+        del self.network.messages[:]
+        self.peer_b.discovery.endpoints_added([_Endpoint("b5")])
+        self.peer_b.discovery.endpoint_removed(self.peer_b.endpoints[0])
+        self.assertEqual([subject.rsplit('/', 1)[1]
+                          for subject, _ in self.network.messages],
+                         ["add", "remove"])
+        self.assertIn("b5", self.peer_a.registry)
+        self.assertNotIn("b0", self.peer_a.registry)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
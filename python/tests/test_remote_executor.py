@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the execution of requests by Herald Remote Services exporters
+
+:author: Thomas Calmant
+"""
+
+# Herald
+import herald.remote
+import herald.remote.herald_jsonrpc as herald_jsonrpc
+import herald.remote.herald_xmlrpc as herald_xmlrpc
+import herald.remote.proxies as proxies
+
+# JSON-RPC
+import jsonrpclib.jsonrpc
+
+# Standard library
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+try:
+    # Python 3
+    import xmlrpc.client as xmlrpclib
+except ImportError:
+    # Python 2
+    import xmlrpclib
+
+# ------------------------------------------------------------------------------
+
+
+class RequestExecutorTests(unittest.TestCase):
+    """
+    Tests the request executor
+    """
+    def setUp(self):
+        self.executor = proxies.RequestExecutor(4, 2, "test")
+        self.executor.start()
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_admission(self):
+        """
+        Checks the number of requests admitted per end point
+        """
+        event = threading.Event()
+        done = []
+
+        def handle(value):
+            event.wait()
+            done.append(value)
+
+        executor = self.executor
+        self.assertTrue(executor.limited)
+        for idx in range(2):
+            self.assertTrue(executor.acquire(set(["service"])))
+            executor.execute(set(["service"]), handle, idx)
+
+        # Saturated end point: the whole request is refused
+        self.assertFalse(executor.acquire(set(["service"])))
+        self.assertFalse(executor.acquire(set(["other", "service"])))
+        self.assertEqual(executor.get_stats()["admitted"], {"service": 2})
+
+        self.assertTrue(executor.acquire(set(["other"])))
+        executor.release(set(["other"]))
+
+        event.set()
+        executor.stop()
+        self.assertEqual(sorted(done), [0, 1])
+        self.assertEqual(executor.get_stats()["admitted"], {})
+
+    def test_timed(self):
+        """
+        Checks the execution statistics of methods
+        """
+        def dispatch(name, params):
+            if name == "service.fail":
+                raise ValueError("Failure")
+            return params[0]
+
+        timed = self.executor.timed(dispatch)
+        for idx in range(10):
+            self.assertEqual(timed("service.echo", [idx]), idx)
+        self.assertRaises(ValueError, timed, "service.fail", [])
+
+        stats = self.executor.get_stats()["methods"]
+        self.assertEqual(sorted(stats), ["service.echo", "service.fail"])
+        self.assertEqual(stats["service.echo"]["count"], 10)
+        self.assertEqual(stats["service.echo"]["errors"], 0)
+        self.assertEqual(stats["service.fail"]["errors"], 1)
+
+    def test_requests(self):
+        """
+        Checks the end points called by requests and the busy responses
+        """
+        request = jsonrpclib.loads(jsonrpclib.jdumps(
+            [jsonrpclib.jsonrpc.dump([1], "a.b.add", rpcid=1),
+             jsonrpclib.jsonrpc.dump([], "c.get", rpcid=2)]))
+        self.assertEqual(herald_jsonrpc.request_endpoints(request),
+                         set(["a.b", "c"]))
+
+        response = jsonrpclib.loads(herald_jsonrpc.busy_response(
+            request, set(["c"])))
+        self.assertEqual([entry["id"] for entry in response], [1, 2])
+        self.assertEqual(response[0]["error"]["code"],
+                         herald.remote.ERROR_SERVICE_BUSY)
+
+        data = xmlrpclib.dumps(([{"methodName": "a.add", "params": [1]},
+                                 {"methodName": "b.get", "params": []}],),
+                               "system.multicall")
+        self.assertEqual(herald_xmlrpc._request_endpoints(data),
+                         set(["a", "b"]))
+        self.assertRaises(xmlrpclib.Fault, xmlrpclib.loads,
+                          herald_xmlrpc._busy_response(set(["a"])))
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the Herald routing table
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.routing import RoutingTable, STATE_CLOSED, STATE_OPEN, \
+    STATE_HALF_OPEN, plan_group_delivery
+import herald
+import herald.beans as beans
+import herald.core
+
+# Standard library
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _Clock(object):
+    """
+    Manually advanced clock
+    """
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+class _Peer(object):
+    """
+    Peer stand-in
+    """
+    def __init__(self, uid, accesses):
+        self.uid = uid
+        self.accesses = accesses
+
+    def get_accesses(self):
+        return self.accesses
+
+
+class _Directory(object):
+    """
+    Directory stand-in
+    """
+    def __init__(self, peer, group=None):
+        self.peer = peer
+        self.group = group
+
+    def get_peer(self, uid):
+        return self.peer
+
+    def get_peers_for_group(self, group):
+        return self.group
+
+
+class _Transport(object):
+    """
+    Transport which can be broken
+    """
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.broken = False
+        self.sent = 0
+
+    def fire(self, peer, message, extra=None):
+        if self.broken:
+            raise IOError("Broken transport")
+        time.sleep(self.delay)
+        self.sent += 1
+
+    def fire_group(self, group, peers, message):
+        if self.broken:
+            raise IOError("Broken transport")
+        self.sent += 1
+        return [peer for peer in peers if not peer.uid.startswith("lost")]
+
+
+class _ServiceReference(object):
+    """
+    Service reference stand-in
+    """
+    def __init__(self, properties):
+        self.properties = properties
+
+    def get_property(self, name):
+        return self.properties.get(name)
+
+
+class _Probe(object):
+    """
+    Probe keeping the stored records
+    """
+    def __init__(self):
+        self.records = []
+
+    def store(self, channel, data):
+        self.records.append((channel, data))
+
+
+class RoutingTableTests(unittest.TestCase):
+    """
+    Tests the routing table
+    """
+    def setUp(self):
+        self.clock = _Clock()
+        self.events = []
+        self.table = RoutingTable(self.events.append, threshold=3,
+                                  retry_delay=5, max_retry_delay=12,
+                                  clock=self.clock)
+
+    def test_latency(self):
+        """
+        The fastest route comes first, unmeasured routes are tried
+        """
+        table = self.table
+        self.assertEqual(table.order("peer", ["http", "mqtt"]),
+                         ["http", "mqtt"])
+        table.success("peer", "http", .012)
+        self.assertEqual(table.order("peer", ["http", "mqtt"]),
+                         ["mqtt", "http"])
+        table.success("peer", "mqtt", .01)
+        self.assertEqual(table.order("peer", ["http", "mqtt"]),
+                         ["mqtt", "http"])
+
+        # Errors penalize a route
+        table.failure("peer", "mqtt")
+        table.failure("peer", "mqtt")
+        table.success("peer", "mqtt", .01)
+        self.assertEqual(table.order("peer", ["http", "mqtt"]),
+                         ["http", "mqtt"])
+        self.assertEqual(self.events, [])
+
+    def test_circuit_breaker(self):
+        """
+        Checks the states of a failing route
+        """
+        table = self.table
+        table.success("peer", "mqtt", .01)
+        for _ in range(3):
+            table.failure("peer", "mqtt")
+        self.assertEqual([event["state"] for event in self.events],
+                         [STATE_OPEN])
+        self.assertEqual(table.order("peer", ["mqtt", "http"]),
+                         ["http", "mqtt"])
+
+        # Failed probe: the retry delay doubles
+        self.clock.now += 5
+        self.assertEqual(table.order("peer", ["mqtt", "http"]),
+                         ["mqtt", "http"])
+        self.assertEqual(self.events[-1]["state"], STATE_HALF_OPEN)
+        self.assertEqual(table.order("peer", ["mqtt", "http"]),
+                         ["http", "mqtt"])
+        table.failure("peer", "mqtt")
+        self.assertEqual(self.events[-1]["state"], STATE_OPEN)
+
+        self.clock.now += 9
+        self.assertEqual(table.order("peer", ["mqtt", "http"]),
+                         ["http", "mqtt"])
+        self.clock.now += 1
+        self.assertEqual(table.order("peer", ["mqtt", "http"])[0], "mqtt")
+        table.failure("peer", "mqtt")
+
+        # Delay is bounded
+        self.clock.now += 12
+        self.assertEqual(table.order("peer", ["mqtt", "http"])[0], "mqtt")
+        table.success("peer", "mqtt", .01)
+        self.assertEqual(self.events[-1]["state"], STATE_CLOSED)
+        self.assertEqual(self.events[-1]["failures"], 0)
+
+    def test_cancel_probe(self):
+        """
+        Checks that a probe which hasn't been attempted is given again
+        """
+        table = self.table
+        for _ in range(3):
+            table.failure("peer", "mqtt")
+        self.clock.now += 5
+        self.assertEqual(table.order("peer", ["mqtt", "http"])[0], "mqtt")
+        self.assertEqual(self.events[-1]["state"], STATE_HALF_OPEN)
+
+        # Transport gone away before sending
+        table.cancel_probe("peer", "mqtt")
+        self.assertEqual(self.events[-1]["state"], STATE_OPEN)
+        self.assertEqual(table.order("peer", ["mqtt", "http"])[0], "mqtt")
+        self.assertEqual(self.events[-1]["state"], STATE_HALF_OPEN)
+
+        # Only half-open routes are concerned
+        nb_events = len(self.events)
+        table.cancel_probe("peer", "http")
+        table.cancel_probe("unknown", "http")
+        self.assertEqual(len(self.events), nb_events)
+
+    def test_cleanup(self):
+        """
+        Checks the removal of routes
+        """
+        table = self.table
+        table.success("peer1", "http", .1)
+        table.success("peer2", "http", .1)
+        table.success("peer2", "mqtt", .1)
+        self.assertEqual(len(table.get_routes()), 3)
+        self.assertEqual(len(table.get_routes("peer2")), 2)
+
+        table.reset("peer2", "mqtt")
+        table.remove_peer("peer1")
+        self.assertEqual([(route["peer"], route["access"])
+                          for route in table.get_routes()],
+                         [("peer2", "http")])
+
+        # Routes never used expire after their creation
+        table.order("peer4", ["http"])
+        self.clock.now += 10
+        table.success("peer3", "http", .1)
+        table.order("peer5", ["http"])
+        table.clean(5)
+        self.assertEqual(sorted(route["peer"] for route in table.get_routes()),
+                         ["peer3", "peer5"])
+
+
+class GroupPlanTests(unittest.TestCase):
+    """
+    Tests the group delivery planner
+    """
+    def test_plan(self):
+        """
+        Broadcast transports are preferred
+        """
+        peers_by_access = {"http": set("abcde"), "mqtt": set("abcd"),
+                           "xmpp": set("e")}
+        self.assertEqual(plan_group_delivery(peers_by_access),
+                         [("http", set("abcde"))])
+        self.assertEqual(plan_group_delivery(peers_by_access, ("mqtt",)),
+                         [("mqtt", set("abcd")), ("http", set("e"))])
+        self.assertEqual(
+            plan_group_delivery(peers_by_access, ("mqtt", "xmpp")),
+            [("mqtt", set("abcd")), ("xmpp", set("e"))])
+        self.assertEqual(plan_group_delivery({}), [])
+
+
+class HeraldFireTests(unittest.TestCase):
+    """
+    Tests the selection of transports by Herald.fire()
+    """
+    def test_fire(self):
+        """
+        A broken transport is avoided
+        """
+        transports = {"http": _Transport(), "mqtt": _Transport(.01)}
+        probe = _Probe()
+        core = herald.core.Herald()
+        core._directory = _Directory(_Peer("peer", ("http", "xmpp", "mqtt")))
+        core._transports = transports
+        core._probe = probe
+
+        # Unmeasured routes are tried, then the fastest one is used
+        for _ in range(5):
+            core.fire("peer", beans.Message("test"))
+        self.assertEqual(transports["http"].sent, 4)
+        self.assertEqual(transports["mqtt"].sent, 1)
+
+        # The broken route is opened after 3 failures
+        transports["http"].broken = True
+        for _ in range(5):
+            core.fire("peer", beans.Message("test"))
+        self.assertEqual(transports["mqtt"].sent, 6)
+        self.assertEqual(len(probe.records), 1)
+        self.assertEqual(probe.records[0][0], herald.PROBE_CHANNEL_ROUTE)
+        self.assertEqual(probe.records[0][1]["access"], "http")
+        self.assertEqual(probe.records[0][1]["failures"], 3)
+
+        states = dict((route["access"], route["state"])
+                      for route in core.get_routes("peer"))
+        self.assertEqual(states, {"http": STATE_OPEN, "mqtt": STATE_CLOSED})
+
+        # No transport works
+        transports["mqtt"].broken = True
+        self.assertRaises(herald.exceptions.NoTransport, core.fire, "peer",
+                          beans.Message("test"))
+
+    def test_fire_group(self):
+        """
+        Only the missing peers are reached through a second transport
+        """
+        group = [_Peer(uid, ("http", "mqtt")) for uid in ("a", "b", "lost")]
+        group.append(_Peer("http-only", ("http",)))
+        transports = {"http": _Transport(), "mqtt": _Transport()}
+        probe = _Probe()
+        core = herald.core.Herald()
+        core._directory = _Directory(None, group)
+        core._transports = transports
+        core._probe = probe
+        core._bind_transport(None, transports["mqtt"], _ServiceReference(
+            {herald.PROP_ACCESS_ID: "mqtt", herald.PROP_BROADCAST: True}))
+
+        message = beans.Message("test")
+        uid, missing = core.fire_group("all", message)
+        self.assertEqual(uid, message.uid)
+        self.assertEqual([peer.uid for peer in missing], ["lost"])
+        self.assertEqual(transports["mqtt"].sent, 1)
+        self.assertEqual(transports["http"].sent, 1)
+        self.assertEqual(probe.records[-1][0], herald.PROBE_CHANNEL_GROUP)
+        self.assertEqual(probe.records[-1][1]["steps"], "mqtt:3:2 http:2:1")
+        self.assertEqual(probe.records[-1][1]["missing"], 1)
+
+        # Broken broadcast transport: fall back to the other one
+        transports["mqtt"].broken = True
+        _, missing = core.fire_group("all", beans.Message("test"))
+        self.assertEqual([peer.uid for peer in missing], ["lost"])
+        self.assertEqual(probe.records[-1][1]["steps"], "mqtt:3:0 http:4:3")
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
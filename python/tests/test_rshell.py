@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the output streaming of the Herald remote shell
+
+:author: Thomas Calmant
+"""
+
+# Herald
+import herald.rshell as rshell
+
+# Standard library
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _Herald(object):
+    """
+    Herald service stand-in, keeping fired messages and replies
+    """
+    def __init__(self):
+        self.messages = []
+        self.replies = []
+        self.sent = []
+        self.event = threading.Event()
+
+    def fire(self, peer, message):
+        self.messages.append(message.content)
+        self.event.set()
+
+    def reply(self, message, content, subject=None):
+        self.replies.append(content)
+
+    def send(self, peer, message):
+        self.sent.append(message)
+        return _Message("peer", message.subject, "prompted")
+
+
+class _Message(object):
+    """
+    Received message stand-in
+    """
+    def __init__(self, sender, subject, content):
+        self.sender = sender
+        self.subject = subject
+        self.content = content
+
+
+class _Shell(object):
+    """
+    Shell service stand-in: "read" reads a line, other commands are printed
+    """
+    def get_banner(self):
+        return "banner"
+
+    def get_ps1(self):
+        return "$ "
+
+    def execute(self, line, session):
+        if line == "read":
+            session.write_line("read: {0}", session.prompt())
+        else:
+            session.write_line("run: {0}", line)
+        return line != "fail"
+
+
+class _Session(object):
+    """
+    Shell session stand-in
+    """
+    def __init__(self):
+        self.output = []
+
+    def write(self, text):
+        self.output.append(text)
+
+    def flush(self):
+        pass
+
+
+class OutputStreamTests(unittest.TestCase):
+    """
+    Tests the output of the remote shell
+    """
+    def test_coalescing(self):
+        """
+        Checks that small writes are sent in few messages
+        """
+        herald_svc = _Herald()
+        output = rshell._HeraldOutputStream(herald_svc, "peer", "session",
+                                            chunk_size=100, flush_delay=.1)
+        for idx in range(30):
+            output.write("{0:02d}\n".format(idx))
+            output.flush()
+
+        # 90 characters: waiting for the delay
+        self.assertEqual(herald_svc.messages, [])
+        self.assertTrue(herald_svc.event.wait(1))
+
+        output.write("x" * 250)
+        output.sync()
+        self.assertEqual([len(content["text"])
+                          for content in herald_svc.messages],
+                         [90, 100, 100, 50])
+        self.assertEqual([content["seq"] for content in herald_svc.messages],
+                         [1, 2, 3, 4])
+        self.assertEqual(output.last_seq, 4)
+        output.close()
+
+    def test_flow_control(self):
+        """
+        Checks that the writer waits for the client acknowledgements
+        """
+        herald_svc = _Herald()
+        output = rshell._HeraldOutputStream(herald_svc, "peer", "session",
+                                            chunk_size=10, flush_delay=0)
+        output.set_window(2)
+
+        text = "".join("{0:09d}\n".format(idx) for idx in range(100))
+        thread = threading.Thread(target=output.write, args=(text,))
+        thread.start()
+
+        # The writer blocks when the window is full
+        time.sleep(.2)
+        self.assertEqual(len(herald_svc.messages), 2)
+        self.assertTrue(thread.is_alive())
+
+        # The client prints messages in order and acknowledges them
+        session = _Session()
+        receiver = rshell._OutputReceiver(session, 2)
+        received = 0
+        while received < 100:
+            while received >= len(herald_svc.messages):
+                time.sleep(.01)
+
+            # Give the messages in reverse order
+            batch = herald_svc.messages[received:]
+            for content in reversed(batch):
+                seq = receiver.receive(content["text"], content["seq"])
+                if seq is not None:
+                    output.acknowledge(seq)
+            received += len(batch)
+
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(receiver.wait(100, 1))
+        self.assertEqual("".join(session.output), text)
+        self.assertFalse(receiver.wait(101, .1))
+        output.close()
+
+    def test_script(self):
+        """
+        Runs a script: input lines are read from the script
+        """
+        herald_svc = _Herald()
+        server = rshell.HeraldRemoteShellServer()
+        server._shell = _Shell()
+        server._flush_delay = 0
+        server._open_session(herald_svc, _Message("client", "open", None))
+        session_id = herald_svc.replies[0]["session_id"]
+
+        lines = ["cmd{0}".format(idx) for idx in range(100)]
+        lines[10:11] = ["read", "input line", "", "fail"]
+        server._run_script(herald_svc, _Message(
+            "client", rshell.MSG_SERVER_SCRIPT,
+            {"session_id": session_id, "lines": lines, "window": None}))
+
+        # No round trip to read input
+        self.assertEqual(herald_svc.sent, [])
+        result = herald_svc.replies[-1]
+        self.assertEqual(len(result["results"]), 101)
+        self.assertEqual(result["results"].count(False), 1)
+        self.assertEqual(result["seq"], len(herald_svc.messages))
+
+        output = "".join(content["text"] for content in herald_svc.messages)
+        self.assertIn("read: input line\n", output)
+        self.assertNotIn("run: input line", output)
+        self.assertIn("run: cmd99\n", output)
+
+        # Without lines in advance, the client is prompted
+        server._run_command(herald_svc, _Message(
+            "client", rshell.MSG_SERVER_COMMAND,
+            {"session_id": session_id, "line": "read"}))
+        self.assertEqual(len(herald_svc.sent), 1)
+        self.assertIn("read: prompted", herald_svc.messages[-1]["text"])
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
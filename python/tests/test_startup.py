@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the Herald start-up utilities
+
+:author: Thomas Calmant
+"""
+
+# Herald
+import herald.startup as startup
+import herald.transports.loopback as loopback
+import herald.transports.mqtt as mqtt
+import herald.utils as utils
+
+# Standard library
+import sys
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class StartupTests(unittest.TestCase):
+    """
+    Tests the selection of bundles and the lazy modules
+    """
+    def test_lazy_module(self):
+        """
+        Checks that a lazy module is imported on first access only
+        """
+        sys.modules.pop("colorsys", None)
+        module = utils.LazyModule("colorsys")
+        self.assertNotIn("colorsys", sys.modules)
+        self.assertIn("not loaded", repr(module))
+
+        self.assertEqual(module.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+        self.assertIn("colorsys", sys.modules)
+        self.assertIs(module.rgb_to_hsv, sys.modules["colorsys"].rgb_to_hsv)
+        self.assertRaises(AttributeError, getattr, module, "unknown")
+        self.assertRaises(ImportError, getattr,
+                          utils.LazyModule("herald.unknown"), "member")
+
+    def test_select_bundles(self):
+        """
+        Checks that only the configured transports are installed
+        """
+        base = ('herald.core', 'herald.directory')
+        self.assertEqual(startup.select_bundles(base, {}), base)
+        self.assertEqual(
+            startup.select_bundles(base, {mqtt.PROP_MQTT_USERNAME: "user"}),
+            base)
+
+        properties = {mqtt.PROP_MQTT_HOST: "localhost",
+                      loopback.PROP_LOOPBACK_HUB: "test"}
+        self.assertEqual(startup.configured_transports(properties),
+                         [mqtt.ACCESS_ID, loopback.ACCESS_ID])
+        bundles = startup.select_bundles(base, properties)
+        self.assertEqual(bundles[:2], base)
+        self.assertIn('herald.transports.mqtt.transport', bundles)
+        self.assertIn('herald.transports.loopback.directory', bundles)
+        self.assertNotIn('herald.transports.http.transport', bundles)
+
+    def test_parse_properties(self):
+        """
+        Checks the parsing of command line properties
+        """
+        self.assertEqual(startup.parse_properties(["a=1", " b =x=y", "c="]),
+                         {"a": "1", "b": "x=y", "c": ""})
+        self.assertEqual(startup.parse_properties(None), {})
+        self.assertRaises(ValueError, startup.parse_properties, ["a"])
+        self.assertRaises(ValueError, startup.parse_properties, ["=1"])
+
+    def test_profile(self):
+        """
+        Checks the import profile
+        """
+        profile = startup.profile_imports(['herald.utils', 'herald.beans'])
+        self.assertEqual([item[0] for item in profile],
+                         ['herald.utils', 'herald.beans'])
+        self.assertTrue(all(item[1] >= 0 for item in profile))
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the JID index of the XMPP transport directory
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.transports.xmpp.beans import XMPPAccess
+from herald.transports.xmpp.directory import XMPPDirectory
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class _Directory(object):
+    """
+    Core directory stand-in
+    """
+    local_uid = "local"
+
+
+class _Peer(object):
+    """
+    Peer bean stand-in
+    """
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class XMPPDirectoryTests(unittest.TestCase):
+    """
+    Tests the JID index
+    """
+    def setUp(self):
+        self.directory = XMPPDirectory()
+        self.directory._directory = _Directory()
+        self.directory._validate(None)
+
+    def test_lookup(self):
+        """
+        Tests full JID, bare JID and UID lookups
+        """
+        peer_a = _Peer("a")
+        peer_b = _Peer("b")
+        self.directory.peer_access_set(
+            peer_a, XMPPAccess("Alice@Example.com/a"))
+        self.directory.peer_access_set(peer_b, XMPPAccess("bob@example.com/b"))
+
+        self.assertIs(self.directory.from_jid("alice@example.com/a"), peer_a)
+        self.assertIs(self.directory.from_jid("bob@example.com/b"), peer_b)
+        self.assertEqual(self.directory.to_jid("a"), "Alice@Example.com/a")
+
+        # Bare JID fallback
+        self.assertIs(self.directory.from_jid("bob@example.com/other"), peer_b)
+
+        # Ambiguous bare JID
+        peer_c = _Peer("c")
+        self.directory.peer_access_set(peer_c, XMPPAccess("bob@example.com/c"))
+        self.assertRaises(KeyError, self.directory.from_jid,
+                          "bob@example.com/other")
+
+        # Local peer is ignored
+        self.directory.peer_access_set(_Peer("local"),
+                                       XMPPAccess("local@example.com/l"))
+        self.assertRaises(KeyError, self.directory.to_jid, "local")
+
+    def test_updates(self):
+        """
+        Tests the update of the index when accesses change
+        """
+        peer = _Peer("a")
+        self.assertRaises(KeyError, self.directory.from_jid, "a@example.com/a")
+
+        # Unknown JIDs must be found once registered
+        self.directory.peer_access_set(peer, XMPPAccess("a@example.com/a"))
+        self.assertIs(self.directory.from_jid("a@example.com/a"), peer)
+
+        # Other resources of the bare JID are found too
+        other = _Peer("b")
+        self.assertRaises(KeyError, self.directory.from_jid, "b@example.com/1")
+        self.directory.peer_access_set(other, XMPPAccess("B@example.com/2"))
+        self.assertIs(self.directory.from_jid("b@example.com/1"), other)
+        self.directory.peer_access_unset(other, XMPPAccess("B@example.com/2"))
+
+        # Change of JID
+        self.directory.peer_access_set(peer, XMPPAccess("a@example.com/new"))
+        self.assertIs(self.directory.from_jid("a@example.com/new"), peer)
+        self.assertEqual(self.directory.to_jid("a"), "a@example.com/new")
+        self.assertNotIn("a@example.com/a", self.directory._jid_peer)
+
+        # Removal
+        self.directory.peer_access_unset(peer, XMPPAccess("a@example.com/new"))
+        self.assertRaises(KeyError, self.directory.from_jid,
+                          "a@example.com/new")
+        self.assertRaises(KeyError, self.directory.to_jid, "a")
+
+    def test_ambiguity_removed(self):
+        """
+        Checks that a bare JID is resolved again once it isn't ambiguous
+        """
+        peer_a = _Peer("a")
+        peer_b = _Peer("b")
+        self.directory.peer_access_set(peer_a, XMPPAccess("u@h/a"))
+        self.directory.peer_access_set(peer_b, XMPPAccess("u@h/b"))
+        self.assertRaises(KeyError, self.directory.from_jid, "u@h/x")
+
+        # Only one peer left
+        self.directory.peer_access_unset(peer_b, XMPPAccess("u@h/b"))
+        self.assertIs(self.directory.from_jid("u@h/x"), peer_a)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
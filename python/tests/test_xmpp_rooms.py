@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the creation of the XMPP rooms, with a fake bot
+
+:author: Thomas Calmant
+"""
+
+# Standard library
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# XMPP transport
+try:
+    import sleekxmpp
+    from herald.transports.xmpp.transport import XmppTransport
+    from herald.transports.xmpp.utils import RoomCreator
+    import herald.transports.chunking as chunking
+    import herald.transports.xmpp.sender as sender
+except ImportError:
+    sleekxmpp = None
+
+# ------------------------------------------------------------------------------
+
+MUC_SERVICE = "conference.example.com"
+""" Name of the MUC service of the fake server """
+
+
+class _Muc(object):
+    """
+    XEP-0045 plug-in stand-in
+    """
+    def __init__(self):
+        self.joins = []
+        self.lock = threading.Lock()
+
+    def joinMUC(self, room, nick):
+        with self.lock:
+            self.joins.append(str(room))
+
+    def getRoomConfig(self, room):
+        # No configuration form
+        raise ValueError("No form")
+
+    def count(self, room):
+        """
+        Returns the number of requests to join the given room
+        """
+        with self.lock:
+            return self.joins.count(room)
+
+
+class _Keepalive(object):
+    """
+    XEP-0199 plug-in stand-in
+    """
+    def enable_keepalive(self, interval, delay):
+        pass
+
+    def disable_keepalive(self):
+        pass
+
+
+class _Stanza(dict):
+    """
+    Message stanza stand-in
+    """
+    def __init__(self, bot, target):
+        dict.__init__(self)
+        self.__bot = bot
+        self.target = target
+
+    def send(self):
+        self.__bot.sent.append(self)
+
+
+class _Bot(object):
+    """
+    XMPP bot stand-in, answering nothing by itself
+    """
+    def __init__(self):
+        self.muc = _Muc()
+        self.plugin = {'xep_0199': _Keepalive()}
+        self.boundjid = sleekxmpp.JID("local@example.com/local")
+        self.handlers = {}
+        self.sent = []
+
+    def __getitem__(self, name):
+        return {'xep_0045': self.muc}[name]
+
+    def add_event_handler(self, name, handler):
+        self.handlers.setdefault(name, []).append(handler)
+
+    def del_event_handler(self, name, handler):
+        self.handlers[name].remove(handler)
+
+    def iter_services(self, feature):
+        return iter((MUC_SERVICE,))
+
+    def make_message(self, mto, mbody, msubject, mtype):
+        return _Stanza(self, mto)
+
+    def presence(self, room, nick, affiliation="member"):
+        """
+        Simulates the presence sent by a room we joined
+        """
+        data = {"from": sleekxmpp.JID("{0}/{1}".format(room, nick)),
+                "muc": {"room": room, "nick": nick,
+                        "affiliation": affiliation},
+                "type": "available"}
+        for handler in list(self.handlers.get("presence", ())):
+            handler(data)
+
+
+class _Peer(object):
+    """
+    Local peer stand-in
+    """
+    def __init__(self):
+        self.uid = "local"
+        self.app_id = "app"
+        self.groups = ("group",)
+        self.accesses = {}
+
+    def dump(self):
+        return {"uid": self.uid, "app_id": self.app_id}
+
+    def set_access(self, access_id, data):
+        self.accesses[access_id] = data
+
+    def unset_access(self, access_id):
+        self.accesses.pop(access_id, None)
+
+
+class _Directory(object):
+    """
+    Herald directory stand-in
+    """
+    local_uid = "local"
+
+    def __init__(self):
+        self.peer = _Peer()
+
+    def get_local_peer(self):
+        return self.peer
+
+
+class _Probe(object):
+    """
+    Probe stand-in
+    """
+    def store(self, channel, data):
+        pass
+
+
+def _wait(condition, timeout=5):
+    """
+    Waits for a condition to become true
+
+    :param condition: A method without argument
+    :param timeout: Maximum time to wait, in seconds
+    :return: The result of the condition
+    """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(.01)
+    return condition()
+
+# ------------------------------------------------------------------------------
+
+
+@unittest.skipIf(sleekxmpp is None, "SleekXMPP is missing")
+class RoomCreatorTests(unittest.TestCase):
+    """
+    Tests the room creator
+    """
+    def setUp(self):
+        self.bot = _Bot()
+        self.creator = RoomCreator(self.bot)
+        self.joined = []
+        self.errors = []
+        self.event = threading.Event()
+
+    def tearDown(self):
+        self.creator.clear()
+
+    def _callback(self, room, nick):
+        self.joined.append(room)
+        self.event.set()
+
+    def _errback(self, room, nick, condition, text):
+        self.errors.append((room, condition))
+        self.event.set()
+
+    def test_timeout(self):
+        """
+        Checks the error given when a room doesn't answer in time
+        """
+        self.creator.create_room("a", MUC_SERVICE, "nick", None,
+                                 self._callback, self._errback, timeout=.05)
+        self.assertEqual(self.bot.muc.joins, ["a@" + MUC_SERVICE])
+        self.assertTrue(self.event.wait(5))
+        self.assertEqual(self.errors, [("a@" + MUC_SERVICE, "timeout")])
+
+        # Presence events aren't listened to anymore
+        self.assertEqual(self.bot.handlers["presence"], [])
+        self.bot.presence("a@" + MUC_SERVICE, "nick", "owner")
+        self.assertEqual(self.joined, [])
+
+    def test_partial(self):
+        """
+        Checks that a room timing out doesn't prevent the others from being
+        joined
+        """
+        for room in ("a", "b", "c"):
+            self.creator.create_room(room, MUC_SERVICE, "nick", None,
+                                     self._callback, self._errback,
+                                     timeout=.2)
+
+        self.bot.presence("a@" + MUC_SERVICE, "nick", "owner")
+        self.bot.presence("b@" + MUC_SERVICE, "nick", "member")
+        self.assertTrue(_wait(lambda: len(self.joined) + len(self.errors)
+                              == 3))
+        self.assertEqual(self.joined, ["a@" + MUC_SERVICE])
+        self.assertEqual(sorted(self.errors),
+                         [("b@" + MUC_SERVICE, "not-owner"),
+                          ("c@" + MUC_SERVICE, "timeout")])
+
+
+@unittest.skipIf(sleekxmpp is None, "SleekXMPP is missing")
+class TransportRoomsTests(unittest.TestCase):
+    """
+    Tests the activation of the transport according to the joined rooms
+    """
+    def setUp(self):
+        self.bot = _Bot()
+        self.directory = _Directory()
+
+        transport = self.transport = XmppTransport()
+        transport._bot = self.bot
+        transport._directory = self.directory
+        transport._probe = _Probe()
+        transport._room_timeout = .1
+        transport._room_retry_delay = .1
+
+        # Sending pipeline, writing to the fake bot
+        self.sender = sender.StanzaSender(
+            transport._XmppTransport__write_stanzas, 1, 10)
+        self.chunks = chunking.ChunkSender()
+        transport._XmppTransport__sender = self.sender
+        transport._XmppTransport__chunks = self.chunks
+        self.sender.start()
+        self.chunks.start()
+
+        self.main_room = "app@" + MUC_SERVICE
+        self.group_room = "app--group@" + MUC_SERVICE
+
+    def tearDown(self):
+        self.transport._on_session_end(None)
+        self.chunks.stop()
+        self.sender.stop()
+
+    def test_main_room_timeout(self):
+        """
+        The transport stays inactive until the main room has been joined
+        """
+        self.transport._on_session_start(None)
+        self.bot.presence(self.group_room, "local")
+
+        # Main room timed out: joined again later
+        self.assertTrue(_wait(lambda: self.bot.muc.count(self.main_room) == 2))
+        self.assertFalse(self.transport._controller)
+        self.assertEqual(self.directory.peer.accesses, {})
+        self.assertEqual(self.bot.muc.count(self.group_room), 1)
+
+        # Activation once joined
+        self.bot.presence(self.main_room, "local")
+        self.assertTrue(self.transport._controller)
+        self.assertIn("xmpp", self.directory.peer.accesses)
+        self.assertTrue(_wait(lambda: self.bot.sent))
+        self.assertEqual(str(self.bot.sent[0].target), self.main_room)
+
+    def test_group_room_timeout(self):
+        """
+        The transport is activated before all group rooms are joined, and
+        the group rooms which failed are joined again
+        """
+        self.transport._on_session_start(None)
+        self.bot.presence(self.main_room, "local")
+        self.assertTrue(self.transport._controller)
+
+        # Group room timed out
+        self.assertTrue(_wait(
+            lambda: self.bot.muc.count(self.group_room) == 2))
+        self.bot.presence(self.group_room, "local")
+
+        # No more attempt once joined
+        time.sleep(.3)
+        self.assertEqual(self.bot.muc.count(self.group_room), 2)
+        self.assertEqual(self.bot.muc.count(self.main_room), 1)
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
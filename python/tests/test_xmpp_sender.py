@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the XMPP stanza sending pipeline
+
+:author: Thomas Calmant
+"""
+
+# Herald
+from herald.transports.xmpp.sender import StanzaSender
+
+# Standard library
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+# ------------------------------------------------------------------------------
+
+
+class StanzaSenderTests(unittest.TestCase):
+    """
+    Tests the stanza sender
+    """
+    def test_order(self):
+        """
+        Checks that stanzas are sent in order, per target
+        """
+        sent = {}
+        lock = threading.Lock()
+
+        def send(target, stanzas):
+            with lock:
+                sent.setdefault(target, []).extend(stanzas)
+
+        sender = StanzaSender(send, 4, 1000)
+        sender.start()
+        futures = [sender.enqueue("peer{0}".format(idx % 5), idx)
+                   for idx in range(500)]
+        for future in futures:
+            future.result(5)
+        sender.stop()
+
+        self.assertEqual(len(sent), 5)
+        for target, stanzas in sent.items():
+            self.assertEqual(stanzas, list(range(int(target[-1]), 500, 5)))
+
+    def test_errors(self):
+        """
+        Checks that errors are given to the futures and that a full queue
+        is refused
+        """
+        blocker = threading.Event()
+
+        def send(target, stanzas):
+            blocker.wait()
+            raise ValueError(target)
+
+        sender = StanzaSender(send, 1, 1, batch_size=1)
+        self.assertRaises(IOError, sender.enqueue, "peer", "stanza")
+
+        sender.start()
+        future = sender.enqueue("peer", "first")
+        # Wait for the worker to take the first stanza
+        while True:
+            try:
+                sender.enqueue("peer", "second")
+                break
+            except IOError:
+                pass
+        self.assertRaises(IOError, sender.enqueue, "peer", "third")
+
+        blocker.set()
+        self.assertRaises(ValueError, future.result, 5)
+        sender.stop()
+
+# ------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()